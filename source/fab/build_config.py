@@ -10,24 +10,28 @@ Contains the :class:`~fab.build_config.BuildConfig` and helper classes.
 import getpass
 import logging
 import os
+import re
 import sys
 import warnings
 from datetime import datetime
-from fnmatch import fnmatch
+from fnmatch import translate
 from logging.handlers import RotatingFileHandler
 from multiprocessing import cpu_count
 from pathlib import Path
 from string import Template
-from typing import List, Optional, Iterable
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 from fab.artefacts import ArtefactSet, ArtefactStore
+from fab.checkpoints import StepCheckpoints
 from fab.constants import BUILD_OUTPUT, SOURCE_ROOT, PREBUILD
+from fab.history import BuildHistory, history_path
 from fab.metrics import (send_metric, init_metrics, stop_metrics,
                          metrics_summary)
+from fab.profiling import init_profiling, stop_profiling
 from fab.tools.category import Category
 from fab.tools.abstract_tool_box import AbstractToolBox
 from fab.steps.cleanup_prebuilds import CLEANUP_COUNT, cleanup_prebuilds
-from fab.util import TimerLogger, by_type, get_fab_workspace
+from fab.util import TimerLogger, by_type, get_fab_workspace, string_checksum
 
 logger = logging.getLogger(__name__)
 
@@ -50,7 +54,9 @@ class BuildConfig():
                  reuse_artefacts: bool = False,
                  fab_workspace: Optional[Path] = None,
                  two_stage: bool = False,
-                 verbose: bool = False):
+                 verbose: bool = False,
+                 resume: bool = False,
+                 profile_python: bool = False):
         """
         :param project_label:
             Name of the build project. The project workspace folder is
@@ -84,6 +90,16 @@ class BuildConfig():
             in some projects.
         :param verbose:
             DEBUG level logging.
+        :param resume:
+            Checkpoint the artefact store after each step. If a build is
+            interrupted, the next run skips the steps whose inputs haven't
+            changed since they completed, restoring their artefacts, and
+            resumes at the first step which needs to run.
+        :param profile_python:
+            Profile Fab's own Python code with cProfile, in each step and
+            its pool workers. The profiles, and a summary of the functions
+            which took the most time, are written to the metrics folder.
+            Not to be confused with the compiler `profile`.
 
         """
         self._tool_box = tool_box
@@ -143,10 +159,14 @@ class BuildConfig():
                 self.n_procs = None
 
         self.reuse_artefacts = reuse_artefacts
+        self.profile_python = profile_python
 
         # todo: should probably pull the artefact store out of the config
         # runtime
         self._artefact_store = ArtefactStore()
+        self.checkpoints: Optional[StepCheckpoints] = None
+        if resume:
+            self.checkpoints = StepCheckpoints(self.project_workspace / 'checkpoints')
 
         self._build_timer = None
         self._start_time = None
@@ -241,9 +261,13 @@ class BuildConfig():
         self._prep_folders()
 
         init_metrics(metrics_folder=self.metrics_folder)
+        if self.profile_python:
+            init_profiling(self.metrics_folder)
 
         # note: initialising here gives a new set of artefacts each run
         self.artefact_store.reset()
+        if self.checkpoints:
+            self.checkpoints.load()
 
     def _prep_folders(self):
         self.source_root.mkdir(parents=True, exist_ok=True)
@@ -284,7 +308,9 @@ class BuildConfig():
         send_metric('run', 'machine', os.uname().machine)
         send_metric('run', 'user', getpass.getuser())
         stop_metrics()
+        BuildHistory(history_path(self.project_workspace)).record_metrics_file(self.metrics_folder)
         metrics_summary(metrics_folder=self.metrics_folder)
+        stop_profiling()
 
 
 # todo: better name? perhaps PathFlags?
@@ -337,17 +363,33 @@ class AddFlags():
         params = {'relative': fpath.parent,
                   'source': config.source_root,
                   'output': config.build_output}
+        match, add_flags = self.resolve(params)
 
         # does the file path match our filter?
-        if not self.match or fnmatch(str(fpath),
-                                     Template(self.match).substitute(params)):
-            # use templating to render any relative paths in our flags
-            add_flags = [Template(flag).substitute(params)
-                         for flag in self.flags]
-
+        if match is None or match(os.path.normcase(str(fpath))):
             # add our flags
             input_flags += add_flags
 
+    def resolve(self, params: Dict[str, Path]) -> Tuple[Optional[Callable[[str], Any]], List[str]]:
+        """
+        Render our templates for the given parameters, ready for matching
+        many paths.
+
+        Returns a match function for normcased file paths, or None if we
+        match every path, and our rendered flags.
+
+        :param params:
+            The values for `$relative`, `$source` and `$output`.
+
+        """
+        match = None
+        if self.match:
+            pattern = os.path.normcase(Template(self.match).substitute(params))
+            match = re.compile(translate(pattern)).match
+
+        # use templating to render any relative paths in our flags
+        return match, [Template(flag).substitute(params) for flag in self.flags]
+
 
 class FlagsConfig():
     """
@@ -370,6 +412,20 @@ class FlagsConfig():
         self.common_flags = common_flags or []
         self.path_flags = path_flags or []
 
+        # Our rendered templates, for each folder we've seen. Flags are
+        # resolved for every file in the build, but only `$relative` depends
+        # on the file, and only through its parent folder. The compile steps
+        # resolve every file's flags before starting their workers, so forked
+        # workers inherit this cache and don't resolve them again.
+        self._folders: Dict[Tuple[Path, Path, Path], _FolderFlags] = {}
+
+    def __getstate__(self):
+        # We're sent to the worker processes with every item, don't send our
+        # cache with us. Workers which aren't forked rebuild it as they go.
+        state = self.__dict__.copy()
+        state['_folders'] = {}
+        return state
+
     # todo: there's templating both in this method and the run method it calls.
     #       make sure it's all properly documented and rationalised.
     def flags_for_path(self, path: Path, config):
@@ -382,13 +438,74 @@ class FlagsConfig():
             The config contains the source root and project workspace.
 
         """
-        # We COULD make the user pass these template params to the constructor
-        # but we have a design requirement to minimise the config burden on
-        # the user, so we take care of it for them here instead.
-        params = {'source': config.source_root, 'output': config.build_output}
-        flags = [Template(i).substitute(params) for i in self.common_flags]
+        return list(self._folder_flags(path, config).resolve(path)[0])
 
-        for flags_modifier in self.path_flags:
-            flags_modifier.run(path, flags, config=config)
+    def checksum_for_path(self, path: Path, config) -> int:
+        """
+        Get a checksum of the flags for a given file, as given by
+        :meth:`~fab.tools.flags.Flags.checksum` for :meth:`flags_for_path`.
+
+        The checksum is only calculated once for each set of flags in a folder.
 
-        return flags
+        :param path:
+            The file path for which we want the checksum.
+        :param config:
+            The config contains the source root and project workspace.
+
+        """
+        return self._folder_flags(path, config).resolve(path)[1]
+
+    def _folder_flags(self, path: Path, config) -> '_FolderFlags':
+        key = (path.parent, config.source_root, config.build_output)
+        folder = self._folders.get(key)
+        if folder is None:
+            # We COULD make the user pass these template params to the
+            # constructor but we have a design requirement to minimise the
+            # config burden on the user, so we take care of it for them here
+            # instead.
+            params = {'source': config.source_root,
+                      'output': config.build_output}
+            folder = _FolderFlags(
+                common_flags=[Template(i).substitute(params)
+                              for i in self.common_flags],
+                path_flags=[i.resolve({'relative': path.parent, **params})
+                            for i in self.path_flags])
+            self._folders[key] = folder
+        return folder
+
+
+class _FolderFlags():
+    """
+    The flags from a :class:`~fab.build_config.FlagsConfig`, rendered for the
+    files in one folder.
+
+    """
+    def __init__(self, common_flags: List[str],
+                 path_flags: List[Tuple[Optional[Callable[[str], Any]],
+                                        List[str]]]):
+        self.common_flags = common_flags
+        self.path_flags = path_flags
+
+        # The flags, and their checksum, for each combination of matching
+        # path flags we've seen.
+        self._resolved: Dict[Tuple[int, ...], Tuple[List[str], int]] = {}
+
+    def resolve(self, path: Path) -> Tuple[List[str], int]:
+        """
+        Return the flags for a file in our folder, which the caller must not
+        modify, and their checksum.
+
+        """
+        fpath = os.path.normcase(str(path))
+        matched = tuple(i for i, (match, _) in enumerate(self.path_flags)
+                        if match is None or match(fpath))
+
+        resolved = self._resolved.get(matched)
+        if resolved is None:
+            flags = list(self.common_flags)
+            for i in matched:
+                flags += self.path_flags[i][1]
+            # the same checksum as Flags.checksum()
+            resolved = flags, string_checksum(str(flags))
+            self._resolved[matched] = resolved
+        return resolved
@@ -0,0 +1,287 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+A local daemon which runs compile commands for Fab, keeping a cache of the object files they write.
+
+Tools send their commands to the daemon through a :class:`~fab.tools.launcher.CacheDaemonLauncher`.
+A command which compiles one C file into one object file is keyed by the compiler executable, the command's
+arguments and the preprocessed source, so an identical compile, from any build or workspace, copies the object
+file from the cache instead of running the compiler. Any other command is just run. This includes Fortran compiles,
+which read and write module files the daemon can't see.
+
+Start the daemon with ``fab cache-daemon``. It listens on a Unix socket, in a folder only the user can open.
+The cache folder can be deleted at any time.
+
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from multiprocessing.connection import Client, Connection, Listener
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from fab.util import get_fab_workspace
+
+logger = logging.getLogger(__name__)
+
+SOCKET_FILENAME = 'daemon.sock'
+CACHE_FOLDER = 'cache-daemon'
+
+# The source files whose compiles can be cached. Only these can be keyed by their preprocessed source.
+CACHEABLE_SUFFIXES = {'.c', '.i'}
+
+
+def default_socket_path() -> Path:
+    """
+    The socket of the user's cache daemon. Unix socket paths are short, so this is in the temporary folder.
+
+    """
+    return Path(tempfile.gettempdir()) / f'fab-cache-daemon-{os.getuid()}' / SOCKET_FILENAME
+
+
+def default_cache_folder() -> Path:
+    """
+    The cache daemon's default cache folder, in the Fab workspace.
+
+    """
+    return get_fab_workspace().expanduser().resolve() / CACHE_FOLDER
+
+
+def _encode(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def _decode(data: str) -> bytes:
+    return base64.b64decode(data)
+
+
+def request(socket_path: Path, message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Send a request to the cache daemon and wait for its response.
+
+    :param socket_path:
+        The daemon's socket.
+    :param message:
+        The request, whose `op` is one of `run`, `stats` or `shutdown`.
+
+    :raises OSError: if the daemon isn't running.
+
+    """
+    with Client(str(socket_path), family='AF_UNIX') as conn:
+        conn.send_bytes(json.dumps(message).encode())
+        return json.loads(conn.recv_bytes())
+
+
+def request_run(socket_path: Path, command: List[str], cwd: str,
+                env: Dict[str, str]) -> Tuple[int, bytes, bytes]:
+    """
+    Run a command in the cache daemon.
+
+    :param socket_path:
+        The daemon's socket.
+    :param command:
+        The executable, followed by its arguments.
+    :param cwd:
+        The folder to run the command in.
+    :param env:
+        The environment to run the command with.
+
+    :returns:
+        The command's return code, stdout and stderr.
+
+    """
+    response = request(socket_path, {'op': 'run', 'command': command, 'cwd': cwd, 'env': env})
+    return response['returncode'], _decode(response['stdout']), _decode(response['stderr'])
+
+
+class CacheDaemon():
+    """
+    Serves requests from Fab on a Unix socket, until asked to shut down.
+
+    """
+    def __init__(self, cache_folder: Path, socket_path: Optional[Path] = None):
+        """
+        :param cache_folder:
+            Where to keep the cached object files.
+        :param socket_path:
+            The socket to listen on. Defaults to the user's daemon socket.
+
+        """
+        self.cache_folder = cache_folder
+        self.socket_path = socket_path or default_socket_path()
+        self.stats = {'hits': 0, 'misses': 0, 'uncached': 0}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def serve(self):
+        """
+        Listen for requests, each in its own thread, until a shutdown request.
+
+        :raises RuntimeError: if a daemon is already listening on the socket.
+
+        """
+        folder = self.socket_path.parent
+        folder.mkdir(mode=0o700, parents=True, exist_ok=True)
+        folder.chmod(0o700)
+        if self.socket_path.exists():
+            try:
+                request(self.socket_path, {'op': 'stats'})
+            except (OSError, EOFError):
+                # left behind by a daemon which didn't shut down
+                self.socket_path.unlink()
+            else:
+                raise RuntimeError(f"a cache daemon is already running at '{self.socket_path}'")
+
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+        logger.info(f"cache daemon listening at '{self.socket_path}', caching in '{self.cache_folder}'")
+        with Listener(str(self.socket_path), family='AF_UNIX') as listener:
+            while not self._stopping.is_set():
+                conn = listener.accept()
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        logger.info(f"cache daemon stopped: {self.stats}")
+
+    def _serve_connection(self, conn: Connection):
+        with conn:
+            try:
+                message = json.loads(conn.recv_bytes())
+            except (OSError, EOFError):
+                return
+            try:
+                response = self.handle(message)
+            except Exception as err:
+                logger.exception(f"error handling {message.get('op')} request")
+                response = {'returncode': 1, 'stdout': '', 'stderr': _encode(f"fab cache daemon: {err}\n".encode())}
+            conn.send_bytes(json.dumps(response).encode())
+
+        if message.get('op') == 'shutdown':
+            # wake up the listener, so it sees we're stopping
+            try:
+                request(self.socket_path, {'op': 'stats'})
+            except (OSError, EOFError):
+                pass
+
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Handle a request.
+
+        :param message:
+            The request, as sent by :func:`request`.
+
+        """
+        op = message.get('op')
+        if op == 'run':
+            returncode, stdout, stderr = self.run(message['command'], Path(message['cwd']), message['env'])
+            return {'returncode': returncode, 'stdout': _encode(stdout), 'stderr': _encode(stderr)}
+        if op == 'stats':
+            with self._lock:
+                return dict(self.stats)
+        if op == 'shutdown':
+            self._stopping.set()
+            return {}
+        raise ValueError(f"unknown request '{op}'")
+
+    def run(self, command: List[str], cwd: Path, env: Dict[str, str]) -> Tuple[int, bytes, bytes]:
+        """
+        Run a command, or copy its output from the cache if it's been run before.
+
+        :returns:
+            The command's return code, stdout and stderr.
+
+        """
+        key = cache_key(command, cwd, env)
+        if key is None:
+            self._count('uncached')
+            return _run(command, cwd, env)
+
+        output = cwd / command[command.index('-o') + 1]
+        cached = self.cache_folder / key[:2] / key
+        try:
+            outputs = json.loads(cached.with_suffix('.json').read_text())
+        except (OSError, ValueError):
+            outputs = None
+        if outputs is not None:
+            _copy(cached.with_suffix('.o'), output)
+            self._count('hits')
+            logger.debug(f"cache hit for {output}")
+            return 0, _decode(outputs['stdout']), _decode(outputs['stderr'])
+
+        returncode, stdout, stderr = _run(command, cwd, env)
+        self._count('misses')
+        if returncode == 0 and output.is_file():
+            # the outputs are written last, so a half-written entry is never used
+            _copy(output, cached.with_suffix('.o'))
+            _write_text(cached.with_suffix('.json'), json.dumps({'stdout': _encode(stdout), 'stderr': _encode(stderr)}))
+        return returncode, stdout, stderr
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+
+def cache_key(command: List[str], cwd: Path, env: Dict[str, str]) -> Optional[str]:
+    """
+    The cache key for a command, or None if it can't be cached.
+
+    Only a command which compiles one C file into one object file, with nothing else written, can be cached.
+    The key is made from the compiler executable, the command's arguments except its output file, and the source
+    as preprocessed by the same command, so it allows for any change to an included header.
+
+    """
+    args = command[1:]
+    sources = [arg for arg in args if Path(arg).suffix in CACHEABLE_SUFFIXES]
+    if (len(sources) != 1 or '-c' not in args or args.count('-o') != 1 or args[-1] == '-o' or
+            any(arg.startswith(('-M', '@')) for arg in args)):
+        return None
+
+    executable = shutil.which(command[0], path=env.get('PATH'))
+    if executable is None:
+        return None
+    stat = os.stat(executable)
+
+    output_index = args.index('-o')
+    key_args = args[:output_index] + args[output_index + 2:]
+    preprocess = [command[0]] + ['-E' if arg == '-c' else arg for arg in key_args]
+    preprocessed = subprocess.run(preprocess, cwd=cwd, env=env, capture_output=True, check=False)
+    if preprocessed.returncode != 0:
+        return None
+
+    key = hashlib.sha256()
+    for part in [executable, str(stat.st_size), str(stat.st_mtime_ns)] + key_args:
+        key.update(part.encode() + b'\0')
+    key.update(preprocessed.stdout)
+    return key.hexdigest()
+
+
+def _run(command: List[str], cwd: Path, env: Dict[str, str]) -> Tuple[int, bytes, bytes]:
+    try:
+        res = subprocess.run(command, cwd=cwd, env=env, capture_output=True, check=False)
+    except OSError as err:
+        return 1, b'', f"fab cache daemon: unable to execute {command}: {err}\n".encode()
+    return res.returncode, res.stdout, res.stderr
+
+
+def _copy(src: Path, dst: Path):
+    # copy to a temporary file and rename it, so nobody sees a partial file
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    handle, tmp = tempfile.mkstemp(dir=dst.parent, prefix=f'.{dst.name}.')
+    os.close(handle)
+    shutil.copyfile(src, tmp)
+    shutil.copymode(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _write_text(dst: Path, text: str):
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    handle, tmp = tempfile.mkstemp(dir=dst.parent, prefix=f'.{dst.name}.')
+    with os.fdopen(handle, 'wt') as out:
+        out.write(text)
+    os.replace(tmp, dst)
@@ -0,0 +1,305 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Checkpoint the artefact store after each step, so an interrupted build can
+resume where it left off.
+
+A rerun skips each step whose inputs haven't changed since it last
+completed, restoring the artefact store as that step left it. A step's
+inputs are described by a fingerprint of its arguments, the artefact store
+it starts with, the size and modification time of every file they mention,
+everything in the project's source folder, and the tools in the tool box.
+
+"""
+import json
+import logging
+import os
+import pickle
+from enum import Enum
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, List, Optional, Set
+
+from fab.parse import AnalysedFile
+from fab.tools.category import Category
+from fab.util import string_checksum
+
+logger = logging.getLogger(__name__)
+
+
+class StepCheckpoints():
+    """
+    The checkpoints from the last run of a build, and this one.
+
+    """
+    INDEX = 'checkpoints.json'
+
+    def __init__(self, folder: Path):
+        """
+        :param folder:
+            Where to keep the checkpoints, usually in the project workspace.
+
+        """
+        self.folder = folder
+
+        # one entry per step, in the order they ran
+        self._checkpoints: List[Dict[str, Any]] = []
+        self._step_count = 0
+        self._depth = 0
+        self._fingerprint: Optional[str] = None
+
+        # The sizes and modification times of everything in the source folder. Only a step which runs can
+        # change them, so they're reused for the steps we skip in between.
+        self._source_tree: Optional[str] = None
+
+    def load(self):
+        """
+        Read the checkpoints from the last run, ready to run the steps again.
+
+        """
+        self._step_count = 0
+        self._depth = 0
+        self._checkpoints = []
+        self._source_tree = None
+        index = self.folder / self.INDEX
+        if not index.exists():
+            return
+        try:
+            self._checkpoints = json.loads(index.read_text())['steps']
+        except (OSError, ValueError, KeyError) as err:
+            logger.warning(f"could not read step checkpoints from '{index}', running all steps: {err}")
+        else:
+            logger.info(f"loaded {len(self._checkpoints)} step checkpoints")
+
+    def begin_step(self, config, name: str, args, kwargs) -> bool:
+        """
+        Called as a step starts. Restores the artefact store and returns True
+        if the step can be skipped.
+
+        Steps called from within another step are part of that step, and are
+        never skipped.
+
+        :param config:
+            The :class:`~fab.build_config.BuildConfig` running the step.
+        :param name:
+            The step name.
+        :param args:
+            The step's positional arguments, after the config.
+        :param kwargs:
+            The step's keyword arguments.
+
+        """
+        self._depth += 1
+        if self._depth > 1:
+            return False
+
+        self._fingerprint = self._step_fingerprint(config, name, args, kwargs)
+        if self._step_count >= len(self._checkpoints):
+            return False
+        checkpoint = self._checkpoints[self._step_count]
+        if checkpoint['step'] != name or checkpoint['fingerprint'] != self._fingerprint:
+            return False
+
+        try:
+            with open(self.folder / checkpoint['store'], 'rb') as store_file:
+                store = pickle.load(store_file)
+        except Exception as err:
+            logger.warning(f"could not restore the artefact store after '{name}', running it again: {err}")
+            return False
+
+        # have its output files changed since?
+        if _output_fingerprint(store) != checkpoint['outputs']:
+            return False
+
+        config.artefact_store.clear()
+        config.artefact_store.update(store)
+        self._step_count += 1
+        self._depth -= 1
+        return True
+
+    def end_step(self, config, name: str, resumable: bool = True):
+        """
+        Called when a step completes. Checkpoints the artefact store.
+
+        :param config:
+            The :class:`~fab.build_config.BuildConfig` running the step.
+        :param name:
+            The step name.
+        :param resumable:
+            Whether a rerun may skip this step. Steps which fetch from
+            outside the workspace must always run, as we can't tell if
+            their inputs have changed.
+
+        """
+        self._depth -= 1
+        if self._depth:
+            return
+
+        # the step may have changed the source folder, e.g. by grabbing source
+        self._source_tree = None
+
+        index = self._step_count
+        self._step_count += 1
+        store_fname = f'{index}.{name}.pkl'
+        checkpoint = {
+            'step': name,
+            # a fingerprint which can't match will always run the step
+            'fingerprint': self._fingerprint if resumable else None,
+            'outputs': _output_fingerprint(config.artefact_store),
+            'store': store_fname,
+        }
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+        tmp = self.folder / f'{store_fname}.tmp'
+        try:
+            with open(tmp, 'wb') as store_file:
+                _StorePickler(store_file).dump(dict(config.artefact_store))
+            os.replace(tmp, self.folder / store_fname)
+        except Exception as err:
+            logger.warning(f"could not checkpoint the artefact store after '{name}': {err}")
+            # we can't resume from here, or anything after it
+            del self._checkpoints[index:]
+            self._save_index()
+            return
+
+        self._checkpoints[index:index + 1] = [checkpoint]
+        self._save_index()
+
+    def abort_step(self):
+        """
+        Called when a step fails. Nothing is checkpointed.
+
+        """
+        self._depth -= 1
+        self._source_tree = None
+
+    def _save_index(self):
+        # write to a temp file first, so an interrupted build never leaves a truncated index
+        index = self.folder / self.INDEX
+        tmp = index.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'steps': self._checkpoints}, indent=2))
+        os.replace(tmp, index)
+
+    def _step_fingerprint(self, config, name: str, args, kwargs) -> str:
+        paths: Set[Path] = set()
+        kwargs = {k: v for k, v in kwargs.items() if k != 'config'}
+        parts = [
+            name,
+            _describe(args, paths),
+            _describe(kwargs, paths),
+            _describe(config.artefact_store, paths),
+            _describe_config(config),
+            _stat_paths(paths),
+            self._stat_source_tree(config),
+        ]
+        return f"{string_checksum(chr(0).join(parts)):x}"
+
+    def _stat_source_tree(self, config) -> str:
+        if self._source_tree is None:
+            self._source_tree = _stat_tree(config.source_root)
+        return self._source_tree
+
+
+class _StorePickler(pickle.Pickler):
+    # Build trees are read-only views, which can't be pickled. We restore them as read-only views.
+    def reducer_override(self, obj):
+        if isinstance(obj, MappingProxyType):
+            return _read_only, (dict(obj),)
+        return NotImplemented
+
+
+def _read_only(mapping):
+    return MappingProxyType(mapping)
+
+
+def _output_fingerprint(store) -> str:
+    # The files mentioned in the artefact store, as a step left it.
+    paths: Set[Path] = set()
+    _describe(store, paths)
+    return f"{string_checksum(_stat_paths(paths)):x}"
+
+
+def _describe(value, paths: Set[Path], _stack=None) -> str:
+    """
+    Describe a value as a string which is the same across Python invocations,
+    collecting any paths we find along the way.
+
+    Unlike repr, sets are sorted and objects are described by their
+    attributes instead of their memory address.
+
+    """
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        return repr(value)
+    if isinstance(value, Path):
+        paths.add(value)
+        return repr(str(value))
+    if isinstance(value, Enum):
+        return str(value)
+    if isinstance(value, logging.Logger):
+        return f'Logger({value.name})'
+    if isinstance(value, type) or (callable(value) and hasattr(value, '__qualname__')):
+        return f'{getattr(value, "__module__", "")}.{value.__qualname__}'
+
+    # guard against reference cycles
+    _stack = _stack or set()
+    if id(value) in _stack:
+        return '...'
+    _stack.add(id(value))
+    try:
+        if isinstance(value, AnalysedFile):
+            paths.add(value.fpath)
+            result = f'{type(value).__name__}({_describe(value.to_dict(), paths, _stack)})'
+        elif isinstance(value, (dict, MappingProxyType)):
+            items = sorted(f'{_describe(k, paths, _stack)}: {_describe(v, paths, _stack)}' for k, v in value.items())
+            result = '{' + ', '.join(items) + '}'
+        elif isinstance(value, (set, frozenset)):
+            result = '{' + ', '.join(sorted(_describe(i, paths, _stack) for i in value)) + '}'
+        elif isinstance(value, (list, tuple)):
+            result = '[' + ', '.join(_describe(i, paths, _stack) for i in value) + ']'
+        elif hasattr(value, '__dict__'):
+            result = f'{type(value).__qualname__}({_describe(vars(value), paths, _stack)})'
+        else:
+            result = f'{type(value).__qualname__}'
+    finally:
+        _stack.discard(id(value))
+    return result
+
+
+def _describe_config(config) -> str:
+    # The build settings which aren't in the step arguments, including the tools we'll use.
+    tools = []
+    for category in Category:
+        if config.tool_box.has(category):
+            tool = config.tool_box.get_tool(category)
+            tools.append(f'{tool}: {tool.get_flags(config.profile)}')
+    return (f'{config.project_label} mpi={config.mpi} openmp={config.openmp} profile={config.profile} '
+            f'two_stage={config.two_stage} tools={tools}')
+
+
+def _stat_paths(paths: Set[Path]) -> str:
+    stats = []
+    for path in sorted(paths):
+        try:
+            stat = path.stat()
+        except OSError:
+            stats.append(f'{path} missing')
+        else:
+            stats.append(f'{path} {stat.st_mtime_ns} {stat.st_size}')
+    return '\n'.join(stats)
+
+
+def _stat_tree(folder: Path) -> str:
+    # Steps such as find_source_files read the source folder directly, not through the artefact store.
+    stats = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in [root, *(os.path.join(root, f) for f in sorted(files))]:
+            try:
+                stat = os.stat(name)
+            except OSError:
+                continue
+            stats.append(f'{name} {stat.st_mtime_ns} {stat.st_size}')
+    return '\n'.join(stats)
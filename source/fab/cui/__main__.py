@@ -17,6 +17,8 @@ from typing import List, Optional
 
 
 from .arguments import FabArgumentParser
+from .cache_daemon import CACHE_DAEMON_COMMAND, cache_daemon_main
+from .history import HISTORY_COMMAND, history_main
 from ..logtools import make_logger, setup_file_logging
 from ..target.base import FabTargetBase
 from ..target.zero import FabZeroConfig
@@ -60,6 +62,16 @@ def main(argv: Optional[List[str]] = None):
         # Use system argument if none have been provided
         argv = sys.argv[1:]
 
+    if argv and argv[0] == HISTORY_COMMAND:
+        # Report on previous builds instead of building
+        history_main(argv[1:])
+        return
+
+    if argv and argv[0] == CACHE_DAEMON_COMMAND:
+        # Run, or talk to, the compile cache daemon instead of building
+        cache_daemon_main(argv[1:])
+        return
+
     parser = FabArgumentParser(description=__doc__)
     file_args = parser.parse_fabfile_only(argv)
 
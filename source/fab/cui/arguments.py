@@ -167,6 +167,16 @@ class FabArgumentParser(argparse.ArgumentParser):
                 help="do not produce much output",
             )
 
+        if "--profile" not in self._option_string_actions:
+            # Profile fab itself, unless the build target uses the option
+            group.add_argument(
+                "--profile",
+                dest="profile_python",
+                action="store_true",
+                help="profile fab's python code, writing the results to "
+                "the metrics folder",
+            )
+
     def _add_info_group(self):
         """Add informative options."""
 
@@ -0,0 +1,71 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+
+"""
+Run a local daemon which caches compiled object files, for builds which use a CacheDaemonLauncher.
+"""
+
+import argparse
+import sys
+from typing import List, Optional
+
+from .arguments import full_path_type
+from ..cache_daemon import CacheDaemon, default_cache_folder, default_socket_path, request
+
+# First argument which selects this command instead of a build
+CACHE_DAEMON_COMMAND = "cache-daemon"
+
+
+def cache_daemon_parser() -> argparse.ArgumentParser:
+    """Create the argument parser for the cache daemon command."""
+
+    parser = argparse.ArgumentParser(prog="fab cache-daemon", description=__doc__)
+    parser.add_argument(
+        "--socket",
+        type=full_path_type,
+        metavar="PATH",
+        default=default_socket_path(),
+        help="socket to listen on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=full_path_type,
+        metavar="DIR",
+        default=default_cache_folder(),
+        help="where to keep the cached object files (default: %(default)s)",
+    )
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--stats", action="store_true", help="report the running daemon's cache hits and exit")
+    action.add_argument("--stop", action="store_true", help="stop the running daemon")
+
+    return parser
+
+
+def cache_daemon_main(argv: Optional[List[str]] = None):
+    """Run the cache daemon until it's stopped, or talk to a running daemon.
+
+    :param argv: list of command line arguments, after the command name.
+    """
+
+    parser = cache_daemon_parser()
+    args = parser.parse_args(argv)
+
+    if args.stats or args.stop:
+        try:
+            response = request(args.socket, {"op": "stats" if args.stats else "shutdown"})
+        except (OSError, EOFError) as err:
+            parser.error(f"no cache daemon running at '{args.socket}': {err}")
+        if args.stats:
+            print(", ".join(f"{name}: {value}" for name, value in response.items()), file=sys.stdout)
+        return
+
+    daemon = CacheDaemon(args.cache_dir, args.socket)
+    try:
+        daemon.serve()
+    except RuntimeError as err:
+        parser.error(str(err))
+    except KeyboardInterrupt:
+        print(f"cache daemon interrupted: {daemon.stats}", file=sys.stderr)
@@ -0,0 +1,84 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+
+"""
+Compare the most recent builds of a project, to find out what got slower.
+"""
+
+import argparse
+import sys
+from typing import List, Optional
+
+from .arguments import full_path_type
+from ..history import BuildHistory, history_path
+from ..util import get_fab_workspace
+
+# First argument which selects this command instead of a build
+HISTORY_COMMAND = "history"
+
+
+def history_parser() -> argparse.ArgumentParser:
+    """Create the argument parser for the history command."""
+
+    parser = argparse.ArgumentParser(prog="fab history", description=__doc__)
+    parser.add_argument(
+        "--project", type=str, metavar="NAME", required=True, help="name of the project"
+    )
+    parser.add_argument(
+        "--workspace",
+        type=full_path_type,
+        metavar="DIR",
+        default=get_fab_workspace().expanduser().resolve(),
+        help="location of working space (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--label", type=str, metavar="LABEL", help="only compare runs with this build label"
+    )
+    parser.add_argument(
+        "--runs", type=int, metavar="N", default=5, help="number of recent runs to compare (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        metavar="PCT",
+        default=10.0,
+        help="percentage slowdown to report as a regression (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        metavar="SECS",
+        default=0.5,
+        help="ignore slowdowns smaller than this (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--top", type=int, metavar="N", default=10, help="number of files to list (default: %(default)s)"
+    )
+
+    return parser
+
+
+def history_main(argv: Optional[List[str]] = None):
+    """Print a comparison of the most recent runs of a project.
+
+    :param argv: list of command line arguments, after the command name.
+    """
+
+    parser = history_parser()
+    args = parser.parse_args(argv)
+
+    db_path = history_path(args.workspace / args.project)
+    if not db_path.is_file():
+        parser.error(f"no build history for project '{args.project}': '{db_path}' does not exist")
+
+    comparison = BuildHistory(db_path).compare(
+        num_runs=args.runs,
+        threshold=args.threshold,
+        min_seconds=args.min_seconds,
+        top=args.top,
+        label=args.label,
+    )
+    print(comparison.report(), file=sys.stdout)
@@ -12,9 +12,10 @@ Classes and helper functions related to the dependency tree, as created by the a
 from abc import ABC
 import logging
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Set, Union
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Set, Union
 
-from fab.parse import AnalysedFile
+from fab.parse import AnalysedFile, intern_symbols
 
 logger = logging.getLogger(__name__)
 
@@ -26,13 +27,20 @@ class AnalysedDependent(AnalysedFile, ABC):
     An :class:`~fab.parse.AnalysedFile` which can depend on others, and be a dependency.
     Instances of this class are nodes in a source dependency tree.
 
-    During parsing, the symbol definitions and dependencies are filled in.
-    During dependency analysis, symbol dependencies are turned into file dependencies.
+    During parsing, the symbol definitions and dependencies are collected with an
+    :class:`~fab.dep_tree.AnalysedDependentBuilder`.
+    During dependency analysis, symbol dependencies are turned into file dependencies,
+    in a copy of the parse result made with :meth:`~fab.parse.AnalysedFile.replace`.
 
     """
+    __slots__ = ('symbol_defs', 'symbol_deps', 'file_deps')
+    symbol_defs: FrozenSet[str]
+    symbol_deps: FrozenSet[str]
+    file_deps: FrozenSet[Path]
+
     def __init__(self, fpath: Union[str, Path], file_hash: Optional[int] = None,
                  symbol_defs: Optional[Iterable[str]] = None, symbol_deps: Optional[Iterable[str]] = None,
-                 file_deps: Optional[Iterable[Path]] = None):
+                 file_deps: Optional[Iterable[Union[str, Path]]] = None):
         """
         :param fpath:
             The source file that was analysed.
@@ -50,24 +58,13 @@ class AnalysedDependent(AnalysedFile, ABC):
         """
         super().__init__(fpath=fpath, file_hash=file_hash)
 
-        self.symbol_defs: Set[str] = set(symbol_defs or {})
-        self.symbol_deps: Set[str] = set(symbol_deps or {})
-        self.file_deps: Set[Path] = set(file_deps or [])
+        self._init('symbol_defs', intern_symbols(symbol_defs))
+        self._init('symbol_deps', intern_symbols(symbol_deps))
+        self._init('file_deps', frozenset(map(Path, file_deps or ())))
 
         assert all([d and len(d) for d in self.symbol_defs]), "bad symbol definitions"
         assert all([d and len(d) for d in self.symbol_deps]), "bad symbol dependencies"
 
-    def add_symbol_def(self, name):
-        assert name and len(name)
-        self.symbol_defs.add(name.lower())
-
-    def add_symbol_dep(self, name):
-        assert name and len(name)
-        self.symbol_deps.add(name.lower())
-
-    def add_file_dep(self, name):
-        self.file_deps.add(Path(name))
-
     @classmethod
     def field_names(cls):
         return super().field_names() + [
@@ -90,77 +87,247 @@ class AnalysedDependent(AnalysedFile, ABC):
         result = cls(
             fpath=Path(d["fpath"]),
             file_hash=d["file_hash"],
-            symbol_defs=set(d["symbol_defs"]),
-            symbol_deps=set(d["symbol_deps"]),
-            file_deps=set(map(Path, d["file_deps"])),
+            symbol_defs=d["symbol_defs"],
+            symbol_deps=d["symbol_deps"],
+            file_deps=d["file_deps"],
         )
         assert result.file_hash is not None
         return result
 
 
+class AnalysedDependentBuilder():
+    """
+    Collects the results of parsing a source file, to create an :class:`~fab.dep_tree.AnalysedDependent`.
+
+    Analysis results are immutable, so language analysers add things to one of these as they find them,
+    then call :meth:`build` when they've finished.
+
+    """
+    def __init__(self, fpath: Union[str, Path], file_hash: Optional[int] = None,
+                 result_class=AnalysedDependent):
+        """
+        :param fpath:
+            The source file being analysed.
+        :param file_hash:
+            The hash of the source.
+        :param result_class:
+            The subclass of :class:`~fab.dep_tree.AnalysedDependent` to build.
+
+        """
+        self.result_class = result_class
+        self.fpath = Path(fpath)
+        self.file_hash = file_hash
+        self.symbol_defs: Set[str] = set()
+        self.symbol_deps: Set[str] = set()
+        self.file_deps: Set[Path] = set()
+
+    def add_symbol_def(self, name):
+        assert name and len(name)
+        self.symbol_defs.add(name.lower())
+
+    def add_symbol_dep(self, name):
+        assert name and len(name)
+        self.symbol_deps.add(name.lower())
+
+    def add_file_dep(self, name):
+        self.file_deps.add(Path(name))
+
+    def fields(self) -> Dict[str, Any]:
+        """
+        The constructor arguments for our result class.
+
+        """
+        return {
+            'fpath': self.fpath,
+            'file_hash': self.file_hash,
+            'symbol_defs': self.symbol_defs,
+            'symbol_deps': self.symbol_deps,
+            'file_deps': self.file_deps,
+        }
+
+    def build(self):
+        """
+        Create the analysis result.
+
+        """
+        return self.result_class(**self.fields())
+
+
+class SubTreeExtractor:
+    """
+    Extract build trees for many roots from one source tree, sharing the work between them.
+
+    The reachable part of the file dependency graph is condensed into its strongly connected components
+    and the closure of each component is cached, so every node is only visited once,
+    however many roots need it. Build trees containing the same files are the same, read-only, object.
+
+    A closure is cached as a bitset of components, in an int. Components are numbered in the order they're closed,
+    which is after all their dependencies, so a closure never needs more bits than its own component's number.
+
+    """
+    def __init__(self, source_tree: Dict[Path, AnalysedDependent]):
+        """
+        :param source_tree:
+            The source tree of analysed files.
+
+        """
+        self.source_tree = source_tree
+
+        # the component of each node we've visited, and the nodes in each component
+        self._components: Dict[Path, int] = {}
+        self._members: List[List[Path]] = []
+
+        # per component, the bitsets of the components it needs (including itself),
+        # and of any deps which aren't in the source tree, numbered in _missing_paths
+        self._closures: List[int] = []
+        self._missing: List[int] = []
+        self._missing_paths: Dict[Path, int] = {}
+
+        # build trees we've already made, by their content
+        self._trees: Dict[int, Mapping[Path, AnalysedDependent]] = {}
+
+    def closure(self, root: Path) -> FrozenSet[Path]:
+        """
+        Return the paths of all the files needed to build *root*, including itself.
+
+        """
+        return frozenset(
+            fpath for index in _bit_indices(self._closures[self._component(root)]) for fpath in self._members[index])
+
+    def missing(self, root: Path) -> FrozenSet[Path]:
+        """
+        Return the file deps needed by *root* which are not in the source tree.
+
+        """
+        missing = _bit_indices(self._missing[self._component(root)])
+        return frozenset(fpath for fpath, index in self._missing_paths.items() if index in missing)
+
+    def extract(self, roots: Iterable[Path]) -> Mapping[Path, AnalysedDependent]:
+        """
+        Return the read-only build tree containing every file needed by the given roots.
+
+        """
+        key = 0
+        for root in roots:
+            key |= self._closures[self._component(root)]
+
+        tree = self._trees.get(key)
+        if tree is None:
+            # keep the order of the source tree, for reproducibility
+            needed = _bit_indices(key)
+            tree = MappingProxyType({fpath: af for fpath, af in self.source_tree.items()
+                                     if self._components.get(fpath) in needed})
+            self._trees[key] = tree
+
+        return tree
+
+    def _component(self, root: Path) -> int:
+        if root not in self._components:
+            self._condense(root)
+        return self._components[root]
+
+    def _condense(self, root: Path):
+        # An iterative version of Tarjan's algorithm, so deep trees don't hit the recursion limit.
+        # Components are completed in reverse topological order,
+        # so the closures of a component's dependencies are always known by the time we close it.
+        # Nodes in a component from a previous call are treated as leaves.
+        index: Dict[Path, int] = {root: 0}
+        lowlink: Dict[Path, int] = {root: 0}
+        stack: List[Path] = [root]
+        on_stack: Set[Path] = {root}
+        work = [(root, iter(self._children(root)))]
+
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child in self._components:
+                    continue
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(self._children(child))))
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+                # is this node the root of a component?
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    self._close_component(component)
+
+    def _children(self, node: Path) -> List[Path]:
+        return [dep for dep in self.source_tree[node].file_deps if dep in self.source_tree]
+
+    def _close_component(self, component: List[Path]):
+        component_index = len(self._members)
+        closure = 1 << component_index
+        missing = 0
+        for member in component:
+            node = self.source_tree[member]
+            assert node.fpath == member, "tree corrupted"
+            for file_dep in node.file_deps:
+                if file_dep in self._components:
+                    closure |= self._closures[self._components[file_dep]]
+                    missing |= self._missing[self._components[file_dep]]
+                elif file_dep not in self.source_tree:
+                    missing |= 1 << self._missing_paths.setdefault(file_dep, len(self._missing_paths))
+
+        self._members.append(component)
+        self._closures.append(closure)
+        self._missing.append(missing)
+        for member in component:
+            self._components[member] = component_index
+
+
+def _bit_indices(bits: int) -> Set[int]:
+    # The positions of the set bits in an int, in time linear in its size.
+    return {index for index, bit in enumerate(reversed(bin(bits)[2:])) if bit == '1'}
+
+
 def extract_sub_tree(source_tree: Dict[Path, AnalysedDependent],
                      root: Path, verbose=False)\
         -> Dict[Path, AnalysedDependent]:
     """
     Extract the subtree required to build the target, from the full source tree of all analysed source files.
 
+    To extract trees for several roots, use a :class:`~fab.dep_tree.SubTreeExtractor` to share the work.
+
     :param source_tree:
         The source tree of analysed files.
     :param root:
         The root of the dependency tree, this is the filename containing the Fortran program.
     :param verbose:
-        Log missing dependencies.
+        Log the files in the sub tree.
 
     """
-    result: Dict[Path, AnalysedDependent] = dict()
-    missing: Set[Path] = set()
+    extractor = SubTreeExtractor(source_tree)
+    result = dict(extractor.extract([root]))
 
-    _extract_sub_tree(src_tree=source_tree,
-                      key=root,
-                      dst_tree=result,
-                      missing=missing,
-                      verbose=verbose)
+    if verbose:
+        for fpath in result:
+            logger.debug(str(fpath))
 
+    missing = extractor.missing(root)
     if missing:
-        logger.warning(f"{root} has missing deps: {missing}")
+        logger.warning(f"{root} has missing deps: {set(missing)}")
 
     return result
 
 
-def _extract_sub_tree(src_tree: Dict[Path, AnalysedDependent],
-                      key: Path,
-                      dst_tree: Dict[Path, AnalysedDependent],
-                      missing: Set[Path],
-                      verbose: bool,
-                      indent: int = 0):
-    # is this node already in the sub tree?
-    if key in dst_tree:
-        return
-
-    if verbose:
-        logger.debug("----" * indent + str(key))
-
-    # add it to the output tree
-    node = src_tree[key]
-    assert node.fpath == key, "tree corrupted"
-    dst_tree[key] = node
-
-    # add its child deps
-    for file_dep in node.file_deps:
-
-        # one of its deps is missing!
-        if not src_tree.get(file_dep):
-            if logger and verbose:
-                logger.debug("----" * indent + " !!MISSING!! " + str(file_dep))
-            missing.add(file_dep)
-            continue
-
-        # add this child dep
-        _extract_sub_tree(
-            src_tree=src_tree, key=file_dep, dst_tree=dst_tree, missing=missing, verbose=verbose, indent=indent + 1)
-
-
-def filter_source_tree(source_tree: Dict[Path, AnalysedDependent], suffixes: Iterable[str]) -> List[AnalysedDependent]:
+def filter_source_tree(source_tree: Mapping[Path, AnalysedDependent],
+                       suffixes: Iterable[str]) -> List[AnalysedDependent]:
     """
     Pull out files with the given extensions from a source tree.
 
@@ -0,0 +1,297 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+An append-only history of each build's step and file timings, so we can see
+when, and where, a build got slower.
+
+Each run's metrics json is overwritten by the next run, so at the end of each
+build, :class:`~fab.build_config.BuildConfig` appends its metrics to a SQLite
+database in the project workspace. ``fab history`` compares the last few runs.
+
+"""
+import json
+import logging
+import sqlite3
+from dataclasses import dataclass, field
+from pathlib import Path
+from statistics import median
+from typing import Any, Dict, List, Optional, Tuple
+
+from fab import __version__ as fab_version
+from fab.metrics import JSON_FILENAME
+
+logger = logging.getLogger(__name__)
+
+HISTORY_FILENAME = 'history.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    label TEXT,
+    datetime TEXT,
+    time_taken REAL,
+    fab_version TEXT,
+    sysname TEXT,
+    nodename TEXT,
+    machine TEXT,
+    user TEXT
+);
+CREATE TABLE IF NOT EXISTS step_times (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    step TEXT NOT NULL,
+    time_taken REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_times (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    step TEXT NOT NULL,
+    fpath TEXT NOT NULL,
+    time_taken REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS step_times_run ON step_times (run_id);
+CREATE INDEX IF NOT EXISTS file_times_run ON file_times (run_id);
+"""
+
+
+def history_path(project_workspace: Path) -> Path:
+    """
+    The history database for a project.
+
+    """
+    return project_workspace / 'metrics' / HISTORY_FILENAME
+
+
+@dataclass
+class Change():
+    """
+    How long something took in the latest run, compared with the runs before it.
+
+    """
+    step: str
+    name: str
+    latest: float
+    # the median of the earlier runs
+    baseline: float
+
+    @property
+    def delta(self) -> float:
+        return self.latest - self.baseline
+
+    @property
+    def percent(self) -> float:
+        return 100 * self.delta / self.baseline if self.baseline else float('inf')
+
+
+@dataclass
+class Comparison():
+    """
+    The latest run compared with the runs before it.
+
+    """
+    runs: List[Dict[str, Any]]
+    threshold: float
+    step_regressions: List[Change] = field(default_factory=list)
+    file_regressions: List[Change] = field(default_factory=list)
+    largest_changes: List[Change] = field(default_factory=list)
+    slowest_files: List[Tuple[str, str, float]] = field(default_factory=list)
+
+    def report(self) -> str:
+        """
+        A plain text report, for the terminal.
+
+        """
+        lines = [f'{"run":>6}  {"datetime":26}  {"time taken":>10}  {"fab":10}  label']
+        for run in self.runs:
+            lines.append(f'{run["id"]:>6}  {run["datetime"] or "":26}  {run["time_taken"] or 0:>10.2f}  '
+                         f'{run["fab_version"] or "":10}  {run["label"]}')
+
+        if len(self.runs) < 2:
+            lines.append('\nneed at least two runs to compare')
+        else:
+            lines.append(f'\nstep regressions over {self.threshold:g}%:')
+            lines.extend(self._changes(self.step_regressions, files=False))
+            lines.append(f'\nfile regressions over {self.threshold:g}%:')
+            lines.extend(self._changes(self.file_regressions))
+            lines.append('\nlargest file changes:')
+            lines.extend(self._changes(self.largest_changes))
+
+        lines.append('\nslowest files in the latest run:')
+        lines.extend(f'  {taken:10.2f}s  {step}: {name}' for step, name, taken in self.slowest_files)
+        if not self.slowest_files:
+            lines.append('  none')
+
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _changes(changes: List[Change], files=True) -> List[str]:
+        if not changes:
+            return ['  none']
+        return [f'  {c.baseline:10.2f}s -> {c.latest:10.2f}s  {c.delta:+9.2f}s  {c.percent:+7.1f}%  '
+                + (f'{c.step}: {c.name}' if files else c.step)
+                for c in changes]
+
+
+class BuildHistory():
+    """
+    The timings of each run of a project, in a SQLite database.
+
+    Runs are only ever added, never updated.
+
+    """
+    def __init__(self, db_path: Path):
+        """
+        :param db_path:
+            The database file, which is created if it doesn't exist.
+
+        """
+        self.db_path = db_path
+
+    def _connect(self) -> sqlite3.Connection:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.db_path)
+        connection.row_factory = sqlite3.Row
+        connection.executescript(_SCHEMA)
+        return connection
+
+    def record_run(self, metrics: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Add a run to the history, from its metrics.
+
+        Per-file timings are taken from any metrics group whose values have a `time_taken`,
+        such as those recorded by the preprocess and compile steps.
+
+        :param metrics:
+            The run's metrics, as written to its metrics json.
+
+        :returns: The id of the new run.
+
+        """
+        run = metrics.get('run', {})
+        files = [(step, name, value['time_taken'])
+                 for step, values in metrics.items()
+                 for name, value in values.items()
+                 if isinstance(value, dict) and isinstance(value.get('time_taken'), (int, float))]
+
+        connection = self._connect()
+        try:
+            with connection:
+                cursor = connection.execute(
+                    'INSERT INTO runs (label, datetime, time_taken, fab_version, sysname, nodename, machine, user) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (run.get('label'), run.get('datetime'), run.get('time taken'), str(fab_version),
+                     run.get('sysname'), run.get('nodename'), run.get('machine'), run.get('user')))
+                run_id = cursor.lastrowid
+                assert run_id is not None
+                connection.executemany('INSERT INTO step_times VALUES (?, ?, ?)',
+                                       [(run_id, step, taken) for step, taken in metrics.get('steps', {}).items()])
+                connection.executemany('INSERT INTO file_times VALUES (?, ?, ?, ?)',
+                                       [(run_id, *file) for file in files])
+        finally:
+            connection.close()
+
+        return run_id
+
+    def record_metrics_file(self, metrics_folder: Path) -> Optional[int]:
+        """
+        Add a run to the history, from the metrics json in the given folder.
+
+        A missing or unreadable file, or a database error, is logged and not raised;
+        the build has already succeeded.
+
+        """
+        try:
+            metrics = json.loads((metrics_folder / JSON_FILENAME).read_text())
+            run_id = self.record_run(metrics)
+        except (OSError, ValueError, sqlite3.Error) as err:
+            logger.warning(f"could not add this run to the build history '{self.db_path}': {err}")
+            return None
+        logger.info(f'build history is in {self.db_path}')
+        return run_id
+
+    def last_runs(self, num_runs: int, label: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        The most recent runs, oldest first.
+
+        :param num_runs:
+            How many runs to return.
+        :param label:
+            Only return runs with this label.
+
+        """
+        connection = self._connect()
+        try:
+            if label is None:
+                rows = connection.execute('SELECT * FROM runs ORDER BY id DESC LIMIT ?', (num_runs,))
+            else:
+                rows = connection.execute('SELECT * FROM runs WHERE label = ? ORDER BY id DESC LIMIT ?',
+                                          (label, num_runs))
+            return [dict(row) for row in reversed(rows.fetchall())]
+        finally:
+            connection.close()
+
+    def _timings(self, table: str, columns: str, run_ids: List[int]) -> Dict[int, Dict[Tuple[str, ...], float]]:
+        connection = self._connect()
+        try:
+            placeholders = ', '.join('?' * len(run_ids))
+            rows = connection.execute(
+                f'SELECT run_id, {columns}, time_taken FROM {table} WHERE run_id IN ({placeholders})', run_ids)
+            timings: Dict[int, Dict[Tuple[str, ...], float]] = {run_id: {} for run_id in run_ids}
+            for row in rows:
+                timings[row[0]][tuple(row[1:-1])] = row[-1]
+            return timings
+        finally:
+            connection.close()
+
+    def compare(self, num_runs: int = 5, threshold: float = 10.0, min_seconds: float = 0.5,
+                top: int = 10, label: Optional[str] = None) -> Comparison:
+        """
+        Compare the latest run with the median of the runs before it.
+
+        :param num_runs:
+            How many of the most recent runs to look at, including the latest.
+        :param threshold:
+            The percentage slowdown which counts as a regression.
+        :param min_seconds:
+            Ignore slowdowns smaller than this, which are usually noise.
+        :param top:
+            How many of the slowest files and largest changes to list.
+        :param label:
+            Only compare runs with this label.
+
+        """
+        runs = self.last_runs(num_runs, label=label)
+        comparison = Comparison(runs=runs, threshold=threshold)
+        if not runs:
+            return comparison
+
+        run_ids = [run['id'] for run in runs]
+        steps = self._timings('step_times', 'step', run_ids)
+        files = self._timings('file_times', 'step, fpath', run_ids)
+
+        latest_files = files[run_ids[-1]]
+        slowest = sorted(latest_files.items(), key=lambda item: item[1], reverse=True)[:top]
+        comparison.slowest_files = [(step, name, taken) for (step, name), taken in slowest]
+
+        if len(runs) < 2:
+            return comparison
+
+        def changes(timings) -> List[Change]:
+            result = []
+            for key, latest in timings[run_ids[-1]].items():
+                earlier = [timings[run_id][key] for run_id in run_ids[:-1] if key in timings[run_id]]
+                if earlier:
+                    result.append(Change(key[0], key[-1], latest, median(earlier)))
+            return result
+
+        def regressions(changes: List[Change]) -> List[Change]:
+            found = [c for c in changes if c.delta >= min_seconds and c.percent > threshold]
+            return sorted(found, key=lambda c: c.delta, reverse=True)
+
+        file_changes = changes(files)
+        comparison.step_regressions = regressions(changes(steps))
+        comparison.file_regressions = regressions(file_changes)[:top]
+        comparison.largest_changes = sorted(file_changes, key=lambda c: abs(c.delta), reverse=True)[:top]
+
+        return comparison
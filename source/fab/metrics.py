@@ -11,14 +11,30 @@ init
     create reading process - daemonic, exits with main process
 
 send
-    group, name, value -> reading process
+    group, name, value -> this process's buffer
+    buffers are sent to the reading process in batches,
+    and when each process exits
+    one process sends at a time, as batches are too big to be written to a pipe in one go
     overwrites any previous value for group[name]
 
+trace
+    name, category, start, duration -> this process's buffer, like a metric
+    a span of time in a chrome trace event timeline, one lane per process
+
+tool usage
+    the cpu time, memory and i/o of each tool subprocess
+    added up for each run_mp item, then sent as a metric for that item and step
+
+item times
+    how long each run_mp item took, sent as a metric for that item and step
+
 reading process
     creates and add to metrics dict
     finishes -> send whole lot down a summary pipe and close
+    writes the trace events to a chrome trace file
 
 stop
+    sends our last batch
     closes pipes & process
     return metrics from summary pipe
 
@@ -29,14 +45,33 @@ stop
 import datetime
 import json
 import logging
+import os
+import subprocess
+import sys
 import warnings
 from collections import defaultdict
+from contextlib import contextmanager
 from multiprocessing import Process, Pipe
+from multiprocessing import Lock as ProcessLock
 from multiprocessing.connection import Connection
+from multiprocessing.util import Finalize
 from pathlib import Path
-from typing import Optional, Dict
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 JSON_FILENAME = 'metrics.json'
+TRACE_FILENAME = 'trace.json'
+
+# the metrics groups for tool subprocess resource usage, per item and per step
+USAGE_GROUP = 'tool usage'
+USAGE_BY_STEP_GROUP = 'tool usage by step'
+
+# the metrics group for how long each run_mp item took, in seconds
+ITEM_TIMES_GROUP = 'item times'
+
+# how many metrics a process buffers before sending them to the reading process
+BATCH_SIZE = 100
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +82,26 @@ _metric_send_conn: Optional[Connection] = None
 # the process which receives individual metrics
 _metric_recv_process: Optional[Process] = None
 
+# Held while sending a batch. Writes to a pipe larger than PIPE_BUF aren't atomic,
+# so batches sent from several processes at once would be interleaved.
+_metric_send_lock: Optional[Any] = None
+
+# metrics waiting to be sent from this process, which we must recreate after a fork
+_metric_buffer: List[list] = []
+_metric_buffer_lock = Lock()
+_metric_buffer_pid: Optional[int] = None
+
+# Trace events are buffered and sent with the metrics, using this group.
+_TRACE_GROUP = None
+
+# the process which initialised the metrics, which owns all the trace lanes
+_trace_pid: Optional[int] = None
+
+# The step and run_mp item this process is working on, to which we attribute tool usage.
+# Pool workers inherit the step from the process which forked them.
+_usage_step: Optional[str] = None
+_usage_item: Optional[Dict[str, Any]] = None
+
 
 def init_metrics(metrics_folder: Path):
     """
@@ -58,14 +113,16 @@ def init_metrics(metrics_folder: Path):
         The folder where we will write metrics.
 
     """
-    global _metric_recv_conn, _metric_send_conn
-    global _metric_recv_process
+    global _metric_recv_conn, _metric_send_conn, _metric_send_lock
+    global _metric_recv_process, _trace_pid
 
     if any([_metric_recv_conn, _metric_send_conn, _metric_recv_process]):
         raise ConnectionError('Metrics already initialised. Only one concurrent user of init_metrics is expected.')
 
     # the pipe connections for individual metrics
     _metric_recv_conn, _metric_send_conn = Pipe(duplex=False)
+    _metric_send_lock = ProcessLock()
+    _trace_pid = os.getpid()
 
     # start the receiving process
     _metric_recv_process = Process(
@@ -88,7 +145,8 @@ def _read_metric(metrics_folder: Path):
 
     """
     # An example metric is the time taken to preprocess a file; metrics['preprocess c']['my_file.c']
-    metrics: Dict[str, Dict[str, float]] = defaultdict(dict)
+    metrics: Dict[str, Dict[str, Any]] = defaultdict(dict)
+    trace_events: List[Dict[str, Any]] = []
 
     # todo: can we do this better?
     # we run in a subprocess, so we get a copy of _metric_send_conn before it closes.
@@ -101,26 +159,70 @@ def _read_metric(metrics_folder: Path):
     num_recorded = 0
     while True:
         try:
-            metric = _metric_recv_conn.recv()  # type: ignore
+            batch = _metric_recv_conn.recv()  # type: ignore
         except EOFError:
             break
+        except Exception as err:
+            # don't lose the metrics we already have, or leave the senders waiting for us
+            logger.error(f"read_metric: could not read a batch of metrics: {err!r}")
+            continue
 
         # todo: consider protecting against using up too much memory
-        group, name, value = metric
-        metrics[group][name] = value
-        num_recorded += 1
-
-    logger.debug(f"read_metric: recorded {num_recorded} metrics")
+        try:
+            for group, name, value in batch:
+                if group is _TRACE_GROUP:
+                    trace_events.append(value)
+                    continue
+                if group == USAGE_GROUP and name in metrics[group]:
+                    # e.g. a file compiled in two passes
+                    value = merge_usage(dict(metrics[group][name]), value)
+                metrics[group][name] = value
+                num_recorded += 1
+        except Exception as err:
+            logger.error(f"read_metric: bad metric in batch: {err!r}")
+
+    logger.debug(f"read_metric: recorded {num_recorded} metrics and {len(trace_events)} trace events")
+
+    # total up the tool usage for each step, including the largest process, for sizing n_procs
+    for usage in list(metrics.get(USAGE_GROUP, {}).values()):
+        step_totals = metrics[USAGE_BY_STEP_GROUP].setdefault(usage['step'], {})
+        merge_usage(step_totals, usage)
 
     metrics_folder.mkdir(parents=True, exist_ok=True)
     with open(metrics_folder / JSON_FILENAME, 'wt') as outfile:
         json.dump(metrics, outfile, indent='\t')
 
+    _write_trace(metrics_folder / TRACE_FILENAME, trace_events)
+
+
+def _write_trace(fpath: Path, trace_events: List[Dict[str, Any]]):
+    # Write a chrome trace event file, which can be loaded into a trace viewer such as Perfetto.
+    # Every event is in one process, with a lane (thread) for each of our processes.
+    lanes = sorted({(event['pid'], event['tid']) for event in trace_events})
+    metadata: List[Dict[str, Any]] = []
+    for index, (pid, tid) in enumerate(lanes):
+        metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                         'args': {'name': 'main' if tid == pid else f'worker {tid}'}})
+        # the main process first, then the workers
+        metadata.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': pid, 'tid': tid,
+                         'args': {'sort_index': -1 if tid == pid else index}})
+    metadata += [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': pid, 'args': {'name': 'fab'}}
+                 for pid in sorted({pid for pid, _ in lanes})]
+
+    trace_events.sort(key=lambda event: event['ts'])
+
+    # write to a temp file first, so a trace viewer never sees a partial file
+    tmp = fpath.with_suffix('.tmp')
+    with open(tmp, 'wt') as outfile:
+        json.dump({'traceEvents': metadata + trace_events, 'displayTimeUnit': 'ms'}, outfile)
+    os.replace(tmp, fpath)
+
 
 def send_metric(group: str, name: str, value):
     """
     Pass a metric to the reader process.
 
+    Metrics are buffered, and sent to the reader process in batches.
     Metrics will be written to a json file after build steps have run.
 
     Example::
@@ -139,25 +241,264 @@ def send_metric(group: str, name: str, value):
     if not _metric_send_conn:
         warnings.warn('_metric_send_conn not set, cannot send metrics')
         return
-    _metric_send_conn.send([group, name, value])  # type: ignore
+    _buffer_metric([group, name, value])
+
+
+def trace_event(name: str, category: str, start: float, duration: float, args: Optional[Dict[str, Any]] = None):
+    """
+    Record a span of time in the build's trace timeline.
+
+    The timeline is written as a chrome trace event file in the metrics folder, with a lane for each process.
+    Does nothing if metrics aren't being recorded.
+
+    :param name:
+        Name of the span, e.g. the step name.
+    :param category:
+        The kind of span, e.g. 'step' or 'tool'.
+    :param start:
+        When the span started, from :func:`time.perf_counter`.
+    :param duration:
+        How long the span took, in seconds.
+    :param args:
+        Any extra details to show for the span.
+
+    """
+    if not _metric_send_conn:
+        return
+    event = {
+        'name': name, 'cat': category, 'ph': 'X',
+        'ts': start * 1e6, 'dur': duration * 1e6,
+        'pid': _trace_pid, 'tid': os.getpid(),
+    }
+    if args:
+        event['args'] = args
+    _buffer_metric([_TRACE_GROUP, name, event])
+
+
+@contextmanager
+def trace(name: str, category: str, **args):
+    """
+    Record the time spent in a with block in the build's trace timeline.
+
+    Example::
+
+        with trace('gfortran', 'tool', command=command):
+            subprocess.run(command)
+
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        trace_event(name, category, start, perf_counter() - start, args)
+
+
+def child_usage(rusage) -> Dict[str, Any]:
+    """
+    The resources used by one child process, from the rusage returned when it was reaped by :func:`os.wait4`.
+
+    CPU times are in seconds. The figures include any processes the child waited for, such as the
+    front and back ends of a compiler driver, so the max RSS is the largest of those. A child starts
+    with this process's memory until it runs its executable, so its max RSS is never less than ours.
+
+    """
+    max_rss_kb = rusage.ru_maxrss
+    if sys.platform == 'darwin':
+        # reported in bytes
+        max_rss_kb //= 1024
+    return {
+        'user': rusage.ru_utime,
+        'system': rusage.ru_stime,
+        'max_rss_kb': max_rss_kb,
+        'inblock': rusage.ru_inblock,
+        'oublock': rusage.ru_oublock,
+        'count': 1,
+    }
+
+
+def run_process(command: List[str], capture_output: bool, env: Optional[Dict[str, str]] = None,
+                cwd: Optional[Union[Path, str]] = None
+                ) -> Tuple[subprocess.CompletedProcess, Dict[str, Any]]:
+    """
+    Run a command like :func:`subprocess.run`, and measure the resources used by that one process.
+
+    `resource.getrusage(resource.RUSAGE_CHILDREN)` can't do this, its max RSS is the largest of all the
+    children this process has ever had, so we reap the child ourselves with :func:`os.wait4`.
+
+    :param command:
+        The executable followed by its arguments.
+    :param capture_output:
+        If True, capture stdout and stderr, otherwise they go to the console.
+    :param env:
+        Optional env for the command.
+    :param cwd:
+        Optional working folder for the command.
+
+    :returns:
+        The completed process, and its resource usage as given by :func:`child_usage`.
+
+    """
+    pipes: Dict[str, Any] = {'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE} if capture_output else {}
+    with subprocess.Popen(command, env=env, cwd=cwd, **pipes) as proc:
+        # Popen.communicate() would reap the child for us, so we read the pipes ourselves,
+        # stderr in another thread so the child can't block on either of them filling up
+        out = err = None
+        if capture_output:
+            errors: List[bytes] = []
+            reader = Thread(target=lambda: errors.append(proc.stderr.read()))  # type: ignore
+            reader.start()
+            out = proc.stdout.read()  # type: ignore
+            reader.join()
+            err = errors[0]
+
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+    return subprocess.CompletedProcess(command, proc.returncode, out, err), child_usage(rusage)
+
+
+def merge_usage(total: Dict[str, Any], usage: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Add some tool usage to a running total, keeping the largest max RSS.
+
+    """
+    for key in ['user', 'system', 'inblock', 'oublock', 'count']:
+        total[key] = total.get(key, 0) + usage[key]
+    total['max_rss_kb'] = max(total.get('max_rss_kb', 0), usage['max_rss_kb'])
+    if 'step' in usage:
+        total.setdefault('step', usage['step'])
+    return total
+
+
+def record_tool_usage(tool_name: str, usage: Dict[str, Any]):
+    """
+    Record the resources used by a tool subprocess, as measured by :func:`child_usage`.
+
+    Usage is attributed to the current step, and to the current run_mp item if there is one,
+    in which case all the usage for that item is sent as one metric when it finishes.
+    Does nothing if metrics aren't being recorded.
+
+    :param tool_name:
+        The name of the tool, used when we're not processing a run_mp item.
+    :param usage:
+        The resources used.
+
+    """
+    if not _metric_send_conn:
+        return
+    if _usage_item is not None:
+        merge_usage(_usage_item, usage)
+    else:
+        _send_usage(tool_name, usage)
+
+
+def _send_usage(name: str, usage: Dict[str, Any]):
+    send_metric(USAGE_GROUP, f'{_usage_step}: {name}', {**usage, 'step': _usage_step})
+
+
+def record_item_time(label: str, seconds: float):
+    """
+    Record how long a run_mp item took, in the current step, for estimating the time left in the next build.
+
+    Does nothing if metrics aren't being recorded.
+
+    """
+    if _metric_send_conn:
+        send_metric(ITEM_TIMES_GROUP, f'{_usage_step}: {label}', seconds)
+
+
+def current_step() -> Optional[str]:
+    """
+    The name of the step this process is running, if any.
+
+    """
+    return _usage_step
+
+
+@contextmanager
+def usage_step(name: str):
+    """
+    Attribute tool usage to the given step, within a with block.
+
+    """
+    global _usage_step
+    previous, _usage_step = _usage_step, name
+    try:
+        yield
+    finally:
+        _usage_step = previous
+
+
+@contextmanager
+def usage_item(label: str):
+    """
+    Add up the tool usage within a with block, and send it as one metric for the given item.
+
+    """
+    global _usage_item
+    previous, _usage_item = _usage_item, {}
+    try:
+        yield
+    finally:
+        usage, _usage_item = _usage_item, previous
+        if usage:
+            _send_usage(label, usage)
+
+
+def _buffer_metric(metric: list):
+    global _metric_buffer, _metric_buffer_lock, _metric_buffer_pid
+
+    if _metric_buffer_pid != os.getpid():
+        # We're the first metric in this process. If we're a forked worker, our buffer is a copy of our parent's,
+        # which it will send, and its lock could have been held by another thread as we forked.
+        _metric_buffer = []
+        _metric_buffer_lock = Lock()
+        _metric_buffer_pid = os.getpid()
+        # Pool workers don't run atexit handlers, but they do run these when they finish.
+        Finalize(None, flush_metrics, exitpriority=100)
+
+    with _metric_buffer_lock:
+        _metric_buffer.append(metric)
+        if len(_metric_buffer) < BATCH_SIZE:
+            return
+    flush_metrics()
+
+
+def flush_metrics():
+    """
+    Send any metrics buffered in this process to the reader process.
+
+    This is called when a batch is full, and when a process which sent metrics exits.
+
+    """
+    global _metric_buffer
+
+    with _metric_buffer_lock:
+        batch, _metric_buffer = _metric_buffer, []
+    if batch and _metric_send_conn and _metric_buffer_pid == os.getpid():
+        with _metric_send_lock:  # type: ignore
+            _metric_send_conn.send(batch)
 
 
 def stop_metrics():
     """
-    Close the metrics pipe and reader process.
+    Send our remaining metrics, then close the metrics pipe and reader process.
 
     """
-    global _metric_recv_conn, _metric_send_conn
+    global _metric_recv_conn, _metric_send_conn, _metric_send_lock
     global _metric_recv_process
 
+    flush_metrics()
+
     # Close the metrics recording pipe.
     # The metrics recording process will notice and finish,
     # and send the total metrics to the "collated metrics" pipe, which it then closes.
     _metric_send_conn.close()  # type: ignore
-    _metric_recv_process.join(1)  # type: ignore
+    # give the reading process time to write a large trace
+    _metric_recv_process.join(30)  # type: ignore
 
     # set these to none so metrics can be initialised again
-    _metric_recv_conn = _metric_send_conn = _metric_recv_process = None
+    _metric_recv_conn = _metric_send_conn = _metric_recv_process = _metric_send_lock = None
 
 
 def metrics_summary(metrics_folder: Path):
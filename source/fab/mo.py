@@ -26,18 +26,19 @@ def add_mo_commented_file_deps(
     not those which just refer to symbols.
 
     :param source_tree:
-        The source tree of analysed files.
+        The source tree of analysed files. Any Fortran file with a new
+        dependency is replaced in the tree.
 
     """
     ignore_set = set(ignore_dependencies) if ignore_dependencies else set()
 
-    analysed_fortran = [i for i in source_tree.values()
+    analysed_fortran = [(key, i) for key, i in source_tree.items()
                         if isinstance(i, AnalysedFortran)]
     analysed_c = [i for i in source_tree.values() if isinstance(i, AnalysedC)]
 
     lookup = {c.fpath.name: c for c in analysed_c}
     num_found = 0
-    for f in analysed_fortran:
+    for key, f in analysed_fortran:
         num_found += len(f.mo_commented_file_deps)
         for dep in f.mo_commented_file_deps:
             if dep in ignore_set:
@@ -56,5 +57,7 @@ def add_mo_commented_file_deps(
                              f"file '{f.fpath}' - ignored for now, but "
                              f"the build might fail because of this.")
                 continue
-            f.file_deps.add(lookup[dep].fpath)
+            # analysis results are immutable, replace it in the tree
+            f = source_tree[key] = f.replace(
+                file_deps=f.file_deps | {lookup[dep].fpath})
     logger.info(f"processed {num_found} DEPENDS ON file dependencies")
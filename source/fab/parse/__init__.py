@@ -5,9 +5,10 @@
 # ##############################################################################
 import json
 import logging
+import sys
 from abc import ABC
 from pathlib import Path
-from typing import Any, Dict, Optional, Set, Union
+from typing import AbstractSet, Any, Dict, FrozenSet, Iterable, Mapping, Optional, Tuple, Union
 
 from fab.util import file_checksum
 
@@ -18,11 +19,35 @@ class ParseException(Exception):
     pass
 
 
+def intern_symbols(names: Optional[Iterable[str]]) -> FrozenSet[str]:
+    """
+    Return the given symbol names as a frozenset of interned strings.
+
+    The same symbol names appear in many analysis results, across a whole build.
+    Interning them means each name is stored once.
+
+    """
+    return frozenset(map(sys.intern, names or ()))
+
+
+def _rebuild(cls, values):
+    # Recreate an analysis result from its compact pickle form. See AnalysedFile.__reduce__().
+    return cls(**dict(zip(cls.field_names(), values)))
+
+
 class AnalysedFile(ABC):
     """
     Analysis results for a single file. Abstract base class.
 
+    Instances are immutable, with a cached hash, so they can be shared and put into sets safely.
+    Use :meth:`replace` to make a modified copy.
+
     """
+    __slots__ = ('fpath', '_file_hash', '_hash')
+    fpath: Path
+    _file_hash: Optional[int]
+    _hash: Optional[int]
+
     def __init__(self, fpath: Union[str, Path], file_hash: Optional[int] = None):
         """
         :param fpath:
@@ -34,20 +59,87 @@ class AnalysedFile(ABC):
         If not provided, the `self.file_hash` property is lazily evaluated in case the file does not yet exist.
 
         """
-        self.fpath = Path(fpath)
-        self._file_hash = file_hash
+        self._init('fpath', Path(fpath))
+        self._init('_file_hash', file_hash)
+        self._init('_hash', None)
+
+    def _init(self, name: str, value):
+        # Set an attribute, bypassing our immutability. Only for use during construction and lazy evaluation.
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"'{self.__class__.__name__}' is immutable, use replace() to change '{name}'")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"'{self.__class__.__name__}' is immutable, cannot delete '{name}'")
 
     @property
     def file_hash(self) -> int:
-        if self._file_hash is None:
+        file_hash = self._file_hash
+        if file_hash is None:
             if not self.fpath.exists():
                 raise ValueError(f"analysed file '{self.fpath}' does not exist")
-            self._file_hash = file_checksum(self.fpath).file_hash
-        return self._file_hash
+            file_hash = file_checksum(self.fpath).file_hash
+            self._init('_file_hash', file_hash)
+        return file_hash
+
+    def replace(self, **changes):
+        """
+        Return a copy of this analysis result, with the given fields changed.
+
+        Example::
+
+            analysed_file.replace(file_deps=analysed_file.file_deps | {Path('my_dep.f90')})
+
+        """
+        unknown = set(changes) - set(self.field_names())
+        if unknown:
+            raise ValueError(f"unknown field(s) for {self.__class__.__name__}: {', '.join(sorted(unknown))}")
+        fields = {name: getattr(self, name) for name in self.field_names()}
+        fields['file_hash'] = self._file_hash
+        fields.update(changes)
+        return self.__class__(**fields)
+
+    def _key(self) -> Tuple:
+        # All our fields, in a hashable form.
+        # We use self.field_names() rather than vars(self) because we want to evaluate any lazy attributes.
+        values = []
+        for field_name in self.field_names():
+            value = getattr(self, field_name)
+            if isinstance(value, Mapping):
+                value = frozenset(value.items())
+            values.append(value)
+        return tuple(values)
 
     def __eq__(self, other):
-        # todo: better to use self.field_names() instead of vars(self) in order to evaluate any lazy attributes?
-        return vars(self) == vars(other)
+        if not isinstance(other, AnalysedFile):
+            return NotImplemented
+        if self is other:
+            return True
+        return self.__class__ is other.__class__ and self._key() == other._key()
+
+    # We need to be hashable before we can go into a set, which is useful for our subclasses.
+    # Note, the numerical result will change with each Python invocation.
+    def __hash__(self):
+        if self._hash is None:
+            self._init('_hash', hash(self._key()))
+        return self._hash
+
+    # Analysis results are passed to and from worker processes, and held for the whole build.
+    # Pickle just the field values, in a compact form: no attribute names, strings instead of paths,
+    # tuples instead of sets. Unpickling goes through the constructor, which re-interns the symbols.
+    def __reduce__(self):
+        values = []
+        for field_name in self.field_names():
+            value = self._file_hash if field_name == 'file_hash' else getattr(self, field_name)
+            if isinstance(value, Path):
+                value = str(value)
+            elif isinstance(value, Mapping):
+                value = dict(value)
+            elif isinstance(value, AbstractSet):
+                value = tuple(str(i) if isinstance(i, Path) else i for i in value)
+            values.append(value)
+        return _rebuild, (self.__class__, tuple(values))
 
     # persistence
     def to_dict(self) -> Dict[str, Any]:
@@ -103,26 +195,6 @@ class AnalysedFile(ABC):
         params = ', '.join([f'{f}={repr(getattr(self, f))}' for f in self.field_names()])
         return f'{self.__class__.__name__}({params})'
 
-    # We need to be hashable before we can go into a set, which is useful for our subclasses.
-    # Note, the numerical result will change with each Python invocation.
-    def __hash__(self):
-        # Build up a list of things to hash, from our attributes.
-        # We use self.field_names() rather than vars(self) because we want to evaluate any lazy attributes.
-        # We turn dicts and sets into sorted tuples for hashing.
-        # todo: There's a good reason dicts and sets aren't supposed to be hashable.
-        #       Please see https://github.com/MetOffice/fab/issues/229
-        things = set()
-        for field_name in self.field_names():
-            thing = getattr(self, field_name)
-            if isinstance(thing, Dict):
-                things.add(tuple(sorted(thing.items())))
-            elif isinstance(thing, Set):
-                things.add(tuple(sorted(thing)))
-            else:
-                things.add(thing)
-
-        return hash(tuple(things))
-
 
 # todo: There's a design weakness relating to this class:
 #       we don't save empty results, which means we'll keep reanalysing them.
@@ -132,13 +204,18 @@ class EmptySourceFile(AnalysedFile):
     An analysis result for a file which resulted in an empty parse tree.
 
     """
-    def __init__(self, fpath: Union[str, Path]):
+    __slots__ = ()
+
+    def __init__(self, fpath: Union[str, Path], file_hash: Optional[int] = None):
         """
         :param fpath:
             The path of the file which was analysed.
+        :param file_hash:
+            The checksum of the file which was analysed.
+            If omitted, Fab will evaluate lazily.
 
         """
-        super().__init__(fpath=fpath)
+        super().__init__(fpath=fpath, file_hash=file_hash)
 
     @classmethod
     def from_dict(cls, d):
@@ -6,10 +6,12 @@ C language handling classes.
 
 """
 import logging
+import re
 import warnings
-from collections import deque
+from bisect import bisect_right
+from collections import Counter, deque
 from pathlib import Path
-from typing import List, Optional, Union, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Union, Tuple
 
 try:
     import clang  # type: ignore
@@ -18,11 +20,106 @@ except ImportError:
     clang = None
 
 from fab.build_config import BuildConfig
-from fab.dep_tree import AnalysedDependent
-from fab.util import log_or_dot, file_checksum
+from fab.dep_tree import AnalysedDependent, AnalysedDependentBuilder
+from fab.util import log_or_dot, file_checksum, string_checksum
 
 logger = logging.getLogger(__name__)
 
+# One clang index per process, created on first use and reused for every file a worker analyses.
+_index = None
+
+# A Fab pragma on its own line, as written by the c_pragma_injector and passed through by the preprocessor.
+_PRAGMA_PATTERN = re.compile(r'^\s*#\s*pragma\s+FAB\s+(Sys|Usr)Include(Start|End)\b')
+
+# A system include, whose header we might precompile.
+_SYSTEM_INCLUDE_PATTERN = re.compile(r'^\s*#\s*include\s*<([^>]+)>')
+
+# A set of headers is only precompiled if at least this many files start by including it.
+PCH_MIN_FILES = 4
+
+
+def _get_index():
+    global _index
+    if _index is None:
+        _index = clang.cindex.Index.create()
+    return _index
+
+
+def leading_system_includes(fpath: Path) -> Tuple[str, ...]:
+    """
+    The system headers a C file includes before anything else, in order.
+
+    Only these can be replaced by a precompiled header, given before the file's first line. The list ends at the
+    first line which isn't a system include, a Fab pragma, a comment or blank, so a macro defined or a project
+    header included before a system header keeps it off the list. A preprocessed file has none.
+
+    """
+    headers: List[str] = []
+    in_comment = False
+    with open(fpath, 'rt', encoding='utf-8', errors='replace') as source:
+        for line in source:
+            line = line.strip()
+            if in_comment:
+                if '*/' not in line:
+                    continue
+                in_comment = False
+                line = line.split('*/', 1)[1].strip()
+            if line.startswith('/*'):
+                if '*/' not in line:
+                    in_comment = True
+                    continue
+                line = line.split('*/', 1)[1].strip()
+            if not line or line.startswith('//') or _PRAGMA_PATTERN.match(line):
+                continue
+            match = _SYSTEM_INCLUDE_PATTERN.match(line)
+            if not match:
+                break
+            headers.append(match.group(1))
+    return tuple(headers)
+
+
+def common_include_sets(leading_includes: Dict[Path, Tuple[str, ...]],
+                        min_files: int = PCH_MIN_FILES) -> Dict[Path, Tuple[str, ...]]:
+    """
+    Choose a commonly included set of headers for each file which can use one.
+
+    A file can use a precompiled header made from any first part of its leading system includes.
+    It's given the longest such set which at least `min_files` files start with, so one precompiled
+    header serves them all. A set which fewer files are given than that is given up, and its files
+    use a shorter set, if they can.
+
+    :param leading_includes:
+        The leading system includes of each file, from :func:`leading_system_includes`.
+    :param min_files:
+        How many files must share a set of headers for it to be worth precompiling.
+
+    """
+    counts = Counter(headers[:length]
+                     for headers in leading_includes.values() for length in range(1, len(headers) + 1))
+    longest = {}
+    for fpath, headers in leading_includes.items():
+        for length in range(len(headers), 0, -1):
+            if counts[headers[:length]] >= min_files:
+                longest[fpath] = headers[:length]
+                break
+
+    users = Counter(longest.values())
+    chosen = {}
+    for fpath, headers in longest.items():
+        for length in range(len(headers), 0, -1):
+            if users[headers[:length]] >= min_files:
+                chosen[fpath] = headers[:length]
+                break
+    return chosen
+
+
+def pch_header_text(headers: Iterable[str]) -> str:
+    """
+    The text of a header which includes each of the given system headers.
+
+    """
+    return ''.join(f'#include <{header}>\n' for header in headers)
+
 
 class AnalysedC(AnalysedDependent):
     """
@@ -40,6 +137,48 @@ class AnalysedC(AnalysedDependent):
     #       everything it needs. We'd normally remove an irrelevant class
     #       like this but we want to keep the door open for filtering
     #       analysis results by type, rather than suffix.
+    __slots__ = ()
+
+
+class IncludeRegions:
+    """
+    Interval map from line number to the kind of #include region the line is in.
+
+    Built once per file from the Fab pragma lines, so each lookup is a bisect
+    rather than a replay of every pragma before the line.
+
+    """
+    def __init__(self, regions: Iterable[Tuple[int, str]]):
+        """
+        :param regions:
+            The ``(lineno, region_type)`` pragma markers, in file order,
+            as found by :meth:`CAnalyser._locate_include_regions`.
+
+        """
+        # Each boundary line starts an interval which runs up to the next boundary.
+        self._lines: List[int] = []
+        self._kinds: List[Optional[str]] = []
+
+        include_stack: List[str] = []
+        for region_line, region_type in regions:
+            if region_type.endswith("start"):
+                include_stack.append(region_type.replace("_start", ""))
+            elif region_type.endswith("end"):
+                include_stack.pop()
+            kind = include_stack[-1] if include_stack else None
+
+            # several markers on one line leave the state after the last of them
+            if self._lines and self._lines[-1] == region_line:
+                self._kinds[-1] = kind
+            else:
+                self._lines.append(region_line)
+                self._kinds.append(kind)
+
+    def __getitem__(self, lineno: int) -> Optional[str]:
+        pos = bisect_right(self._lines, lineno)
+        if not pos:
+            return None
+        return self._kinds[pos - 1]
 
 
 class CAnalyser:
@@ -48,11 +187,30 @@ class CAnalyser:
 
     """
 
-    def __init__(self, config: BuildConfig):
+    def __init__(self, config: BuildConfig, pragmas_from_source: bool = False,
+                 precompiled_headers: bool = False):
+        """
+        :param config:
+            The :class:`fab.build_config.BuildConfig` object where we can read settings
+            such as the project workspace folder or the multiprocessing flag.
+        :param pragmas_from_source:
+            Find the Fab include pragmas by reading the source lines, instead of
+            scanning clang's token stream for the whole translation unit.
+        :param precompiled_headers:
+            Let :meth:`precompile_headers` make precompiled headers, which clang loads
+            instead of parsing the same system headers for many files.
 
-        # runtime
+        """
         self._config = config
+        self._pragmas_from_source = pragmas_from_source
+        self._precompiled_headers = precompiled_headers
+
+        # the libclang precompiled header for each file which has one
+        self._pch: Dict[Path, Path] = {}
+
+        # runtime
         self._include_region: List[Tuple[int, str]] = []
+        self._include_map = IncludeRegions([])
 
     # todo: simplifiy by passing in the file path instead of the analysed tokens?
     def _locate_include_regions(self, trans_unit) -> None:
@@ -91,20 +249,93 @@ class CAnalyser:
                     self._include_region.append(
                         (lineno, "usr_include_end"))
 
+        self._include_map = IncludeRegions(self._include_region)
+
+    def _locate_include_regions_in_source(self, fpath: Path) -> None:
+        """
+        Look for Fab pragmas by reading the preprocessed source lines.
+
+        The pragmas survive preprocessing as directives on their own lines, so this finds the same
+        regions as :meth:`_locate_include_regions` without asking clang to tokenise the whole file.
+
+        """
+        self._include_region = []
+        with open(fpath, 'rt', encoding='utf-8', errors='replace') as source:
+            for lineno, line in enumerate(source, start=1):
+                if 'FAB' not in line:
+                    continue
+                match = _PRAGMA_PATTERN.match(line)
+                if match:
+                    self._include_region.append(
+                        (lineno, f"{match.group(1).lower()}_include_{match.group(2).lower()}"))
+
+        self._include_map = IncludeRegions(self._include_region)
+
+    def precompile_headers(self, fpaths: Iterable[Path], min_files: int = PCH_MIN_FILES) -> None:
+        """
+        Make a libclang precompiled header for each set of system headers which at least `min_files` of the files
+        start by including, for :meth:`run` to load instead of parsing those headers in each file.
+
+        Does nothing unless this analyser was made with `precompiled_headers`. Files which have already been
+        analysed are left out. A precompiled header is kept in the prebuild folder, named by a hash of its headers,
+        and is made again if clang won't load it.
+
+        """
+        if not (clang and self._precompiled_headers):
+            return
+
+        leading = {}
+        for fpath in fpaths:
+            file_hash = file_checksum(fpath).file_hash
+            if not (self._config.prebuild_folder / f'{fpath.stem}.{file_hash}.an').exists():
+                leading[fpath] = leading_system_includes(fpath)
+
+        pchs: Dict[Tuple[str, ...], Optional[Path]] = {}
+        for fpath, headers in common_include_sets(leading, min_files).items():
+            if headers not in pchs:
+                pchs[headers] = self._precompile_header(headers)
+            pch = pchs[headers]
+            if pch:
+                self._pch[fpath] = pch
+
+    def _precompile_header(self, headers: Tuple[str, ...]) -> Optional[Path]:
+        text = pch_header_text(headers)
+        header = self._config.prebuild_folder / f'libclang-pch.{string_checksum(text)}.h'
+        pch = header.with_suffix('.pch')
+        self._config.add_current_prebuilds([header, pch])
+        if pch.exists() and self._loads(pch):
+            return pch
+
+        logger.info(f"precompiling {len(headers)} headers for C analysis: {', '.join(headers)}")
+        try:
+            header.write_text(text)
+            _get_index().parse(header, args=["-xc-header"]).save(str(pch))
+        except Exception as err:
+            logger.warning(f"unable to precompile headers for C analysis: {err}")
+            return None
+        return pch
+
+    def _loads(self, pch: Path) -> bool:
+        # whether clang loads the precompiled header, which it won't if a header has changed since it was made
+        translation_unit = _get_index().parse('pch_check.c', args=["-xc", "-include-pch", str(pch)],
+                                              unsaved_files=[('pch_check.c', '')])
+        return not _has_fatal_error(translation_unit)
+
     def _check_for_include(self, lineno) -> Optional[str]:
         """Check whether a given line number is in a region that has come from an include."""
-        # todo: don't need a stack?
-        include_stack = []
-        for region_line, region_type in self._include_region:
-            if region_line > lineno:
-                break
-            if region_type.endswith("start"):
-                include_stack.append(region_type.replace("_start", ""))
-            elif region_type.endswith("end"):
-                include_stack.pop()
-        if include_stack:
-            return include_stack[-1]
-        return None
+        return self._include_map[lineno]
+
+    def _walk_nodes(self, trans_unit) -> Iterator:
+        """
+        Walk the nodes of a translation unit, skipping whole subtrees which came from system includes.
+
+        We don't descend into anything declared in a system header, such as the bodies of its inline functions.
+
+        """
+        for top_level in trans_unit.cursor.get_children():
+            if self._check_for_include(top_level.location.line) == "sys_include":
+                continue
+            yield from top_level.walk_preorder()
 
     def run(self, fpath: Path) \
             -> Union[Tuple[AnalysedC, Path], Tuple[Exception, None]]:
@@ -124,19 +355,28 @@ class CAnalyser:
 
         log_or_dot(logger, f"analysing {fpath}")
 
-        analysed_file = AnalysedC(fpath=fpath, file_hash=file_hash)
+        analysed_file = AnalysedDependentBuilder(fpath=fpath, file_hash=file_hash, result_class=AnalysedC)
 
-        # parse the file
+        # parse the file, loading its precompiled header, if it has one
         try:
-            index = clang.cindex.Index.create()
-            translation_unit = index.parse(fpath, args=["-xc"])
+            pch = self._pch.get(fpath)
+            if pch:
+                translation_unit = _get_index().parse(fpath, args=["-xc", "-include-pch", str(pch)])
+                if _has_fatal_error(translation_unit):
+                    logger.debug(f'unable to use precompiled header {pch} for {fpath}')
+                    pch = None
+            if not pch:
+                translation_unit = _get_index().parse(fpath, args=["-xc"])
         except Exception as err:
             logger.exception(f'error parsing {fpath}')
             return err, None
 
         # Create include region line mappings
         try:
-            self._locate_include_regions(translation_unit)
+            if self._pragmas_from_source:
+                self._locate_include_regions_in_source(fpath)
+            else:
+                self._locate_include_regions(translation_unit)
         except Exception as err:
             logger.exception(f'error locating include regions {fpath}')
             return err, None
@@ -144,12 +384,9 @@ class CAnalyser:
         # Now walk the actual nodes and find all relevant external symbols
         try:
             usr_symbols: List[str] = []
-            for node in translation_unit.cursor.walk_preorder():
+            for node in self._walk_nodes(translation_unit):
                 if not node.spelling:
                     continue
-                # ignore sys include stuff
-                if self._check_for_include(node.location.line) == "sys_include":
-                    continue
                 logger.debug('Considering node: %s', node.spelling)
 
                 if node.kind in {clang.cindex.CursorKind.FUNCTION_DECL,
@@ -162,8 +399,9 @@ class CAnalyser:
             logger.exception(f'error walking parsed nodes {fpath}')
             return err, None
 
-        analysed_file.save(analysis_fpath)
-        return analysed_file, analysis_fpath
+        result = analysed_file.build()
+        result.save(analysis_fpath)
+        return result, analysis_fpath
 
     def _process_symbol_declaration(self, analysed_file, node, usr_symbols):
         # Identify symbol declarations which are definitions or user includes
@@ -192,3 +430,7 @@ class CAnalyser:
         if node.spelling in usr_symbols:
             logger.debug('  * Is a user symbol (so a dependency)')
             analysed_file.add_symbol_dep(node.spelling)
+
+
+def _has_fatal_error(translation_unit) -> bool:
+    return any(diagnostic.severity >= clang.cindex.Diagnostic.Fatal for diagnostic in translation_unit.diagnostics)
@@ -7,9 +7,13 @@
 Fortran language handling classes.
 
 """
+import json
 import logging
+import os
 from pathlib import Path
-from typing import Union, Optional, Iterable, Dict, Any, Set
+from types import MappingProxyType
+from typing import (Union, Optional, Iterable, Dict, Any, FrozenSet,
+                    Mapping, Set)
 
 from fparser.two.Fortran2003 import (  # type: ignore
     Entity_Decl_List, Use_Stmt, Module_Stmt, Program_Stmt, Subroutine_Stmt,
@@ -21,10 +25,12 @@ from fparser.two.utils import walk  # type: ignore
 
 # todo: what else should we be importing from 2008 instead of 2003? This seems fragile.
 from fparser.two.Fortran2008 import (  # type: ignore
-    Type_Declaration_Stmt, Attr_Spec_List)
+    Type_Declaration_Stmt, Attr_Spec_List, Submodule, Submodule_Stmt,
+    Parent_Identifier)
 
 from fab.build_config import BuildConfig
-from fab.dep_tree import AnalysedDependent
+from fab.dep_tree import AnalysedDependent, AnalysedDependentBuilder
+from fab.parse import EmptySourceFile, intern_symbols
 from fab.parse.fortran_common import _typed_child, FortranAnalyserBase
 from fab.util import file_checksum, string_checksum
 
@@ -43,6 +49,15 @@ class AnalysedFortran(AnalysedDependent):
     runtime into an instance of this class.
 
     """
+    __slots__ = ('program_defs', 'module_defs', 'submodule_defs', 'module_deps',
+                 'mo_commented_file_deps', 'psyclone_kernels')
+    program_defs: FrozenSet[str]
+    module_defs: FrozenSet[str]
+    submodule_defs: FrozenSet[str]
+    module_deps: FrozenSet[str]
+    mo_commented_file_deps: FrozenSet[str]
+    psyclone_kernels: Mapping[str, int]
+
     def __init__(self, fpath: Union[str, Path],
                  file_hash: Optional[int] = None,
                  program_defs: Optional[Iterable[str]] = None,
@@ -51,8 +66,9 @@ class AnalysedFortran(AnalysedDependent):
                  module_deps: Optional[Iterable[str]] = None,
                  symbol_deps: Optional[Iterable[str]] = None,
                  mo_commented_file_deps: Optional[Iterable[str]] = None,
-                 file_deps: Optional[Iterable[Path]] = None,
-                 psyclone_kernels: Optional[Dict[str, int]] = None):
+                 file_deps: Optional[Iterable[Union[str, Path]]] = None,
+                 psyclone_kernels: Optional[Mapping[str, int]] = None,
+                 submodule_defs: Optional[Iterable[str]] = None):
         """
         :param fpath:
             The source file that was analysed.
@@ -80,42 +96,50 @@ class AnalysedFortran(AnalysedDependent):
         :param psyclone_kernels:
             The hash of any PSyclone kernel metadata found in this source file,
             by name.
+        :param submodule_defs:
+            Set of submodules defined by this source file, each named
+            `<ancestor module>@<submodule>`, as in the name of its smod file.
+            A subset of symbol_defs.
 
         """
         super().__init__(fpath=fpath, file_hash=file_hash,
                          symbol_defs=symbol_defs, symbol_deps=symbol_deps, file_deps=file_deps)
 
-        self.program_defs: Set[str] = set(program_defs or [])
-        self.module_defs: Set[str] = set(module_defs or [])
-        self.module_deps: Set[str] = set(module_deps or [])
-        self.mo_commented_file_deps: Set[str] = \
-            set(mo_commented_file_deps or [])
+        self._init('program_defs', intern_symbols(program_defs))
+        self._init('module_defs', intern_symbols(module_defs))
+        self._init('submodule_defs', intern_symbols(submodule_defs))
+        self._init('module_deps', intern_symbols(module_deps))
+        self._init('mo_commented_file_deps', intern_symbols(mo_commented_file_deps))
 
         # Todo: Ideally Psyclone stuff would not be part of this general
         #       fortran analysis code. Instead, perhaps we could inject
         #       bespoke node handling into the fortran analyser.
-        self.psyclone_kernels: Dict[str, int] = psyclone_kernels or {}
+        self._init('psyclone_kernels', MappingProxyType(dict(psyclone_kernels or {})))
 
         self.validate()
 
-    def add_program_def(self, name):
-        self.program_defs.add(name.lower())
-        self.add_symbol_def(name)
-
-    def add_module_def(self, name):
-        self.module_defs.add(name.lower())
-        self.add_symbol_def(name)
-
-    def add_module_dep(self, name):
-        self.module_deps.add(name.lower())
-        self.add_symbol_dep(name)
-
     @property
     def mod_filenames(self):
         """The mod_filenames property defines which module files are
         expected to be created (but not where)."""
         return {f'{mod}.mod' for mod in self.module_defs}
 
+    @property
+    def smod_filenames(self):
+        """The smod_filenames property defines which submodule files are
+        expected to be created for our submodules (but not where).
+
+        Compilers may also write an smod file for a module, but we don't rely on it."""
+        return {f'{submod}.smod' for submod in self.submodule_defs}
+
+    @property
+    def submodule_ancestors(self):
+        """The modules and submodules whose smod files are needed to compile our submodules,
+        named as in :attr:`submodule_defs`. A module is named on its own."""
+        ancestors = {submod.split('@')[0] for submod in self.submodule_defs}
+        ancestors.update(dep for dep in self.symbol_deps if '@' in dep)
+        return ancestors
+
     @classmethod
     def field_names(cls):
         # we're not using the super class because we want to insert,
@@ -123,7 +147,7 @@ class AnalysedFortran(AnalysedDependent):
         return [
             'fpath', 'file_hash',
             'program_defs',
-            'module_defs', 'symbol_defs',
+            'module_defs', 'submodule_defs', 'symbol_defs',
             'module_deps', 'symbol_deps',
             'mo_commented_file_deps',
             'file_deps',
@@ -137,9 +161,10 @@ class AnalysedFortran(AnalysedDependent):
         result.update({
             "program_defs": list(sorted(self.program_defs)),
             "module_defs": list(sorted(self.module_defs)),
+            "submodule_defs": list(sorted(self.submodule_defs)),
             "module_deps": list(sorted(self.module_deps)),
             "mo_commented_file_deps": list(sorted(self.mo_commented_file_deps)),
-            "psyclone_kernels": self.psyclone_kernels,
+            "psyclone_kernels": dict(self.psyclone_kernels),
         })
 
         return result
@@ -149,13 +174,15 @@ class AnalysedFortran(AnalysedDependent):
         result = cls(
             fpath=Path(d["fpath"]),
             file_hash=d["file_hash"],
-            program_defs=set(d["program_defs"]),
-            module_defs=set(d["module_defs"]),
-            symbol_defs=set(d["symbol_defs"]),
-            module_deps=set(d["module_deps"]),
-            symbol_deps=set(d["symbol_deps"]),
-            file_deps=set(map(Path, d["file_deps"])),
-            mo_commented_file_deps=set(d["mo_commented_file_deps"]),
+            program_defs=d["program_defs"],
+            module_defs=d["module_defs"],
+            # not in results from before submodules were supported
+            submodule_defs=d.get("submodule_defs", []),
+            symbol_defs=d["symbol_defs"],
+            module_deps=d["module_deps"],
+            symbol_deps=d["symbol_deps"],
+            file_deps=d["file_deps"],
+            mo_commented_file_deps=d["mo_commented_file_deps"],
             psyclone_kernels=d["psyclone_kernels"],
         )
 
@@ -167,6 +194,7 @@ class AnalysedFortran(AnalysedDependent):
 
         assert all(d and len(d) for d in self.program_defs), "bad program definitions"
         assert all(d and len(d) for d in self.module_defs), "bad module definitions"
+        assert all(d and '@' in d for d in self.submodule_defs), "bad submodule definitions"
         assert all(d and len(d) for d in self.symbol_defs), "bad symbol definitions"
         assert all(d and len(d) for d in self.module_deps), "bad module dependencies"
         assert all(d and len(d) for d in self.symbol_deps), "bad symbol dependencies"
@@ -176,10 +204,59 @@ class AnalysedFortran(AnalysedDependent):
             "programs definitions must also be symbol definitions"
         assert self.module_defs <= self.symbol_defs, \
             "modules definitions must also be symbol definitions"
+        assert self.submodule_defs <= self.symbol_defs, \
+            "submodule definitions must also be symbol definitions"
         assert self.module_deps <= self.symbol_deps, \
             "modules dependencies must also be symbol dependencies"
 
 
+class AnalysedFortranBuilder(AnalysedDependentBuilder):
+    """
+    Collects the results of parsing a Fortran file, to create an
+    :class:`~fab.parse.fortran.AnalysedFortran`.
+
+    """
+    def __init__(self, fpath: Union[str, Path],
+                 file_hash: Optional[int] = None):
+        super().__init__(fpath=fpath, file_hash=file_hash,
+                         result_class=AnalysedFortran)
+        self.program_defs: Set[str] = set()
+        self.module_defs: Set[str] = set()
+        self.submodule_defs: Set[str] = set()
+        self.module_deps: Set[str] = set()
+        self.mo_commented_file_deps: Set[str] = set()
+        self.psyclone_kernels: Dict[str, int] = {}
+
+    def add_program_def(self, name):
+        self.program_defs.add(name.lower())
+        self.add_symbol_def(name)
+
+    def add_module_def(self, name):
+        self.module_defs.add(name.lower())
+        self.add_symbol_def(name)
+
+    def add_submodule_def(self, ancestor, name):
+        submod = f'{ancestor}@{name}'.lower()
+        self.submodule_defs.add(submod)
+        self.add_symbol_def(submod)
+
+    def add_module_dep(self, name):
+        self.module_deps.add(name.lower())
+        self.add_symbol_dep(name)
+
+    def fields(self) -> Dict[str, Any]:
+        result = super().fields()
+        result.update({
+            'program_defs': self.program_defs,
+            'module_defs': self.module_defs,
+            'submodule_defs': self.submodule_defs,
+            'module_deps': self.module_deps,
+            'mo_commented_file_deps': self.mo_commented_file_deps,
+            'psyclone_kernels': self.psyclone_kernels,
+        })
+        return result
+
+
 class FortranAnalyser(FortranAnalyserBase):
     """
     A build step which analyses a fortran file using fparser2, creating an
@@ -225,7 +302,8 @@ class FortranAnalyser(FortranAnalyserBase):
     def walk_nodes(self, fpath, file_hash, node_tree) -> AnalysedFortran:
 
         # see what's in the tree
-        analysed_fortran = AnalysedFortran(fpath=fpath, file_hash=file_hash)
+        analysed_fortran = AnalysedFortranBuilder(fpath=fpath,
+                                                  file_hash=file_hash)
         for obj in walk(node_tree):
             obj_type = type(obj)
             try:
@@ -248,7 +326,7 @@ class FortranAnalyser(FortranAnalyserBase):
                         routine = self._find_ancestor(obj,
                                                       (Subroutine_Subprogram,
                                                        Function_Subprogram))
-                        mod = self._find_ancestor(obj, Module)
+                        mod = self._find_ancestor(obj, (Module, Submodule))
                         # These two walks will potentially add subroutines
                         # more than once, but that doesn't matter too much
                         if routine:
@@ -279,6 +357,9 @@ class FortranAnalyser(FortranAnalyserBase):
                 elif obj_type == Module_Stmt:
                     analysed_fortran.add_module_def(str(obj.get_name()))
 
+                elif obj_type == Submodule_Stmt:
+                    self._process_submodule_statement(analysed_fortran, obj)
+
                 elif obj_type in (Subroutine_Stmt, Function_Stmt):
                     self._process_subroutine_or_function(analysed_fortran,
                                                          fpath, obj)
@@ -329,7 +410,7 @@ class FortranAnalyser(FortranAnalyserBase):
                 logger.exception(f'error processing node '
                                  f'{obj.item or obj_type} in {fpath}')
 
-        return analysed_fortran
+        return analysed_fortran.build()
 
     def _process_use_statement(self, analysed_file, obj):
         use_name = _typed_child(obj, Name, must_exist=True)
@@ -341,6 +422,18 @@ class FortranAnalyser(FortranAnalyserBase):
             # found a dependency on fortran
             analysed_file.add_module_dep(use_name)
 
+    def _process_submodule_statement(self, analysed_file, obj):
+        # A submodule extends its ancestor module, and optionally a parent
+        # submodule of the same ancestor. Its compilation needs their mod
+        # and smod files, but nothing needs to recompile when it changes.
+        parent_id = _typed_child(obj, Parent_Identifier, must_exist=True)
+        ancestor, parent = parent_id.items
+        ancestor = ancestor.string
+        analysed_file.add_submodule_def(ancestor, str(obj.get_name()))
+        analysed_file.add_module_dep(ancestor)
+        if parent:
+            analysed_file.add_symbol_dep(f'{ancestor}@{parent.string}')
+
     def _process_variable_binding(self, analysed_file,
                                   obj: Type_Declaration_Stmt):
         # The name keyword on the bind statement is optional.
@@ -408,7 +501,7 @@ class FortranAnalyser(FortranAnalyserBase):
 
         # not bound, just record the presence of the fortran symbol
         # we don't need to record stuff in modules (we think!)
-        elif (not self._find_ancestor(obj, Module) and
+        elif (not self._find_ancestor(obj, (Module, Submodule)) and
               not self._find_ancestor(obj, Interface_Block)):
             if isinstance(obj, Subroutine_Stmt):
                 analysed_file.add_symbol_def(str(obj.get_name()))
@@ -417,6 +510,101 @@ class FortranAnalyser(FortranAnalyserBase):
                 analysed_file.add_symbol_def(name.string)
 
 
+class KernelIndex():
+    """
+    A persistent map from the hash of a Fortran file to the PSyclone kernel metadata it defines.
+
+    Files which define no kernels are recorded too, with no kernels, so that nothing
+    unchanged needs to be parsed, or have its analysis results loaded, to find out.
+
+    Both the psyclone and the analyse steps add to the index, whichever analyses a file first.
+
+    """
+    # The index lives in the prebuild folder, under this name.
+    FILENAME = 'psyclone_kernels.json'
+
+    def __init__(self, fpath: Path):
+        """
+        :param fpath:
+            Where the index is stored. It's read if it exists.
+
+        """
+        self.fpath = fpath
+        self._kernels: Dict[int, Dict[str, int]] = {}
+        self._changed = False
+
+        if fpath.exists():
+            try:
+                with open(fpath, 'rt') as index_file:
+                    loaded = json.load(index_file)
+                self._kernels = {int(file_hash): kernels for file_hash, kernels in loaded.items()}
+            except (ValueError, AttributeError) as err:
+                logger.warning(f"ignoring unreadable kernel index {fpath}: {err}")
+
+    def __contains__(self, file_hash: int) -> bool:
+        return file_hash in self._kernels
+
+    def __len__(self) -> int:
+        return len(self._kernels)
+
+    def get(self, file_hash: int) -> Optional[Dict[str, int]]:
+        """
+        Return the kernel metadata hashes, by kernel type name, for the file with the given hash.
+
+        Returns None if the file hasn't been indexed.
+
+        """
+        return self._kernels.get(file_hash)
+
+    def add(self, file_hash: int, kernels: Mapping[str, int]):
+        """
+        Record the kernels defined in the file with the given hash.
+
+        """
+        kernels = dict(kernels)
+        if self._kernels.get(file_hash) != kernels:
+            self._kernels[file_hash] = kernels
+            self._changed = True
+
+    def add_results(self, analysed_files: Iterable[Any]):
+        """
+        Record the kernels found in some analysis results.
+
+        Empty files are recorded as defining no kernels. Results for other languages are ignored.
+
+        """
+        for af in analysed_files:
+            if isinstance(af, AnalysedFortran):
+                self.add(af.file_hash, af.psyclone_kernels)
+            elif isinstance(af, EmptySourceFile):
+                self.add(af.file_hash, {})
+
+    def prune(self, keep: Iterable[int]):
+        """
+        Forget every file hash which isn't in `keep`, so the index doesn't grow with every edit.
+
+        """
+        keep = set(keep)
+        for file_hash in set(self._kernels) - keep:
+            del self._kernels[file_hash]
+            self._changed = True
+
+    def save(self):
+        """
+        Write the index, if it has changed.
+
+        The file is replaced in one go, so an interrupted build can't leave a partial index.
+
+        """
+        if not self._changed:
+            return
+        tmp_fpath = self.fpath.with_name(self.fpath.name + '.tmp')
+        with open(tmp_fpath, 'wt') as index_file:
+            json.dump({str(k): v for k, v in self._kernels.items()}, index_file)
+        os.replace(tmp_fpath, self.fpath)
+        self._changed = False
+
+
 class FortranParserWorkaround():
     """
     Use this class to create a workaround when the third-party Fortran parser
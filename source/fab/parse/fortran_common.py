@@ -103,7 +103,8 @@ class FortranAnalyserBase(ABC):
                 # result will *not* point to the file we eventually want to
                 # compile, it will point to the user's original file,
                 # somewhere else. So replace it with our own path.
-                loaded_result.fpath = fpath
+                if loaded_result.fpath != fpath:
+                    loaded_result = loaded_result.replace(fpath=fpath)
                 return loaded_result, analysis_fpath
 
         log_or_dot(logger, f"analysing {fpath}")
@@ -136,6 +137,10 @@ class FortranAnalyserBase(ABC):
             str(fpath),
             ignore_comments=False,
             include_omp_conditional_lines=self.config.openmp)
+        return self._parse_reader(fpath, reader)
+
+    def _parse_reader(self, fpath, reader):
+        """Get a node tree from an fparser reader, reporting any errors against the given file."""
         # don't call sys.exit, it messes up the multi-processing
         reader.exit_on_error = False
 
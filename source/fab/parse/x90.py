@@ -3,23 +3,78 @@
 #  For further details please refer to the file COPYRIGHT
 #  which you should have received as part of this distribution
 # ##############################################################################
+import re
 from pathlib import Path
-from typing import Iterable, Set, Union, Optional, Dict, Any
+from typing import Iterable, FrozenSet, List, Set, Union, Optional, Dict, Any
 
+from fparser.common.readfortran import FortranStringReader  # type: ignore
 from fparser.two.Fortran2003 import Use_Stmt, Call_Stmt, Name, Only_List, Actual_Arg_Spec_List, Part_Ref  # type: ignore
 from fparser.two.utils import walk  # type: ignore
 
-from fab.parse import AnalysedFile
+from fab.parse import AnalysedFile, intern_symbols
 from fab.build_config import BuildConfig
 from fab.parse.fortran_common import FortranAnalyserBase, logger, _typed_child
 from fab.util import by_type
 
+# regex to convert an x90 into parsable fortran, so it can be analysed using a third party tool
+
+WHITE = r'[\s&]+'
+OPT_WHITE = r'[\s&]*'
+
+SQ_STRING = "'[^']*'"
+DQ_STRING = '"[^"]*"'
+STRING = f'({SQ_STRING}|{DQ_STRING})'
+
+NAME_KEYWORD = 'name' + OPT_WHITE + '=' + OPT_WHITE + STRING + OPT_WHITE + ',' + OPT_WHITE
+NAMED_INVOKE = 'call' + WHITE + 'invoke' + OPT_WHITE + r'\(' + OPT_WHITE + NAME_KEYWORD
+
+_x90_compliance_pattern = re.compile(pattern=NAMED_INVOKE)
+
+
+# todo: In the future, we'd like to extend fparser to handle the leading invoke keywords. (Lots of effort.)
+def sanitise_x90(src: str) -> str:
+    """
+    Take out the leading name keyword in calls to invoke(), making parsable fortran from x90 source.
+
+    If present it looks like this::
+
+        call invoke( name = "compute_dry_mass", ...
+
+    :param src:
+        The text of an x90 file.
+
+    Returns the parsable text.
+
+    """
+    # Before we remove the name keywords to invoke, we must remove any comment lines.
+    # This is the simplest way to avoid producing bad fortran when the name keyword is followed by a comment line.
+    # I.e. The comment line doesn't have an "&", so we get "call invoke(!" with no "&", which is a syntax error.
+    no_comment_lines = [line for line in src.splitlines(keepends=True) if not line.lstrip().startswith('!')]
+    src = ''.join(no_comment_lines)
+
+    replaced: List[str] = []
+
+    def repl(matchobj):
+        # matchobj[0] contains the entire matching string, from "call" to the "," after the name keyword.
+        # matchobj[1] contains the single group in the search pattern, which is defined in STRING.
+        name = matchobj[1].replace('"', '').replace("'", "")
+        replaced.append(name)
+        return 'call invoke('
+
+    out = _x90_compliance_pattern.sub(repl=repl, string=src)
+    logger.debug(f'names removed: {replaced}')
+
+    return out
+
 
 class AnalysedX90(AnalysedFile):
     """
     Analysis results for an x90 file.
 
     """
+    __slots__ = ('kernel_deps',)
+    kernel_deps: FrozenSet[str]
+
     def __init__(self, fpath: Union[str, Path], file_hash: int,
                  # todo: the fortran version doesn't include the remaining args - update this too, for simplicity.
                  kernel_deps: Optional[Iterable[str]] = None):
@@ -35,7 +90,7 @@ class AnalysedX90(AnalysedFile):
         super().__init__(fpath=fpath, file_hash=file_hash)
 
         # Maps used kernel metadata (type def names) to the modules they're found in
-        self.kernel_deps: Set[str] = set(kernel_deps or {})
+        self._init('kernel_deps', intern_symbols(kernel_deps))
 
     def to_dict(self) -> Dict[str, Any]:
         result = super().to_dict()
@@ -49,7 +104,7 @@ class AnalysedX90(AnalysedFile):
         result = cls(
             fpath=Path(d["fpath"]),
             file_hash=d["file_hash"],
-            kernel_deps=set(d["kernel_deps"]),
+            kernel_deps=d["kernel_deps"],
         )
         assert result.file_hash is not None
         return result
@@ -62,16 +117,29 @@ class AnalysedX90(AnalysedFile):
 
 
 class X90Analyser(FortranAnalyserBase):
+    """
+    Analyses x90 files, finding the kernels they pass to invoke().
 
-    # Makes a parsable fortran version of x90.
-    # todo: Use hashing to reuse previous analysis results.
+    The x90 is sanitised into parsable fortran in memory. Results are stored against
+    the hash of the x90 itself, so an unchanged x90 is neither sanitised nor parsed again.
 
+    """
     def __init__(self, config: BuildConfig):
         super().__init__(config=config, result_class=AnalysedX90)
 
+    def _parse_file(self, fpath):
+        """Get a node tree from the sanitised text of an x90 file."""
+        with open(fpath, 'rt') as x90:
+            src = sanitise_x90(x90.read())
+        reader = FortranStringReader(
+            src,
+            ignore_comments=False,
+            include_omp_conditional_lines=self.config.openmp)
+        return self._parse_reader(fpath, reader)
+
     def walk_nodes(self, fpath, file_hash, node_tree) -> AnalysedX90:  # type: ignore
 
-        analysed_file = AnalysedX90(fpath=fpath, file_hash=file_hash)
+        kernel_deps: Set[str] = set()
         symbol_deps: Dict[str, str] = {}
 
         for obj in walk(node_tree):
@@ -81,7 +149,7 @@ class X90Analyser(FortranAnalyserBase):
                     self._process_use_statement(symbol_deps, obj)  # raises
 
                 elif obj_type == Call_Stmt:
-                    self._process_call_statement(symbol_deps, analysed_file, obj)
+                    self._process_call_statement(symbol_deps, kernel_deps, obj)
 
             except Exception:
                 logger.exception(f'error processing node {obj.item or obj_type} in {fpath}')
@@ -90,7 +158,7 @@ class X90Analyser(FortranAnalyserBase):
         # analysis_fpath = self._get_analysis_fpath(fpath, file_hash)
         # analysed_file.save(analysis_fpath)
 
-        return analysed_file
+        return AnalysedX90(fpath=fpath, file_hash=file_hash, kernel_deps=kernel_deps)
 
     def _process_use_statement(self, symbol_deps: Dict[str, str], obj):
         # Record the modules in which potential kernels live.
@@ -104,7 +172,7 @@ class X90Analyser(FortranAnalyserBase):
         for name in name_nodes:
             symbol_deps[name.string] = module_dep.string
 
-    def _process_call_statement(self, symbol_deps: Dict[str, str], analysed_file, obj):
+    def _process_call_statement(self, symbol_deps: Dict[str, str], kernel_deps: Set[str], obj):
         # if we're calling invoke, record the names of the args.
         # sanity check they end with "_type".
         called_name = _typed_child(obj, Name)
@@ -121,6 +189,6 @@ class X90Analyser(FortranAnalyserBase):
                 arg_name = _typed_child(arg, Name)
                 arg_name = arg_name.string
                 if arg_name in symbol_deps:
-                    analysed_file.kernel_deps.add(arg_name)
+                    kernel_deps.add(arg_name)
                 else:
                     logger.debug(f"arg '{arg_name}' to invoke() was not used, presumed built-in kernel")
@@ -0,0 +1,184 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Profile Fab's own Python code, for finding its hot paths.
+
+When profiling is initialised, each step runs under cProfile, as do the pool workers started by
+:func:`~fab.steps.run_mp`, through a pool initializer. Each step and each worker writes a `.prof` file
+into the profile folder, which can be loaded with :mod:`pstats` or a viewer such as snakeviz.
+When profiling stops, the files are merged into a summary of the top functions.
+
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+from collections import defaultdict
+from contextlib import contextmanager
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+PROFILE_FOLDER = 'profile'
+SUMMARY_FILENAME = 'profile_summary.txt'
+
+# how many functions to list in each part of the summary
+SUMMARY_TOP = 30
+
+logger = logging.getLogger(__name__)
+
+# where to write the .prof files, when profiling
+_profile_folder: Optional[Path] = None
+
+# The profiler running in this process, and the name of the .prof file it will write.
+# Pool workers are named after the step which started them.
+_profiler: Optional[cProfile.Profile] = None
+_profile_name: Optional[str] = None
+
+
+def init_profiling(metrics_folder: Path):
+    """
+    Start profiling each step, writing into a profile folder in the given metrics folder.
+
+    Any profiles from a previous run are removed.
+
+    :param metrics_folder:
+        The build's metrics folder.
+
+    """
+    global _profile_folder
+
+    folder = metrics_folder / PROFILE_FOLDER
+    folder.mkdir(parents=True, exist_ok=True)
+    for old in folder.glob('*.prof'):
+        old.unlink()
+    _profile_folder = folder
+
+
+def profiling() -> bool:
+    """
+    Whether profiling has been initialised.
+
+    """
+    return _profile_folder is not None
+
+
+@contextmanager
+def profile_step(name: str):
+    """
+    Profile a step, within a with block, writing the profile when the block ends.
+
+    Steps called by another step are included in that step's profile, because a process can only run one profiler.
+
+    """
+    global _profiler, _profile_name
+
+    if _profile_folder is None or _profiler is not None:
+        yield
+        return
+
+    _profile_name = _unique_name(_profile_folder, name)
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+    try:
+        yield
+    finally:
+        _profiler.disable()
+        _profiler.dump_stats(_profile_folder / f'{_profile_name}.prof')
+        _profiler = _profile_name = None
+
+
+def _unique_name(folder: Path, name: str) -> str:
+    # a step can run more than once in a build
+    unique, count = name, 1
+    while (folder / f'{unique}.prof').exists():
+        count += 1
+        unique = f'{name}-{count}'
+    return unique
+
+
+def pool_options() -> Dict[str, Any]:
+    """
+    The arguments for creating a multiprocessing pool whose workers are profiled, if we're profiling.
+
+    """
+    if _profile_folder is None:
+        return {}
+    return {'initializer': _start_worker_profile, 'initargs': (_profile_folder, _profile_name or 'workers')}
+
+
+def _start_worker_profile(folder: Path, step_name: str):
+    global _profile_folder, _profiler, _profile_name
+
+    # A forked worker inherits its parent's profiler, which we stop so it doesn't see the worker's calls.
+    if _profiler is not None:
+        _profiler.disable()
+
+    _profile_folder = folder
+    _profile_name = f'{step_name}.worker-{os.getpid()}'
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+    # Pool workers don't run atexit handlers, but they do run these when they finish.
+    Finalize(None, _stop_worker_profile, exitpriority=110)
+
+
+def _stop_worker_profile():
+    global _profiler
+
+    if _profiler is None or _profile_folder is None:
+        return
+    _profiler.disable()
+    _profiler.dump_stats(_profile_folder / f'{_profile_name}.prof')
+    _profiler = None
+
+
+def stop_profiling(top: int = SUMMARY_TOP) -> Optional[Path]:
+    """
+    Stop profiling, and merge the profiles into a summary in the metrics folder.
+
+    The summary lists the functions which took the most time overall, across all steps and workers,
+    then the functions which took the most cumulative time in each step, with its workers.
+
+    :param top:
+        How many functions to list in each part of the summary.
+
+    :returns:
+        The summary file, if we were profiling.
+
+    """
+    global _profile_folder
+
+    if _profile_folder is None:
+        return None
+    folder, _profile_folder = _profile_folder, None
+
+    # a step's profile merged with those of its workers
+    by_step: Dict[str, List[Path]] = defaultdict(list)
+    for fpath in sorted(folder.glob('*.prof')):
+        by_step[fpath.name.split('.')[0]].append(fpath)
+
+    summary = folder.parent / SUMMARY_FILENAME
+    with summary.open('wt') as out:
+        if not by_step:
+            out.write('no steps were profiled\n')
+            return summary
+
+        out.write(f'profiled {len(by_step)} steps, in {folder}\n\n')
+        out.write(_section('all steps, by own time', [f for files in by_step.values() for f in files], 'tottime', top))
+        for name, files in by_step.items():
+            title = f'{name}, with {len(files) - 1} workers, by cumulative time'
+            out.write(_section(title, files, 'cumulative', top))
+
+    logger.info(f'profile summary written to {summary}')
+    return summary
+
+
+def _section(title: str, files: List[Path], sort: str, top: int) -> str:
+    stream = io.StringIO()
+    stats = pstats.Stats(*map(str, files), stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+    return f'{"=" * 10} {title} {"=" * 10}\n{stream.getvalue()}\n'
@@ -0,0 +1,171 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Report the progress of :func:`~fab.steps.run_mp`, with an estimate of the time remaining.
+
+The parent process is told as each item finishes. The estimate comes from how long each item took in the last
+build, scaled by how the items done so far compare with last time, so it allows for a busier machine or different
+flags. Without any history, each item is assumed to take as long as the average so far.
+
+"""
+import json
+import logging
+import sys
+from functools import lru_cache
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Optional, TextIO
+
+from fab.metrics import ITEM_TIMES_GROUP, JSON_FILENAME
+
+logger = logging.getLogger(__name__)
+
+
+def load_item_times(metrics_folder: Path, step_name: Optional[str]) -> Dict[str, float]:
+    """
+    How long each item took, in seconds, in the given step, from the last build's metrics.
+
+    :param metrics_folder:
+        The build's metrics folder.
+    :param step_name:
+        The step whose items we want.
+
+    """
+    fpath = metrics_folder / JSON_FILENAME
+    try:
+        mtime = fpath.stat().st_mtime_ns
+    except OSError:
+        return {}
+    return _load_item_times(fpath, mtime, step_name)
+
+
+@lru_cache(maxsize=8)
+def _load_item_times(fpath: Path, mtime: int, step_name: Optional[str]) -> Dict[str, float]:
+    # the mtime is part of the cache key, compile steps call us for every pass
+    try:
+        times = json.loads(fpath.read_text()).get(ITEM_TIMES_GROUP, {})
+    except (OSError, ValueError) as err:
+        logger.warning(f"could not read item times from '{fpath}': {err}")
+        return {}
+    prefix = f'{step_name}: '
+    return {name[len(prefix):]: value for name, value in times.items()
+            if name.startswith(prefix) and isinstance(value, (int, float))}
+
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f'{hours}h{minutes:02}m'
+    if minutes:
+        return f'{minutes}m{seconds:02}s'
+    return f'{seconds}s'
+
+
+class Progress():
+    """
+    Counts the items finished by a run_mp call, reporting how many are done and the time remaining.
+
+    On a terminal, this is a single status line which is redrawn as items finish.
+    Otherwise, or when debug logging, the progress is logged every so often.
+    Nothing is reported unless the fab logger is at INFO level.
+
+    """
+    # how often to redraw the status line, and to log progress, in seconds
+    REDRAW_INTERVAL = 0.2
+    LOG_INTERVAL = 10.0
+
+    def __init__(self, name: str, labels: List[str], previous: Optional[Dict[str, float]] = None,
+                 stream: Optional[TextIO] = None):
+        """
+        :param name:
+            What to call the work, usually the step name.
+        :param labels:
+            The label of each item, as used in the previous times.
+        :param previous:
+            How long each item took in the last build, in seconds.
+        :param stream:
+            Where to draw the status line. Defaults to stdout.
+
+        """
+        self.name = name
+        self.total = len(labels)
+        self.done = 0
+        self.stream = stream or sys.stdout
+
+        # Each item's share of the work. Items we haven't seen before are given the average.
+        previous = previous or {}
+        default = sum(previous.values()) / len(previous) if previous else 1.0
+        self._expected = [previous.get(label, default) for label in labels]
+        self._finished = [False] * self.total
+        self._expected_done = 0.0
+        self._expected_total = sum(self._expected)
+
+        self._start = self._last_report = perf_counter()
+        self._enabled = bool(self.total) and logger.isEnabledFor(logging.INFO)
+        self._tty = self._enabled and self.stream.isatty() and not logger.isEnabledFor(logging.DEBUG)
+        self._line_length = 0
+
+    def item_done(self, index: int):
+        """
+        Record that an item has finished, reporting progress if it's time to.
+
+        :param index:
+            The index of the item in the labels.
+
+        """
+        if self._finished[index]:
+            return
+        self._finished[index] = True
+        self.done += 1
+        self._expected_done += self._expected[index]
+
+        if not self._enabled or self.done == self.total:
+            return
+        now = perf_counter()
+        if now - self._last_report >= (self.REDRAW_INTERVAL if self._tty else self.LOG_INTERVAL):
+            self._last_report = now
+            self._report(self.status())
+
+    def eta(self) -> Optional[float]:
+        """
+        The estimated time remaining, in seconds, or None before the first item finishes.
+
+        """
+        if not self._expected_done:
+            return None
+        # the items done so far tell us how fast we're getting through the expected work
+        rate = (perf_counter() - self._start) / self._expected_done
+        return (self._expected_total - self._expected_done) * rate
+
+    def status(self) -> str:
+        """
+        A one line summary of the progress.
+
+        """
+        status = f'{self.name}: {self.done}/{self.total} ({100 * self.done // self.total}%)'
+        eta = self.eta()
+        if eta is not None:
+            status += f', about {_format_seconds(eta)} left'
+        return status
+
+    def finish(self):
+        """
+        Clear the status line, when all the items are done or there's been an error.
+
+        """
+        if self._tty and self._line_length:
+            self.stream.write('\r' + ' ' * self._line_length + '\r')
+            self.stream.flush()
+            self._line_length = 0
+
+    def _report(self, status: str):
+        if self._tty:
+            self.stream.write('\r' + status.ljust(self._line_length))
+            self.stream.flush()
+            self._line_length = len(status)
+        else:
+            logger.info(status)
@@ -6,31 +6,133 @@
 """
 Predefined build steps with sensible defaults.
 """
+import logging
 import multiprocessing
-from typing import Iterable, Optional, Union
+import queue
+from collections import deque
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
-from fab.metrics import send_metric
+from fab.checkpoints import StepCheckpoints
+from fab.metrics import current_step, record_item_time, send_metric, trace, trace_event, usage_item, usage_step
+from fab.profiling import pool_options, profile_step
+from fab.progress import load_item_times, Progress
+from fab.throttle import load_peak_rss, MemoryThrottle
 from fab.util import by_type, TimerLogger
-from functools import wraps
+from functools import partial, wraps
 
+logger = logging.getLogger(__name__)
+
+
+def step(func=None, *, resumable: bool = True):
+    """
+    Function decorator for steps.
+
+    When the build config is checkpointing, a rerun skips any step whose
+    inputs haven't changed since it last completed. Steps which fetch from
+    outside the workspace must always run, using `@step(resumable=False)`.
+
+    """
+    if func is None:
+        return partial(step, resumable=resumable)
 
-def step(func):
-    """Function decorator for steps."""
     @wraps(func)
     def wrapper(*args, **kwargs):
 
         name = func.__name__
+        if args:
+            config, step_args = args[0], args[1:]
+        else:
+            config, step_args = kwargs.get('config'), args
+        checkpoints = getattr(config, 'checkpoints', None)
+        if not isinstance(checkpoints, StepCheckpoints):
+            checkpoints = None
 
         # call the function
-        with TimerLogger(name) as step:
-            func(*args, **kwargs)
+        with TimerLogger(name) as step, usage_step(name), profile_step(name):
+            if checkpoints and checkpoints.begin_step(config, name, step_args, kwargs):
+                logger.info(f'{name} inputs unchanged since it last completed, restored its artefacts')
+            else:
+                try:
+                    func(*args, **kwargs)
+                except Exception:
+                    if checkpoints:
+                        checkpoints.abort_step()
+                    raise
+                if checkpoints:
+                    checkpoints.end_step(config, name, resumable=resumable)
 
         send_metric('steps', name, step.taken)
+        trace_event(name, 'step', step.start, step.taken)
 
     return wrapper
 
 
-def run_mp(config, items, func, no_multiprocessing: bool = False):
+class _TracedItem():
+    """
+    Wraps a function which processes a single item, recording each call in the
+    build's trace timeline, and the resources used by any tools it ran.
+    Picklable, for sending to pool workers.
+
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, item):
+        label = _item_label(item)
+        start = perf_counter()
+        with trace(self.func.__name__, 'item', item=label), usage_item(label):
+            result = self.func(item)
+        record_item_time(label, perf_counter() - start)
+        return result
+
+
+class _IndexedItem():
+    """
+    Wraps a function which processes a single item, so it takes and returns the item's index too,
+    for telling the parent process which items are done when the results come back in any order.
+
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, indexed_item):
+        index, item = indexed_item
+        return index, self.func(item)
+
+
+def _item_label(item) -> str:
+    # Items are often a tuple of the thing to process and some shared arguments.
+    if isinstance(item, tuple) and item:
+        item = item[0]
+    return str(getattr(item, 'fpath', item))[:200]
+
+
+# The function and items for a throttled run_mp, which forked pool workers inherit.
+_throttled_work: Optional[Tuple[Callable, List]] = None
+
+
+def _run_throttled_item(index: int):
+    func, items = _throttled_work  # type: ignore
+    return func(items[index])
+
+
+def _call(func, item):
+    return func(item)
+
+
+def _put_index(finished: queue.SimpleQueue, index: int, _result):
+    finished.put(index)
+
+
+def _start_pool(config, processes: Optional[int] = None):
+    processes = processes or config.n_procs
+    with trace('start pool', 'pool', processes=processes):
+        return multiprocessing.Pool(processes, **pool_options())
+
+
+def run_mp(config, items, func, no_multiprocessing: bool = False, throttle: bool = False,
+           max_procs: Optional[int] = None):
     """
     Called from Step.run() to process multiple items in parallel.
 
@@ -44,17 +146,96 @@ def run_mp(config, items, func, no_multiprocessing: bool = False):
         A function to process a single item. Must accept a single argument.
     :param no_multiprocessing:
         Overrides the config's multiprocessing flag, disabling multiprocessing for this call.
+    :param throttle:
+        Start each item only when there's enough memory for it, judging by the memory available, the memory the
+        item needed in the last build and the load average, with at most `config.n_procs` items running at once.
+        For steps whose items can be heavy, such as compiling.
+    :param max_procs:
+        Process at most this many items at once, if it's fewer than `config.n_procs`.
 
     """
-    if config.multiprocessing and not no_multiprocessing:
-        with multiprocessing.Pool(config.n_procs) as p:
-            results = p.map(func, items)
-    else:
-        results = [func(f) for f in items]
+    func = _TracedItem(func)
+    items = list(items)
+    processes = min(filter(None, [config.n_procs, max_procs]), default=None)
+    progress = _start_progress(config, items)
+    try:
+        if config.multiprocessing and not no_multiprocessing and throttle:
+            results = _run_mp_throttled(config, items, func, progress, processes)
+        elif config.multiprocessing and not no_multiprocessing:
+            results = [None] * len(items)
+            with _start_pool(config, processes) as p:
+                with trace('map', 'pool'):
+                    # like map, with the same chunks, but we hear about each chunk as it finishes
+                    chunksize = max(1, -(-len(items) // (4 * (processes or 1))))
+                    for index, result in p.imap_unordered(_IndexedItem(func), enumerate(items), chunksize):
+                        results[index] = result
+                        progress.item_done(index)
+                # let the workers exit normally, sending their buffered metrics, rather than be terminated
+                with trace('join pool', 'pool'):
+                    p.close()
+                    p.join()
+        else:
+            results = []
+            for index, item in enumerate(items):
+                results.append(func(item))
+                progress.item_done(index)
+    finally:
+        progress.finish()
 
     return results
 
 
+def _start_progress(config, items: List) -> Progress:
+    step_name = current_step()
+    return Progress(step_name or 'run_mp', [_item_label(item) for item in items],
+                    load_item_times(config.metrics_folder, step_name))
+
+
+def _run_mp_throttled(config, items: List, func, progress: Progress, processes: Optional[int]) -> List:
+    global _throttled_work
+
+    throttle = MemoryThrottle(max_procs=processes or 1,
+                              peak_rss=load_peak_rss(config.metrics_folder, current_step()))
+    estimates = [throttle.estimate(_item_label(item)) for item in items]
+
+    # Forked workers inherit the items, so we only send them an index,
+    # instead of pickling each item and any shared arguments it carries.
+    forked = multiprocessing.get_start_method() == 'fork'
+    _throttled_work = (func, items)
+
+    pending = deque(range(len(items)))
+    running: Dict[int, int] = {}
+    async_results = {}
+    finished: queue.SimpleQueue = queue.SimpleQueue()
+    try:
+        with _start_pool(config, processes) as p:
+            with trace('throttled map', 'pool'):
+                while pending or running:
+                    while pending and throttle.admit(estimates[pending[0]], running.values()):
+                        index = pending.popleft()
+                        running[index] = estimates[index]
+                        call, args = (_run_throttled_item, (index,)) if forked else (_call, (func, items[index]))
+                        done = partial(_put_index, finished, index)
+                        async_results[index] = p.apply_async(call, args, callback=done, error_callback=done)
+
+                    # wait for something to finish, checking the memory again now and then
+                    try:
+                        index = finished.get(timeout=1)
+                    except queue.Empty:
+                        continue
+                    del running[index]
+                    progress.item_done(index)
+
+            # let the workers exit normally, sending their buffered metrics, rather than be terminated
+            with trace('join pool', 'pool'):
+                p.close()
+                p.join()
+    finally:
+        _throttled_work = None
+
+    return [async_results[index].get() for index in range(len(items))]
+
+
 def run_mp_imap(config, items, func, result_handler):
     """
     Like run_mp, but uses imap instead of map so that we can process each result as it happens.
@@ -70,13 +251,30 @@ def run_mp_imap(config, items, func, result_handler):
         A function to handle a single result. Must accept a single argument.
 
     """
-    if config.multiprocessing:
-        with multiprocessing.Pool(config.n_procs) as p:
-            analysis_results = p.imap_unordered(func, items)
-            result_handler(analysis_results)
-    else:
-        analysis_results = (func(a) for a in items)  # generator
-        result_handler(analysis_results)
+    func = _TracedItem(func)
+    items = list(items)
+    progress = _start_progress(config, items)
+    try:
+        if config.multiprocessing:
+            with _start_pool(config) as p:
+                with trace('imap', 'pool'):
+                    analysis_results = p.imap_unordered(_IndexedItem(func), enumerate(items))
+                    result_handler(_report_progress(analysis_results, progress))
+                with trace('join pool', 'pool'):
+                    p.close()
+                    p.join()
+        else:
+            analysis_results = ((index, func(a)) for index, a in enumerate(items))  # generator
+            result_handler(_report_progress(analysis_results, progress))
+    finally:
+        progress.finish()
+
+
+def _report_progress(indexed_results: Iterable[Tuple[int, Any]], progress: Progress):
+    # pass on the results, noting each item as done
+    for index, result in indexed_results:
+        progress.item_done(index)
+        yield result
 
 
 def check_for_errors(results: Iterable[Union[str, Exception]],
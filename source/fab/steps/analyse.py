@@ -37,16 +37,17 @@ from itertools import chain
 import logging
 import sys
 import warnings
+from collections import defaultdict
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Set, Union
 
 from fab import FabException
 from fab.artefacts import ArtefactsGetter, ArtefactSet, CollectionConcat
-from fab.dep_tree import extract_sub_tree, validate_dependencies, AnalysedDependent
+from fab.dep_tree import validate_dependencies, AnalysedDependent, SubTreeExtractor
 from fab.mo import add_mo_commented_file_deps
 from fab.parse import AnalysedFile, EmptySourceFile
 from fab.parse.c import AnalysedC, CAnalyser
-from fab.parse.fortran import AnalysedFortran, FortranParserWorkaround, FortranAnalyser
+from fab.parse.fortran import AnalysedFortran, FortranParserWorkaround, FortranAnalyser, KernelIndex
 from fab.steps import run_mp, step
 from fab.util import TimerLogger, by_type
 
@@ -71,6 +72,8 @@ def analyse(
         special_measure_analysis_results: Optional[Iterable[FortranParserWorkaround]] = None,
         unreferenced_deps: Optional[Iterable[str]] = None,
         ignore_dependencies: Optional[Iterable[str]] = None,
+        precompiled_headers: bool = False,
+        pragmas_from_source: bool = False,
         ):
     """
     Produce one or more build trees by analysing source code dependencies.
@@ -112,6 +115,13 @@ def analyse(
     :param ignore_dependencies:
         Third party Fortran module names in USE statements, 'DEPENDS ON' files
         and modules to be ignored.
+    :param precompiled_headers:
+        Parse C files which start by including a commonly included set of system headers with a precompiled
+        header, made by libclang, instead of parsing those headers for each file. Files which have already been
+        preprocessed contain their headers' text, so they can't use one.
+    :param pragmas_from_source:
+        Find the Fab include pragmas in C files by reading their source lines, instead of scanning clang's
+        token stream for the whole translation unit.
 
     """
 
@@ -132,7 +142,8 @@ def analyse(
     fortran_analyser = FortranAnalyser(config=config,
                                        std=std,
                                        ignore_dependencies=ignore_dependencies)
-    c_analyser = CAnalyser(config=config)
+    c_analyser = CAnalyser(config=config, pragmas_from_source=pragmas_from_source,
+                           precompiled_headers=precompiled_headers)
 
     # Creates the *build_trees* artefact from the files in `self.source_getter`.
 
@@ -148,6 +159,7 @@ def analyse(
     # parse
     files: List[Path] = source_getter(config.artefact_store)
     analysed_files = _parse_files(config, files=files, fortran_analyser=fortran_analyser, c_analyser=c_analyser)
+    _update_kernel_index(config, analysed_files)
     _add_manual_results(special_measure_analysis_results, analysed_files)
 
     # shall we search the results for fortran programs and a c function called main?
@@ -174,15 +186,16 @@ def analyse(
 
     logger.info(f"source tree size {len(project_source_tree)}")
 
-    # extract "build trees" for executables.
+    # extract "build trees" for executables,
+    # throwing in any extra source we need, which Fab can't automatically detect.
     if root_symbols:
-        build_trees = _extract_build_trees(root_symbols, project_source_tree, symbol_table)
+        build_trees = _extract_build_trees(root_symbols, project_source_tree, symbol_table, unreferenced_deps)
     else:
         build_trees = {None: project_source_tree}
+        _add_unreferenced_deps(unreferenced_deps, symbol_table, project_source_tree, project_source_tree)
 
-    # throw in any extra source we need, which Fab can't automatically detect
-    for build_tree in build_trees.values():
-        _add_unreferenced_deps(unreferenced_deps, symbol_table, project_source_tree, build_tree)
+    # build trees can be shared between roots, only validate each one once
+    for build_tree in {id(tree): tree for tree in build_trees.values()}.values():
         validate_dependencies(build_tree)
 
     config.artefact_store[ArtefactSet.BUILD_TREES] = build_trees
@@ -197,8 +210,8 @@ def _analyse_dependencies(analysed_files: Iterable[AnalysedDependent]):
         # map symbols to the files they're in
         symbol_table: Dict[str, Path] = _gen_symbol_table(analysed_files)
 
-        # fill in the file deps attribute in the analysed file objects
-        _gen_file_deps(analysed_files, symbol_table)
+        # fill in the file deps attribute, in new analysed file objects
+        analysed_files = _gen_file_deps(analysed_files, symbol_table)
 
     # build the tree
     # the nodes refer to other nodes via the file dependencies we just made, which are keys into this dict
@@ -207,26 +220,62 @@ def _analyse_dependencies(analysed_files: Iterable[AnalysedDependent]):
     return source_tree, symbol_table
 
 
-def _extract_build_trees(root_symbols, project_source_tree, symbol_table):
+def _extract_build_trees(root_symbols, project_source_tree, symbol_table, unreferenced_deps=None):
     """
     Find the subset of files needed to build each root symbol (executable).
 
     Assumes we have been given a root symbol(s) or we wouldn't have been called.
-    Returns a build tree for every root symbol.
+    Returns a build tree for every root symbol, each including the files for any unreferenced deps.
+    The work is shared between roots, and roots needing the same files share a single, read-only build tree.
+
+    Nothing depends on a submodule, so the submodules of every module in a build tree are added to it,
+    along with their own dependencies.
 
     """
     build_trees = {}
     assert root_symbols is not None
+    extractor = SubTreeExtractor(project_source_tree)
+    extra_roots = _unreferenced_dep_fpaths(unreferenced_deps, symbol_table, project_source_tree)
+    submodules = _submodule_fpaths(project_source_tree, symbol_table)
+
     for root in root_symbols:
+        root_fpath = symbol_table[root]
         with TimerLogger(f"extracting build tree for root '{root}'"):
-            build_tree = extract_sub_tree(project_source_tree, symbol_table[root], verbose=False)
-
-        logger.info(f"target source tree size {len(build_tree)} (target '{symbol_table[root]}')")
+            roots = [root_fpath] + extra_roots
+            build_tree = extractor.extract(roots)
+
+            # adding submodules can bring in more modules, with their own submodules
+            while True:
+                needed = {sub for fpath in build_tree for sub in submodules.get(fpath, ())} - set(build_tree)
+                if not needed:
+                    break
+                roots += sorted(needed)
+                build_tree = extractor.extract(roots)
+
+        missing = extractor.missing(root_fpath)
+        if missing:
+            logger.warning(f"{root_fpath} has missing deps: {set(missing)}")
+
+        logger.info(f"target source tree size {len(build_tree)} (target '{root_fpath}')")
         build_trees[root] = build_tree
 
     return build_trees
 
 
+def _submodule_fpaths(project_source_tree, symbol_table: Dict[str, Path]) -> Dict[Path, Set[Path]]:
+    """
+    Map the file defining each module to the files defining its submodules.
+
+    """
+    submodules: Dict[Path, Set[Path]] = defaultdict(set)
+    for af in by_type(project_source_tree.values(), AnalysedFortran):
+        for submod in af.submodule_defs:
+            ancestor_fpath = symbol_table.get(submod.split('@')[0])
+            if ancestor_fpath and ancestor_fpath != af.fpath:
+                submodules[ancestor_fpath].add(af.fpath)
+    return submodules
+
+
 def _parse_files(config, files: List[Path], fortran_analyser, c_analyser) -> Set[AnalysedDependent]:
     """
     Determine the symbols which are defined in, and used by, each file.
@@ -254,6 +303,7 @@ def _parse_files(config, files: List[Path], fortran_analyser, c_analyser) -> Set
         if sys.version.startswith('3.7'):
             warnings.warn('Python 3.7 detected. Disabling multiprocessing for C analysis.')
             no_multiprocessing = True
+        c_analyser.precompile_headers(c_files)
         c_results = run_mp(config, items=c_files, func=c_analyser.run, no_multiprocessing=no_multiprocessing)
     c_analyses, c_artefacts = zip(*c_results) if c_results else (tuple(), tuple())
 
@@ -274,6 +324,25 @@ def _parse_files(config, files: List[Path], fortran_analyser, c_analyser) -> Set
     return non_empty
 
 
+def _update_kernel_index(config, analysed_files: Iterable[AnalysedFile]):
+    """
+    Record any PSyclone kernels we found in the kernel index, if this project has one.
+
+    The psyclone step creates the index. Adding what we've analysed means the psyclone step
+    won't need to look at these files again until they change.
+
+    Only files which define kernels are added. The psyclone step keeps just the files under its
+    kernel roots, so anything else we added would be pruned again, rewriting the index every build.
+
+    """
+    kernel_index_fpath = config.prebuild_folder / KernelIndex.FILENAME
+    if not kernel_index_fpath.exists():
+        return
+    kernel_index = KernelIndex(kernel_index_fpath)
+    kernel_index.add_results(af for af in by_type(analysed_files, AnalysedFortran) if af.psyclone_kernels)
+    kernel_index.save()
+
+
 def _add_manual_results(special_measure_analysis_results, analysed_files: Set[AnalysedDependent]):
     # add manual analysis results for files which could not be parsed
     if special_measure_analysis_results:
@@ -319,14 +388,19 @@ def _gen_symbol_table(analysed_files: Iterable[AnalysedDependent]) -> Dict[str,
     return symbols
 
 
-def _gen_file_deps(analysed_files: Iterable[AnalysedDependent], symbols: Dict[str, Path]):
+def _gen_file_deps(analysed_files: Iterable[AnalysedDependent],
+                   symbols: Dict[str, Path]) -> List[AnalysedDependent]:
     """
     Use the symbol table to convert symbol dependencies into file dependencies.
 
+    Analysis results are immutable, so this returns a copy of each one, with its file dependencies.
+
     """
+    result = []
     deps_not_found = set()
     with TimerLogger("converting symbol to file deps"):
         for analysed_file in analysed_files:
+            file_deps = set(analysed_file.file_deps)
             for symbol_dep in analysed_file.symbol_deps:
                 file_dep = symbols.get(symbol_dep)
                 # don't depend on oneself!
@@ -337,24 +411,28 @@ def _gen_file_deps(analysed_files: Iterable[AnalysedDependent], symbols: Dict[st
                     deps_not_found.add(symbol_dep)
                     logger.debug(f"not found {symbol_dep} for {analysed_file.fpath}")
                     continue
-                analysed_file.file_deps.add(file_dep)
+                file_deps.add(file_dep)
+
+            if file_deps != analysed_file.file_deps:
+                analysed_file = analysed_file.replace(file_deps=file_deps)
+            result.append(analysed_file)
+
     if deps_not_found:
         logger.info(f"{len(deps_not_found)} deps not found")
+    return result
 
 
-def _add_unreferenced_deps(unreferenced_deps, symbol_table: Dict[str, Path],
-                           all_analysed_files: Dict[Path, AnalysedDependent],
-                           build_tree: Dict[Path, AnalysedDependent]):
+def _unreferenced_dep_fpaths(unreferenced_deps, symbol_table: Dict[str, Path],
+                             all_analysed_files: Dict[Path, AnalysedDependent]) -> List[Path]:
     """
-    Add files to the build tree.
-
-    This is used for building Fortran code which Fab doesn't know is a dependency.
+    Find the files containing the given unreferenced dependencies, warning about any we can't find.
 
     """
     if not unreferenced_deps:
-        return
-    logger.info(f"Adding {len(unreferenced_deps or [])} unreferenced dependencies")
+        return []
+    logger.info(f"Adding {len(unreferenced_deps)} unreferenced dependencies")
 
+    fpaths = []
     for symbol_dep in unreferenced_deps:
 
         # what file is the symbol in?
@@ -362,19 +440,33 @@ def _add_unreferenced_deps(unreferenced_deps, symbol_table: Dict[str, Path],
         if not analysed_fpath:
             warnings.warn(f"no file found for unreferenced dependency {symbol_dep}")
             continue
-        analysed_file = all_analysed_files[analysed_fpath]
 
         # was it found and analysed?
-        if not analysed_file:
+        if not all_analysed_files.get(analysed_fpath):
             warnings.warn(f"couldn't find file for symbol dep '{symbol_dep}'")
             continue
 
+        fpaths.append(analysed_fpath)
+
+    return fpaths
+
+
+def _add_unreferenced_deps(unreferenced_deps, symbol_table: Dict[str, Path],
+                           all_analysed_files: Dict[Path, AnalysedDependent],
+                           build_tree: Dict[Path, AnalysedDependent]):
+    """
+    Add files to the build tree.
+
+    This is used for building Fortran code which Fab doesn't know is a dependency.
+
+    """
+    extractor = SubTreeExtractor(all_analysed_files)
+    for analysed_fpath in _unreferenced_dep_fpaths(unreferenced_deps, symbol_table, all_analysed_files):
+
         # is it already in the build tree?
-        if analysed_file.fpath in build_tree:
-            logger.info(f"file {analysed_file.fpath} for unreferenced dependency {symbol_dep} "
-                        f"is already in the build tree")
+        if analysed_fpath in build_tree:
+            logger.info(f"file {analysed_fpath} for unreferenced dependency is already in the build tree")
             continue
 
         # add the file and it's file deps
-        sub_tree = extract_sub_tree(source_tree=all_analysed_files, root=analysed_fpath)
-        build_tree.update(sub_tree)
+        build_tree.update(extractor.extract([analysed_fpath]))
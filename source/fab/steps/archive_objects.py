@@ -8,15 +8,18 @@ Object archive creation from a list of object files for use in static linking.
 
 """
 
+import json
 import logging
-from typing import Optional
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
 from pathlib import Path
 from string import Template
 
 from fab.artefacts import ArtefactSet
 from fab.build_config import BuildConfig
 from fab.steps import step
-from fab.util import log_or_dot
+from fab.util import file_checksum, log_or_dot, string_checksum
 from fab.tools.ar import Ar
 from fab.tools.category import Category
 from fab.artefacts import ArtefactsGetter, CollectionGetter
@@ -25,6 +28,10 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_SOURCE_GETTER = CollectionGetter(ArtefactSet.OBJECT_FILES)
 
+# An archive is updated in place, rather than created again, when at most this fraction of its members
+# have been added, changed or removed since it was written.
+INCREMENTAL_LIMIT = 0.25
+
 
 # todo: two diagrams showing the flow of artefacts in the executables and
 # library use cases show how the library has a single build target with None
@@ -60,6 +67,15 @@ def archive_objects(config: BuildConfig,
     thousands of .o files, making any error output difficult to read. You
     don't have to use this step before linking. The linker step has a default
     artefact getter which will work with or without this preceding step.
+    Linkers which read response files are given a long list of object files
+    in one, so it won't exceed the system's command line limit.
+
+    Each archive is recorded in the prebuild folder, with a hash of its
+    ordered members and their contents. An archive whose members haven't
+    changed is left alone. When only a few members have changed, they are
+    replaced in the existing archive, and any removed members are deleted
+    from it, instead of writing the whole archive again. The archives of
+    different build targets are created in parallel.
 
     **Creating a Static or Shared Library:**
 
@@ -118,7 +134,8 @@ def archive_objects(config: BuildConfig,
     if not output_fpath and list(target_objects.keys()) == [None]:
         raise ValueError("You must specify an output path when building a library.")
 
-    for root, objects in target_objects.items():
+    archives: Dict[Optional[str], Path] = {}
+    for root in target_objects:
 
         if root:
             # we're building an object archive for an executable
@@ -128,12 +145,119 @@ def archive_objects(config: BuildConfig,
             assert len(target_objects) == 1, "unexpected root of None with multiple build targets"
             output_fpath = Path(Template(str(output_fpath)).substitute(
                 output=config.build_output))
+        archives[root] = output_fpath
+
+    # the record of each archive, if there's somewhere to keep it
+    records: Dict[Optional[str], Optional[Path]] = {root: None for root in archives}
+    if config.prebuild_folder.is_dir():
+        for root, fpath in archives.items():
+            records[root] = config.prebuild_folder / f'{fpath.name}.{string_checksum(str(fpath))}.json'
+        config.add_current_prebuilds(filter(None, records.values()))
+
+    def archive(root: Optional[str]):
+        _archive(ar, archives[root], sorted(target_objects[root]), records[root])
+
+    # ar spends its time in a subprocess, so the archives are created in threads
+    with ThreadPoolExecutor(max_workers=config.n_procs or 1) as executor:
+        list(executor.map(archive, archives))
+
+    for root, fpath in archives.items():
+        config.artefact_store.update_dict(output_collection, fpath, root)
+
+
+def _archive(ar: Ar, output_fpath: Path, members: List[Path], record_fpath: Optional[Path]):
+    """
+    Create or update one archive, unless its members are unchanged since it was last written.
+
+    """
+    previous = _load_record(record_fpath) if record_fpath else None
+    record = _make_record(ar, members)
+
+    plan = None
+    if previous and record and previous['archive'] == _stat(output_fpath):
+        if previous['hash'] == record['hash']:
+            log_or_dot(logger, f"CreateObjectArchive '{output_fpath}' is up to date.")
+            return
+        if previous['ar'] == record['ar']:
+            plan = _update_plan(previous['members'], record['members'])
+
+    if record_fpath:
+        # forget the archive while it's changing, in case we don't finish
+        record_fpath.unlink(missing_ok=True)
+    try:
+        if plan:
+            replace, delete = plan
+            log_or_dot(logger, f"CreateObjectArchive replacing {len(replace)} and deleting {len(delete)} "
+                               f"member(s) of '{output_fpath}'.")
+            if delete:
+                ar.delete(output_fpath, delete)
+            if replace:
+                ar.replace(output_fpath, replace)
+        else:
+            log_or_dot(logger, f"CreateObjectArchive running archiver for "
+                               f"'{output_fpath}'.")
+            ar.create(output_fpath, list(members))
+    except RuntimeError as err:
+        raise RuntimeError(f"error creating object archive:\n{err}") from err
+
+    if record_fpath and record:
+        record['archive'] = _stat(output_fpath)
+        tmp_fpath = record_fpath.with_name(record_fpath.name + '.tmp')
+        tmp_fpath.write_text(json.dumps(record))
+        os.replace(tmp_fpath, record_fpath)
+
+
+def _make_record(ar: Ar, members: List[Path]) -> Optional[Dict[str, Any]]:
+    # The archiver and the archive's ordered members, with a hash of them all.
+    # None if a member is missing, which ar will report.
+    try:
+        hashed = [[str(member), file_checksum(member).file_hash] for member in members]
+    except OSError:
+        return None
+    identity = [ar.name, ar.exec_name]
+    return {'ar': identity, 'members': hashed, 'hash': string_checksum(json.dumps([identity, hashed]))}
+
+
+def _update_plan(previous: List[List], current: List[List]) -> Optional[Tuple[List[Union[Path, str]], List[str]]]:
+    """
+    The members to replace, and the names of the members to delete, to bring an archive up to date.
+
+    Returns None if the archive should be created again instead, because too many members have changed,
+    or because two members have the same name, which ar can't tell apart.
+
+    :param previous:
+        The path and hash of each member the archive has.
+    :param current:
+        The path and hash of each member it should have.
+
+    """
+    old = {Path(fpath): file_hash for fpath, file_hash in previous}
+    new = {Path(fpath): file_hash for fpath, file_hash in current}
+    names = {fpath.name for fpath in new}
+    if len(names) != len(new) or len({fpath.name for fpath in old}) != len(old):
+        return None
+
+    replace: List[Union[Path, str]] = [fpath for fpath, file_hash in new.items() if old.get(fpath) != file_hash]
+    removed = [fpath for fpath in old if fpath not in new]
+    if len(replace) + len(removed) > INCREMENTAL_LIMIT * len(new):
+        return None
+
+    # a replaced member takes the place of a removed one with the same name
+    delete = [fpath.name for fpath in removed if fpath.name not in names]
+    return replace, delete
+
+
+def _load_record(record_fpath: Path) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(record_fpath.read_text())
+    except (OSError, ValueError):
+        return None
 
-        log_or_dot(logger, f"CreateObjectArchive running archiver for "
-                           f"'{output_fpath}'.")
-        try:
-            ar.create(output_fpath, sorted(objects))
-        except RuntimeError as err:
-            raise RuntimeError(f"error creating object archive:\n{err}") from err
 
-        config.artefact_store.update_dict(output_collection, output_fpath, root)
+def _stat(fpath: Path) -> Optional[List[int]]:
+    # the archive's size and modification time, to tell if anything else has changed it
+    try:
+        stat = os.stat(fpath)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
@@ -8,7 +8,11 @@ C file compilation.
 
 """
 import logging
-from dataclasses import dataclass
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import chain
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from typing import cast, Dict, List, Optional, Tuple
 
 from fab import FabException
@@ -16,12 +20,14 @@ from fab.artefacts import (ArtefactsGetter, ArtefactSet, ArtefactStore,
                            FilterBuildTrees)
 from fab.build_config import BuildConfig, FlagsConfig
 from fab.metrics import send_metric
-from fab.parse.c import AnalysedC
+from fab.parse.c import (AnalysedC, common_include_sets,
+                         leading_system_includes, pch_header_text)
 from fab.steps import check_for_errors, run_mp, step
 from fab.tools.category import Category
 from fab.tools.compiler import Compiler
 from fab.tools.flags import Flags
-from fab.util import CompiledFile, log_or_dot, Timer, by_type
+from fab.util import (CompiledFile, compile_batches, log_or_dot, Timer,
+                      by_type, string_checksum)
 
 logger = logging.getLogger(__name__)
 
@@ -34,12 +40,16 @@ class MpCommonArgs:
     '''A simple class to pass arguments to subprocesses.'''
     config: BuildConfig
     flags: FlagsConfig
+    # the flags which include a precompiled header, for each file which has one
+    pch_flags: Dict[Path, List[str]] = field(default_factory=dict)
 
 
 @step
 def compile_c(config, common_flags: Optional[List[str]] = None,
               path_flags: Optional[List] = None,
-              source: Optional[ArtefactsGetter] = None):
+              source: Optional[ArtefactsGetter] = None,
+              batch_size: int = 1,
+              precompiled_headers: bool = False):
     """
     Compiles all C files in all build trees, creating or extending a set of
     compiled files for each target.
@@ -63,6 +73,22 @@ def compile_c(config, common_flags: Optional[List[str]] = None,
     :param source:
         An :class:`~fab.artefacts.ArtefactsGetter` which give us our c files
         to process.
+    :param batch_size:
+        The most files to compile with each invocation of the compiler.
+        Files with the same flags are compiled together, saving the
+        compiler's start up time for each file, which can be as long as the
+        compilation of a small file. A batch is compiled in a temporary
+        folder, so its flags must not use paths relative to the source
+        folder. If a batch fails, its files are compiled one at a time, to
+        report the errors in each file.
+    :param precompiled_headers:
+        Precompile each set of system headers which several files start by
+        including, if the compiler supports precompiled headers, and give
+        it to those files with `-include`, so the compiler loads it instead
+        of parsing the headers for each file. A precompiled header is made
+        for each set of flags, and kept in the prebuild folder. Files which
+        have already been preprocessed contain their headers' text, so
+        they can't use one.
 
     """
     # todo: tell the compiler (and other steps) which artefact name to create?
@@ -86,10 +112,21 @@ def compile_c(config, common_flags: Optional[List[str]] = None,
     logger.info(f'C compiler is {compiler}')
 
     mp_payload = MpCommonArgs(config=config, flags=flags)
+    if precompiled_headers:
+        mp_payload.pch_flags = _precompile_headers(config, to_compile,
+                                                   mp_payload, compiler)
     mp_items = [(fpath, mp_payload) for fpath in to_compile]
 
     # compile everything in one go
-    compilation_results = run_mp(config, items=mp_items, func=_compile_file)
+    if batch_size > 1:
+        compilation_results = _compile_batched(config, to_compile, mp_payload,
+                                               compiler, batch_size)
+    else:
+        # resolve every file's flags now, so forked workers inherit them
+        for analysed_file in to_compile:
+            flags.checksum_for_path(path=analysed_file.fpath, config=config)
+        compilation_results = run_mp(config, items=mp_items,
+                                     func=_compile_file, throttle=True)
     check_for_errors(compilation_results, caller_label='compile c')
     compiled_c = list(by_type(compilation_results, CompiledFile))
     logger.info(f"compiled {len(compiled_c)} c files")
@@ -119,26 +156,205 @@ def store_artefacts(compiled_files: List[CompiledFile],
         artefact_store.update_dict(ArtefactSet.OBJECT_FILES, new_objects, root)
 
 
-def _compile_file(arg: Tuple[AnalysedC, MpCommonArgs]):
+def _compile_batched(config, to_compile: List[AnalysedC],
+                     mp_payload: MpCommonArgs, compiler: Compiler,
+                     batch_size: int) -> List:
+    """
+    Compile the files which have no prebuild in batches, with one invocation
+    of the compiler for each batch.
+
+    """
+    results: List = []
+    needed = []
+    # a file can be in more than one build tree
+    for analysed_file in dict.fromkeys(to_compile):
+        obj_file_prebuild = _get_obj_prebuild(config, compiler,
+                                              analysed_file, mp_payload)
+        if obj_file_prebuild.exists():
+            log_or_dot(logger, f'CompileC using prebuild: '
+                               f'{analysed_file.fpath}')
+            results.append(CompiledFile(input_fpath=analysed_file.fpath,
+                                        output_fpath=obj_file_prebuild))
+        else:
+            needed.append((analysed_file, obj_file_prebuild))
+
+    # files with a precompiled header are batched with the others using it
+    batches = compile_batches(
+        needed,
+        lambda fpath: (mp_payload.flags.flags_for_path(path=fpath,
+                                                       config=config) +
+                       mp_payload.pch_flags.get(fpath, [])),
+        batch_size,
+        workers=config.n_procs if config.multiprocessing else 1)
+    logger.info(f"compiling {len(needed)} c files in {len(batches)} batches")
+    mp_items = [(batch, mp_payload) for batch in batches]
+    batch_results = run_mp(config, items=mp_items, func=_compile_batch,
+                           throttle=True)
+    return results + list(chain(*batch_results))
+
+
+def _compile_batch(arg: Tuple[List[Tuple[AnalysedC, Path]], MpCommonArgs]):
+    """
+    Compile a batch of files with one invocation of the compiler, moving
+    each object file to its prebuild path.
+
+    If the batch fails, its files are compiled one at a time, so that each
+    error is reported for the file which caused it.
+
+    """
+    batch, mp_payload = arg
+    if len(batch) == 1:
+        return [_compile_file((batch[0][0], mp_payload))]
 
-    analysed_file, mp_payload = arg
     config = mp_payload.config
+    compiler = _get_compiler(config)
+    fpaths = [analysed_file.fpath for analysed_file, _ in batch]
+    flags = Flags(mp_payload.flags.flags_for_path(path=fpaths[0],
+                                                  config=config))
+    flags += mp_payload.pch_flags.get(fpaths[0], [])
+    with Timer() as timer:
+        logger.debug(f'CompileC compiling a batch of {len(batch)} files')
+        config.prebuild_folder.mkdir(parents=True, exist_ok=True)
+        try:
+            with TemporaryDirectory(prefix='batch-',
+                                    dir=config.prebuild_folder) as tmp:
+                objects = compiler.compile_files(fpaths, Path(tmp),
+                                                 config=config,
+                                                 add_flags=flags)
+                for analysed_file, obj_file_prebuild in batch:
+                    objects[analysed_file.fpath].replace(obj_file_prebuild)
+        except (RuntimeError, OSError) as err:
+            # Any objects already moved are picked up as prebuilds.
+            logger.debug(f'CompileC batch failed, compiling its files one '
+                         f'at a time: {err}')
+            return [_compile_file((analysed_file, mp_payload))
+                    for analysed_file, _ in batch]
+
+    # The batch's time is shared between its files.
+    for fpath in fpaths:
+        send_metric(
+            group="compile c",
+            name=str(fpath),
+            value={'time_taken': timer.taken / len(batch),
+                   'start': timer.start})
+    return [CompiledFile(input_fpath=analysed_file.fpath,
+                         output_fpath=obj_file_prebuild)
+            for analysed_file, obj_file_prebuild in batch]
+
+
+def _precompile_headers(config, to_compile: List[AnalysedC],
+                        mp_payload: MpCommonArgs,
+                        compiler: Compiler) -> Dict[Path, List[str]]:
+    """
+    Precompile each commonly included set of system headers, for the files
+    which have no prebuild.
+
+    Returns the flags which include a precompiled header, for each file
+    which can use one.
+
+    """
+    if not compiler.pch_suffix:
+        logger.info(f"{compiler.name} does not support precompiled headers")
+        return {}
+
+    # a precompiled header can only be used with the flags it was made with
+    leading: Dict[Tuple[str, ...], Dict] = defaultdict(dict)
+    for analysed_file in dict.fromkeys(to_compile):
+        flags = mp_payload.flags.flags_for_path(path=analysed_file.fpath,
+                                                config=config)
+        if not _get_obj_prebuild(config, compiler, analysed_file,
+                                 mp_payload).exists():
+            leading[tuple(flags)][analysed_file.fpath] = \
+                leading_system_includes(analysed_file.fpath)
+
+    users: Dict[Path, List[Path]] = defaultdict(list)
+    mp_items = {}
+    for flags_key, includes in leading.items():
+        flags = Flags(list(flags_key))
+        for fpath, headers in common_include_sets(includes).items():
+            text = pch_header_text(headers)
+            pch_hash = (string_checksum(text) + flags.checksum() +
+                        compiler.get_hash(config.profile))
+            header = config.prebuild_folder / f'pch.{pch_hash:x}.h'
+            users[header].append(fpath)
+            mp_items[header] = (header, text, flags, mp_payload)
+    if not mp_items:
+        return {}
+
+    logger.info(f"precompiling {len(mp_items)} sets of headers for "
+                f"{sum(map(len, users.values()))} c files")
+    config.prebuild_folder.mkdir(parents=True, exist_ok=True)
+    results = run_mp(config, items=list(mp_items.values()),
+                     func=_precompile_header)
+
+    pch_flags = {}
+    for header, pch in zip(mp_items, results):
+        if pch is None:
+            continue
+        config.add_current_prebuilds([header, pch])
+        for fpath in users[header]:
+            pch_flags[fpath] = ['-include', str(header)]
+    return pch_flags
+
+
+def _precompile_header(arg: Tuple[Path, str, Flags, MpCommonArgs]) \
+        -> Optional[Path]:
+    """
+    Write a header which includes a set of system headers, and precompile it,
+    unless it's been precompiled before.
+
+    Returns the precompiled header, or None if it couldn't be made, in which
+    case its files are compiled without it.
+
+    """
+    header, text, flags, mp_payload = arg
+    config = mp_payload.config
+    compiler = _get_compiler(config)
+    pch = header.with_name(header.name + str(compiler.pch_suffix))
+    if pch.exists():
+        log_or_dot(logger, f'CompileC using precompiled header: {pch}')
+        return pch
+
+    log_or_dot(logger, f'CompileC precompiling {header}')
+    header.write_text(text)
+    try:
+        return compiler.precompile_header(header, config, add_flags=flags)
+    except RuntimeError as err:
+        logger.warning(f"unable to precompile {header}, compiling its files "
+                       f"without it:\n{err}")
+        return None
+
+
+def _get_compiler(config) -> Compiler:
     compiler = config.tool_box.get_tool(Category.C_COMPILER)
     if compiler.category != Category.C_COMPILER:
         raise RuntimeError(f"Unexpected tool '{compiler.name}' of category "
                            f"'{compiler.category}' instead of CCompiler")
     # Tool box returns a Tool, in order to make mypy happy, we need
     # to cast it to be a Compiler.
-    compiler = cast(Compiler, compiler)
+    return cast(Compiler, compiler)
+
+
+def _get_obj_prebuild(config: BuildConfig, compiler: Compiler,
+                      analysed_file, mp_payload: MpCommonArgs) -> Path:
+    flags_checksum = mp_payload.flags.checksum_for_path(
+        path=analysed_file.fpath, config=config)
+    obj_combo_hash = _get_obj_combo_hash(config, compiler,
+                                         analysed_file, flags_checksum)
+    return (config.prebuild_folder /
+            f'{analysed_file.fpath.stem}.{obj_combo_hash:x}.o')
+
+
+def _compile_file(arg: Tuple[AnalysedC, MpCommonArgs]):
+
+    analysed_file, mp_payload = arg
+    config = mp_payload.config
+    compiler = _get_compiler(config)
     with Timer() as timer:
         flags = Flags(mp_payload.flags.flags_for_path(path=analysed_file.fpath,
                                                       config=config))
-        obj_combo_hash = _get_obj_combo_hash(config, compiler,
-                                             analysed_file, flags)
-
-        obj_file_prebuild = (config.prebuild_folder /
-                             f'{analysed_file.fpath.stem}.'
-                             f'{obj_combo_hash:x}.o')
+        obj_file_prebuild = _get_obj_prebuild(config, compiler,
+                                              analysed_file, mp_payload)
 
         # prebuild available?
         if obj_file_prebuild.exists():
@@ -148,9 +364,10 @@ def _compile_file(arg: Tuple[AnalysedC, MpCommonArgs]):
             obj_file_prebuild.parent.mkdir(parents=True, exist_ok=True)
             log_or_dot(logger, f'CompileC compiling {analysed_file.fpath}')
             try:
-                compiler.compile_file(analysed_file.fpath, obj_file_prebuild,
-                                      config=config,
-                                      add_flags=flags)
+                compiler.compile_file(
+                    analysed_file.fpath, obj_file_prebuild, config=config,
+                    add_flags=flags + mp_payload.pch_flags.get(
+                        analysed_file.fpath, []))
             except RuntimeError as err:
                 return FabException(f"error compiling "
                                     f"{analysed_file.fpath}:\n{err}")
@@ -164,12 +381,13 @@ def _compile_file(arg: Tuple[AnalysedC, MpCommonArgs]):
 
 
 def _get_obj_combo_hash(config: BuildConfig,
-                        compiler: Compiler, analysed_file, flags: Flags):
+                        compiler: Compiler, analysed_file,
+                        flags_checksum: int):
     # get a combo hash of things which matter to the object file we define
     try:
         obj_combo_hash = sum([
             analysed_file.file_hash,
-            flags.checksum(),
+            flags_checksum,
             compiler.get_hash(config.profile),
         ])
     except TypeError as err:
@@ -13,6 +13,7 @@ import shutil
 from dataclasses import dataclass
 from itertools import chain
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from typing import cast, Dict, List, Optional, Set, Tuple, Union
 
 from fab.artefacts import (ArtefactsGetter, ArtefactSet, ArtefactStore,
@@ -24,7 +25,7 @@ from fab.steps import check_for_errors, run_mp, step
 from fab.tools.category import Category
 from fab.tools.compiler import Compiler
 from fab.tools.flags import Flags
-from fab.util import (CompiledFile, log_or_dot_finish, log_or_dot, Timer,
+from fab.util import (CompiledFile, compile_batches, log_or_dot, Timer,
                       by_type, file_checksum)
 
 logger = logging.getLogger(__name__)
@@ -40,13 +41,15 @@ class MpCommonArgs:
     flags: FlagsConfig
     mod_hashes: Dict[str, int]
     syntax_only: bool
+    batch_size: int = 1
 
 
 @step
 def compile_fortran(config: BuildConfig,
                     common_flags: Optional[List[str]] = None,
                     path_flags: Optional[List] = None,
-                    source: Optional[ArtefactsGetter] = None):
+                    source: Optional[ArtefactsGetter] = None,
+                    batch_size: int = 1):
     """
     Compiles all Fortran files in all build trees, creating/extending a set
     of compiled files for each build target.
@@ -69,6 +72,16 @@ def compile_fortran(config: BuildConfig,
     :param source:
         An :class:`~fab.artefacts.ArtefactsGetter` which gives us our Fortran
         files to process.
+    :param batch_size:
+        The most files to compile with each invocation of the compiler.
+        Files which define no modules, and have the same flags, are compiled
+        together, saving the compiler's start up time for each file. Files
+        which define modules are always compiled one at a time, in their
+        source folder, so their mod files don't depend on where they were
+        compiled. A batch is compiled in a temporary folder, so its flags
+        must not use paths relative to the source folder. If a batch fails,
+        its files are compiled one at a time, to report the errors in each
+        file.
 
     """
 
@@ -96,7 +109,8 @@ def compile_fortran(config: BuildConfig,
     # build the arguments passed to the multiprocessing function
     mp_common_args = MpCommonArgs(
         config=config, flags=flags_config,
-        mod_hashes=mod_hashes, syntax_only=syntax_only)
+        mod_hashes=mod_hashes, syntax_only=syntax_only,
+        batch_size=batch_size)
 
     if syntax_only:
         logger.info("Starting two-stage compile: mod files, multiple passes")
@@ -109,7 +123,6 @@ def compile_fortran(config: BuildConfig,
                                   uncompiled=uncompiled,
                                   mp_common_args=mp_common_args,
                                   mod_hashes=mod_hashes)
-    log_or_dot_finish(logger)
 
     if syntax_only:
         logger.info("Finalising two-stage compile: object files, single pass")
@@ -118,9 +131,7 @@ def compile_fortran(config: BuildConfig,
         # A single pass should now compile all the object files in one go
         # todo: order by last compile duration
         uncompiled = set(sum(build_lists.values(), []))
-        mp_args = [(fpath, mp_common_args) for fpath in uncompiled]
-        results_this_pass = run_mp(config, items=mp_args, func=process_file)
-        log_or_dot_finish(logger)
+        results_this_pass = _run_compiles(config, uncompiled, mp_common_args)
         check_for_errors(results_this_pass, caller_label="compile_fortran")
         compiled_this_pass = list(by_type(results_this_pass, CompiledFile))
         logger.info(f"stage 2 compiled {len(compiled_this_pass)} files")
@@ -160,8 +171,7 @@ def compile_pass(config, compiled: Dict[Path, CompiledFile],
     # compile
     logger.info(f"\ncompiling {len(compile_next)} of {len(uncompiled)} "
                 f"remaining files")
-    mp_args = [(fpath, mp_common_args) for fpath in compile_next]
-    results_this_pass = run_mp(config, items=mp_args, func=process_file)
+    results_this_pass = _run_compiles(config, compile_next, mp_common_args)
 
     # there's a compilation result and a list of prebuild files for each
     # compiled file
@@ -188,6 +198,111 @@ def compile_pass(config, compiled: Dict[Path, CompiledFile],
     return uncompiled
 
 
+def _run_compiles(config, analysed_files: Set[AnalysedFortran],
+                  mp_common_args: MpCommonArgs) -> List:
+    """
+    Compile the given files, which don't depend on each other.
+
+    When batching, the files which define no modules and have no prebuild are
+    compiled in batches, and the rest one at a time.
+
+    Returns a compilation result and a list of prebuild files for each file.
+
+    """
+    if mp_common_args.batch_size <= 1 or mp_common_args.syntax_only:
+        mp_args = [(af, mp_common_args) for af in analysed_files]
+        return run_mp(config, items=mp_args, func=process_file, throttle=True)
+
+    compiler = _get_compiler(config)
+    flags_config = mp_common_args.flags
+    results: List = []
+    items: List[Tuple] = []
+    needed = []
+    for af in analysed_files:
+        if af.module_defs or af.submodule_defs:
+            # resolve its flags now, so forked workers inherit them
+            flags_config.checksum_for_path(path=af.fpath, config=config)
+            items.append((af, mp_common_args))
+            continue
+        obj_file_prebuild = _get_obj_prebuild(config, af, mp_common_args,
+                                              compiler)
+        if obj_file_prebuild.exists():
+            log_or_dot(logger, f'CompileFortran using prebuild: {af.fpath}')
+            results.append((CompiledFile(input_fpath=af.fpath,
+                                         output_fpath=obj_file_prebuild),
+                            [obj_file_prebuild]))
+        else:
+            needed.append((af, obj_file_prebuild))
+
+    batches = compile_batches(
+        needed,
+        lambda fpath: flags_config.flags_for_path(path=fpath, config=config),
+        mp_common_args.batch_size,
+        workers=config.n_procs if config.multiprocessing else 1)
+    logger.info(f"compiling {len(needed)} files without modules in "
+                f"{len(batches)} batches")
+    items.extend((batch, mp_common_args) for batch in batches)
+    mp_results = run_mp(config, items=items, func=_compile_item,
+                        throttle=True)
+    return results + list(chain(*mp_results))
+
+
+def _compile_item(arg) -> List:
+    # a batch of files, or a single file
+    if isinstance(arg[0], list):
+        return _compile_batch(arg)
+    return [process_file(arg)]
+
+
+def _compile_batch(arg: Tuple[List[Tuple[AnalysedFortran, Path]],
+                              MpCommonArgs]) -> List:
+    """
+    Compile a batch of files which define no modules, with one invocation of
+    the compiler, moving each object file to its prebuild path.
+
+    If the batch fails, its files are compiled one at a time, so that each
+    error is reported for the file which caused it.
+
+    """
+    batch, mp_common_args = arg
+    if len(batch) == 1:
+        return [process_file((batch[0][0], mp_common_args))]
+
+    config = mp_common_args.config
+    compiler = _get_compiler(config)
+    fpaths = [analysed_file.fpath for analysed_file, _ in batch]
+    flags = Flags(mp_common_args.flags.flags_for_path(path=fpaths[0],
+                                                      config=config))
+    with Timer() as timer:
+        logger.debug(f'CompileFortran compiling a batch of {len(batch)} files')
+        config.prebuild_folder.mkdir(parents=True, exist_ok=True)
+        try:
+            with TemporaryDirectory(prefix='batch-',
+                                    dir=config.prebuild_folder) as tmp:
+                objects = compiler.compile_files(fpaths, Path(tmp),
+                                                 config=config,
+                                                 add_flags=flags)
+                for analysed_file, obj_file_prebuild in batch:
+                    objects[analysed_file.fpath].replace(obj_file_prebuild)
+        except (RuntimeError, OSError) as err:
+            # Any objects already moved are picked up as prebuilds.
+            logger.debug(f'CompileFortran batch failed, compiling its files '
+                         f'one at a time: {err}')
+            return [process_file((analysed_file, mp_common_args))
+                    for analysed_file, _ in batch]
+
+    # The batch's time is shared between its files.
+    for fpath in fpaths:
+        send_metric(
+            group="compile fortran",
+            name=str(fpath),
+            value={'time_taken': timer.taken / len(batch),
+                   'start': timer.start})
+    return [(CompiledFile(input_fpath=analysed_file.fpath,
+                          output_fpath=obj_file_prebuild), [obj_file_prebuild])
+            for analysed_file, obj_file_prebuild in batch]
+
+
 def get_compile_next(compiled: Dict[Path, CompiledFile],
                      uncompiled: Set[AnalysedFortran]) -> Set[AnalysedFortran]:
     '''Find what to compile next.
@@ -241,9 +356,10 @@ def process_file(arg: Tuple[AnalysedFortran, MpCommonArgs]) \
     since it was last compiled.
 
     Object files are created directly as artefacts in the prebuild folder.
-    Mod files are created in the module folder and copied as artefacts into
-    the prebuild folder. If nothing has changed, prebuilt mod files are copied
-    *from* the prebuild folder into the module folder.
+    Mod and smod files are created in the module folder and copied as
+    artefacts into the prebuild folder. If nothing has changed, prebuilt mod
+    and smod files are copied *from* the prebuild folder into the module
+    folder.
 
     .. note::
 
@@ -251,7 +367,7 @@ def process_file(arg: Tuple[AnalysedFortran, MpCommonArgs]) \
         changed, must trigger a recompile. For mod and object files, this
         includes a checksum of: *source code, compiler*. For object files,
         this also includes a checksum of: *compiler flags, modules on which
-        we depend*.
+        we depend, the smod files of any submodule ancestors*.
 
         Before compiling a file, we calculate the combo hashes and see if the
         output files already exists.
@@ -263,37 +379,29 @@ def process_file(arg: Tuple[AnalysedFortran, MpCommonArgs]) \
     with Timer() as timer:
         analysed_file, mp_common_args = arg
         config = mp_common_args.config
-        compiler = config.tool_box.get_tool(Category.FORTRAN_COMPILER,
-                                            config.mpi)
-        if compiler.category != Category.FORTRAN_COMPILER:
-            raise RuntimeError(f"Unexpected tool '{compiler.name}' of "
-                               f"category '{compiler.category}' instead of "
-                               f"FortranCompiler")
-        # The ToolBox returns a Tool, but we need to tell mypy that
-        # this is a Compiler
-        compiler = cast(Compiler, compiler)
+        compiler = _get_compiler(config)
         flags = Flags(mp_common_args.flags.flags_for_path(
             path=analysed_file.fpath, config=config))
 
         mod_combo_hash = _get_mod_combo_hash(config, analysed_file,
                                              compiler=compiler)
-        obj_combo_hash = _get_obj_combo_hash(config, analysed_file,
-                                             mp_common_args=mp_common_args,
-                                             compiler=compiler, flags=flags)
 
         # calculate the incremental/prebuild artefact filenames
-        obj_file_prebuild = (
-            mp_common_args.config.prebuild_folder /
-            f'{analysed_file.fpath.stem}.{obj_combo_hash:x}.o')
-        mod_file_prebuilds = [
-            (mp_common_args.config.prebuild_folder /
-             f'{mod_def}.{mod_combo_hash:x}.mod')
-            for mod_def in analysed_file.module_defs
-        ]
+        obj_file_prebuild = _get_obj_prebuild(config, analysed_file,
+                                              mp_common_args, compiler)
+        mod_files = _get_mod_files(analysed_file)
+        mod_file_prebuilds = {
+            mod_file: (mp_common_args.config.prebuild_folder /
+                       f'{mod_file.stem}.{mod_combo_hash:x}{mod_file.suffix}')
+            for mod_file in mod_files
+        }
+        required_prebuilds = [mod_file_prebuilds[mod_file]
+                              for mod_file, required in mod_files.items()
+                              if required]
 
         # have we got all the prebuilt artefacts we need to avoid a recompile?
         prebuilds_exist = list(map(lambda f: f.exists(),
-                                   [obj_file_prebuild] + mod_file_prebuilds))
+                                   [obj_file_prebuild] + required_prebuilds))
         if not all(prebuilds_exist):
             # compile
             try:
@@ -308,29 +416,30 @@ def process_file(arg: Tuple[AnalysedFortran, MpCommonArgs]) \
             # copy the mod files to the prebuild folder as artefacts for reuse
             # note: perhaps we could sometimes avoid these copies because mods
             # can change less frequently than obj
-            for mod_def in analysed_file.module_defs:
-                shutil.copy2(
-                    mp_common_args.config.build_output / f'{mod_def}.mod',
-                    (mp_common_args.config.prebuild_folder /
-                     f'{mod_def}.{mod_combo_hash:x}.mod'),
-                )
+            for mod_file, required in mod_files.items():
+                built = mp_common_args.config.build_output / mod_file
+                if required or built.exists():
+                    shutil.copy2(built, mod_file_prebuilds[mod_file])
 
         else:
             log_or_dot(logger,
                        f'CompileFortran using prebuild: {analysed_file.fpath}')
 
             # copy the prebuilt mod files from the prebuild folder
-            for mod_def in analysed_file.module_defs:
-                shutil.copy2(
-                    (mp_common_args.config.prebuild_folder
-                        / f'{mod_def}.{mod_combo_hash:x}.mod'),
-                    mp_common_args.config.build_output / f'{mod_def}.mod',
-                )
+            for mod_file, required in mod_files.items():
+                prebuilt = mod_file_prebuilds[mod_file]
+                if required or prebuilt.exists():
+                    shutil.copy2(
+                        prebuilt,
+                        mp_common_args.config.build_output / mod_file,
+                    )
 
         # return the results
         compiled_file = CompiledFile(input_fpath=analysed_file.fpath,
                                      output_fpath=obj_file_prebuild)
-        artefacts = [obj_file_prebuild] + mod_file_prebuilds
+        artefacts = [obj_file_prebuild] + [
+            prebuild for prebuild in mod_file_prebuilds.values()
+            if prebuild.exists()]
 
     metric_name = "compile fortran"
     if mp_common_args.syntax_only:
@@ -344,18 +453,49 @@ def process_file(arg: Tuple[AnalysedFortran, MpCommonArgs]) \
     return compiled_file, artefacts
 
 
+def _get_compiler(config: BuildConfig) -> Compiler:
+    compiler = config.tool_box.get_tool(Category.FORTRAN_COMPILER,
+                                        config.mpi)
+    if compiler.category != Category.FORTRAN_COMPILER:
+        raise RuntimeError(f"Unexpected tool '{compiler.name}' of "
+                           f"category '{compiler.category}' instead of "
+                           f"FortranCompiler")
+    # The ToolBox returns a Tool, but we need to tell mypy that
+    # this is a Compiler
+    return cast(Compiler, compiler)
+
+
+def _get_obj_prebuild(config: BuildConfig, analysed_file,
+                      mp_common_args: MpCommonArgs,
+                      compiler: Compiler) -> Path:
+    flags_checksum = mp_common_args.flags.checksum_for_path(
+        path=analysed_file.fpath, config=config)
+    obj_combo_hash = _get_obj_combo_hash(config, analysed_file,
+                                         mp_common_args=mp_common_args,
+                                         compiler=compiler,
+                                         flags_checksum=flags_checksum)
+    return (config.prebuild_folder /
+            f'{analysed_file.fpath.stem}.{obj_combo_hash:x}.o')
+
+
 def _get_obj_combo_hash(config: BuildConfig,
                         analysed_file, mp_common_args: MpCommonArgs,
-                        compiler: Compiler, flags: Flags):
+                        compiler: Compiler, flags_checksum: int):
     # get a combo hash of things which matter to the object file we define
     # todo: don't just silently use 0 for a missing dep hash
     mod_deps_hashes = {
         mod_dep: mp_common_args.mod_hashes.get(mod_dep, 0)
         for mod_dep in analysed_file.module_deps}
+    # A submodule also depends on the smod files of its ancestors. Nothing
+    # else does, so a change to a submodule doesn't recompile its module's
+    # users.
+    mod_deps_hashes.update({
+        f'{ancestor}.smod': mp_common_args.mod_hashes.get(f'{ancestor}.smod', 0)
+        for ancestor in analysed_file.submodule_ancestors})
     try:
         obj_combo_hash = sum([
             analysed_file.file_hash,
-            flags.checksum(),
+            flags_checksum,
             sum(mod_deps_hashes.values()),
             compiler.get_hash(config.profile),
         ])
@@ -400,11 +540,31 @@ def compile_file(analysed_file, flags, output_fpath, mp_common_args):
                           syntax_only=mp_common_args.syntax_only)
 
 
+def _get_mod_files(analysed_file) -> Dict[Path, bool]:
+    """
+    The module files the compiler writes for an analysed file, and whether each one must exist.
+
+    Every module has a mod file and every submodule has an smod file.
+    Compilers may also write an smod file for a module, if it declares separate module procedures.
+
+    """
+    mod_files: Dict[Path, bool] = {}
+    for mod_def in sorted(analysed_file.module_defs):
+        mod_files[Path(f'{mod_def}.mod')] = True
+        mod_files[Path(f'{mod_def}.smod')] = False
+    for submod_def in sorted(analysed_file.submodule_defs):
+        mod_files[Path(f'{submod_def}.smod')] = True
+    return mod_files
+
+
 def get_mod_hashes(analysed_files: Set[AnalysedFortran],
                    config: BuildConfig) -> Dict[str, int]:
     """
     Get the hash of every module file defined in the list of analysed files.
 
+    Mod files are keyed by module name and smod files by file name, e.g
+    `my_mod.smod` or `my_mod@my_submod.smod`.
+
     """
     mod_hashes = {}
     for af in analysed_files:
@@ -412,4 +572,12 @@ def get_mod_hashes(analysed_files: Set[AnalysedFortran],
             fpath: Path = config.build_output / f'{mod_def}.mod'
             mod_hashes[mod_def] = file_checksum(fpath).file_hash
 
+            fpath = config.build_output / f'{mod_def}.smod'
+            if fpath.exists():
+                mod_hashes[fpath.name] = file_checksum(fpath).file_hash
+
+        for submod_def in af.submodule_defs:
+            fpath = config.build_output / f'{submod_def}.smod'
+            mod_hashes[fpath.name] = file_checksum(fpath).file_hash
+
     return mod_hashes
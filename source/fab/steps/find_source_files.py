@@ -8,13 +8,14 @@ Gather files from a source folder.
 
 """
 import logging
+from collections import deque
 from pathlib import Path
-from typing import Iterable, Optional, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 from fab.artefacts import ArtefactSet
 from fab.build_config import BuildConfig
 from fab.steps import step
-from fab.util import file_walk
+from fab.util import file_walk, string_checksum
 
 logger = logging.getLogger(__name__)
 
@@ -96,6 +97,89 @@ class Exclude(_PathFilter):
         return f'Exclude({", ".join(self.filter_strings)})'
 
 
+class _PathFilterMatcher():
+    """
+    An ordered collection of path filters, compiled into a single
+    Aho-Corasick automaton.
+
+    Deems a path as wanted or not, exactly as checking the filters in turn
+    would: the longest matching filter string wins, with ties going to the
+    last filter, and paths are wanted if nothing matches. This takes one pass
+    over the path, however many filters and filter strings there are.
+
+    """
+
+    _NO_MATCH = (-1, -1, True)
+
+    def __init__(self, path_filters: Iterable[_PathFilter]):
+        """
+        :param path_filters:
+            The Include and/or Exclude objects, in order.
+
+        """
+        # The trie of filter strings. State 0 is the root.
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # The best filter string ending at each state, as
+        # (length, filter index, include), including any found via the
+        # failure links. Tuples compare by length, then by filter order, and
+        # anything beats no match, which leaves the path wanted.
+        self._best: List[Tuple[int, int, bool]] = [self._NO_MATCH]
+
+        for index, path_filter in enumerate(path_filters):
+            for filter_string in path_filter.filter_strings:
+                state = 0
+                for char in filter_string:
+                    next_state = self._goto[state].get(char)
+                    if next_state is None:
+                        next_state = len(self._goto)
+                        self._goto[state][char] = next_state
+                        self._goto.append({})
+                        self._fail.append(0)
+                        self._best.append(self._NO_MATCH)
+                    state = next_state
+                self._best[state] = max(self._best[state], (len(filter_string), index, path_filter.include))
+
+        # Breadth first, so each state's failure state is already complete.
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._best[next_state] = max(self._best[next_state], self._best[self._fail[next_state]])
+                queue.append(next_state)
+
+        # Transitions for characters which aren't in the trie are resolved
+        # through the failure links on first use, then cached here.
+        self._delta: List[Dict[str, int]] = [dict(goto) for goto in self._goto]
+
+    def _next_state(self, state: int, char: str) -> int:
+        delta = self._delta[state]
+        next_state = delta.get(char)
+        if next_state is None:
+            next_state = self._next_state(self._fail[state], char) if state else 0
+            delta[char] = next_state
+        return next_state
+
+    def check(self, path: Path) -> bool:
+        """
+        Whether the filters want the given path.
+
+        :param path: the path to check.
+
+        """
+        best = self._best[0]
+        state = 0
+        for char in str(path):
+            state = self._next_state(state, char)
+            if self._best[state] > best:
+                best = self._best[state]
+        return best[2]
+
+
 @step
 def find_source_files(
         config: BuildConfig,
@@ -159,24 +243,24 @@ def find_source_files(
 
     source_root = source_root or config.source_root
 
+    # Keep the folder listings between builds, so unchanged folders aren't listed again.
+    snapshot = None
+    if config.prebuild_folder.is_dir():
+        snapshot = config.prebuild_folder / f'source_folders.{string_checksum(str(source_root))}.json'
+        config.add_current_prebuilds([snapshot])
+    max_workers = config.n_procs or 1
+
     # file filtering
+    matcher = _PathFilterMatcher(path_filters)
     filtered_fpaths = set()
     # todo: we shouldn't need to ignore the prebuild folder here, it's not
     # underneath the source root.
     for fpath in file_walk(source_root,
-                           ignore_folders=[config.prebuild_folder]):
+                           ignore_folders=[config.prebuild_folder],
+                           max_workers=max_workers, snapshot=snapshot):
         # Search for the longest match (and latest one in case of
         # equal length)
-        wanted = True
-        max_len = -1
-        for path_filter in path_filters:
-            # did this filter have anything to say about this file?
-            pattern_len, result = path_filter.check(fpath)
-            if result is not None and pattern_len >= max_len:
-                wanted = result
-                max_len = pattern_len
-
-        if wanted:
+        if matcher.check(fpath):
             filtered_fpaths.add(fpath)
         else:
             logger.debug(f"excluding {fpath}")
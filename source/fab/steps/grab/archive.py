@@ -11,7 +11,7 @@ from typing import Union
 from fab.steps import step
 
 
-@step
+@step(resumable=False)
 def grab_archive(config, src: Union[Path, str], dst_label: str = ''):
     """
     Copy source from an archive into the project folder.
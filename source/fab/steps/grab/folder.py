@@ -10,7 +10,7 @@ from fab.steps import step
 from fab.tools.category import Category
 
 
-@step
+@step(resumable=False)
 def grab_folder(config, src: Union[Path, str], dst_label: str = ''):
     """
     Copy a source folder to the project workspace.
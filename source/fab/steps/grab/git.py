@@ -14,7 +14,7 @@ from fab.tools.category import Category
 
 
 # todo: allow cli args, e.g to set the depth
-@step
+@step(resumable=False)
 def git_checkout(config, src: str, dst_label: str = '', revision=None):
     """
     Checkout or update a Git repo.
@@ -36,7 +36,7 @@ def git_checkout(config, src: str, dst_label: str = '', revision=None):
         warnings.warn(f'not safe to clean git source in {dst}')
 
 
-@step
+@step(resumable=False)
 def git_merge(config, src: str, dst_label: str = '', revision=None):
     """
     Merge a git repo into a local working copy.
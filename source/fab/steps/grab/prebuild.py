@@ -8,7 +8,7 @@ from fab.steps.grab import logger
 from fab.tools.category import Category
 
 
-@step
+@step(resumable=False)
 def grab_pre_build(config, path, allow_fail=False):
     """
     Copy the contents of another project's prebuild folder into our
@@ -58,7 +58,7 @@ def _svn_prep_common(config, src: str,
     return src, dst, revision
 
 
-@step
+@step(resumable=False)
 def svn_export(config, src: str,
                dst_label: Optional[str] = None,
                revision=None,
@@ -73,7 +73,7 @@ def svn_export(config, src: str,
     svn.export(src, dst, revision)
 
 
-@step
+@step(resumable=False)
 def svn_checkout(config, src: str, dst_label: Optional[str] = None,
                  revision=None, category=Category.SUBVERSION):
     """
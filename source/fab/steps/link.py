@@ -7,18 +7,26 @@
 Link an executable.
 
 """
+import json
 import logging
+import os
+from pathlib import Path
 from string import Template
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from fab.artefacts import (ArtefactsGetter, ArtefactSet, ArtefactStore,
                            CollectionGetter)
 from fab.parse.fortran import AnalysedFortran
-from fab.steps import step
+from fab.steps import run_mp, step
 from fab.tools.category import Category
+from fab.tools.linker import Linker
+from fab.util import file_checksum, log_or_dot, string_checksum
 
 logger = logging.getLogger(__name__)
 
+# Links can need a lot of memory, so by default we only run a few at once.
+MAX_LINKS = 4
+
 
 class DefaultLinkerSource(ArtefactsGetter):
     """
@@ -37,7 +45,8 @@ class DefaultLinkerSource(ArtefactsGetter):
 def link_exe(config,
              libs: Optional[List[str]] = None,
              flags: Optional[List[str]] = None,
-             source: Optional[ArtefactsGetter] = None) -> None:
+             source: Optional[ArtefactsGetter] = None,
+             max_links: int = MAX_LINKS) -> None:
     """
     Link object files into an executable for every build target.
 
@@ -49,6 +58,15 @@ def link_exe(config,
     from an :class:`~fab.steps.archive_objects.ArchiveObjects` step, and
     falls back to using output from compiler steps.
 
+    An executable is only linked again when its link inputs have changed
+    since it was last linked: the linker and its version, the link command's
+    arguments, including the libraries and flags, and the contents of the
+    object files, and of any libraries named by path or found in a `-L`
+    folder. Libraries found elsewhere, such as the system's, aren't checked.
+
+    The executables are linked in parallel, with at most `max_links` at once,
+    each started only when there's enough memory for it.
+
     :param config:
         The :class:`fab.build_config.BuildConfig` object where we can read
         settings such as the project workspace folder or the multiprocessing
@@ -60,6 +78,8 @@ def link_exe(config,
     :param source:
         An optional :class:`~fab.artefacts.ArtefactsGetter`. It defaults to the
         output from compiler steps, which typically is the expected behaviour.
+    :param max_links:
+        The most executables to link at once.
 
     """
     source_getter = source or DefaultLinkerSource()
@@ -92,13 +112,93 @@ def link_exe(config,
     libs = libs or []
     flags = flags or []
 
+    items = []
     for root, objects in target_objects.items():
         exe_path = config.project_workspace / f'{root}'
-        linker.link(objects, exe_path, config=config, libs=libs,
-                    add_flags=flags)
+        record_fpath = None
+        if config.prebuild_folder.is_dir():
+            record_fpath = config.prebuild_folder / f'{exe_path.name}.{string_checksum(str(exe_path))}.json'
+            config.add_current_prebuilds([record_fpath])
+        items.append((root, sorted(objects), exe_path, record_fpath, linker, config, libs, flags))
+
+    # a single link doesn't need a pool
+    run_mp(config, items, _link, no_multiprocessing=len(items) < 2, throttle=True, max_procs=max_links)
+
+    for _, _, exe_path, *_ in items:
         config.artefact_store.add(ArtefactSet.EXECUTABLES, exe_path)
 
 
+def _link(item: Tuple):
+    """
+    Link one executable, unless its record shows it's up to date.
+
+    """
+    root, objects, exe_path, record_fpath, linker, config, libs, flags = item
+    params = linker.get_all_commandline_options(objects, exe_path, config, libs=libs, add_flags=flags)
+    fingerprint = _link_fingerprint(linker, params, exe_path)
+
+    if record_fpath:
+        try:
+            record = json.loads(record_fpath.read_text())
+        except (OSError, ValueError):
+            record = None
+        if record == {'fingerprint': fingerprint, 'exe': _stat(exe_path)}:
+            log_or_dot(logger, f"executable '{exe_path}' is up to date")
+            return
+        # forget the executable while it's changing, in case we don't finish
+        record_fpath.unlink(missing_ok=True)
+
+    linker.link(objects, exe_path, config=config, libs=libs, add_flags=flags)
+
+    if record_fpath:
+        tmp_fpath = record_fpath.with_name(record_fpath.name + '.tmp')
+        tmp_fpath.write_text(json.dumps({'fingerprint': fingerprint, 'exe': _stat(exe_path)}))
+        os.replace(tmp_fpath, record_fpath)
+
+
+def _link_fingerprint(linker: Linker, params: List[str], output_file: Path) -> int:
+    """
+    A checksum of everything which goes into a link.
+
+    :param linker:
+        The linker, whose name, executable and version are included.
+    :param params:
+        The link command's arguments. The contents of any file they name are included, as are any libraries they
+        link with `-l` which are found in a folder given with `-L`.
+    :param output_file:
+        The file the link writes, which isn't an input.
+
+    """
+    parts = [linker.name, linker.exec_name, linker.compiler.get_version_string()] + params
+    search_folders = [Path(arg[2:]) for arg in params if arg.startswith('-L') and len(arg) > 2]
+    for arg in params:
+        fpath = Path(arg)
+        if arg.startswith('-l') and len(arg) > 2:
+            fpath = _find_library(arg[2:], search_folders) or fpath
+        if fpath != output_file and fpath.is_file():
+            parts.append(f'{fpath} {file_checksum(fpath).file_hash}')
+    return string_checksum('\n'.join(parts))
+
+
+def _find_library(name: str, search_folders: List[Path]) -> Optional[Path]:
+    # the file the linker would use for -l<name>, preferring a shared library, as linkers do
+    for folder in search_folders:
+        for suffix in ['.so', '.a']:
+            fpath = folder / f'lib{name}{suffix}'
+            if fpath.is_file():
+                return fpath
+    return None
+
+
+def _stat(fpath: Path) -> Optional[List[int]]:
+    # the executable's size and modification time, to tell if anything else has changed it
+    try:
+        stat = os.stat(fpath)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
 # todo: the bit about Dict[None, object_files] seems too obscure - try to
 # rethink this.
 @step
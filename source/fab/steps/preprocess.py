@@ -20,7 +20,7 @@ from fab.metrics import send_metric
 from fab.steps import check_for_errors, run_mp, step
 from fab.tools.category import Category
 from fab.tools.preprocessor import Cpp, CppFortran, Preprocessor
-from fab.util import (log_or_dot_finish, input_to_output_fpath, log_or_dot,
+from fab.util import (input_to_output_fpath, log_or_dot,
                       suffix_filter, Timer, by_type)
 
 logger = logging.getLogger(__name__)
@@ -89,7 +89,6 @@ def pre_processor(config: BuildConfig, preprocessor: Preprocessor,
     results = run_mp(config, items=mp_args, func=process_artefact)
     check_for_errors(results, caller_label=name)
 
-    log_or_dot_finish(logger)
     config.artefact_store.add(output_collection, set(by_type(results, Path)))
 
 
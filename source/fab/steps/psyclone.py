@@ -10,7 +10,6 @@ https://github.com/stfc/PSyclone
 """
 from dataclasses import dataclass
 import logging
-import re
 import shutil
 import warnings
 from itertools import chain
@@ -20,15 +19,15 @@ from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 from fab.build_config import BuildConfig
 
 from fab.artefacts import (ArtefactSet, ArtefactsGetter, SuffixFilter)
-from fab.parse.fortran import FortranAnalyser, AnalysedFortran
-from fab.parse.x90 import X90Analyser, AnalysedX90
+from fab.parse.fortran import FortranAnalyser, KernelIndex
+from fab.parse.x90 import X90Analyser, AnalysedX90, sanitise_x90
 from fab.steps import run_mp, check_for_errors, step
 from fab.steps.preprocess import pre_processor
 from fab.tools.category import Category
 from fab.tools.psyclone import Psyclone
 from fab.util import (log_or_dot, input_to_output_fpath, file_checksum,
                       file_walk, TimerLogger, string_checksum, suffix_filter,
-                      by_type, log_or_dot_finish)
+                      by_type)
 
 logger = logging.getLogger(__name__)
 
@@ -148,7 +147,6 @@ def psyclone(config: BuildConfig,
     mp_arg = [(x90, mp_payload) for x90 in x90s]
     with TimerLogger(f"running psyclone on {len(x90s)} x90 files"):
         results = run_mp(config, mp_arg, do_one_file)
-    log_or_dot_finish(logger)
     outputs, prebuilds = zip(*results) if results else ((), ())
     check_for_errors(outputs, caller_label='psyclone')
 
@@ -194,20 +192,18 @@ def _generate_mp_payload(config, analysed_x90, all_kernel_hashes, overrides_fold
 def _analyse_x90s(config: BuildConfig,
                   x90s: Set[Path]) -> Dict[Path, AnalysedX90]:
     """
-    Analyse parsable versions of the x90s, finding kernel dependencies.
-    """
+    Analyse the x90s, finding kernel dependencies.
 
-    # make parsable - todo: fast enough not to require prebuilds?
-    with TimerLogger(f"converting {len(x90s)} x90s into parsable fortran"):
-        parsable_x90s = run_mp(config, items=x90s, func=make_parsable_x90)
+    Each x90 is sanitised into parsable fortran in memory, as part of its analysis.
+    The analysis is stored against the hash of the original x90, which still includes the invoke names.
 
+    """
     # Parse. Note that there is no need to ignore dependencies: the x90
     # files will be converted to algorithm layer f90 files, and then
     # properly analysed later.
     x90_analyser = X90Analyser(config=config)
-    with TimerLogger(f"analysing {len(parsable_x90s)} parsable x90 files"):
-        x90_results = run_mp(config, items=parsable_x90s, func=x90_analyser.run)
-    log_or_dot_finish(logger)
+    with TimerLogger(f"analysing {len(x90s)} x90 files"):
+        x90_results = run_mp(config, items=x90s, func=x90_analyser.run)
     x90_analyses, x90_artefacts = zip(*x90_results) if x90_results else ((), ())
     check_for_errors(results=x90_analyses)
 
@@ -215,13 +211,7 @@ def _analyse_x90s(config: BuildConfig,
     prebuild_files = list(by_type(x90_artefacts, Path))
     config.add_current_prebuilds(prebuild_files)
 
-    # record the analysis results against the original x90 filenames (not the parsable versions we analysed)
-    analysed_x90 = by_type(x90_analyses, AnalysedX90)
-    analysed_x90 = {result.fpath.with_suffix('.x90'): result for result in analysed_x90}
-
-    # make the hashes from the original x90s, not the parsable versions which have invoke names removed.
-    for p in analysed_x90:
-        analysed_x90[p]._file_hash = file_checksum(p).file_hash
+    analysed_x90 = {result.fpath: result for result in by_type(x90_analyses, AnalysedX90)}
 
     return analysed_x90
 
@@ -256,19 +246,27 @@ def _analyse_kernels(
 
     """
     # Ignore the prebuild folder. Todo: test the prebuild folder is ignored, in case someone breaks this.
-    file_lists = [list(file_walk(root, ignore_folders=[config.prebuild_folder])) for root in kernel_roots]
+    max_workers = config.n_procs or 1
+    file_lists = [list(file_walk(root, ignore_folders=[config.prebuild_folder], max_workers=max_workers))
+                  for root in kernel_roots]
     all_kernel_files: Set[Path] = set(sum(file_lists, []))
     kernel_files: List[Path] = suffix_filter(all_kernel_files, ['.f90'])
 
+    # Most kernel files are unchanged since the last build, and are found in the kernel index.
+    kernel_index = KernelIndex(config.prebuild_folder / KernelIndex.FILENAME)
+    file_hashes: Dict[Path, int] = {
+        fc.fpath: fc.file_hash for fc in run_mp(config, items=kernel_files, func=file_checksum)}
+    to_analyse = [f for f in kernel_files if file_hashes[f] not in kernel_index]
+    logger.info(f"{len(kernel_files) - len(to_analyse)} of {len(kernel_files)} potential kernel files were indexed")
+
     # We use the normal Fortran analyser, which records psyclone kernel metadata.
     # todo: We'd like to separate that from the general fortran analyser at some point, to reduce coupling.
     # The Analyse step also uses the same fortran analyser. It stores its results so they won't be analysed twice.
     fortran_analyser = FortranAnalyser(config=config,
                                        ignore_dependencies=ignore_dependencies)
 
-    with TimerLogger(f"analysing {len(kernel_files)} potential psyclone kernel files"):
-        fortran_results = run_mp(config, items=kernel_files, func=fortran_analyser.run)
-    log_or_dot_finish(logger)
+    with TimerLogger(f"analysing {len(to_analyse)} potential psyclone kernel files"):
+        fortran_results = run_mp(config, items=to_analyse, func=fortran_analyser.run)
     fortran_analyses, fortran_artefacts = zip(*fortran_results) if fortran_results else (tuple(), tuple())
 
     errors: List[Exception] = list(by_type(fortran_analyses, Exception))
@@ -276,18 +274,26 @@ def _analyse_kernels(
         errs_str = '\n\n'.join(map(str, errors))
         logger.error(f"There were {len(errors)} errors while parsing kernels:\n\n{errs_str}")
 
-    # mark the analysis results files (i.e. prebuilds) as being current, so the cleanup knows not to delete them
+    # mark the analysis results files (i.e. prebuilds) as being current, so the cleanup knows not to delete them,
+    # including those of the files we found in the index
     prebuild_files = list(by_type(fortran_artefacts, Path))
-    config.add_current_prebuilds(prebuild_files)
+    indexed = set(kernel_files) - set(to_analyse)
+    prebuild_files.extend(fortran_analyser._get_analysis_fpath(fpath, file_hashes[fpath]) for fpath in indexed)
+    config.add_current_prebuilds(prebuild_files + [kernel_index.fpath])
 
-    analysed_fortran: List[AnalysedFortran] = list(by_type(fortran_analyses, AnalysedFortran))
+    # Files which failed to parse aren't indexed, so they'll be tried again next time.
+    # The index only needs to remember the files we have now.
+    kernel_index.add_results(fortran_analyses)
+    kernel_index.prune(keep=file_hashes.values())
+    kernel_index.save()
 
     # gather all kernel hashes into one big lump
     all_kernel_hashes: Dict[str, int] = {}
-    for af in analysed_fortran:
-        assert set(af.psyclone_kernels).isdisjoint(all_kernel_hashes), \
-            f"duplicate kernel name(s): {set(af.psyclone_kernels) & set(all_kernel_hashes)}"
-        all_kernel_hashes.update(af.psyclone_kernels)
+    for fpath in kernel_files:
+        kernels = kernel_index.get(file_hashes[fpath]) or {}
+        assert set(kernels).isdisjoint(all_kernel_hashes), \
+            f"duplicate kernel name(s): {set(kernels) & set(all_kernel_hashes)}"
+        all_kernel_hashes.update(kernels)
 
     return all_kernel_hashes
 
@@ -373,7 +379,7 @@ def _gen_prebuild_hash(x90_file: Path, mp_payload: MpCommonArgs):
      - cli args
 
     """
-    # We've analysed (a parsable version of) this x90.
+    # We've analysed this x90.
     analysis_result = mp_payload.analysed_x90[x90_file]  # type: ignore
 
     # include the hashes of kernels used by this x90
@@ -393,7 +399,7 @@ def _gen_prebuild_hash(x90_file: Path, mp_payload: MpCommonArgs):
     # todo: hash the psyclone version in case the built-in kernels change?
     prebuild_hash = sum([
 
-        # the hash of the x90 (not of the parsable version, so includes invoke names)
+        # the hash of the x90 (not of its sanitised text, so includes invoke names)
         analysis_result.file_hash,
 
         # the hashes of the kernels used by this x90
@@ -439,62 +445,20 @@ def _check_override(check_path: Path, mp_payload: MpCommonArgs):
     return check_path
 
 
-# regex to convert an x90 into parsable fortran, so it can be analysed using a third party tool
-
-WHITE = r'[\s&]+'
-OPT_WHITE = r'[\s&]*'
-
-SQ_STRING = "'[^']*'"
-DQ_STRING = '"[^"]*"'
-STRING = f'({SQ_STRING}|{DQ_STRING})'
-
-NAME_KEYWORD = 'name' + OPT_WHITE + '=' + OPT_WHITE + STRING + OPT_WHITE + ',' + OPT_WHITE
-NAMED_INVOKE = 'call' + WHITE + 'invoke' + OPT_WHITE + r'\(' + OPT_WHITE + NAME_KEYWORD
-
-_x90_compliance_pattern = None
-
-
-# todo: In the future, we'd like to extend fparser to handle the leading invoke keywords. (Lots of effort.)
 def make_parsable_x90(x90_path: Path) -> Path:
     """
     Take out the leading name keyword in calls to invoke(), making temporary, parsable fortran from x90s.
 
-    If present it looks like this::
-
-        call invoke( name = "compute_dry_mass", ...
+    Returns the path of the parsable file, which is written next to the x90.
 
-    Returns the path of the parsable file.
-
-    This function is not slow so we're not creating prebuilds for this work.
+    The psyclone step doesn't need this file; the :class:`~fab.parse.x90.X90Analyser` sanitises x90s in memory.
 
     """
-    global _x90_compliance_pattern
-    if not _x90_compliance_pattern:
-        _x90_compliance_pattern = re.compile(pattern=NAMED_INVOKE)
-
-    # src = open(x90_path, 'rt').read()
-
-    # Before we remove the name keywords to invoke, we must remove any comment lines.
-    # This is the simplest way to avoid producing bad fortran when the name keyword is followed by a comment line.
-    # I.e. The comment line doesn't have an "&", so we get "call invoke(!" with no "&", which is a syntax error.
-    src_lines = open(x90_path, 'rt').readlines()
-    no_comment_lines = [line for line in src_lines if not line.lstrip().startswith('!')]
-    src = ''.join(no_comment_lines)
-
-    replaced = []
-
-    def repl(matchobj):
-        # matchobj[0] contains the entire matching string, from "call" to the "," after the name keyword.
-        # matchobj[1] contains the single group in the search pattern, which is defined in STRING.
-        name = matchobj[1].replace('"', '').replace("'", "")
-        replaced.append(name)
-        return 'call invoke('
-
-    out = _x90_compliance_pattern.sub(repl=repl, string=src)
+    with open(x90_path, 'rt') as x90:
+        out = sanitise_x90(x90.read())
 
     out_path = x90_path.with_suffix('.parsable_x90')
-    open(out_path, 'wt').write(out)
-
-    logger.debug(f'names removed from {str(x90_path)}: {replaced}')
+    with open(out_path, 'wt') as parsable:
+        parsable.write(out)
 
     return out_path
@@ -81,6 +81,7 @@ class FabZeroConfig(FabTargetBase):
             openmp=False,
             tool_box=tool_box,
             fab_workspace=Path(args.workspace),
+            profile_python=getattr(args, "profile_python", False),
         ) as config:
             grab_folder(config, args.source)
             find_source_files(config)
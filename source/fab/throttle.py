@@ -0,0 +1,146 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Decide when :func:`~fab.steps.run_mp` can start another item, so that heavy
+compiles don't run the machine out of memory.
+
+"""
+import json
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Collection, Dict, Optional
+
+from fab.metrics import JSON_FILENAME, USAGE_GROUP
+
+logger = logging.getLogger(__name__)
+
+
+def available_memory_kb() -> Optional[int]:
+    """
+    The memory available for new processes, from /proc/meminfo, or None if we can't tell.
+
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def load_peak_rss(metrics_folder: Path, step_name: Optional[str]) -> Dict[str, int]:
+    """
+    The peak memory of the tools run for each item, in the given step, from the last build's metrics.
+
+    Each item's peak is the largest of its own tool processes, see :func:`~fab.metrics.run_process`,
+    so one heavy compile doesn't raise the estimate for every item after it.
+
+    :param metrics_folder:
+        The build's metrics folder.
+    :param step_name:
+        The step whose items we want.
+
+    """
+    fpath = metrics_folder / JSON_FILENAME
+    try:
+        mtime = fpath.stat().st_mtime_ns
+    except OSError:
+        return {}
+    return _load_peak_rss(fpath, mtime, step_name)
+
+
+@lru_cache(maxsize=8)
+def _load_peak_rss(fpath: Path, mtime: int, step_name: Optional[str]) -> Dict[str, int]:
+    # the mtime is part of the cache key, compile steps call us for every pass
+    try:
+        usage = json.loads(fpath.read_text()).get(USAGE_GROUP, {})
+    except (OSError, ValueError) as err:
+        logger.warning(f"could not read tool usage history from '{fpath}': {err}")
+        return {}
+    prefix = f'{step_name}: '
+    return {name[len(prefix):]: value['max_rss_kb']
+            for name, value in usage.items() if name.startswith(prefix)}
+
+
+class MemoryThrottle():
+    """
+    Admits new work by available memory, the work's historical peak memory,
+    and the load average.
+
+    Work whose peak memory is unknown is estimated as the average of the
+    known work, or zero if we have no history, in which case only the
+    available memory and load average are considered.
+
+    """
+    # leave this much memory for the OS and the rest of the build
+    MARGIN_KB = 512 * 1024
+
+    def __init__(self, max_procs: int, peak_rss: Optional[Dict[str, int]] = None):
+        """
+        :param max_procs:
+            The most work to run at once, whatever the memory.
+        :param peak_rss:
+            The peak memory of each item of work, in kB, when it last ran.
+
+        """
+        self.max_procs = max_procs
+        self.peak_rss = peak_rss or {}
+        self._default_kb = sum(self.peak_rss.values()) // len(self.peak_rss) if self.peak_rss else 0
+
+        try:
+            self.cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            self.cpus = os.cpu_count() or 1
+
+        # the memory we have to share out, as of when we started
+        available = available_memory_kb()
+        self.budget_kb = None if available is None else available - self.MARGIN_KB
+
+    def estimate(self, label: str) -> int:
+        """
+        The memory, in kB, we expect the given item of work to need.
+
+        """
+        return self.peak_rss.get(label, self._default_kb)
+
+    def admit(self, estimate_kb: int, running: Collection[int]) -> bool:
+        """
+        Whether we can start some work now.
+
+        We can always start work when nothing else is running.
+
+        :param estimate_kb:
+            The memory we expect the work to need.
+        :param running:
+            The memory we expect the work which is already running to need.
+
+        """
+        if not running:
+            return True
+        if len(running) >= self.max_procs:
+            return False
+
+        # is the machine busy with work which isn't ours?
+        try:
+            load = os.getloadavg()[0]
+        except OSError:
+            load = 0.0
+        if load - len(running) >= self.cpus:
+            return False
+
+        if self.budget_kb is not None:
+            # what's running may not have reached its peak yet
+            if sum(running) + estimate_kb > self.budget_kb:
+                return False
+            available = available_memory_kb()
+            if available is not None and estimate_kb + self.MARGIN_KB > available:
+                return False
+
+        return True
@@ -18,8 +18,13 @@ class Ar(Tool):
     '''This is the base class for `ar`.
     '''
 
-    def __init__(self):
-        super().__init__("ar", "ar", Category.AR)
+    def __init__(self, name: str = "ar", exec_name: str = "ar"):
+        super().__init__(name, exec_name, Category.AR)
+
+    @property
+    def supports_response_files(self) -> bool:
+        ''':returns: True, GNU ar reads arguments from a response file.'''
+        return True
 
     def create(self, output_fpath: Path,
                members: List[Union[Path, str]]):
@@ -34,3 +39,25 @@ class Ar(Tool):
         parameters: List[Union[Path, str]] = ["cr", output_fpath]
         parameters.extend(map(str, members))
         return self.run(additional_parameters=parameters)
+
+    def replace(self, output_fpath: Path,
+                members: List[Union[Path, str]]):
+        '''Replace the listed members of an existing archive, or add them
+        if they're not in it. Members are matched by their file name.
+
+        :param output_fpath: the archive to update.
+        :param members: the list of objects to be put in the archive.
+        '''
+        parameters: List[Union[Path, str]] = ["r", output_fpath]
+        parameters.extend(map(str, members))
+        return self.run(additional_parameters=parameters)
+
+    def delete(self, output_fpath: Path, names: List[str]):
+        '''Delete the named members from an existing archive.
+
+        :param output_fpath: the archive to update.
+        :param names: the file names of the members to delete.
+        '''
+        parameters: List[Union[Path, str]] = ["d", output_fpath]
+        parameters.extend(names)
+        return self.run(additional_parameters=parameters)
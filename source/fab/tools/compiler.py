@@ -11,7 +11,7 @@ classes for gcc, gfortran, icc, ifort
 import re
 from pathlib import Path
 import warnings
-from typing import cast, List, Optional, Tuple, Union
+from typing import cast, Dict, List, Optional, Tuple, Union
 import zlib
 from fab.build_config import BuildConfig
 
@@ -44,6 +44,12 @@ class Compiler(CompilerSuiteTool):
     :param availability_option: a command line option for the tool to test
         if the tool is available on the current system. Defaults to
         `--version`.
+    :param response_files: whether the compiler reads arguments from a
+        response file, given as `@file`.
+    :param pch_suffix: the suffix of a precompiled header, which the
+        compiler uses in place of a header given with `-include` when it
+        finds one next to it. None if the compiler doesn't support
+        precompiled headers.
     '''
 
     # pylint: disable=too-many-arguments
@@ -57,11 +63,15 @@ class Compiler(CompilerSuiteTool):
                  output_flag: Optional[str] = None,
                  openmp_flag: Optional[str] = None,
                  version_argument: Optional[str] = None,
-                 availability_option: Optional[Union[str, List[str]]] = None):
+                 availability_option: Optional[Union[str, List[str]]] = None,
+                 response_files: bool = False,
+                 pch_suffix: Optional[str] = None):
         super().__init__(name, exec_name, suite, category=category,
                          availability_option=availability_option)
         self._version: Union[Tuple[int, ...], None] = None
         self._mpi = mpi
+        self._response_files = response_files
+        self._pch_suffix = pch_suffix
         self._compile_flag = compile_flag if compile_flag else "-c"
         self._output_flag = output_flag if output_flag else "-o"
         self._openmp_flag = openmp_flag if openmp_flag else ""
@@ -75,6 +85,21 @@ class Compiler(CompilerSuiteTool):
         """
         return self._mpi
 
+    @property
+    def supports_response_files(self) -> bool:
+        """
+        :returns: whether this compiler reads arguments from a response file.
+        """
+        return self._response_files
+
+    @property
+    def pch_suffix(self) -> Optional[str]:
+        """
+        :returns: the suffix of a precompiled header, or None if this
+            compiler doesn't support them.
+        """
+        return self._pch_suffix
+
     @property
     def openmp(self) -> bool:
         """
@@ -120,8 +145,8 @@ class Compiler(CompilerSuiteTool):
     def get_all_commandline_options(
             self,
             config: "BuildConfig",
-            input_file: Path,
-            output_file: Path,
+            input_file: Union[Path, List[Path]],
+            output_file: Optional[Path],
             add_flags:  Union[None, List[str]] = None) -> List[str]:
         '''This function returns all command line options for a compiler
         (but not the executable name). It is used by a compiler wrapper
@@ -130,8 +155,12 @@ class Compiler(CompilerSuiteTool):
         the -o flag), the flag to only compile (and not link), and if
         required openmp.
 
-        :param input_file: the name of the input file.
-        :param output_file: the name of the output file.
+        :param input_file: the name of the input file, or a list of input
+            files to compile with one invocation. The files in a list are
+            given by their full path and there is no output flag, so each
+            object file is written to the current working directory.
+        :param output_file: the name of the output file, if there is only
+            one input file.
         :param config: The BuildConfig, from which compiler profile and OpenMP
             status are taken.
         :param add_flags: additional flags for the compiler.
@@ -150,7 +179,11 @@ class Compiler(CompilerSuiteTool):
                     f"instead.")
             params += add_flags
 
-        params.extend([input_file.name, self._output_flag, str(output_file)])
+        if isinstance(input_file, list):
+            params.extend(str(fpath) for fpath in input_file)
+        else:
+            params.extend([input_file.name, self._output_flag,
+                           str(output_file)])
         return params
 
     def compile_file(self, input_file: Path,
@@ -176,6 +209,75 @@ class Compiler(CompilerSuiteTool):
         return self.run(profile=config.profile, cwd=input_file.parent,
                         additional_parameters=params)
 
+    def precompile_header(self, header: Path,
+                          config: "BuildConfig",
+                          add_flags: Union[None, List[str]] = None) -> Path:
+        '''Precompiles a header, writing the precompiled header next to it,
+        where the compiler finds it when the header is given with
+        `-include`. A file must be compiled with the same flags to use it.
+
+        :param header: the path of the header.
+        :param config: The BuildConfig, from which compiler profile and OpenMP
+            status are taken.
+        :param add_flags: additional compiler flags.
+
+        :returns: the path of the precompiled header.
+
+        :raises RuntimeError: if this compiler doesn't support precompiled
+            headers.
+        '''
+        if not self.pch_suffix:
+            raise RuntimeError(f"Compiler '{self.name}' does not support "
+                               f"precompiled headers.")
+        pch = header.with_name(header.name + self.pch_suffix)
+        params = self.get_all_commandline_options(
+            config, header, pch, (add_flags or []) + ["-x", "c-header"])
+        self.run(profile=config.profile, cwd=header.parent,
+                 additional_parameters=params)
+        return pch
+
+    def compile_files(self, input_files: List[Path],
+                      output_folder: Path,
+                      config: "BuildConfig",
+                      add_flags: Union[None, List[str]] = None
+                      ) -> Dict[Path, Path]:
+        '''Compiles several files with one invocation of the compiler,
+        which saves the compiler's start up time for each file. The
+        current working directory for the command is the output folder,
+        where the compiler writes an object file named after each source
+        file, so the source files must have different names.
+
+        :param input_files: the paths of the input files.
+        :param output_folder: the folder for the object files.
+        :param config: The BuildConfig, from which compiler profile and OpenMP
+            status are taken.
+        :param add_flags: additional compiler flags.
+
+        :returns: the object file for each input file.
+        '''
+        objects = self._batch_objects(input_files, output_folder)
+        params = self.get_all_commandline_options(config, input_files,
+                                                  None, add_flags)
+        self.run(profile=config.profile, cwd=output_folder,
+                 additional_parameters=params)
+        return objects
+
+    @staticmethod
+    def _batch_objects(input_files: List[Path],
+                       output_folder: Path) -> Dict[Path, Path]:
+        ''':returns: the object file the compiler writes for each input
+            file of a batch.
+
+        :raises ValueError: if two input files would write the same object
+            file.
+        '''
+        objects = {fpath: output_folder / f"{fpath.stem}.o"
+                   for fpath in input_files}
+        if len(set(objects.values())) < len(input_files):
+            raise ValueError(f"Cannot compile files with the same name in "
+                             f"one batch: {input_files}")
+        return objects
+
     def check_available(self) -> bool:
         '''Checks if the compiler is available. While the method in
         the Tools base class would be sufficient (when using --version),
@@ -256,7 +358,8 @@ class Compiler(CompilerSuiteTool):
             error.
         '''
         try:
-            return self.run(version_command, capture_output=True)
+            return self.run(version_command, capture_output=True,
+                            use_launcher=False)
         except RuntimeError as err:
             raise RuntimeError(f"Error asking for version of compiler "
                                f"'{self.name}'") from err
@@ -291,6 +394,10 @@ class CCompiler(Compiler):
     :param output_flag: the compilation flag to use to indicate the name
         of the output file
     :param openmp_flag: the flag to use to enable OpenMP
+    :param response_files: whether the compiler reads arguments from a
+        response file, given as `@file`.
+    :param pch_suffix: the suffix of a precompiled header, if the compiler
+        supports them.
     '''
 
     # pylint: disable=too-many-arguments
@@ -301,14 +408,18 @@ class CCompiler(Compiler):
                  output_flag: Optional[str] = None,
                  openmp_flag: Optional[str] = None,
                  version_argument: Optional[str] = None,
-                 availability_option: Optional[str] = None):
+                 availability_option: Optional[str] = None,
+                 response_files: bool = False,
+                 pch_suffix: Optional[str] = None):
         super().__init__(name, exec_name, suite,
                          category=Category.C_COMPILER, mpi=mpi,
                          compile_flag=compile_flag, output_flag=output_flag,
                          openmp_flag=openmp_flag,
                          version_argument=version_argument,
                          version_regex=version_regex,
-                         availability_option=availability_option)
+                         availability_option=availability_option,
+                         response_files=response_files,
+                         pch_suffix=pch_suffix)
 
 
 # ============================================================================
@@ -332,6 +443,8 @@ class FortranCompiler(Compiler):
         store created module files.
     :param syntax_only_flag: flag to indicate to only do a syntax check.
         The side effect is that the module files are created.
+    :param response_files: whether the compiler reads arguments from a
+        response file, given as `@file`.
     '''
 
     # pylint: disable=too-many-arguments
@@ -344,6 +457,7 @@ class FortranCompiler(Compiler):
                  version_argument: Optional[str] = None,
                  module_folder_flag: Optional[str] = None,
                  syntax_only_flag: Optional[str] = None,
+                 response_files: bool = False,
                  ):
 
         super().__init__(name=name, exec_name=exec_name, suite=suite,
@@ -351,7 +465,8 @@ class FortranCompiler(Compiler):
                          mpi=mpi, compile_flag=compile_flag,
                          output_flag=output_flag, openmp_flag=openmp_flag,
                          version_argument=version_argument,
-                         version_regex=version_regex)
+                         version_regex=version_regex,
+                         response_files=response_files)
         self._module_folder_flag = (module_folder_flag if module_folder_flag
                                     else "")
         self._syntax_only_flag = syntax_only_flag
@@ -374,8 +489,8 @@ class FortranCompiler(Compiler):
     def get_all_commandline_options(
             self,
             config: "BuildConfig",
-            input_file: Path,
-            output_file: Path,
+            input_file: Union[Path, List[Path]],
+            output_file: Optional[Path],
             add_flags:  Union[None, List[str]] = None,
             syntax_only: Optional[bool] = False) -> List[str]:
         '''This function returns all command line options for a Fortran
@@ -385,8 +500,10 @@ class FortranCompiler(Compiler):
         syntax-only flags (as required) to the standard compiler
         flags.
 
-        :param input_file: the name of the input file.
-        :param output_file: the name of the output file.
+        :param input_file: the name of the input file, or a list of input
+            files to compile with one invocation.
+        :param output_file: the name of the output file, if there is only
+            one input file.
         :param config: The BuildConfig, from which compiler profile and OpenMP
             status are taken.
         :param add_flags: additional flags for the compiler.
@@ -451,6 +568,34 @@ class FortranCompiler(Compiler):
         self.run(profile=config.profile, cwd=input_file.parent,
                  additional_parameters=params)
 
+    def compile_files(self, input_files: List[Path],
+                      output_folder: Path,
+                      config: "BuildConfig",
+                      add_flags: Union[None, List[str]] = None,
+                      syntax_only: Optional[bool] = False
+                      ) -> Dict[Path, Path]:
+        '''Compiles several files with one invocation of the compiler.
+        This re-implements `compile_files` of the base class, but passes
+        the syntax_only flag in.
+
+        :param input_files: the paths of the input files.
+        :param output_folder: the folder for the object files.
+        :param config: The BuildConfig, from which compiler profile and OpenMP
+            status are taken.
+        :param add_flags: additional flags for the compiler.
+        :param syntax_only: if set, the compiler will only do
+            a syntax check
+
+        :returns: the object file for each input file.
+        '''
+        objects = self._batch_objects(input_files, output_folder)
+        params = self.get_all_commandline_options(config, input_files,
+                                                  None, add_flags,
+                                                  syntax_only)
+        self.run(profile=config.profile, cwd=output_folder,
+                 additional_parameters=params)
+        return objects
+
 
 # ============================================================================
 # Gnu
@@ -473,6 +618,8 @@ class Gcc(CCompiler):
         # excluding the dot (so it would become a valid 1.2)
         super().__init__(name, exec_name, suite="gnu", mpi=mpi,
                          openmp_flag="-fopenmp",
+                         response_files=True,
+                         pch_suffix=".gch",
                          version_regex=r"gcc \(.*?\) (\d[\d\.]+\d)(?:$| )")
 
 
@@ -491,6 +638,7 @@ class Gfortran(FortranCompiler):
                          openmp_flag="-fopenmp",
                          module_folder_flag="-J",
                          syntax_only_flag="-fsyntax-only",
+                         response_files=True,
                          version_regex=(r"GNU Fortran \(.*?\) "
                                         r"(\d[\d\.]+\d)(?:$| )"))
 
@@ -509,6 +657,7 @@ class Icc(CCompiler):
     def __init__(self, name: str = "icc", exec_name: str = "icc"):
         super().__init__(name, exec_name, suite="intel-classic",
                          openmp_flag="-qopenmp",
+                         response_files=True,
                          version_regex=r"icc \(ICC\) (\d[\d\.]+\d) ")
 
 
@@ -526,6 +675,7 @@ class Ifort(FortranCompiler):
                          module_folder_flag="-module",
                          openmp_flag="-qopenmp",
                          syntax_only_flag="-syntax-only",
+                         response_files=True,
                          version_regex=r"ifort \(IFORT\) (\d[\d\.]+\d) ")
 
 
@@ -541,6 +691,7 @@ class Icx(CCompiler):
     def __init__(self, name: str = "icx", exec_name: str = "icx"):
         super().__init__(name, exec_name, suite="intel-llvm",
                          openmp_flag="-qopenmp",
+                         response_files=True,
                          version_regex=(r"Intel\(R\) oneAPI DPC\+\+/C\+\+ "
                                         r"Compiler (\d[\d\.]+\d) "))
 
@@ -558,6 +709,7 @@ class Ifx(FortranCompiler):
                          module_folder_flag="-module",
                          openmp_flag="-qopenmp",
                          syntax_only_flag="-syntax-only",
+                         response_files=True,
                          version_regex=r"ifx \(IFX\) (\d[\d\.]+\d) ")
 
 
@@ -9,7 +9,7 @@ the derived classes for mpif90, mpicc, and CrayFtnWrapper and CrayCcWrapper.
 """
 
 from pathlib import Path
-from typing import cast, List, Optional, Union
+from typing import cast, Dict, List, Optional, Union
 
 from fab.build_config import BuildConfig
 from fab.tools.category import Category
@@ -56,6 +56,18 @@ class CompilerWrapper(Compiler):
         '''Returns the flag to enable OpenMP.'''
         return self._compiler.openmp_flag
 
+    @property
+    def supports_response_files(self) -> bool:
+        ''':returns: whether the wrapped compiler reads arguments from a
+            response file, which the wrapper passes on.'''
+        return self._compiler.supports_response_files
+
+    @property
+    def pch_suffix(self) -> Optional[str]:
+        ''':returns: the suffix of a precompiled header made by the wrapped
+            compiler, or None if it doesn't support them.'''
+        return self._compiler.pch_suffix
+
     @property
     def has_syntax_only(self) -> bool:
         ''':returns: whether this compiler supports a syntax-only feature.
@@ -96,8 +108,8 @@ class CompilerWrapper(Compiler):
     def get_all_commandline_options(
             self,
             config: "BuildConfig",
-            input_file: Path,
-            output_file: Path,
+            input_file: Union[Path, List[Path]],
+            output_file: Optional[Path],
             add_flags:  Union[None, List[str]] = None,
             syntax_only: Optional[bool] = False) -> List[str]:
         '''This function returns all command line options for a
@@ -105,8 +117,10 @@ class CompilerWrapper(Compiler):
         if the wrapped compiler is a Fortran compiler. Otherwise,
         an exception will be raised.
 
-        :param input_file: the name of the input file.
-        :param output_file: the name of the output file.
+        :param input_file: the name of the input file, or a list of input
+            files to compile with one invocation.
+        :param output_file: the name of the output file, if there is only
+            one input file.
         :param config: The BuildConfig, from which compiler profile and OpenMP
             status are taken.
         :param add_flags: additional flags for the compiler.
@@ -171,6 +185,33 @@ class CompilerWrapper(Compiler):
         self.run(profile=config.profile, cwd=input_file.parent,
                  additional_parameters=flags)
 
+    def compile_files(self, input_files: List[Path],
+                      output_folder: Path,
+                      config: "BuildConfig",
+                      add_flags: Union[None, List[str]] = None,
+                      syntax_only: Optional[bool] = None
+                      ) -> Dict[Path, Path]:
+        '''Compiles several files with one invocation of the wrapper
+        compiler.
+
+        :param input_files: the paths of the input files.
+        :param output_folder: the folder for the object files.
+        :param config: The BuildConfig, from which compiler profile and OpenMP
+            status are taken.
+        :param add_flags: additional flags for the compiler.
+        :param syntax_only: if set, the compiler will only do
+            a syntax check
+
+        :returns: the object file for each input file.
+        '''
+        objects = self._batch_objects(input_files, output_folder)
+        flags = self.get_all_commandline_options(
+            config, input_files, None, add_flags=add_flags,
+            syntax_only=syntax_only)
+        self.run(profile=config.profile, cwd=output_folder,
+                 additional_parameters=flags)
+        return objects
+
 
 # ============================================================================
 class Mpif90(CompilerWrapper):
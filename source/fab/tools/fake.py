@@ -0,0 +1,322 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+
+"""This file contains simulated compilers, preprocessors, linkers and ar.
+
+They do their work without starting a process, writing deterministic
+outputs after a configurable delay for each file. This allows Fab's own
+overheads (scheduling, hashing, copying and inter-process communication)
+to be measured, and tested, without a real compiler hiding them.
+
+They belong to the "fake" compiler suite. The ToolRepository never picks
+them as a default tool unless this suite is made the default, e.g.
+`ToolRepository().set_default_compiler_suite("fake")`.
+"""
+
+import math
+import random
+import re
+import shlex
+import subprocess
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from fab.tools.ar import Ar
+from fab.tools.category import Category
+from fab.tools.compiler import CCompiler, FortranCompiler
+from fab.tools.preprocessor import Preprocessor
+
+FAKE_SUITE = "fake"
+FAKE_VERSION = "1.0.0"
+
+_MODULE_DEF = re.compile(r"^\s*module\s+(?!procedure\b)(\w+)",
+                         re.IGNORECASE | re.MULTILINE)
+
+
+class FakeLatency:
+    '''How long a simulated tool takes for each file. Each file's latency is
+    drawn from a log-normal distribution, seeded by the file name, so the
+    same file always takes the same time.
+
+    :param mean: the mean latency in seconds.
+    :param sigma: the spread of the log-normal distribution. Zero gives
+        every file the mean latency.
+    '''
+
+    def __init__(self, mean: float = 0.0, sigma: float = 0.0):
+        self.mean = mean
+        self.sigma = sigma
+
+    def __call__(self, name: str) -> float:
+        ''':returns: the latency for the file with the given name.'''
+        if self.mean <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.mean
+        rng = random.Random(zlib.crc32(name.encode()))
+        return rng.lognormvariate(math.log(self.mean) - self.sigma ** 2 / 2,
+                                  self.sigma)
+
+
+class _Simulated:
+    '''Runs a simulated tool instead of an executable. Mixed into the tool
+    classes below, which must provide a `name` and a `_simulate` method.
+    '''
+
+    name: str
+
+    def __init__(self, *args, latency: Optional[FakeLatency] = None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latency = latency or FakeLatency()
+
+    @property
+    def is_simulated(self) -> bool:
+        ''':returns: True, this tool does not run an executable.'''
+        return True
+
+    @property
+    def suite(self) -> str:
+        ''':returns: the fake compiler suite.'''
+        return FAKE_SUITE
+
+    def _execute(self, command: List[str], capture_output: bool,
+                 env: Optional[Dict[str, str]],
+                 cwd: Optional[Union[Path, str]]
+                 ) -> Tuple[subprocess.CompletedProcess, None]:
+        '''Simulates running the command.
+
+        :returns: a completed process, with a return code of 1 and the
+            error as stderr if the simulated tool failed, and no resource
+            usage, as no process was run.
+        '''
+        args = command[1:]
+        if args == ["--version"]:
+            return subprocess.CompletedProcess(
+                command, 0, f"{self.name} {FAKE_VERSION}\n".encode(), b""), None
+        try:
+            args = _expand_response_files(args)
+            delay_for, stdout = self._simulate(args, Path(cwd or "."))
+        except (OSError, ValueError) as err:
+            return subprocess.CompletedProcess(command, 1, b"",
+                                               str(err).encode()), None
+        names = [delay_for] if isinstance(delay_for, str) else delay_for
+        time.sleep(sum(map(self.latency, names)))
+        return subprocess.CompletedProcess(command, 0, stdout.encode(),
+                                           b""), None
+
+    def _simulate(self, args: List[str],
+                  cwd: Path) -> Tuple[Union[str, List[str]], str]:
+        '''Does the tool's work.
+
+        :returns: the name of each file processed, which sets how long the
+            tool takes, and the tool's output.
+        '''
+        raise NotImplementedError
+
+
+def _expand_response_files(args: List[str]) -> List[str]:
+    '''Replaces each `@file` argument with the arguments in the file.'''
+    expanded: List[str] = []
+    for arg in args:
+        if arg.startswith("@"):
+            expanded.extend(shlex.split(Path(arg[1:]).read_text()))
+        else:
+            expanded.append(arg)
+    return expanded
+
+
+def _checksum(*parts: Union[bytes, str]) -> int:
+    '''A deterministic checksum of the given parts.'''
+    result = 0
+    for part in parts:
+        result = zlib.crc32(part.encode() if isinstance(part, str) else part,
+                            result)
+    return result
+
+
+def _parse_compiler_args(args: List[str], cwd: Path,
+                         options_with_values: List[str]
+                         ) -> Tuple[List[Path], Dict[str, str], List[str]]:
+    '''Splits compiler arguments into input files, options which take a
+    value, and other flags.
+    '''
+    inputs: List[Path] = []
+    values: Dict[str, str] = {}
+    flags: List[str] = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if not arg:
+            pass
+        elif arg in options_with_values:
+            if i + 1 >= len(args):
+                raise ValueError(f"missing value for '{arg}'")
+            values[arg] = args[i + 1]
+            i += 1
+        elif arg.startswith("-"):
+            flags.append(arg)
+        else:
+            inputs.append(cwd / arg)
+        i += 1
+    return inputs, values, flags
+
+
+class _FakeCompilerMixin(_Simulated):
+    '''Compiles, or links when there is no compile flag.'''
+
+    compile_flag: str
+    output_flag: str
+
+    # Options which are followed by a value, as well as the output flag
+    _value_options = ["-I", "-J", "-include", "-x"]
+
+    def _simulate(self, args: List[str],
+                  cwd: Path) -> Tuple[Union[str, List[str]], str]:
+        inputs, values, flags = _parse_compiler_args(
+            args, cwd, [self.output_flag] + self._value_options)
+        if not inputs:
+            raise ValueError(f"{self.name}: no input files")
+        output = values.get(self.output_flag)
+        include = values.get("-include")
+        if include is not None and not (cwd / include).exists():
+            raise ValueError(f"{self.name}: {include}: no such file")
+
+        if self.compile_flag not in flags:
+            # Link the inputs into an executable
+            if output is None:
+                raise ValueError(f"{self.name}: no output file")
+            contents = [fpath.read_bytes() for fpath in sorted(inputs)]
+            (cwd / output).write_text(
+                f"FAKE-EXECUTABLE {_checksum(*contents, *flags)}\n")
+            return output, ""
+
+        if output is not None and len(inputs) > 1:
+            raise ValueError(f"{self.name}: cannot specify "
+                             f"'{self.output_flag}' with multiple files")
+        # Without an output file, each object is named after its source
+        # and written to the current working directory
+        for fpath in inputs:
+            source = fpath.read_bytes()
+            self._write_modules(source, values, cwd)
+            if not self._syntax_only(flags):
+                (cwd / (output or fpath.with_suffix(".o").name)).write_text(
+                    f"FAKE-OBJECT {_checksum(source, *flags)}\n")
+        return [fpath.name for fpath in inputs], ""
+
+    def _write_modules(self, source: bytes, values: Dict[str, str],
+                       cwd: Path):
+        pass
+
+    def _syntax_only(self, flags: List[str]) -> bool:
+        return False
+
+
+class FakeFortranCompiler(_FakeCompilerMixin, FortranCompiler):
+    '''A simulated Fortran compiler. It writes an object file and a module
+    file for every module defined in the source, without checking the
+    source is valid.
+
+    :param name: name of this compiler.
+    :param latency: how long to take for each file.
+    '''
+
+    def __init__(self, name: str = "fake-fortran",
+                 latency: Optional[FakeLatency] = None):
+        super().__init__(name, name, suite=FAKE_SUITE,
+                         openmp_flag="-fopenmp",
+                         module_folder_flag="-J",
+                         syntax_only_flag="-fsyntax-only",
+                         version_regex=r"fake-\S+ (\d[\d\.]+\d)$",
+                         response_files=True, latency=latency)
+
+    def _write_modules(self, source: bytes, values: Dict[str, str],
+                       cwd: Path):
+        module_folder = cwd / values.get("-J", ".")
+        for name in _MODULE_DEF.findall(source.decode(errors="replace")):
+            (module_folder / f"{name.lower()}.mod").write_text(
+                f"FAKE-MODULE {name.lower()} {_checksum(source)}\n")
+
+    def _syntax_only(self, flags: List[str]) -> bool:
+        return "-fsyntax-only" in flags
+
+
+class FakeCCompiler(_FakeCompilerMixin, CCompiler):
+    '''A simulated C compiler. It writes an object file without checking
+    the source is valid.
+
+    :param name: name of this compiler.
+    :param latency: how long to take for each file.
+    '''
+
+    def __init__(self, name: str = "fake-cc",
+                 latency: Optional[FakeLatency] = None):
+        super().__init__(name, name, suite=FAKE_SUITE,
+                         openmp_flag="-fopenmp",
+                         version_regex=r"fake-\S+ (\d[\d\.]+\d)$",
+                         response_files=True, pch_suffix=".gch",
+                         latency=latency)
+
+
+class FakePreprocessor(_Simulated, Preprocessor):
+    '''A simulated preprocessor. It copies the input to the output, without
+    any preprocessor directives.
+
+    :param name: name of this preprocessor.
+    :param category: the category (C_PREPROCESSOR or FORTRAN_PREPROCESSOR).
+    :param latency: how long to take for each file.
+    '''
+
+    def __init__(self, name: str = "fake-cpp",
+                 category: Category = Category.C_PREPROCESSOR,
+                 latency: Optional[FakeLatency] = None):
+        super().__init__(name, name, category, latency=latency)
+
+    def _simulate(self, args: List[str], cwd: Path) -> Tuple[str, str]:
+        # Input and output files come as the last two parameters
+        files = [arg for arg in args if not arg.startswith("-")]
+        if len(files) < 2:
+            raise ValueError(f"{self.name}: expected input and output files")
+        input_file, output_file = cwd / files[-2], cwd / files[-1]
+        lines = input_file.read_text().splitlines(keepends=True)
+        output_file.write_text(
+            "".join(line for line in lines if not line.startswith("#")))
+        return input_file.name, ""
+
+
+class FakeAr(_Simulated, Ar):
+    '''A simulated `ar`. It writes an archive listing its members, which
+    can be replaced or deleted like a real archive's.
+
+    :param latency: how long to take for each archive.
+    '''
+
+    def __init__(self, latency: Optional[FakeLatency] = None):
+        super().__init__("fake-ar", "fake-ar", latency=latency)
+
+    def _simulate(self, args: List[str], cwd: Path) -> Tuple[str, str]:
+        if len(args) < 2:
+            raise ValueError(f"{self.name}: expected an archive name")
+        operation, output = args[0], cwd / args[1]
+        # an archive's members are listed by name, in order
+        entries: Dict[str, str] = {}
+        if output.exists():
+            for line in output.read_text().splitlines()[1:]:
+                name, checksum = line.rsplit(" ", 1)
+                entries[name] = checksum
+        if "d" in operation:
+            for name in args[2:]:
+                entries.pop(name, None)
+        elif "r" in operation:
+            for member in [cwd / arg for arg in args[2:]]:
+                entries[member.name] = str(_checksum(member.read_bytes()))
+        else:
+            raise ValueError(f"{self.name}: unknown operation '{operation}'")
+        output.write_text("FAKE-ARCHIVE\n" + "".join(
+            f"{name} {checksum}\n" for name, checksum in entries.items()))
+        return output.name, ""
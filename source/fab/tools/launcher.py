@@ -0,0 +1,118 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+
+"""This file contains launchers, which run a tool's command through
+another program, e.g. `ccache`, `sccache`, a site's caching wrapper or
+`nice`. A launcher is not part of a tool's identity, so using one does not
+change a compiler's hash, and does not cause anything to be recompiled.
+
+The CacheDaemonLauncher sends each command to a local Fab cache daemon
+(see :mod:`fab.cache_daemon`), which reuses the output of an identical
+earlier compile.
+"""
+
+import logging
+import os
+import shlex
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from fab.cache_daemon import default_socket_path, request_run
+from fab.metrics import run_process
+
+logger = logging.getLogger(__name__)
+
+
+class Launcher:
+    '''Runs a tool's command with the launcher's command in front of it.
+
+    :param command: the launcher's command, as a list of arguments or as a
+        string, which is split like a shell command line.
+    '''
+
+    def __init__(self, command: Union[str, Sequence[str]]):
+        if isinstance(command, str):
+            command = shlex.split(command)
+        self._command = list(command)
+
+    @property
+    def command(self) -> List[str]:
+        ''':returns: the launcher's command.'''
+        return self._command
+
+    def execute(self, command: List[str], capture_output: bool,
+                env: Optional[Dict[str, str]],
+                cwd: Optional[Union[Path, str]]
+                ) -> Tuple[subprocess.CompletedProcess,
+                           Optional[Dict[str, Any]]]:
+        '''Runs a tool's command through the launcher.
+
+        :param command: the tool's executable, followed by its arguments.
+
+        :returns: the completed process, and the resources used by the
+            launcher and the tool.
+        '''
+        return run_process(self._command + command,
+                           capture_output=capture_output, env=env, cwd=cwd)
+
+    def __str__(self) -> str:
+        return " ".join(self._command)
+
+
+class CacheDaemonLauncher(Launcher):
+    '''Sends each command to a local Fab cache daemon, which runs it, or
+    reuses the output of an identical earlier command. If the daemon isn't
+    running, the command is run directly.
+
+    :param socket_path: the daemon's socket. Defaults to the socket of a
+        daemon started with `fab cache-daemon`, in the Fab workspace.
+    '''
+
+    def __init__(self, socket_path: Optional[Path] = None):
+        super().__init__([])
+        self._socket_path = socket_path or default_socket_path()
+        self._warned = False
+
+    @property
+    def socket_path(self) -> Path:
+        ''':returns: the daemon's socket.'''
+        return self._socket_path
+
+    def execute(self, command: List[str], capture_output: bool,
+                env: Optional[Dict[str, str]],
+                cwd: Optional[Union[Path, str]]
+                ) -> Tuple[subprocess.CompletedProcess,
+                           Optional[Dict[str, Any]]]:
+        '''Runs a tool's command in the cache daemon.
+
+        :param command: the tool's executable, followed by its arguments.
+
+        :returns: the completed process, with the command's output, and no
+            resource usage, which the daemon doesn't report.
+        '''
+        try:
+            returncode, stdout, stderr = request_run(
+                self._socket_path, command,
+                cwd=str(Path(cwd or ".").resolve()),
+                env=dict(os.environ if env is None else env))
+        except (OSError, EOFError) as err:
+            if not self._warned:
+                logger.warning(f"Fab cache daemon not available at "
+                               f"'{self._socket_path}', running commands "
+                               f"directly: {err}")
+                self._warned = True
+            return super().execute(command, capture_output, env, cwd)
+
+        if not capture_output:
+            print(stdout.decode(), end="")
+            print(stderr.decode(), end="")
+            stdout = stderr = b""
+        return subprocess.CompletedProcess(command, returncode,
+                                           stdout, stderr), None
+
+    def __str__(self) -> str:
+        return f"fab cache daemon at {self._socket_path}"
@@ -10,7 +10,8 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple, Union
 import warnings
 
 from fab.build_config import BuildConfig
@@ -67,6 +68,28 @@ class Linker(CompilerSuiteTool):
         '''
         return self._compiler.check_available()
 
+    @property
+    def is_simulated(self) -> bool:
+        ''':returns: whether the wrapped compiler is simulated.'''
+        return self._compiler.is_simulated
+
+    @property
+    def supports_response_files(self) -> bool:
+        ''':returns: whether the wrapped compiler reads arguments from a
+            response file.'''
+        return self._compiler.supports_response_files
+
+    def _execute(self, command: List[str], capture_output: bool,
+                 env: Optional[Dict[str, str]],
+                 cwd: Optional[Union[Path, str]]
+                 ) -> Tuple[subprocess.CompletedProcess,
+                            Optional[Dict[str, Any]]]:
+        '''Links by running the compiler, so that a simulated compiler
+        also simulates linking.
+        '''
+        return self._compiler._execute(command, capture_output=capture_output,
+                                       env=env, cwd=cwd)
+
     @property
     def suite(self) -> str:
         '''
@@ -219,23 +242,17 @@ class Linker(CompilerSuiteTool):
             params.extend(self._post_lib_flags[config.profile])
         return params
 
-    def link(self, input_files: List[Path], output_file: Path,
-             config: "BuildConfig",
-             libs: Optional[List[str]] = None,
-             add_flags: Optional[List[str]] = None) -> str:
-        '''Executes the linker with the specified input files,
-        creating `output_file`.
-
-        :param input_files: list of input files to link.
-        :param output_file: output file.
-        :param config: The BuildConfig, from which compiler profile and OpenMP
-            status are taken.
-        :param libs: additional libraries to link with.
+    def get_all_commandline_options(
+            self, input_files: List[Path], output_file: Path,
+            config: "BuildConfig",
+            libs: Optional[List[str]] = None,
+            add_flags: Optional[List[str]] = None) -> List[str]:
+        '''Determines the arguments of the link command, i.e. everything
+        after the executable name. Parameters are as for `link`.
 
-        :returns: the stdout of the link command
+        :returns: the list of arguments.
         '''
-
-        params: List[Union[str, Path]] = []
+        params: List[str] = []
 
         params.extend(self._compiler.get_flags(config.profile))
 
@@ -253,5 +270,22 @@ class Linker(CompilerSuiteTool):
         if add_flags:
             params.extend(add_flags)
         params.extend([self.output_flag, str(output_file)])
+        return params
+
+    def link(self, input_files: List[Path], output_file: Path,
+             config: "BuildConfig",
+             libs: Optional[List[str]] = None,
+             add_flags: Optional[List[str]] = None) -> str:
+        '''Executes the linker with the specified input files,
+        creating `output_file`.
 
-        return self.run(params)
+        :param input_files: list of input files to link.
+        :param output_file: output file.
+        :param config: The BuildConfig, from which compiler profile and OpenMP
+            status are taken.
+        :param libs: additional libraries to link with.
+
+        :returns: the stdout of the link command
+        '''
+        return self.run(self.get_all_commandline_options(
+            input_files, output_file, config, libs=libs, add_flags=add_flags))
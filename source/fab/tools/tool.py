@@ -14,12 +14,38 @@ a tool is actually available.
 """
 
 import logging
+import os
 from pathlib import Path
+import re
 import subprocess
-from typing import Dict, List, Optional, Sequence, Union
+import tempfile
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
+from fab.metrics import record_tool_usage, run_process, trace
 from fab.tools.category import Category
 from fab.tools.flags import ProfileFlags
+from fab.tools.launcher import Launcher
+
+
+# Characters which must be escaped in a response file
+_RESPONSE_FILE_SPECIAL = re.compile(r"([\\\s\"'])")
+
+
+def write_response_file(arguments: List[str]) -> Path:
+    '''Writes arguments to a temporary response file, one per line, with
+    backslashes, quotes and white space escaped, as read by the GNU and
+    Intel tools.
+
+    :param arguments: the arguments to write.
+
+    :returns: the path of the response file, which the caller must remove.
+    '''
+    handle, name = tempfile.mkstemp(prefix="fab-", suffix=".rsp")
+    with os.fdopen(handle, "wt") as response_file:
+        for argument in arguments:
+            response_file.write(
+                _RESPONSE_FILE_SPECIAL.sub(r"\\\1", argument) + "\n")
+    return Path(name)
 
 
 class Tool:
@@ -34,6 +60,16 @@ class Tool:
         `--version`.
     '''
 
+    # Command lines longer than this, in characters, are passed in a
+    # response file if the tool supports them. Linux limits a single
+    # argument to 128k, and all arguments and the environment to 2M.
+    RESPONSE_FILE_THRESHOLD = 64 * 1024
+
+    # The most characters of a command line recorded in the build's trace
+    # timeline. Compile lines can run to several KB, and every tool run is
+    # traced.
+    TRACE_COMMAND_LENGTH = 200
+
     def __init__(self, name: str, exec_name: Union[str, Path],
                  category: Category = Category.MISC,
                  availability_option: Optional[Union[str, List[str]]] = None):
@@ -42,6 +78,7 @@ class Tool:
         self._exec_path = Path(exec_name)
         self._flags = ProfileFlags()
         self._category = category
+        self._launcher: Optional[Launcher] = None
         if availability_option:
             self._availability_option = availability_option
         else:
@@ -63,7 +100,7 @@ class Tool:
         :returns: whether the tool is working (True) or not.
         '''
         try:
-            self.run(self._availability_option)
+            self.run(self._availability_option, use_launcher=False)
         except (RuntimeError, FileNotFoundError):
             return False
         return True
@@ -91,6 +128,37 @@ class Tool:
             self._is_available = self.check_available()
         return self._is_available
 
+    @property
+    def is_simulated(self) -> bool:
+        '''Returns whether this tool only simulates running a real tool.'''
+        return False
+
+    @property
+    def supports_response_files(self) -> bool:
+        '''Returns whether this tool reads arguments from a response file,
+        given as `@file`.'''
+        return False
+
+    @property
+    def launcher(self) -> Optional[Launcher]:
+        ''':returns: the launcher which runs this tool, if any.'''
+        return self._launcher
+
+    def set_launcher(self,
+                     launcher: Optional[Union[str, Sequence[str], Launcher]]):
+        '''Runs this tool through a launcher, e.g. `ccache` or `nice`,
+        which is put in front of the tool's command. The launcher is not
+        part of the tool's identity, so it does not change the tool's hash,
+        and it is not used to check if the tool is available or to get its
+        version. Simulated tools ignore the launcher.
+
+        :param launcher: the launcher, or its command as a list of
+            arguments or a string. None removes any launcher.
+        '''
+        if launcher is not None and not isinstance(launcher, Launcher):
+            launcher = Launcher(launcher)
+        self._launcher = launcher
+
     @property
     def is_compiler(self) -> bool:
         '''Returns whether this tool is a (Fortran or C) compiler or not.'''
@@ -162,7 +230,8 @@ class Tool:
             profile: Optional[str] = None,
             env: Optional[Dict[str, str]] = None,
             cwd: Optional[Union[Path, str]] = None,
-            capture_output=True) -> str:
+            capture_output=True,
+            use_launcher: bool = True) -> str:
         """
         Run the binary as a subprocess.
 
@@ -176,6 +245,12 @@ class Tool:
         :param capture_output:
             If True, capture and return stdout. If False, the command will
             print its output directly to the console.
+        :param use_launcher:
+            If False, the tool's launcher is not used.
+
+        If the tool supports response files and the command is longer than
+        `RESPONSE_FILE_THRESHOLD`, the arguments are passed in a temporary
+        response file instead.
 
         :raises RuntimeError: if the code is not available.
         :raises RuntimeError: if the return code of the executable is not 0.
@@ -196,12 +271,37 @@ class Tool:
             raise RuntimeError(f"Tool '{self.name}' is not available to run "
                                f"'{command}'.")
         self._logger.debug(f'run_command: {" ".join(command)}')
+        run_command = command
+        response_file = None
+        if (self.supports_response_files and
+                sum(len(i) + 1 for i in command) > self.RESPONSE_FILE_THRESHOLD):
+            response_file = write_response_file(command[1:])
+            run_command = [command[0], f"@{response_file}"]
+            self._logger.debug(f'using response file {response_file}')
+        traced_command = " ".join(command)
+        if len(traced_command) > self.TRACE_COMMAND_LENGTH:
+            traced_command = (traced_command[:self.TRACE_COMMAND_LENGTH - 3]
+                              + '...')
         try:
-            res = subprocess.run(command, capture_output=capture_output,
-                                 env=env, cwd=cwd, check=False)
+            with trace(self.name, 'tool', command=traced_command):
+                if (use_launcher and self._launcher is not None and
+                        not self.is_simulated):
+                    self._logger.debug(f'using launcher {self._launcher}')
+                    res, usage = self._launcher.execute(
+                        run_command, capture_output=capture_output,
+                        env=env, cwd=cwd)
+                else:
+                    res, usage = self._execute(run_command,
+                                               capture_output=capture_output,
+                                               env=env, cwd=cwd)
         except FileNotFoundError as err:
             raise RuntimeError("Unable to execute command: "
                                + str(command)) from err
+        finally:
+            if response_file:
+                response_file.unlink()
+        if usage is not None:
+            record_tool_usage(self.name, usage)
         if res.returncode != 0:
             msg = (f'Command failed with return code {res.returncode}:\n'
                    f'{command}')
@@ -214,6 +314,22 @@ class Tool:
             return res.stdout.decode()
         return ""
 
+    def _execute(self, command: List[str], capture_output: bool,
+                 env: Optional[Dict[str, str]],
+                 cwd: Optional[Union[Path, str]]
+                 ) -> Tuple[subprocess.CompletedProcess,
+                            Optional[Dict[str, Any]]]:
+        '''Executes the command. Separated from `run` so that a simulated
+        tool can do its work without starting a process.
+
+        :param command: the executable followed by its arguments.
+
+        :returns: the completed process, and the resources it used, or None
+            if no process was run.
+        '''
+        return run_process(command, capture_output=capture_output,
+                           env=env, cwd=cwd)
+
 
 class CompilerSuiteTool(Tool):
     '''A tool that is part of a compiler suite (typically compiler
@@ -7,11 +7,13 @@
 '''This file contains the ToolBox class.
 '''
 
+import copy
 import warnings
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional, Sequence, Union
 
 from fab.tools.abstract_tool_box import AbstractToolBox
 from fab.tools.category import Category
+from fab.tools.launcher import Launcher
 from fab.tools.tool import Tool
 from fab.tools.tool_repository import ToolRepository
 
@@ -23,6 +25,7 @@ class ToolBox(AbstractToolBox):
 
     def __init__(self) -> None:
         self._all_tools: Dict[Category, Tool] = {}
+        self._launchers: Dict[Category, Optional[Launcher]] = {}
 
     def has(self, category: Category) -> bool:
         '''
@@ -48,7 +51,47 @@ class ToolBox(AbstractToolBox):
             warnings.warn(f"Replacing existing tool "
                           f"'{self._all_tools[tool.category]}' with "
                           f"'{tool}'.")
-        self._all_tools[tool.category] = tool
+        self._all_tools[tool.category] = self._apply_launcher(tool)
+
+    def set_launcher(self,
+                     launcher: Optional[Union[str, Sequence[str], Launcher]],
+                     categories: Optional[Iterable[Category]] = None) -> None:
+        '''Runs the tools of the given categories through a launcher, e.g.
+        `ccache`, `nice -n 10` or a
+        :class:`~fab.tools.launcher.CacheDaemonLauncher`. This applies to
+        the tools already in this tool box, and to any added or taken from
+        the ToolRepository later. The tool box keeps its own copy of each
+        launched tool, so the launcher doesn't affect the same tool in
+        other tool boxes. The launcher does not change the hash of a
+        compiler, so nothing is recompiled because of it.
+
+        :param launcher: the launcher, or its command as a list of
+            arguments or a string. None removes any launcher.
+        :param categories: the categories of tools to launch. Defaults to
+            the C and Fortran compilers.
+        '''
+        if launcher is not None and not isinstance(launcher, Launcher):
+            launcher = Launcher(launcher)
+        if categories is None:
+            categories = [Category.C_COMPILER, Category.FORTRAN_COMPILER]
+        for category in categories:
+            self._launchers[category] = launcher
+            if category in self._all_tools:
+                self._all_tools[category] = self._apply_launcher(
+                    self._all_tools[category])
+
+    def _apply_launcher(self, tool: Tool) -> Tool:
+        '''
+        :returns: the tool, or a copy of it which runs through this tool
+            box's launcher for its category, if there is one. The tool
+            itself is left alone, as it may be shared with other tool
+            boxes through the ToolRepository.
+        '''
+        if tool.category not in self._launchers:
+            return tool
+        launched = copy.copy(tool)
+        launched.set_launcher(self._launchers[tool.category])
+        return launched
 
     def get_tool(self, category: Category,
                  mpi: Optional[bool] = None,
@@ -85,5 +128,6 @@ class ToolBox(AbstractToolBox):
         tr = ToolRepository()
         tool = tr.get_default(category, mpi=mpi, openmp=openmp,
                               enforce_fortran_linker=enforce_fortran_linker)
+        tool = self._apply_launcher(tool)
         self._all_tools[category] = tool
         return tool
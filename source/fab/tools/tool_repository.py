@@ -13,7 +13,7 @@ from __future__ import annotations
 
 import logging
 from pathlib import Path
-from typing import cast, Optional, Union
+from typing import cast, List, Optional, Union
 
 from fab.tools.tool import Tool
 from fab.tools.category import Category
@@ -23,6 +23,8 @@ from fab.tools.compiler_wrapper import (CompilerWrapper, CrayCcWrapper,
 from fab.tools.linker import Linker
 from fab.tools.versioning import Fcm, Git, Subversion
 from fab.tools.ar import Ar
+from fab.tools.fake import (FAKE_SUITE, FakeAr, FakeCCompiler,
+                            FakeFortranCompiler, FakePreprocessor)
 from fab.tools.preprocessor import Cpp, CppFortran
 from fab.tools.compiler import (Craycc, Crayftn, Gcc, Gfortran, Icc, Icx,
                                 Ifort, Ifx, Nvc, Nvfortran)
@@ -39,6 +41,8 @@ class ToolRepository(dict):
     '''
 
     _singleton: None | ToolRepository = None
+    # The compiler suite set by set_default_compiler_suite
+    _default_suite: Optional[str] = None
 
     def __new__(cls) -> ToolRepository:
         '''Singleton access. Changes the value of _singleton so that the
@@ -106,6 +110,16 @@ class ToolRepository(dict):
                 craycc = CrayCcWrapper(cc)
                 self.add_tool(craycc)
 
+        # Add the simulated tools, for measuring Fab's own overheads. These
+        # are added last, so they don't get MPI or Cray wrappers, and they
+        # are never a default unless the fake suite is made the default.
+        for tool in [FakeFortranCompiler(), FakeCCompiler(),
+                     FakePreprocessor(),
+                     FakePreprocessor("fake-fpp",
+                                      Category.FORTRAN_PREPROCESSOR),
+                     FakeAr()]:
+            self.add_tool(tool)
+
     def add_tool(self, tool: Tool):
         '''Creates an instance of the specified class and adds it
         to the tool repository. If the tool is a compiler, it automatically
@@ -229,6 +243,20 @@ class ToolRepository(dict):
             if len(self[category]) > 0 and self[category][0].suite != suite:
                 raise RuntimeError(f"Cannot find '{category}' "
                                    f"in the suite '{suite}'.")
+        self._default_suite = suite
+
+    def _default_candidates(self, category: Category) -> List[Tool]:
+        '''Returns the tools in a category which can be a default, in order
+        of preference. Simulated tools are only used if the fake suite is
+        the default, in which case they are preferred.
+
+        :param category: the category of the tools.
+        '''
+        simulated = [tool for tool in self[category] if tool.is_simulated]
+        real = [tool for tool in self[category] if not tool.is_simulated]
+        if self._default_suite == FAKE_SUITE:
+            return simulated + real
+        return real
 
     def get_default(self, category: Category,
                     mpi: Optional[bool] = None,
@@ -262,7 +290,7 @@ class ToolRepository(dict):
         tool: Tool
         # If not a compiler or linker, return the first tool
         if not category.is_compiler and category != Category.LINKER:
-            for tool in self[category]:
+            for tool in self._default_candidates(category):
                 if tool.is_available:
                     return tool
             tool_names = ",".join(i.name for i in self[category])
@@ -282,7 +310,7 @@ class ToolRepository(dict):
             raise RuntimeError(f"Invalid or missing enforce_fortran_linker "
                                f"specification for '{category}'.")
 
-        for tool in self[category]:
+        for tool in self._default_candidates(category):
             tool = cast(Union[Compiler, Linker], tool)   # make mypy happy
             # If OpenMP is requested, but the tool does not support openmp,
             # ignore the tool.
@@ -9,15 +9,17 @@ Various utility functions live here - until we give them a proper place to live!
 """
 
 import datetime
+import json
 import logging
+import math
 import os
-import sys
 import zlib
 from argparse import ArgumentParser
 from collections import namedtuple, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from time import perf_counter
-from typing import Iterator, Iterable, Optional, Dict, Set, Union, List
+from time import perf_counter, time_ns
+from typing import Any, Callable, Iterator, Iterable, Optional, Dict, Set, Tuple, Union, List
 
 import fab
 
@@ -26,24 +28,22 @@ logger = logging.getLogger(__name__)
 
 def log_or_dot(logger, msg):
     """
-    Util function which prints a fullstop without a newline, except in debug logging where it logs a message.
+    Util function which logs a message about a single item in debug logging.
+
+    Fullstops are no longer printed for each item, as :func:`~fab.steps.run_mp`
+    reports the progress of its items.
 
     """
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug(msg)
-    elif logger.isEnabledFor(logging.INFO):
-        print('.', end='')
-        sys.stdout.flush()
 
 
 def log_or_dot_finish(logger):
     """
-    Util function which completes the row of fullstops from :func:`~fab.util.log_or_dot`,
-    by printing a newline when not in debug logging.
+    Util function which used to complete the row of fullstops from :func:`~fab.util.log_or_dot`.
+    It now does nothing, and is kept for existing build scripts.
 
     """
-    if logger.isEnabledFor(logging.INFO):
-        print('')
 
 
 HashedFile = namedtuple("HashedFile", ['fpath', 'file_hash'])
@@ -76,7 +76,13 @@ def string_checksum(s: str):
     return zlib.crc32(s.encode())
 
 
-def file_walk(path: Union[str, Path], ignore_folders: Optional[List[Path]] = None) -> Iterator[Path]:
+# How long after a folder is modified before we trust its mtime to show any further change.
+# Some file systems only record modification times to the nearest second or two.
+_MTIME_GRANULARITY_NS = 2_000_000_000
+
+
+def file_walk(path: Union[str, Path], ignore_folders: Optional[List[Path]] = None,
+              max_workers: int = 1, snapshot: Optional[Path] = None) -> Iterator[Path]:
     """
     Return every file in *path* and its sub-folders.
 
@@ -84,6 +90,12 @@ def file_walk(path: Union[str, Path], ignore_folders: Optional[List[Path]] = Non
         Folder to iterate.
     :param ignore_folders:
         Pass in any folder if you don't want to traverse into. Please see explanation and intended use, below.
+    :param max_workers:
+        The number of threads used to list folders. Listing many folders in parallel
+        helps on network file systems, where each one is a round trip.
+    :param snapshot:
+        Optional file in which to keep the folder listings between walks. Any folder whose modification
+        time hasn't changed since the last walk is not listed again.
 
     .. note::
 
@@ -93,21 +105,84 @@ def file_walk(path: Union[str, Path], ignore_folders: Optional[List[Path]] = Non
         searching for source code to analyse.
         To meet these needs, this function will not traverse into the given folders, if provided.
 
+    Files are returned in the same order as a depth-first walk of the folders, as listed by the file system.
+
     """
     path = Path(path)
     assert path.is_dir(), f"not dir: '{path}'"
     ignore_folders = ignore_folders or []
 
-    # Note: path here *can* be the prebuild folder
-    for i in path.iterdir():
-        if i.is_dir():
-            # Don't recurse into the given folders.
-            if i in ignore_folders:
-                logger.debug(f'file_walk ignoring {i}')
-                continue
-            yield from file_walk(path=i, ignore_folders=ignore_folders)
+    taken = time_ns()
+    previous_taken, previous = _load_walk_snapshot(snapshot) if snapshot else (0, {})
+    trusted_before = previous_taken - _MTIME_GRANULARITY_NS
+
+    def list_folder(folder: str) -> Tuple[int, List[str]]:
+        mtime = os.stat(folder).st_mtime_ns
+        cached = previous.get(folder)
+        if cached and cached[0] == mtime and mtime < trusted_before:
+            return cached
+        return mtime, _scan_folder(folder)
+
+    # List the folders a level at a time, so each level can be listed in parallel.
+    listings: Dict[str, Tuple[int, List[str]]] = {}
+    pending = [str(path)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending:
+            found = []
+            for folder, listing in zip(pending, executor.map(list_folder, pending)):
+                listings[folder] = listing
+                for name in listing[1]:
+                    if name.endswith('/'):
+                        sub_folder = os.path.join(folder, name[:-1])
+                        # Don't recurse into the given folders.
+                        # Note: path here *can* be the prebuild folder
+                        if Path(sub_folder) in ignore_folders:
+                            logger.debug(f'file_walk ignoring {sub_folder}')
+                            continue
+                        found.append(sub_folder)
+            pending = found
+
+    if snapshot:
+        _save_walk_snapshot(snapshot, taken, listings)
+
+    yield from _walk_listings(str(path), listings)
+
+
+def _scan_folder(folder: str) -> List[str]:
+    # The names in a folder, in directory order, with a trailing slash on sub-folders.
+    # DirEntry.is_dir() uses the file type from the directory listing, so only symlinks need a stat.
+    with os.scandir(folder) as entries:
+        return [entry.name + '/' if entry.is_dir() else entry.name for entry in entries]
+
+
+def _walk_listings(folder: str, listings: Dict[str, Tuple[int, List[str]]]) -> Iterator[Path]:
+    for name in listings[folder][1]:
+        if name.endswith('/'):
+            sub_folder = os.path.join(folder, name[:-1])
+            if sub_folder in listings:
+                yield from _walk_listings(sub_folder, listings)
         else:
-            yield i
+            yield Path(folder, name)
+
+
+def _load_walk_snapshot(snapshot: Path) -> Tuple[int, Dict[str, Tuple[int, List[str]]]]:
+    try:
+        with open(snapshot, 'rt') as snapshot_file:
+            loaded = json.load(snapshot_file)
+        return loaded['taken'], {folder: (mtime, names) for folder, (mtime, names) in loaded['folders'].items()}
+    except FileNotFoundError:
+        return 0, {}
+    except (ValueError, KeyError, TypeError) as err:
+        logger.warning(f"ignoring unreadable folder snapshot {snapshot}: {err}")
+        return 0, {}
+
+
+def _save_walk_snapshot(snapshot: Path, taken: int, listings: Dict[str, Tuple[int, List[str]]]):
+    # Write to a temporary file first, so an interrupted build can't leave a partial snapshot.
+    tmp_snapshot = snapshot.with_name(snapshot.name + '.tmp')
+    with open(tmp_snapshot, 'wt') as snapshot_file:
+        json.dump({'taken': taken, 'folders': listings}, snapshot_file)
+    os.replace(tmp_snapshot, snapshot)
 
 
 class Timer:
@@ -184,6 +259,45 @@ class CompiledFile:
         return f'CompiledFile({self.input_fpath}, {self.output_fpath})'
 
 
+def compile_batches(to_compile: Iterable[Tuple[Any, Path]], flags_for: Callable[[Path], List[str]],
+                    batch_size: int, workers: int = 1) -> List[List[Tuple[Any, Path]]]:
+    """
+    Group files to compile into batches, each of which can be compiled with one invocation of the compiler.
+
+    The files in a batch have the same flags and different names, because the compiler names each object file
+    after its source file. Batches are made smaller when there are too few to keep every worker busy.
+
+    :param to_compile:
+        The analysed file to compile and its prebuild object file, for each file.
+    :param flags_for:
+        Gives the compiler flags for a source file.
+    :param batch_size:
+        The most files in a batch.
+    :param workers:
+        How many batches can be compiled at once.
+
+    """
+    to_compile = sorted(to_compile, key=lambda item: item[0].fpath)
+    batch_size = max(1, min(batch_size, math.ceil(len(to_compile) / workers)))
+
+    batches: List[List[Tuple[Any, Path]]] = []
+    # the batches which have room for more files, and the names in them, by flags
+    open_batches: Dict[Tuple[str, ...], List[Tuple[List, Set[str]]]] = defaultdict(list)
+    for item in to_compile:
+        stem = item[0].fpath.stem
+        candidates = open_batches[tuple(flags_for(item[0].fpath))]
+        batch, stems = next(((b, s) for b, s in candidates if stem not in s), ([], set()))
+        if not batch:
+            candidates.append((batch, stems))
+            batches.append(batch)
+        batch.append(item)
+        stems.add(stem)
+        if len(batch) >= batch_size:
+            candidates[:] = [c for c in candidates if c[0] is not batch]
+
+    return batches
+
+
 # todo: we should probably pass in the output folder, not the project workspace
 def input_to_output_fpath(config, input_path: Path):
     """
@@ -305,4 +419,6 @@ def common_arg_parser() -> ArgumentParser:
     group.add_argument('--multiprocessing', default=True, help='Turns OFF multiprocessing.')
     group.add_argument('--two-stage', action='store_true',
                        help='Compile .mod files first in a separate pass. Theoretically faster in some projects.')
+    group.add_argument('--profile-python', action='store_true',
+                       help="Profile Fab's own Python code, writing the results to the metrics folder.")
     return arg_parser
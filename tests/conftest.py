@@ -7,10 +7,12 @@
 Fixtures and helpers for testing.
 """
 import os
+import resource
 from pathlib import Path
 from typing import Dict, List, Optional
 
-from pytest import fixture
+from pytest import fixture, MonkeyPatch
+from pytest_subprocess.fake_popen import FakePopen
 from pytest_subprocess.fake_process import FakeProcess, ProcessRecorder
 
 from fab.build_config import BuildConfig
@@ -100,6 +102,32 @@ class ExtendedRecorder:
         return args
 
 
+@fixture(scope='function')
+def fake_process(fake_process: FakeProcess,
+                 monkeypatch: MonkeyPatch) -> FakeProcess:
+    """
+    Mocks the 'subprocess' module, and reaping processes with `os.wait4`.
+
+    Fab reaps tool processes with `os.wait4` to measure their resource
+    usage. The fake processes are reaped with no usage.
+    """
+    started: Dict[int, FakePopen] = {}
+    configure = FakePopen.configure
+
+    def record(self, **kwargs):
+        configure(self, **kwargs)
+        started[self.pid] = self
+
+    def wait4(pid: int, options: int):
+        returncode = started.pop(pid).wait()
+        status = returncode << 8 if returncode >= 0 else -returncode
+        return pid, status, resource.struct_rusage((0,) * 16)
+
+    monkeypatch.setattr(FakePopen, 'configure', record)
+    monkeypatch.setattr('fab.metrics.os.wait4', wait4)
+    return fake_process
+
+
 @fixture(scope='function')
 def subproc_record(fake_process: FakeProcess) -> ExtendedRecorder:
     """
@@ -0,0 +1,32 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Report the benchmark results at the end of the test session.
+"""
+import json
+import os
+from pathlib import Path
+
+
+def pytest_terminal_summary(terminalreporter):
+    from .test_scaling import results
+
+    if not any(results.values()):
+        return
+
+    terminalreporter.section('fab scaling benchmarks')
+    terminalreporter.write_line(f'{"stage":24} {"files":>8} {"seconds":>10} {"us/file":>10} '
+                                f'{"peak MB":>9} {"worker MB":>10}')
+    for stage, by_size in results.items():
+        for size, result in sorted(by_size.items()):
+            terminalreporter.write_line(
+                f'{stage:24} {size:>8} {result["seconds"]:>10.3f} {1e6 * result["seconds"] / size:>10.1f} '
+                f'{result["peak_rss_kb"] / 1024:>9.1f} {result["worker_peak_rss_kb"] / 1024:>10.1f}')
+
+    output = os.getenv('FAB_BENCHMARK_OUTPUT')
+    if output:
+        Path(output).write_text(json.dumps(results, indent=2))
+        terminalreporter.write_line(f'results written to {output}')
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Generate a synthetic project, for measuring how Fab scales with project size.
+
+The project has a Fortran program, `main`, which uses layers of Fortran modules.
+Each module uses modules from the layer below it, so the depth of the module
+dependency tree, and the number of compile passes, is the number of layers.
+Files are spread over nested folders, one folder tree per layer.
+
+Some modules also call:
+
+* an external Fortran subroutine, through a deprecated `DEPENDS ON:` comment
+* a C function, through a `bind(c)` interface, or a `DEPENDS ON: <file>.o` comment
+
+There are also x90 PSyKAl algorithm files, which use the modules but which nothing uses.
+
+The same spec and seed always generate the same project.
+
+"""
+import argparse
+import math
+import random
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+@dataclass
+class ProjectSpec:
+    """
+    The shape of a generated project.
+
+    """
+    #: The total number of source files.
+    num_files: int = 1000
+    #: The number of layers of modules, and so the depth of the dependency tree.
+    depth: int = 10
+    #: How many modules in the layer below each module uses.
+    fan_out: int = 3
+    #: The mean number of subroutines in each module.
+    subroutines: int = 4
+    #: The spread of the log-normal distribution of module sizes. Zero makes every module the same size.
+    size_sigma: float = 0.5
+    #: The fraction of the files which are C.
+    c_fraction: float = 0.05
+    #: The fraction of the files which are x90 algorithm files.
+    x90_fraction: float = 0.0
+    #: The fraction of the files which are external Fortran subroutines, called via `DEPENDS ON:` comments.
+    depends_on_fraction: float = 0.05
+    #: The most source files in one folder.
+    files_per_dir: int = 100
+    seed: int = 0
+
+
+@dataclass
+class GeneratedProject:
+    """
+    The files in a generated project, by kind.
+
+    """
+    root: Path
+    root_symbol: str = 'main'
+    files: Dict[str, List[Path]] = field(default_factory=dict)
+
+    @property
+    def num_files(self) -> int:
+        return sum(map(len, self.files.values()))
+
+
+@dataclass
+class _Module:
+    index: int
+    layer: int
+    num_subroutines: int
+    uses: List[int] = field(default_factory=list)
+    externals: List[int] = field(default_factory=list)
+    c_funcs: List[int] = field(default_factory=list)
+    c_depends_on: List[int] = field(default_factory=list)
+
+
+def _entry(module: int) -> str:
+    return f'mod_{module}_sub_1'
+
+
+def _fortran_module(module: _Module) -> str:
+    lines = [f'module mod_{module.index}']
+    lines += [f'  use mod_{dep}, only: {_entry(dep)}' for dep in module.uses]
+    lines.append('  implicit none')
+    if module.c_funcs:
+        lines.append('  interface')
+        for c in module.c_funcs:
+            lines += [f'    subroutine c_func_{c}() bind(c, name="c_func_{c}")',
+                      f'    end subroutine c_func_{c}']
+        lines.append('  end interface')
+    lines.append('contains')
+
+    # the first subroutine calls into everything this module depends on, the rest just do some sums
+    for sub in range(1, module.num_subroutines + 1):
+        name = f'mod_{module.index}_sub_{sub}'
+        lines += [f'  subroutine {name}()',
+                  '    implicit none',
+                  '    integer :: i',
+                  '    real :: total',
+                  '    total = 0.0',
+                  f'    do i = 1, {sub * 10}',
+                  '      total = total + sqrt(real(i))',
+                  '    end do']
+        if sub == 1:
+            lines += [f'    call {_entry(dep)}()' for dep in module.uses]
+            for ext in module.externals:
+                lines += [f'    ! DEPENDS ON: ext_{ext}', f'    call ext_{ext}()']
+            lines += [f'    call c_func_{c}()' for c in module.c_funcs]
+            for c in module.c_depends_on:
+                lines += [f'    ! DEPENDS ON: c_{c}.o', f'    call c_func_{c}()']
+        lines.append(f'  end subroutine {name}')
+
+    lines.append(f'end module mod_{module.index}')
+    return '\n'.join(lines) + '\n'
+
+
+def _external(index: int) -> str:
+    return (f'subroutine ext_{index}()\n'
+            '  implicit none\n'
+            f'  print *, "external {index}"\n'
+            f'end subroutine ext_{index}\n')
+
+
+def _c_file(index: int) -> str:
+    # the trailing underscore is for calls without an interface, from a DEPENDS ON comment
+    return ('#include <stdio.h>\n'
+            '\n'
+            f'void c_func_{index}(void) {{ printf("c {index}\\n"); }}\n'
+            '\n'
+            f'void c_func_{index}_(void) {{ c_func_{index}(); }}\n')
+
+
+def _x90_file(index: int, uses: List[int]) -> str:
+    lines = [f'module alg_{index}_mod']
+    lines += [f'  use mod_{dep}, only: {_entry(dep)}' for dep in uses]
+    lines += ['  implicit none',
+              'contains',
+              f'  subroutine alg_{index}()',
+              '    implicit none',
+              '    real :: field',
+              f'    call invoke(name="alg_{index}_invoke", setval_c(field, 0.0))']
+    lines += [f'    call {_entry(dep)}()' for dep in uses]
+    lines += [f'  end subroutine alg_{index}',
+              f'end module alg_{index}_mod']
+    return '\n'.join(lines) + '\n'
+
+
+def _program(uses: List[int]) -> str:
+    lines = ['program main']
+    lines += [f'  use mod_{dep}, only: {_entry(dep)}' for dep in uses]
+    lines.append('  implicit none')
+    lines += [f'  call {_entry(dep)}()' for dep in uses]
+    lines.append('end program main')
+    return '\n'.join(lines) + '\n'
+
+
+def _split(total: int, parts: int) -> List[int]:
+    # split a total into near-equal parts
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def generate_project(spec: ProjectSpec, root: Path) -> GeneratedProject:
+    """
+    Write a synthetic project into the given folder.
+
+    :param spec:
+        The shape of the project.
+    :param root:
+        The folder to create the source in.
+
+    """
+    rng = random.Random(spec.seed)
+
+    num_c = int(spec.num_files * spec.c_fraction)
+    num_x90 = int(spec.num_files * spec.x90_fraction)
+    num_externals = int(spec.num_files * spec.depends_on_fraction)
+    num_modules = spec.num_files - num_c - num_x90 - num_externals - 1
+    depth = min(spec.depth, num_modules)
+    if depth < 1:
+        raise ValueError(f'{spec.num_files} files is too few for this project spec')
+
+    # module sizes are log-normally distributed around the mean
+    mu = math.log(spec.subroutines) - spec.size_sigma ** 2 / 2
+
+    def num_subroutines() -> int:
+        return max(1, round(rng.lognormvariate(mu, spec.size_sigma)))
+
+    # layers of modules, each using modules in the layer below
+    layers: List[List[_Module]] = []
+    index = 0
+    for layer, layer_size in enumerate(_split(num_modules, depth)):
+        layers.append([_Module(index + i, layer, num_subroutines()) for i in range(layer_size)])
+        index += layer_size
+
+    for upper, lower in zip(layers, layers[1:]):
+        # make sure every module is used, then add random uses up to the fan-out
+        for i, module in enumerate(lower):
+            upper[i % len(upper)].uses.append(module.index)
+        for module in upper:
+            sample = rng.sample(lower, min(spec.fan_out, len(lower)))
+            extra = [m.index for m in sample if m.index not in module.uses]
+            module.uses += extra[:max(0, spec.fan_out - len(module.uses))]
+            module.uses.sort()
+
+    # external subroutines and c functions are called from random modules
+    all_modules = [module for layer in layers for module in layer]
+    for ext in range(num_externals):
+        rng.choice(all_modules).externals.append(ext)
+    for c in range(num_c):
+        module = rng.choice(all_modules)
+        (module.c_depends_on if rng.random() < 0.5 else module.c_funcs).append(c)
+
+    project = GeneratedProject(root=root, files={'program': [], 'module': [], 'external': [], 'c': [], 'x90': []})
+
+    def write(kind: str, folder: str, position: int, name: str, text: str):
+        fpath = root / folder / f'dir_{position // spec.files_per_dir:04}' / name
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        fpath.write_text(text)
+        project.files[kind].append(fpath)
+
+    write('program', 'program', 0, 'main.f90', _program([m.index for m in layers[0]]))
+    for modules in layers:
+        for position, module in enumerate(modules):
+            write('module', f'layer_{module.layer:03}', position, f'mod_{module.index}.f90', _fortran_module(module))
+    for ext in range(num_externals):
+        write('external', 'external', ext, f'ext_{ext}.f90', _external(ext))
+    for c in range(num_c):
+        write('c', 'c', c, f'c_{c}.c', _c_file(c))
+    for x90 in range(num_x90):
+        uses = sorted(rng.sample([m.index for m in all_modules], min(spec.fan_out, len(all_modules))))
+        write('x90', 'algorithm', x90, f'alg_{x90}.x90', _x90_file(x90, uses))
+
+    return project
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output', type=Path, help='folder to create the project in')
+    for spec_field in fields(ProjectSpec):
+        parser.add_argument(f'--{spec_field.name.replace("_", "-")}', type=type(spec_field.default),
+                            default=spec_field.default, help='(default: %(default)s)')
+    args = vars(parser.parse_args(argv))
+
+    output = args.pop('output')
+    project = generate_project(ProjectSpec(**args), output)
+    print(f'generated {project.num_files} files in {output}: '
+          + ', '.join(f'{len(files)} {kind}' for kind, files in project.files.items()))
+
+
+if __name__ == '__main__':
+    main()
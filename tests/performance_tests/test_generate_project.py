@@ -0,0 +1,51 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Test the synthetic project generator.
+"""
+import re
+
+import pytest
+
+from .generate_project import generate_project, ProjectSpec
+
+
+class TestGenerateProject:
+
+    def test_shape(self, tmp_path):
+        spec = ProjectSpec(num_files=200, depth=4, fan_out=2, c_fraction=0.1, x90_fraction=0.05,
+                           depends_on_fraction=0.1, files_per_dir=20)
+        project = generate_project(spec, tmp_path)
+
+        assert project.num_files == 200
+        assert {kind: len(files) for kind, files in project.files.items()} == {
+            'program': 1, 'module': 149, 'external': 20, 'c': 20, 'x90': 10}
+        assert len(list(tmp_path.rglob('*.*'))) == 200
+        assert max(len(list(folder.iterdir())) for folder in tmp_path.glob('*/dir_*')) <= 20
+
+        # modules only use modules in the next layer down, at least the fan-out unless there's too few
+        layers = {int(fpath.parent.parent.name.split('_')[1]) for fpath in project.files['module']}
+        assert layers == {0, 1, 2, 3}
+        for fpath in project.files['module']:
+            uses = re.findall(r'use mod_(\d+)', fpath.read_text())
+            if fpath.parent.parent.name == 'layer_003':
+                assert not uses
+            else:
+                assert len(uses) >= spec.fan_out
+
+        text = ''.join(fpath.read_text() for fpath in project.files['module'])
+        assert text.count('! DEPENDS ON: ext_') == 20
+        assert text.count('! DEPENDS ON: c_') + text.count('bind(c') == 20
+
+    def test_repeatable(self, tmp_path):
+        first = generate_project(ProjectSpec(num_files=50), tmp_path / 'first')
+        second = generate_project(ProjectSpec(num_files=50), tmp_path / 'second')
+        for a, b in zip(first.files['module'], second.files['module']):
+            assert a.read_text() == b.read_text()
+
+    def test_too_small(self, tmp_path):
+        with pytest.raises(ValueError):
+            generate_project(ProjectSpec(num_files=1), tmp_path)
@@ -0,0 +1,170 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Measure how the time and peak memory of Fab's core mechanics scale with project size.
+
+Each size of generated project is run through finding the source, analysis, dependency
+resolution, compile scheduling, compiling and linking, and prebuild cleanup. The compiler
+and linker are simulated, so we measure Fab's own overheads. Set `FAB_BENCHMARK_LATENCY`
+to give the simulated compiler a mean latency per file, in seconds.
+
+The default is a quick smoke test. To run the benchmarks::
+
+    FAB_BENCHMARK_SIZES=1000,10000,50000 python -m pytest tests/performance_tests
+
+Set `FAB_BENCHMARK_OUTPUT` to a file path to save the results as json.
+When more than one size is run, each stage's time per file at the largest size must be
+within :data:`SCALING_LIMIT` of its time per file at the smallest size.
+
+"""
+import os
+import resource
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+from fab.artefacts import ArtefactSet, SuffixFilter
+from fab.build_config import BuildConfig
+from fab.dep_tree import validate_dependencies
+from fab.mo import add_mo_commented_file_deps
+from fab.parse.fortran import AnalysedFortran
+from fab.steps.analyse import _analyse_dependencies, _extract_build_trees, analyse
+from fab.steps.cleanup_prebuilds import CLEANUP_COUNT, cleanup_prebuilds
+from fab.steps.compile_fortran import compile_fortran, get_compile_next
+from fab.steps.find_source_files import find_source_files
+from fab.steps.link import link_exe
+from fab.tools.fake import FakeFortranCompiler, FakeLatency
+from fab.tools.linker import Linker
+from fab.tools.tool_box import ToolBox
+from fab.util import by_type, CompiledFile
+
+from .generate_project import generate_project, ProjectSpec
+
+SIZES = [int(size) for size in os.getenv('FAB_BENCHMARK_SIZES', '100').split(',')]
+
+LATENCY = float(os.getenv('FAB_BENCHMARK_LATENCY', '0'))
+
+STAGES = ['find source files', 'analyse', 'dependency resolution', 'compile scheduling', 'compile and link',
+          'cleanup prebuilds']
+
+# the most a stage's time per file can grow from the smallest project to the largest
+SCALING_LIMIT = 3.0
+
+# results[stage][size] = {'seconds': ..., 'peak_rss_kb': ..., 'worker_peak_rss_kb': ...}
+results: Dict[str, Dict[int, Dict[str, float]]] = {stage: {} for stage in STAGES}
+
+
+def _peak_rss_kb() -> int:
+    # the high water mark since we last reset it, or since we started if we can't
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peak_rss():
+    try:
+        Path('/proc/self/clear_refs').write_text('5')
+    except OSError:
+        pass
+
+
+@contextmanager
+def measure(stage: str, size: int):
+    """
+    Record the wall time and peak memory of a stage.
+
+    Worker memory is the largest of any pool worker which has exited so far, not just in this stage.
+
+    """
+    _reset_peak_rss()
+    start = time.perf_counter()
+    yield
+    results[stage][size] = {
+        'seconds': time.perf_counter() - start,
+        'peak_rss_kb': _peak_rss_kb(),
+        'worker_peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_pipeline(size, tmp_path_factory, stub_tool_repository):
+    project = generate_project(ProjectSpec(num_files=size), tmp_path_factory.mktemp(f'project_{size}'))
+
+    tool_box = ToolBox()
+    compiler = FakeFortranCompiler(latency=FakeLatency(LATENCY, sigma=0.5))
+    tool_box.add_tool(compiler)
+    tool_box.add_tool(Linker(compiler))
+
+    with BuildConfig(f'scaling {size}', tool_box, fab_workspace=tmp_path_factory.mktemp('fab')) as config:
+
+        with measure('find source files', size):
+            find_source_files(config, source_root=project.root)
+        assert len(config.artefact_store[ArtefactSet.INITIAL_SOURCE_FILES]) == project.num_files
+
+        with measure('analyse', size):
+            analyse(config, source=SuffixFilter(ArtefactSet.INITIAL_SOURCE_FILES, ['.f90', '.c']),
+                    root_symbol=project.root_symbol)
+        build_tree = config.artefact_store[ArtefactSet.BUILD_TREES][project.root_symbol]
+        analysed_fortran = set(by_type(build_tree.values(), AnalysedFortran))
+        assert len(analysed_fortran) == len(project.files['program'] + project.files['module']
+                                            + project.files['external'])
+
+        with measure('dependency resolution', size):
+            source_tree, symbol_table = _analyse_dependencies(build_tree.values())
+            add_mo_commented_file_deps(source_tree)
+            build_trees = _extract_build_trees([project.root_symbol], source_tree, symbol_table)
+            validate_dependencies(build_trees[project.root_symbol])
+        assert build_trees[project.root_symbol].keys() == build_tree.keys()
+
+        with measure('compile scheduling', size):
+            compiled = {}
+            uncompiled = analysed_fortran
+            passes = 0
+            while uncompiled:
+                compile_next = get_compile_next(compiled, uncompiled)
+                compiled.update({af.fpath: CompiledFile(af.fpath, af.fpath.with_suffix('.o'))
+                                 for af in compile_next})
+                uncompiled = set(filter(lambda af: af.fpath not in compiled, uncompiled))
+                passes += 1
+        # the layers of modules and the program, maybe an extra pass for the external subroutines
+        assert passes > ProjectSpec().depth
+
+        with measure('compile and link', size):
+            compile_fortran(config)
+            link_exe(config)
+        assert len(config.artefact_store[ArtefactSet.OBJECT_FILES][project.root_symbol]) == len(analysed_fortran)
+        assert len(config.artefact_store[ArtefactSet.EXECUTABLES]) == 1
+
+        # two older versions of every analysis result
+        current = list(config.prebuild_folder.glob('*.an'))
+        for fpath in current:
+            stem, _, suffix = fpath.name.split('.')
+            for old in range(2):
+                (fpath.parent / f'{stem}.old{old}.{suffix}').touch()
+        with measure('cleanup prebuilds', size):
+            cleanup_prebuilds(config, n_versions=1)
+        assert config.artefact_store[CLEANUP_COUNT] == len(current)
+
+
+@pytest.mark.parametrize('stage', STAGES)
+def test_scaling(stage):
+    sizes = sorted(results[stage])
+    if len(sizes) < 2:
+        pytest.skip('need more than one project size to check the scaling')
+
+    smallest, largest = sizes[0], sizes[-1]
+    per_file = {size: results[stage][size]['seconds'] / size for size in (smallest, largest)}
+    assert per_file[largest] <= SCALING_LIMIT * per_file[smallest], \
+        f"{stage} took {per_file[largest] / per_file[smallest]:.1f} times longer per file " \
+        f"at {largest} files than at {smallest}"
@@ -0,0 +1,11 @@
+! (c) Crown copyright Met Office. All rights reserved.
+! For further details please refer to the file COPYRIGHT
+! which you should have received as part of this distribution
+!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+! A descendant of the greeting implementation, which needs its smod file.
+!
+submodule (greeting_mod:greeting_impl) greeting_extra
+
+  implicit none
+
+end submodule greeting_extra
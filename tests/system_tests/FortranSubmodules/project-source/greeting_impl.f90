@@ -0,0 +1,17 @@
+! (c) Crown copyright Met Office. All rights reserved.
+! For further details please refer to the file COPYRIGHT
+! which you should have received as part of this distribution
+!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+! The implementation of the greeting.
+!
+submodule (greeting_mod) greeting_impl
+
+  implicit none
+
+contains
+
+  module subroutine greet()
+    write(*, '(A)') 'Hello'
+  end subroutine greet
+
+end submodule greeting_impl
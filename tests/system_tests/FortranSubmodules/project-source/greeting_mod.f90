@@ -0,0 +1,16 @@
+! (c) Crown copyright Met Office. All rights reserved.
+! For further details please refer to the file COPYRIGHT
+! which you should have received as part of this distribution
+!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+! The interface to a greeting, implemented in a submodule.
+!
+module greeting_mod
+
+  implicit none
+
+  interface
+    module subroutine greet()
+    end subroutine greet
+  end interface
+
+end module greeting_mod
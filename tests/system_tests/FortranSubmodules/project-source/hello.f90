@@ -0,0 +1,15 @@
+! (c) Crown copyright Met Office. All rights reserved.
+! For further details please refer to the file COPYRIGHT
+! which you should have received as part of this distribution
+!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+! Uses the greeting module, knowing nothing of its submodules.
+!
+program hello
+
+  use greeting_mod, only: greet
+
+  implicit none
+
+  call greet()
+
+end program hello
@@ -0,0 +1,58 @@
+# ##############################################################################
+#  (c) Crown copyright Met Office. All rights reserved.
+#  For further details please refer to the file COPYRIGHT
+#  which you should have received as part of this distribution
+# ##############################################################################
+import subprocess
+from pathlib import Path
+from unittest import mock
+
+from fab.artefacts import ArtefactSet
+from fab.build_config import BuildConfig
+from fab.steps.analyse import analyse
+from fab.steps.compile_fortran import compile_file, compile_fortran
+from fab.steps.find_source_files import find_source_files
+from fab.steps.grab.folder import grab_folder
+from fab.steps.link import link_exe
+from fab.steps.preprocess import preprocess_fortran
+from fab.tools.tool_box import ToolBox
+
+PROJECT_SOURCE = Path(__file__).parent / 'project-source'
+
+
+def build(tmp_path):
+    with BuildConfig(fab_workspace=tmp_path, tool_box=ToolBox(),
+                     project_label='foo', multiprocessing=False) as config:
+        find_source_files(config)
+        preprocess_fortran(config)
+        analyse(config, root_symbol='hello')
+        with mock.patch('fab.steps.compile_fortran.compile_file', wraps=compile_file) as mock_compile:
+            compile_fortran(config)
+        link_exe(config, flags=['-lgfortran'])
+
+    compiled = {call.args[0].name for call in mock_compile.mock_calls}
+
+    exe = list(config.artefact_store[ArtefactSet.EXECUTABLES])[0]
+    output = subprocess.run([str(exe)], capture_output=True).stdout.decode().strip()
+    return output, compiled
+
+
+def test_fortran_submodules(tmp_path):
+    with BuildConfig(fab_workspace=tmp_path, tool_box=ToolBox(),
+                     project_label='foo', multiprocessing=False) as config:
+        grab_folder(config, PROJECT_SOURCE)
+
+    # nothing uses the submodules, but they're needed to link
+    output, compiled = build(tmp_path)
+    assert output == 'Hello'
+    assert compiled == {'greeting_mod.f90', 'greeting_impl.f90', 'greeting_extra.f90', 'hello.f90'}
+
+    # change the implementation, but not the interface
+    impl = config.source_root / 'greeting_impl.f90'
+    impl.write_text(impl.read_text().replace("'Hello'", "'Goodbye'"))
+
+    # the program which uses the module isn't recompiled
+    output, compiled = build(tmp_path)
+    assert output == 'Goodbye'
+    assert 'greeting_impl.f90' in compiled
+    assert not compiled & {'greeting_mod.f90', 'hello.f90'}
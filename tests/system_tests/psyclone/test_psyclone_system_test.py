@@ -12,6 +12,7 @@ from unittest import mock
 
 from pytest import fixture, mark, warns
 
+from fab.artefacts import ArtefactSet
 from fab.build_config import BuildConfig
 from fab.parse.x90 import X90Analyser, AnalysedX90
 from fab.steps.cleanup_prebuilds import cleanup_prebuilds
@@ -85,12 +86,25 @@ class TestX90Analyser:
         analysed_x90 = self.run(tmp_path)
         assert analysed_x90 == self.expected_analysis_result
 
+    def test_x90(self, tmp_path):
+        # the x90 itself is sanitised in memory, without writing a parsable file next to it
+        with BuildConfig('proj', ToolBox(), fab_workspace=tmp_path) as config:
+            analysed_x90, _ = X90Analyser(config=config).run(SAMPLE_X90)  # type: ignore
+
+        assert analysed_x90 == AnalysedX90(
+            fpath=SAMPLE_X90,
+            file_hash=file_checksum(SAMPLE_X90).file_hash,
+            kernel_deps={'kernel_one_type', 'kernel_two_type'})
+        assert not SAMPLE_X90.with_suffix('.parsable_x90').exists()
+
     def test_prebuild(self, tmp_path):
         self.run(tmp_path)
 
         # Run it a second time, ensure it's not re-processed and still gives the correct result
-        with mock.patch('fab.parse.x90.X90Analyser.walk_nodes') as mock_walk:
+        with mock.patch('fab.parse.x90.sanitise_x90') as mock_sanitise, \
+                mock.patch('fab.parse.x90.X90Analyser.walk_nodes') as mock_walk:
             analysed_x90 = self.run(tmp_path)
+        mock_sanitise.assert_not_called()
         mock_walk.assert_not_called()
         assert analysed_x90 == self.expected_analysis_result
 
@@ -106,7 +120,7 @@ class Test_analysis_for_x90s_and_kernels:
         # analysed_x90
         assert analysed_x90 == {
             SAMPLE_X90: AnalysedX90(
-                fpath=SAMPLE_X90.with_suffix('.parsable_x90'),
+                fpath=SAMPLE_X90,
                 file_hash=file_checksum(SAMPLE_X90).file_hash,
                 kernel_deps={'kernel_one_type', 'kernel_two_type'})}
 
@@ -118,6 +132,23 @@ class Test_analysis_for_x90s_and_kernels:
             'kernel_four_type': 1427207736,
         }
 
+    def test_kernel_index(self, tmp_path):
+        with BuildConfig('proj', fab_workspace=tmp_path,
+                         tool_box=ToolBox()) as config:
+            all_kernel_hashes = _analyse_kernels(config, kernel_roots=[Path(__file__).parent])
+
+            analysis_prebuilds = set(config.prebuild_folder.glob('*.an'))
+            assert analysis_prebuilds
+            config.artefact_store[ArtefactSet.CURRENT_PREBUILDS].clear()
+
+            # Unchanged kernel files are found in the index, without being analysed again.
+            with mock.patch('fab.parse.fortran.FortranAnalyser.run') as mock_run:
+                assert _analyse_kernels(config, kernel_roots=[Path(__file__).parent]) == all_kernel_hashes
+            mock_run.assert_not_called()
+
+            # their analysis prebuilds are still current, so the cleanup keeps them
+            assert analysis_prebuilds <= config.artefact_store[ArtefactSet.CURRENT_PREBUILDS]
+
 
 @mark.skipif(not Psyclone().is_available, reason="psyclone cli tool not available")
 class TestPsyclone:
@@ -7,21 +7,24 @@ from typing import List, Tuple
 from unittest import mock
 from unittest.mock import Mock
 
-from pytest import importorskip
+from pytest import importorskip, mark
 
+from fab.artefacts import ArtefactSet
 from fab.build_config import BuildConfig
-from fab.parse.c import CAnalyser, AnalysedC
+from fab.parse.c import CAnalyser, AnalysedC, IncludeRegions
 from fab.tools.tool_box import ToolBox
 from fab.tools.tool_repository import ToolRepository
 
 clang = importorskip('clang')
 
 
+@mark.parametrize('pragmas_from_source', [False, True])
 def test_simple_result(tmp_path: Path,
-                       stub_tool_repository: ToolRepository) -> None:
+                       stub_tool_repository: ToolRepository,
+                       pragmas_from_source: bool) -> None:
     config = BuildConfig('proj', ToolBox(), mpi=False, openmp=False,
                          fab_workspace=tmp_path)
-    c_analyser = CAnalyser(config)
+    c_analyser = CAnalyser(config, pragmas_from_source=pragmas_from_source)
 
     with mock.patch('fab.parse.AnalysedFile.save'):
         fpath = Path(__file__).parent / "test_c_analyser.c"
@@ -38,6 +41,41 @@ def test_simple_result(tmp_path: Path,
     assert artefact == c_analyser._config.prebuild_folder / f'test_c_analyser.{analysis.file_hash}.an'
 
 
+def test_precompiled_headers(tmp_path: Path,
+                             stub_tool_repository: ToolRepository) -> None:
+    """
+    Tests files which start with the same system headers are parsed with a
+    precompiled header, with the same results.
+    """
+    config = BuildConfig('proj', ToolBox(), mpi=False, openmp=False,
+                         fab_workspace=tmp_path)
+    config.prebuild_folder.mkdir(parents=True)
+    fpaths = []
+    for name in ['a', 'b']:
+        fpath = tmp_path / f'{name}.c'
+        fpath.write_text(f'#include <stdlib.h>\nint {name}(void) {{ return abs(-1); }}\n')
+        fpaths.append(fpath)
+
+    def analyse(c_analyser):
+        c_analyser.precompile_headers(fpaths, min_files=2)
+        with mock.patch('fab.parse.AnalysedFile.save'):
+            return [c_analyser.run(fpath)[0] for fpath in fpaths], c_analyser._pch
+
+    plain, no_pch = analyse(CAnalyser(config))
+    assert no_pch == {}
+    analyses, pch = analyse(CAnalyser(config, precompiled_headers=True))
+    assert analyses == plain
+    [pch_fpath] = set(pch.values())
+    assert set(pch) == set(fpaths)
+    assert pch_fpath.parent == config.prebuild_folder
+    assert pch_fpath in config.artefact_store[ArtefactSet.CURRENT_PREBUILDS]
+
+    # the precompiled header is reused
+    with mock.patch.object(clang.cindex.TranslationUnit, 'save') as save:
+        assert analyse(CAnalyser(config, precompiled_headers=True))[1] == pch
+    save.assert_not_called()
+
+
 class Test__locate_include_regions:
 
     def test_vanilla(self) -> None:
@@ -81,16 +119,43 @@ class Test__locate_include_regions:
         assert analyser._include_region == expect
 
 
+class Test__locate_include_regions_in_source:
+
+    def test_vanilla(self):
+        # the same regions as the token scan, from the example source file
+        analyser = CAnalyser(config=None)
+        analyser._locate_include_regions_in_source(Path(__file__).parent / "test_c_analyser.c")
+
+        assert analyser._include_region == [
+            (2, "sys_include_start"),
+            (7, "sys_include_end"),
+            (10, "usr_include_start"),
+            (13, "usr_include_end"),
+        ]
+        assert analyser._check_for_include(4) == "sys_include"
+        assert analyser._check_for_include(11) == "usr_include"
+        assert analyser._check_for_include(20) is None
+
+    def test_ignores_other_pragmas(self, tmp_path):
+        fpath = tmp_path / 'foo.c'
+        fpath.write_text('#pragma once\n// FAB SysIncludeStart\n  #  pragma FAB UsrIncludeStart\n')
+
+        analyser = CAnalyser(config=None)
+        analyser._locate_include_regions_in_source(fpath)
+
+        assert analyser._include_region == [(3, "usr_include_start")]
+
+
 class Test__check_for_include:
 
     def test_vanilla(self):
         analyser = CAnalyser(config=None)
-        analyser._include_region = [
+        analyser._include_map = IncludeRegions([
             (10, "sys_include_start"),
             (20, "sys_include_end"),
             (30, "usr_include_start"),
             (40, "usr_include_end"),
-        ]
+        ])
 
         assert analyser._check_for_include(5) is None
         assert analyser._check_for_include(15) == "sys_include"
@@ -0,0 +1,63 @@
+"""
+Test finding the commonly included headers of C files.
+
+"""
+from pathlib import Path
+
+from fab.parse.c import (common_include_sets, leading_system_includes,
+                         pch_header_text)
+
+
+class Test_leading_system_includes:
+
+    def test_vanilla(self, tmp_path: Path) -> None:
+        fpath = tmp_path / 'foo.c'
+        fpath.write_text('/* a comment\n   over lines */\n'
+                         '#include <stdio.h>\n'
+                         '\n'
+                         '// another comment\n'
+                         '#pragma FAB SysIncludeStart\n'
+                         '  #  include <netcdf.h>\n'
+                         '#pragma FAB SysIncludeEnd\n'
+                         '#include "foo.h"\n'
+                         '#include <mpi.h>\n'
+                         'int foo;\n')
+        assert leading_system_includes(fpath) == ('stdio.h', 'netcdf.h')
+
+    def test_macro_first(self, tmp_path: Path) -> None:
+        # a macro can change what a header declares, so it can't be precompiled
+        fpath = tmp_path / 'foo.c'
+        fpath.write_text('#define _GNU_SOURCE\n#include <stdio.h>\n')
+        assert leading_system_includes(fpath) == ()
+
+    def test_preprocessed(self, tmp_path: Path) -> None:
+        fpath = tmp_path / 'foo.c'
+        fpath.write_text('# 1 "foo.c"\nint foo;\n')
+        assert leading_system_includes(fpath) == ()
+
+
+def test_common_include_sets() -> None:
+    leading = {
+        Path('a.c'): ('stdio.h', 'mpi.h', 'netcdf.h'),
+        Path('b.c'): ('stdio.h', 'mpi.h', 'netcdf.h'),
+        Path('c.c'): ('stdio.h', 'mpi.h'),
+        Path('d.c'): ('stdio.h', 'string.h'),
+        Path('e.c'): ('math.h',),
+        Path('f.c'): (),
+    }
+    # each file gets the longest set shared by enough files, unless too few
+    # files are given it, as c.c and d.c would be
+    assert common_include_sets(leading, min_files=2) == {
+        Path('a.c'): ('stdio.h', 'mpi.h', 'netcdf.h'),
+        Path('b.c'): ('stdio.h', 'mpi.h', 'netcdf.h'),
+    }
+    # a shorter set can serve more files
+    assert common_include_sets(leading, min_files=3) == {
+        Path(name): ('stdio.h', 'mpi.h') for name in ['a.c', 'b.c', 'c.c']}
+    assert common_include_sets(leading, min_files=4) == {
+        Path(name): ('stdio.h',) for name in ['a.c', 'b.c', 'c.c', 'd.c']}
+
+
+def test_pch_header_text() -> None:
+    assert pch_header_text(['stdio.h', 'sys/types.h']) == \
+        '#include <stdio.h>\n#include <sys/types.h>\n'
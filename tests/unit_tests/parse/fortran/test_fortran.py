@@ -4,11 +4,14 @@
 #  which you should have received as part of this distribution
 # ##############################################################################
 import copy
+import pickle
 from pathlib import Path
 
 import pytest
 
-from fab.parse.fortran import AnalysedFortran
+from fab.parse import EmptySourceFile
+from fab.parse.c import AnalysedC
+from fab.parse.fortran import AnalysedFortran, AnalysedFortranBuilder, KernelIndex
 
 
 class TestAnalysedFortran(object):
@@ -140,6 +143,7 @@ class TestAnalysedFortran(object):
             'file_hash': 123,
             'program_defs': [],
             'module_defs': ['my_mod1', 'my_mod2'],
+            'submodule_defs': [],
             'symbol_defs': ['my_func1', 'my_func2', 'my_mod1', 'my_mod2'],
             'module_deps': ['other_mod1', 'other_mod2'],
             'symbol_deps': ['other_func1', 'other_func2', 'other_mod1', 'other_mod2'],
@@ -148,25 +152,55 @@ class TestAnalysedFortran(object):
             'psyclone_kernels': {'kernel_one_type': 123, 'kernel_two_type': 456},
         }
 
-    def test_add_module_def(self, analysed_fortran):
-        analysed_fortran.add_module_def('my_mod3')
-        assert analysed_fortran.module_defs == {'my_mod1', 'my_mod2', 'my_mod3'}
-        assert analysed_fortran.symbol_defs == {'my_func1', 'my_func2', 'my_mod1', 'my_mod2', 'my_mod3'}
-
-    def test_add_module_dep(self, analysed_fortran):
-        analysed_fortran.add_module_dep('other_mod3')
-        assert analysed_fortran.module_deps == {'other_mod1', 'other_mod2', 'other_mod3'}
-        assert analysed_fortran.symbol_deps == {'other_func1', 'other_func2', 'other_mod1', 'other_mod2', 'other_mod3'}
+    def test_immutable(self, analysed_fortran):
+        with pytest.raises(AttributeError):
+            analysed_fortran.module_defs = {'my_mod3'}
+        with pytest.raises(AttributeError):
+            analysed_fortran.module_defs.add('my_mod3')
+        with pytest.raises(TypeError):
+            analysed_fortran.psyclone_kernels['kernel_three_type'] = 789
+
+    def test_replace(self, analysed_fortran, different_module_defs):
+        assert analysed_fortran.replace(module_defs={'my_mod3'},
+                                        symbol_defs={'my_mod3', 'my_func1', 'my_func2'}) \
+            == different_module_defs
+
+    def test_pickle(self, analysed_fortran):
+        unpickled = pickle.loads(pickle.dumps(analysed_fortran))
+        assert unpickled == analysed_fortran
+        assert hash(unpickled) == hash(analysed_fortran)
+
+    def test_interned(self, analysed_fortran):
+        # symbol names are shared between analysis results
+        other = pickle.loads(pickle.dumps(analysed_fortran))
+        mod_name = next(iter(analysed_fortran.module_defs))
+        assert next(i for i in other.module_defs if i == mod_name) is mod_name
 
     def test_mod_filenames(self, analysed_fortran):
         assert analysed_fortran.mod_filenames == {'my_mod1.mod', 'my_mod2.mod'}
 
+    def test_submodule(self):
+        analysed_fortran = AnalysedFortran(
+            fpath=Path('foo.f90'), file_hash=123,
+            submodule_defs=['my_mod@my_sub'],
+            symbol_defs=['my_mod@my_sub'],
+            module_deps=['my_mod'],
+            symbol_deps=['my_mod', 'my_mod@my_parent_sub'],
+        )
+        assert analysed_fortran.smod_filenames == {'my_mod@my_sub.smod'}
+        assert analysed_fortran.submodule_ancestors == {'my_mod', 'my_mod@my_parent_sub'}
+
     def test_to_dict(self, analysed_fortran, as_dict):
         assert analysed_fortran.to_dict() == as_dict
 
     def test_from_dict(self, analysed_fortran, as_dict):
         assert AnalysedFortran.from_dict(as_dict) == analysed_fortran
 
+    def test_from_dict_before_submodules(self, analysed_fortran, as_dict):
+        # results saved before submodules were supported are still usable
+        del as_dict['submodule_defs']
+        assert AnalysedFortran.from_dict(as_dict) == analysed_fortran
+
     def test_save_load(self, analysed_fortran, tmp_path):
         fpath = tmp_path / 'analysed_fortran.an'
 
@@ -207,7 +241,83 @@ class TestAnalysedFortran(object):
         assert hash(analysed_fortran) != hash(different_psyclone_kernels)
 
 
+class TestAnalysedFortranBuilder(object):
+
+    @pytest.fixture
+    def builder(self):
+        return AnalysedFortranBuilder(fpath=Path('foo.f90'), file_hash=123)
+
+    def test_add_module_def(self, builder):
+        builder.add_module_def('My_Mod')
+        result = builder.build()
+        assert result.module_defs == {'my_mod'}
+        assert result.symbol_defs == {'my_mod'}
+
+    def test_add_module_dep(self, builder):
+        builder.add_module_dep('other_mod')
+        result = builder.build()
+        assert result.module_deps == {'other_mod'}
+        assert result.symbol_deps == {'other_mod'}
+
+    def test_add_program_def(self, builder):
+        builder.add_program_def('my_prog')
+        result = builder.build()
+        assert result.program_defs == {'my_prog'}
+        assert result.symbol_defs == {'my_prog'}
+
+
 # to/from dict should use vars(), and just be in the base class
 
 
 # hash should use field_names() and just be in the base class
+
+
+class TestKernelIndex(object):
+
+    @pytest.fixture
+    def index_fpath(self, tmp_path):
+        return tmp_path / KernelIndex.FILENAME
+
+    def test_round_trip(self, index_fpath):
+        index = KernelIndex(index_fpath)
+        index.add(123, {'kernel_one_type': 456})
+        index.add(789, {})
+        index.save()
+
+        loaded = KernelIndex(index_fpath)
+        assert loaded.get(123) == {'kernel_one_type': 456}
+        assert loaded.get(789) == {}
+        assert 789 in loaded
+        assert loaded.get(999) is None
+
+    def test_save_unchanged(self, index_fpath):
+        index = KernelIndex(index_fpath)
+        index.save()
+        assert not index_fpath.exists()
+
+    def test_add_results(self, index_fpath, tmp_path):
+        empty = EmptySourceFile(fpath=tmp_path / 'empty.f90')
+        empty.fpath.write_text('')
+
+        index = KernelIndex(index_fpath)
+        index.add_results([
+            AnalysedFortran(fpath=Path('kernel.f90'), file_hash=1, psyclone_kernels={'kernel_one_type': 2}),
+            AnalysedC(fpath=Path('foo.c'), file_hash=3),
+            empty,
+        ])
+        assert index.get(1) == {'kernel_one_type': 2}
+        assert 3 not in index
+        assert index.get(empty.file_hash) == {}
+
+    def test_prune(self, index_fpath):
+        index = KernelIndex(index_fpath)
+        index.add(1, {})
+        index.add(2, {})
+        index.prune(keep=[2])
+        assert len(index) == 1
+        assert 2 in index
+
+    def test_unreadable(self, index_fpath):
+        # a corrupt index is ignored, everything will be analysed again
+        index_fpath.write_text('not json')
+        assert len(KernelIndex(index_fpath)) == 0
@@ -20,7 +20,9 @@ import pytest
 
 from fab.build_config import BuildConfig
 from fab.parse import EmptySourceFile
-from fab.parse.fortran import FortranAnalyser, AnalysedFortran
+from fab.parse.fortran import (FortranAnalyser, AnalysedFortran,
+                               AnalysedFortranBuilder)
+from fab.steps import run_mp
 from fab.tools.tool_box import ToolBox
 from fab.tools.tool_repository import ToolRepository
 
@@ -70,6 +72,15 @@ class TestAnalyser:
         assert isinstance(analysis, EmptySourceFile)
         assert artefact is None
 
+    def test_empty_file_mp(self, fortran_analyser: FortranAnalyser,
+                           tmp_path: Path) -> None:
+        # an empty result comes back from a worker process
+        config = mock.Mock(multiprocessing=True, n_procs=2,
+                           metrics_folder=tmp_path)
+        empty_fpath = Path(__file__).parent / "empty.f90"
+        results = run_mp(config, [empty_fpath], fortran_analyser.run)
+        assert results == [(EmptySourceFile(empty_fpath), None)]
+
     def test_module_file(self, fortran_analyser, module_fpath,
                          module_expected):
         with mock.patch('fab.parse.AnalysedFile.save'):
@@ -90,8 +101,9 @@ class TestAnalyser:
 
         # Without parsing openmp sentinels, the compute_chunk... symbols
         # must not be added:
-        module_expected.module_deps.remove('compute_chunk_size_mod')
-        module_expected.symbol_deps.remove('compute_chunk_size_mod')
+        module_expected = module_expected.replace(
+            module_deps=module_expected.module_deps - {'compute_chunk_size_mod'},
+            symbol_deps=module_expected.symbol_deps - {'compute_chunk_size_mod'})
 
         assert analysis == module_expected
         assert isinstance(analysis, AnalysedFortran)
@@ -115,10 +127,10 @@ class TestAnalyser:
 
         # With ignore_dependencies, some_file.o, monty_func symbol and
         # compute_chunk_size_mod symbol must not be added:
-        module_expected.mo_commented_file_deps = set()
-        module_expected.symbol_deps.remove('monty_func')
-        module_expected.module_deps.remove('compute_chunk_size_mod')
-        module_expected.symbol_deps.remove('compute_chunk_size_mod')
+        module_expected = module_expected.replace(
+            mo_commented_file_deps=set(),
+            module_deps=module_expected.module_deps - {'compute_chunk_size_mod'},
+            symbol_deps=module_expected.symbol_deps - {'monty_func', 'compute_chunk_size_mod'})
 
         assert analysis == module_expected
         assert isinstance(analysis, AnalysedFortran)
@@ -138,19 +150,46 @@ class TestAnalyser:
                 analysis, artefact = fortran_analyser.run(
                     fpath=Path(tmp_file.name))
 
-            module_expected.fpath = Path(tmp_file.name)
-            module_expected._file_hash = 325155675
-            module_expected.program_defs = {'foo_mod'}
-            module_expected.module_defs = set()
-            module_expected.symbol_defs.update({'internal_func',
-                                                'internal_sub',
-                                                'openmp_sentinel'})
+            module_expected = module_expected.replace(
+                fpath=Path(tmp_file.name),
+                file_hash=325155675,
+                program_defs={'foo_mod'},
+                module_defs=set(),
+                symbol_defs=module_expected.symbol_defs | {'internal_func',
+                                                           'internal_sub',
+                                                           'openmp_sentinel'})
 
             assert analysis == module_expected
             assert isinstance(analysis, AnalysedFortran)
             assert artefact == fortran_analyser._config.prebuild_folder \
                    / f'{Path(tmp_file.name).stem}.{analysis.file_hash}.an'
 
+    def test_submodule_file(self, fortran_analyser, tmp_path):
+        fpath = tmp_path / 'my_sub.f90'
+        fpath.write_text("""
+            SUBMODULE (my_mod:my_parent) my_sub
+              USE other_mod, ONLY: thing
+            CONTAINS
+              MODULE SUBROUTINE foo()
+                CALL helper()
+                CALL external_sub()
+              END SUBROUTINE foo
+              SUBROUTINE helper()
+              END SUBROUTINE helper
+            END SUBMODULE my_sub
+        """)
+        with mock.patch('fab.parse.AnalysedFile.save'):
+            analysis, _ = fortran_analyser.run(fpath=fpath)
+
+        # The submodule depends on its ancestors, but its own procedures are not symbols.
+        assert analysis == AnalysedFortran(
+            fpath=fpath, file_hash=analysis.file_hash,
+            submodule_defs={'my_mod@my_sub'},
+            symbol_defs={'my_mod@my_sub'},
+            module_deps={'my_mod', 'other_mod'},
+            symbol_deps={'my_mod', 'my_mod@my_parent', 'other_mod', 'external_sub'},
+        )
+
 
 # todo: test more methods!
 
@@ -190,7 +229,7 @@ class TestProcessVariableBinding:
 
         # run our handler
         fpath = Path('foo')
-        analysed_file = AnalysedFortran(fpath=fpath, file_hash=0)
+        analysed_file = AnalysedFortranBuilder(fpath=fpath, file_hash=0)
         analyser = FortranAnalyser(config=stub_configuration)
         analyser._process_variable_binding(analysed_file=analysed_file,
                                            obj=var_decl)
@@ -6,7 +6,7 @@
 from pathlib import Path
 
 import pytest
-from fab.parse.c import AnalysedC
+from fab.parse.c import AnalysedC, IncludeRegions
 
 
 class TestAnalysedC(object):
@@ -27,3 +27,39 @@ class TestAnalysedC(object):
         loaded = AnalysedC.load(fpath)
 
         assert loaded == analysed_c
+
+
+class TestIncludeRegions(object):
+
+    def test_vanilla(self):
+        regions = IncludeRegions([
+            (10, "sys_include_start"),
+            (20, "sys_include_end"),
+            (30, "usr_include_start"),
+            (40, "usr_include_end"),
+        ])
+
+        assert regions[5] is None
+        assert regions[10] == "sys_include"
+        assert regions[15] == "sys_include"
+        assert regions[20] is None
+        assert regions[35] == "usr_include"
+        assert regions[40] is None
+        assert regions[45] is None
+
+    def test_nested(self):
+        # a user header which pulls in a system header
+        regions = IncludeRegions([
+            (10, "usr_include_start"),
+            (12, "sys_include_start"),
+            (14, "sys_include_end"),
+            (20, "usr_include_end"),
+        ])
+
+        assert regions[11] == "usr_include"
+        assert regions[13] == "sys_include"
+        assert regions[15] == "usr_include"
+        assert regions[21] is None
+
+    def test_empty(self):
+        assert IncludeRegions([])[1] is None
@@ -8,11 +8,15 @@ Test contents of parse/__init__.py
 
 """
 import copy
+import pickle
 from pathlib import Path
 
 import pytest
-from fab.parse import AnalysedFile
-from fab.dep_tree import AnalysedDependent
+from fab.parse import AnalysedFile, EmptySourceFile
+from fab.parse.c import AnalysedC
+from fab.parse.fortran import AnalysedFortran
+from fab.parse.x90 import AnalysedX90
+from fab.dep_tree import AnalysedDependent, AnalysedDependentBuilder
 
 
 class TestAnalysedFile(object):
@@ -58,6 +62,23 @@ class TestAnalysedFile(object):
         assert hash(analysed_file) != hash(different_file_hash)
 
 
+@pytest.mark.parametrize('analysed_file', [
+    AnalysedFile(fpath=Path('foo.f90'), file_hash=123),
+    EmptySourceFile(fpath=Path('foo.f90'), file_hash=123),
+    AnalysedDependent(fpath=Path('foo.f90'), file_hash=123, symbol_defs={'my_func'}, file_deps={Path('bar.f90')}),
+    AnalysedFortran(fpath=Path('foo.f90'), file_hash=123, module_defs={'my_mod'}, symbol_defs={'my_mod'},
+                    module_deps={'other_mod'}, symbol_deps={'other_mod'}, mo_commented_file_deps={'bar.c'}),
+    AnalysedC(fpath=Path('foo.c'), file_hash=123, symbol_defs={'my_func'}, symbol_deps={'other_func'}),
+    AnalysedX90(fpath=Path('foo.x90'), file_hash=123, kernel_deps={'my_kernel_type'}),
+])
+def test_pickle(analysed_file):
+    # every kind of analysis result survives the trip to and from a worker process
+    unpickled = pickle.loads(pickle.dumps(analysed_file))
+    assert unpickled.__class__ is analysed_file.__class__
+    assert unpickled == analysed_file
+    assert unpickled._file_hash == analysed_file._file_hash
+
+
 class TestAnalysedDependent(object):
 
     @pytest.fixture
@@ -107,18 +128,25 @@ class TestAnalysedDependent(object):
             file_deps={Path('other_file3.f90'), Path('other_file4.f90')},
         )
 
-    def test_add_symbol_def(self, analysed_dependent):
-        analysed_dependent.add_symbol_def('my_func3')
-        assert analysed_dependent.symbol_defs == {'my_func1', 'my_func2', 'my_func3'}
+    def test_immutable(self, analysed_dependent):
+        with pytest.raises(AttributeError):
+            analysed_dependent.fpath = Path('bar.f90')
+        with pytest.raises(AttributeError):
+            analysed_dependent.symbol_defs.add('my_func3')
 
-    def test_add_symbol_dep(self, analysed_dependent):
-        analysed_dependent.add_symbol_dep('other_func3')
-        assert analysed_dependent.symbol_deps == {'other_func1', 'other_func2', 'other_func3'}
-
-    def test_add_file_dep(self, analysed_dependent):
-        analysed_dependent.add_file_dep('other_file3.f90')
-        assert analysed_dependent.file_deps == {
+    def test_replace(self, analysed_dependent):
+        result = analysed_dependent.replace(file_deps=analysed_dependent.file_deps | {Path('other_file3.f90')})
+        assert result.file_deps == {
             Path('other_file1.f90'), Path('other_file2.f90'), Path('other_file3.f90')}
+        assert result.symbol_defs == analysed_dependent.symbol_defs
+        assert analysed_dependent.file_deps == {Path('other_file1.f90'), Path('other_file2.f90')}
+
+    def test_replace_unknown(self, analysed_dependent):
+        with pytest.raises(ValueError):
+            analysed_dependent.replace(module_defs={'my_mod'})
+
+    def test_pickle(self, analysed_dependent):
+        assert pickle.loads(pickle.dumps(analysed_dependent)) == analysed_dependent
 
     def test_to_dict(self, analysed_dependent, as_dict):
         assert analysed_dependent.to_dict() == as_dict
@@ -151,3 +179,27 @@ class TestAnalysedDependent(object):
 
     def test_hash_different_file_deps(self, analysed_dependent, different_file_deps):
         assert hash(analysed_dependent) != hash(different_file_deps)
+
+
+class TestAnalysedDependentBuilder(object):
+
+    @pytest.fixture
+    def builder(self):
+        return AnalysedDependentBuilder(fpath=Path('foo.f90'), file_hash=123)
+
+    def test_add_symbol_def(self, builder):
+        builder.add_symbol_def('My_Func')
+        assert builder.build().symbol_defs == {'my_func'}
+
+    def test_add_symbol_dep(self, builder):
+        builder.add_symbol_dep('Other_Func')
+        assert builder.build().symbol_deps == {'other_func'}
+
+    def test_add_file_dep(self, builder):
+        builder.add_file_dep('other_file.f90')
+        assert builder.build().file_deps == {Path('other_file.f90')}
+
+    def test_build(self, builder):
+        result = builder.build()
+        assert isinstance(result, AnalysedDependent)
+        assert result == AnalysedDependent(fpath=Path('foo.f90'), file_hash=123)
@@ -7,7 +7,7 @@ import copy
 from pathlib import Path
 
 import pytest
-from fab.parse.x90 import AnalysedX90
+from fab.parse.x90 import AnalysedX90, sanitise_x90
 
 
 class TestAnalysedX90(object):
@@ -59,3 +59,19 @@ class TestAnalysedX90(object):
 
     def test_hash_different_kernel_deps(self, analysed_x90, different_kernel_deps):
         assert hash(analysed_x90) != hash(different_kernel_deps)
+
+
+class Test_sanitise_x90(object):
+
+    def test_named_invoke(self):
+        src = 'call invoke( name = "compute", &\n             kernel_type(a))\n'
+        assert sanitise_x90(src) == 'call invoke(kernel_type(a))\n'
+
+    def test_comment_after_name(self):
+        # the comment line has no continuation, so it has to go before the name is removed
+        src = "call invoke(name='compute', &\n  ! a comment\n  kernel_type(a))\n"
+        assert sanitise_x90(src) == 'call invoke(kernel_type(a))\n'
+
+    def test_unnamed_invoke(self):
+        src = 'call invoke(kernel_type(a))\n'
+        assert sanitise_x90(src) == src
@@ -1,14 +1,15 @@
 from pathlib import Path
 from typing import Dict, List, Set
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
-from pytest import fixture, warns, raises
+from pytest import fixture, mark, warns, raises
 
 from fab.build_config import BuildConfig
 from fab.dep_tree import AnalysedDependent
-from fab.parse.fortran import AnalysedFortran, FortranParserWorkaround
-from fab.steps.analyse import (_add_manual_results, _add_unreferenced_deps,
-                               _gen_file_deps, _gen_symbol_table, _parse_files)
+from fab.parse.fortran import AnalysedFortran, FortranParserWorkaround, KernelIndex
+from fab.steps.analyse import (analyse, _add_manual_results, _add_unreferenced_deps,
+                               _extract_build_trees, _gen_file_deps,
+                               _gen_symbol_table, _parse_files, _update_kernel_index)
 from fab.tools.tool_box import ToolBox
 from fab.tools.tool_repository import ToolRepository
 from fab.util import HashedFile
@@ -43,7 +44,8 @@ class Test_gen_symbol_table(object):
         """
         Tests duplicate symbols in different files.
         """
-        analysed_files[1].symbol_defs.add('foo_1')
+        analysed_files[1] = analysed_files[1].replace(
+            symbol_defs=analysed_files[1].symbol_defs | {'foo_1'})
 
         with raises(ValueError):
             result = _gen_symbol_table(analysed_files=analysed_files)
@@ -81,10 +83,11 @@ class Test_gen_file_deps(object):
                               set())
         ]
 
-        _gen_file_deps(analysed_files=analysed_files, symbols=symbols)
+        result = _gen_file_deps(analysed_files=analysed_files, symbols=symbols)
 
-        assert analysed_files[0].file_deps == {symbols['dep1_mod'],
-                                               symbols['dep2']}
+        assert result[0].file_deps == {symbols['dep1_mod'],
+                                       symbols['dep2']}
+        assert analysed_files[0].file_deps == set()
 
 
 # todo: this is fortran-ey, move it?
@@ -142,6 +145,68 @@ class Test_add_unreferenced_deps(object):
     #     pass
 
 
+class Test_extract_build_trees(object):
+    """
+    Tests extracting a build tree for each root symbol.
+    """
+    @fixture
+    def source_tree(self) -> Dict[Path, AnalysedDependent]:
+        return {
+            Path('prog_a.f90'): AnalysedFortran(fpath=Path('prog_a.f90'), file_deps={Path('lib.f90')},
+                                                file_hash=1),
+            Path('prog_b.f90'): AnalysedFortran(fpath=Path('prog_b.f90'), file_deps={Path('lib.f90')},
+                                                file_hash=2),
+            Path('lib.f90'): AnalysedFortran(fpath=Path('lib.f90'), file_hash=3),
+            Path('util.f90'): AnalysedFortran(fpath=Path('util.f90'), file_hash=4),
+        }
+
+    @fixture
+    def symbol_table(self) -> Dict[str, Path]:
+        return {'prog_a': Path('prog_a.f90'), 'prog_b': Path('prog_b.f90'),
+                'lib': Path('lib.f90'), 'util': Path('util.f90')}
+
+    def test_vanilla(self, source_tree, symbol_table) -> None:
+        result = _extract_build_trees(['prog_a', 'prog_b', 'lib'], source_tree, symbol_table)
+
+        assert set(result['prog_a']) == {Path('prog_a.f90'), Path('lib.f90')}
+        assert set(result['prog_b']) == {Path('prog_b.f90'), Path('lib.f90')}
+        assert set(result['lib']) == {Path('lib.f90')}
+
+    def test_unreferenced_deps(self, source_tree, symbol_table) -> None:
+        result = _extract_build_trees(['prog_a', 'lib'], source_tree, symbol_table,
+                                      unreferenced_deps=['util'])
+
+        assert set(result['prog_a']) == {Path('prog_a.f90'), Path('lib.f90'), Path('util.f90')}
+        assert set(result['lib']) == {Path('lib.f90'), Path('util.f90')}
+
+    def test_shared(self, source_tree, symbol_table) -> None:
+        # two programs in one file need the same build tree
+        symbol_table['prog_c'] = Path('prog_a.f90')
+        result = _extract_build_trees(['prog_a', 'prog_c'], source_tree, symbol_table)
+
+        assert result['prog_a'] is result['prog_c']
+
+
+class Test_extract_build_trees_submodules(object):
+
+    def test_submodules_added(self):
+        # nothing depends on a submodule, but it comes with its module, bringing its own deps
+        source_tree = {
+            Path('prog.f90'): AnalysedFortran(fpath=Path('prog.f90'), file_hash=0, file_deps={Path('mod.f90')}),
+            Path('mod.f90'): AnalysedFortran(fpath=Path('mod.f90'), file_hash=0),
+            Path('impl.f90'): AnalysedFortran(
+                fpath=Path('impl.f90'), file_hash=0, submodule_defs={'my_mod@impl'}, symbol_defs={'my_mod@impl'},
+                file_deps={Path('mod.f90'), Path('util.f90')}),
+            Path('util.f90'): AnalysedFortran(fpath=Path('util.f90'), file_hash=0),
+            Path('other.f90'): AnalysedFortran(fpath=Path('other.f90'), file_hash=0),
+        }
+        symbol_table = {'my_prog': Path('prog.f90'), 'my_mod': Path('mod.f90'), 'my_mod@impl': Path('impl.f90')}
+
+        build_trees = _extract_build_trees(['my_prog'], source_tree, symbol_table)
+
+        assert set(build_trees['my_prog']) == {Path('prog.f90'), Path('mod.f90'), Path('impl.f90'), Path('util.f90')}
+
+
 class Test_parse_files(object):
     """
     Tests examining a file.
@@ -176,6 +241,55 @@ class Test_parse_files(object):
                          c_analyser=Mock())
 
 
+class TestAnalyse:
+
+    @mark.parametrize('pragmas_from_source', [False, True])
+    def test_pragmas_from_source(self, tmp_path, pragmas_from_source):
+        # the option is passed to the c analyser
+        config = BuildConfig('proj', ToolBox(), fab_workspace=tmp_path, multiprocessing=False)
+        with patch('fab.steps.analyse.CAnalyser') as c_analyser, \
+                patch('fab.steps.analyse._parse_files', return_value=set()), \
+                warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
+            analyse(config, source=Mock(return_value=[]), pragmas_from_source=pragmas_from_source)
+        c_analyser.assert_called_once_with(config=config, pragmas_from_source=pragmas_from_source,
+                                           precompiled_headers=False)
+
+
+class Test_update_kernel_index(object):
+
+    @fixture
+    def config(self, tmp_path):
+        config = BuildConfig('proj', ToolBox(), fab_workspace=tmp_path)
+        config.prebuild_folder.mkdir(parents=True)
+        return config
+
+    @fixture
+    def analysed_files(self):
+        return {AnalysedFortran(fpath=Path('kernel.f90'), file_hash=1, psyclone_kernels={'kernel_one_type': 2})}
+
+    def test_shared(self, config, analysed_files):
+        # the psyclone step has created an index, which we add to
+        (config.prebuild_folder / KernelIndex.FILENAME).write_text('{}')
+
+        _update_kernel_index(config, analysed_files)
+
+        assert KernelIndex(config.prebuild_folder / KernelIndex.FILENAME).get(1) == {'kernel_one_type': 2}
+
+    def test_kernels_only(self, config):
+        # files which define no kernels would only be pruned again by the psyclone step
+        index_fpath = config.prebuild_folder / KernelIndex.FILENAME
+        index_fpath.write_text('{}')
+
+        _update_kernel_index(config, {AnalysedFortran(fpath=Path('foo.f90'), file_hash=3)})
+
+        assert index_fpath.read_text() == '{}'
+
+    def test_no_index(self, config, analysed_files):
+        # projects which don't use psyclone don't get an index
+        _update_kernel_index(config, analysed_files)
+        assert not (config.prebuild_folder / KernelIndex.FILENAME).exists()
+
+
 class TestAddManualResults:
     """
     Tests user over-ridden results. Covers parser failures.
@@ -7,6 +7,7 @@
 Test for the archive step.
 """
 from pathlib import Path
+from unittest.mock import patch
 
 from pyfakefs.fake_filesystem import FakeFilesystem
 from pytest import raises, warns
@@ -17,7 +18,10 @@ from tests.conftest import call_list
 from fab.artefacts import ArtefactSet
 from fab.build_config import BuildConfig
 from fab.steps.archive_objects import archive_objects
+from fab.util import string_checksum
 from fab.tools.category import Category
+from fab.tools.fake import FakeAr
+from fab.tools.tool_box import ToolBox
 from fab.tools.tool_repository import ToolRepository
 
 
@@ -57,7 +61,9 @@ class TestArchiveObjects:
         with warns(UserWarning,
                    match="_metric_send_conn not set, cannot send metrics"):
             archive_objects(config=config)
-        assert call_list(fake_process) == commands
+        # the archives are created in parallel, in any order
+        assert call_list(fake_process)[0] == version_command
+        assert sorted(call_list(fake_process)) == sorted(commands)
 
         # ensure the correct artefacts were created
         assert config.artefact_store[ArtefactSet.OBJECT_ARCHIVES] == {
@@ -98,6 +104,66 @@ class TestArchiveObjects:
         assert config.artefact_store[ArtefactSet.OBJECT_ARCHIVES] == {
             None: {config.build_output / 'mylib.a'}}
 
+    def test_incremental(self, tmp_path: Path) -> None:
+        """
+        Tests an archive is only written when its members change, and only
+        the changed members are replaced when there are few of them.
+        """
+        tool_box = ToolBox()
+        tool_box.add_tool(FakeAr())
+        config = BuildConfig('proj', tool_box, multiprocessing=False,
+                             fab_workspace=tmp_path)
+        config.prebuild_folder.mkdir(parents=True)
+        objects = {config.prebuild_folder / f'{name}.o': name
+                   for name in 'abcdefghijkl'}
+
+        def archive():
+            config._artefact_store[ArtefactSet.OBJECT_FILES] = {
+                None: set(objects)}
+            with warns(UserWarning, match="cannot send metrics"), \
+                    patch.object(FakeAr, 'run', autospec=True,
+                                 side_effect=FakeAr.run) as spy:
+                archive_objects(config=config, output_fpath='$output/lib.a')
+            return [call.kwargs['additional_parameters'][0]
+                    for call in spy.call_args_list]
+
+        def written():
+            for fpath, text in objects.items():
+                fpath.write_text(text)
+
+        written()
+        assert archive() == ['cr']
+        archive_text = (config.build_output / 'lib.a').read_text()
+        assert archive_text.startswith('FAKE-ARCHIVE\na.o ')
+        assert config.prebuild_folder / f'lib.a.{string_checksum(str(config.build_output / "lib.a"))}.json' in \
+            config.artefact_store[ArtefactSet.CURRENT_PREBUILDS]
+
+        # unchanged, even when an object is written again
+        written()
+        assert archive() == []
+
+        # one object changed, one added and one removed
+        objects[config.prebuild_folder / 'a.o'] = 'changed'
+        objects[config.prebuild_folder / 'm.o'] = 'm'
+        del objects[config.prebuild_folder / 'b.o']
+        written()
+        assert archive() == ['d', 'r']
+        incremental_text = (config.build_output / 'lib.a').read_text()
+        (config.build_output / 'lib.a').unlink()
+        assert archive() == ['cr']
+        assert (sorted(incremental_text.splitlines()) ==
+                sorted((config.build_output / 'lib.a').read_text().splitlines()))
+
+        # too many changes, or an archive changed by something else, are
+        # created again
+        for fpath in list(objects)[:4]:
+            objects[fpath] = 'changed again'
+        written()
+        assert archive() == ['cr']
+        (config.build_output / 'lib.a').write_text('something else')
+        assert archive() == ['cr']
+        assert archive() == []
+
     def test_incorrect_tool(self, stub_tool_box, monkeypatch):
         """
         Test that an incorrect archive tool is detected.
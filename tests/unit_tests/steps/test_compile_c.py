@@ -7,7 +7,7 @@
 Exercises the compiler step.
 """
 from pathlib import Path
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from pytest import fixture, raises, warns
 from pytest_subprocess.fake_process import FakeProcess
@@ -17,6 +17,7 @@ from fab.build_config import AddFlags, BuildConfig
 from fab.parse.c import AnalysedC
 from fab.steps.compile_c import _get_obj_combo_hash, _compile_file, compile_c
 from fab.tools.category import Category
+from fab.tools.fake import FakeCCompiler
 from fab.tools.flags import Flags
 from fab.tools.tool_box import ToolBox
 
@@ -110,6 +111,101 @@ class TestCompileC:
         with raises(RuntimeError):
             compile_c(config=config)
 
+    def test_batch(self, tmp_path: Path) -> None:
+        """
+        Tests compiling files in batches, with per-file errors when a batch
+        fails.
+        """
+        tool_box = ToolBox()
+        tool_box.add_tool(FakeCCompiler())
+        config = BuildConfig('proj', tool_box, multiprocessing=False,
+                             fab_workspace=tmp_path)
+        config.source_root.mkdir(parents=True)
+        analysed_files = []
+        for name in ['a', 'b', 'c', 'd']:
+            fpath = config.source_root / f'{name}.c'
+            if name != 'd':
+                fpath.write_text(f'int {name};\n')
+            analysed_files.append(AnalysedC(fpath=fpath, file_hash=0))
+        config._artefact_store[ArtefactSet.BUILD_TREES] = {
+            None: {af.fpath: af for af in analysed_files[:3]},
+            'broken': {af.fpath: af for af in analysed_files}}
+
+        # d.c doesn't exist, so its batch fails, and is compiled again
+        # one file at a time
+        with warns(UserWarning, match="cannot send metrics"), \
+                patch.object(FakeCCompiler, 'compile_files', autospec=True,
+                             side_effect=FakeCCompiler.compile_files) as spy:
+            with raises(RuntimeError) as err:
+                compile_c(config=config, batch_size=2)
+        assert [[fpath.name for fpath in call.args[1]]
+                for call in spy.call_args_list] == [['a.c', 'b.c'],
+                                                    ['c.c', 'd.c']]
+        assert "1 error(s) found during compile c" in str(err.value)
+        assert f"error compiling {analysed_files[3].fpath}" in str(err.value)
+        objects = sorted(config.prebuild_folder.glob('*.o'))
+        assert [obj.name.split('.')[0] for obj in objects] == ['a', 'b', 'c']
+
+        # without the broken file, the objects are all prebuilt
+        del config._artefact_store[ArtefactSet.BUILD_TREES]['broken']
+        compile_c(config=config, batch_size=2)
+        assert config.artefact_store[ArtefactSet.OBJECT_FILES] == {
+            None: set(objects)}
+        assert sorted(config.prebuild_folder.iterdir()) == objects
+
+    def test_precompiled_headers(self, tmp_path: Path) -> None:
+        """
+        Tests files which start with the same system headers are compiled
+        with a precompiled header, to the same objects.
+        """
+        tool_box = ToolBox()
+        tool_box.add_tool(FakeCCompiler())
+        config = BuildConfig('proj', tool_box, multiprocessing=False,
+                             fab_workspace=tmp_path)
+        config.source_root.mkdir(parents=True)
+        analysed_files = []
+        for name in 'abcde':
+            fpath = config.source_root / f'{name}.c'
+            includes = '#include <stdio.h>\n' if name != 'e' else ''
+            fpath.write_text(f'{includes}int {name};\n')
+            analysed_files.append(AnalysedC(fpath=fpath, file_hash=0))
+        config._artefact_store[ArtefactSet.BUILD_TREES] = {
+            None: {af.fpath: af for af in analysed_files}}
+
+        with warns(UserWarning, match="cannot send metrics"), \
+                patch.object(FakeCCompiler, 'compile_file', autospec=True,
+                             side_effect=FakeCCompiler.compile_file) as spy:
+            compile_c(config=config, common_flags=['-O2'],
+                      precompiled_headers=True)
+        [header] = config.prebuild_folder.glob('pch.*.h')
+        assert header.read_text() == '#include <stdio.h>\n'
+        assert header.with_suffix('.h.gch').exists()
+        assert {call.args[1].name: call.kwargs['add_flags']
+                for call in spy.call_args_list} == {
+            'a.c': ['-O2', '-include', str(header)],
+            'b.c': ['-O2', '-include', str(header)],
+            'c.c': ['-O2', '-include', str(header)],
+            'd.c': ['-O2', '-include', str(header)],
+            'e.c': ['-O2']}
+        assert {header, header.with_suffix('.h.gch')} <= \
+            config.artefact_store[ArtefactSet.CURRENT_PREBUILDS]
+
+        # the objects are the same without it
+        objects = {fpath.name: fpath.read_text()
+                   for fpath in config.prebuild_folder.glob('*.o')}
+        for fpath in config.prebuild_folder.iterdir():
+            fpath.unlink()
+        with warns(UserWarning, match="cannot send metrics"):
+            compile_c(config=config, common_flags=['-O2'])
+        assert objects == {fpath.name: fpath.read_text()
+                           for fpath in config.prebuild_folder.glob('*.o')}
+
+        # nothing is precompiled for prebuilt objects
+        with warns(UserWarning, match="cannot send metrics"):
+            compile_c(config=config, common_flags=['-O2'],
+                      precompiled_headers=True)
+        assert not list(config.prebuild_folder.glob('pch.*'))
+
 
 class TestGetObjComboHash:
     '''Tests the object combo hash functionality.'''
@@ -130,7 +226,8 @@ class TestGetObjComboHash:
         #
         # ToDo: Messing with "private" members.
         #
-        result = _get_obj_combo_hash(config, compiler, analysed_file, flags)
+        result = _get_obj_combo_hash(config, compiler, analysed_file,
+                                     flags.checksum())
         assert result == 5289295574
 
     def test_change_file(self, content, flags,
@@ -142,11 +239,9 @@ class TestGetObjComboHash:
 
         fake_process.register(['scc', '--version'], stdout='1.2.3')
         compiler = config.tool_box.get_tool(Category.C_COMPILER)
-        #
-        # ToDo: Messing with "private" members.
-        #
-        analysed_file._file_hash += 1
-        result = _get_obj_combo_hash(config, compiler, analysed_file, flags)
+        analysed_file = analysed_file.replace(file_hash=analysed_file.file_hash + 1)
+        result = _get_obj_combo_hash(config, compiler, analysed_file,
+                                     flags.checksum())
         assert result == 5289295575
 
     def test_change_flags(self, content, flags,
@@ -159,7 +254,8 @@ class TestGetObjComboHash:
         fake_process.register(['scc', '--version'], stdout='1.2.3')
         compiler = config.tool_box.get_tool(Category.C_COMPILER)
         flags = Flags(['-Dfoo'] + flags)
-        result = _get_obj_combo_hash(config, compiler, analysed_file, flags)
+        result = _get_obj_combo_hash(config, compiler, analysed_file,
+                                     flags.checksum())
         assert result != 5066163117
 
     def test_change_compiler(self, content, flags,
@@ -178,7 +274,8 @@ class TestGetObjComboHash:
         #       messing with "private" members.
         #
         compiler._name = compiler.name + "XX"
-        result = _get_obj_combo_hash(config, compiler, analysed_file, flags)
+        result = _get_obj_combo_hash(config, compiler, analysed_file,
+                                     flags.checksum())
         assert result != 5066163117
 
     def test_change_compiler_version(self, content, flags) -> None:
@@ -191,5 +288,6 @@ class TestGetObjComboHash:
         #
         # ToDo: Messing with "private" members.
         #
-        result = _get_obj_combo_hash(config, compiler, analysed_file, flags)
+        result = _get_obj_combo_hash(config, compiler, analysed_file,
+                                     flags.checksum())
         assert result != 5066163117
@@ -1,6 +1,6 @@
 from pathlib import Path
 from typing import Dict
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from pyfakefs.fake_filesystem import FakeFilesystem
 from pytest import fixture, mark, raises, warns
@@ -10,11 +10,13 @@ from fab.artefacts import ArtefactSet, ArtefactStore
 from fab.build_config import BuildConfig, FlagsConfig
 from fab.parse.fortran import AnalysedFortran
 from fab.steps.compile_fortran import (
-    compile_pass, get_compile_next,
+    _get_mod_files, _get_obj_combo_hash, compile_pass, get_compile_next,
     get_mod_hashes, handle_compiler_args, MpCommonArgs, process_file,
     store_artefacts
 )
 from fab.tools.category import Category
+from fab.tools.fake import FakeFortranCompiler
+from fab.tools.flags import Flags
 from fab.tools.tool_box import ToolBox
 from fab.util import CompiledFile
 
@@ -110,6 +112,56 @@ class TestCompilePass:
         assert Path('/fab/b.f90') in compiled
         assert list(uncompiled_result)[0].fpath == Path('/fab/a.f90')
 
+    def test_batch(self, tmp_path: Path) -> None:
+        """
+        Tests files which define no modules are compiled in batches.
+        """
+        fc = FakeFortranCompiler()
+        tool_box = ToolBox()
+        tool_box.add_tool(fc)
+        config = BuildConfig('proj', tool_box, multiprocessing=False,
+                             mpi=False, openmp=False, fab_workspace=tmp_path)
+        config.source_root.mkdir(parents=True)
+        config.build_output.mkdir(parents=True)
+        fc.set_module_output_path(config.build_output)
+
+        uncompiled = set()
+        for name in ['a', 'b', 'c', 'my_mod']:
+            fpath = config.source_root / f'{name}.f90'
+            if name == 'my_mod':
+                fpath.write_text('module my_mod\nend module my_mod\n')
+                af = AnalysedFortran(fpath=fpath, file_hash=0,
+                                     module_defs={'my_mod'},
+                                     symbol_defs={'my_mod'})
+            else:
+                fpath.write_text(f'subroutine {name}\nend subroutine\n')
+                af = AnalysedFortran(fpath=fpath, file_hash=0)
+            uncompiled.add(af)
+
+        compiled: Dict[Path, CompiledFile] = {}
+        mod_hashes: Dict[str, int] = {}
+        mp_common_args = MpCommonArgs(config, FlagsConfig(), mod_hashes,
+                                      syntax_only=False, batch_size=4)
+        with warns(UserWarning, match="cannot send metrics"), \
+                patch.object(FakeFortranCompiler, 'compile_files',
+                             autospec=True,
+                             side_effect=FakeFortranCompiler.compile_files
+                             ) as spy:
+            uncompiled = compile_pass(config=config, compiled=compiled,
+                                      uncompiled=uncompiled,
+                                      mod_hashes=mod_hashes,
+                                      mp_common_args=mp_common_args)
+
+        assert not uncompiled
+        assert [[fpath.name for fpath in call.args[1]]
+                for call in spy.call_args_list] == [['a.f90', 'b.f90',
+                                                     'c.f90']]
+        assert sorted(cf.output_fpath.name.split('.')[0]
+                      for cf in compiled.values()) == ['a', 'b', 'c',
+                                                       'my_mod']
+        assert all(cf.output_fpath.exists() for cf in compiled.values())
+        assert 'my_mod' in mod_hashes
+
 
 class TestGetCompileNext:
 
@@ -174,12 +226,14 @@ def content(stub_tool_box, fs: FakeFilesystem):
     flags = ['flag1', 'flag2']
     flags_config = Mock()
     flags_config.flags_for_path.return_value = flags
+    flags_config.checksum_for_path.side_effect = \
+        lambda path, config: Flags(flags_config.flags_for_path(path, config)).checksum()
 
-    analysed_file = AnalysedFortran(fpath=Path('foofile'), file_hash=34567)
-    analysed_file.add_module_dep('mod_dep_1')
-    analysed_file.add_module_dep('mod_dep_2')
-    analysed_file.add_module_def('mod_def_1')
-    analysed_file.add_module_def('mod_def_2')
+    analysed_file = AnalysedFortran(fpath=Path('foofile'), file_hash=34567,
+                                    module_deps=['mod_dep_1', 'mod_dep_2'],
+                                    symbol_deps=['mod_dep_1', 'mod_dep_2'],
+                                    module_defs=['mod_def_1', 'mod_def_2'],
+                                    symbol_defs=['mod_def_1', 'mod_def_2'])
 
     mp_common_args = MpCommonArgs(
         config=BuildConfig('proj', stub_tool_box, fab_workspace=Path('/fab')),
@@ -301,7 +355,7 @@ class TestProcessFile:
         """
         mp_common_args, flags, analysed_file = content
 
-        analysed_file._file_hash += 1
+        analysed_file = analysed_file.replace(file_hash=analysed_file.file_hash + 1)
 
         fake_process.register(['sfc', '--version'], stdout='1.2.3')
         record = fake_process.register(['sfc', fake_process.any()])
@@ -596,3 +650,60 @@ class TestGetModHashes:
         result = get_mod_hashes(analysed_files=analysed_files, config=config)
 
         assert result == {'foo': 3990191875, 'bar': 2746925363}
+
+    def test_smod(self, stub_tool_box, fs) -> None:
+        """
+        Tests hashing of the smod files of modules and submodules.
+        """
+        Path('/fab_workspace/proj/build_output').mkdir(parents=True)
+        Path('/fab_workspace/proj/build_output/foo.mod').write_text("Foo file.")
+        Path('/fab_workspace/proj/build_output/foo.smod').write_text("Foo file.")
+        Path('/fab_workspace/proj/build_output/foo@sub.smod').write_text("Bar file.")
+        Path('foo_mod.f90').touch()
+        analysed_files = {
+            AnalysedFortran('foo_mod.f90',
+                            module_defs=['foo'], submodule_defs=['foo@sub'],
+                            symbol_defs=['foo', 'foo@sub'])
+        }
+
+        config = BuildConfig('proj', stub_tool_box,
+                             fab_workspace=Path('/fab_workspace'))
+
+        result = get_mod_hashes(analysed_files=analysed_files, config=config)
+
+        assert result == {'foo': 3990191875, 'foo.smod': 3990191875, 'foo@sub.smod': 2746925363}
+
+
+class TestSubmodules:
+    """
+    Tests of smod files and submodule compile hashes.
+    """
+    @fixture
+    def submodule(self):
+        return AnalysedFortran(fpath=Path('impl.f90'), file_hash=34567,
+                               submodule_defs=['my_mod@impl'],
+                               symbol_defs=['my_mod@impl'],
+                               module_deps=['my_mod'],
+                               symbol_deps=['my_mod', 'my_mod@parent'])
+
+    def test_get_mod_files(self, submodule):
+        module = AnalysedFortran(fpath=Path('my_mod.f90'), file_hash=1,
+                                 module_defs=['my_mod'], symbol_defs=['my_mod'])
+        assert _get_mod_files(module) == {Path('my_mod.mod'): True, Path('my_mod.smod'): False}
+        assert _get_mod_files(submodule) == {Path('my_mod@impl.smod'): True}
+
+    def test_obj_combo_hash(self, submodule, content):
+        mp_common_args, _, _ = content
+        compiler = Mock(get_hash=Mock(return_value=0))
+
+        mp_common_args.mod_hashes.update({'my_mod': 1, 'my_mod.smod': 10, 'my_mod@parent.smod': 100})
+        before = _get_obj_combo_hash(mp_common_args.config, submodule, mp_common_args, compiler, 0)
+
+        # the submodule needs recompiling if an ancestor's smod changes
+        mp_common_args.mod_hashes['my_mod@parent.smod'] += 1
+        after = _get_obj_combo_hash(mp_common_args.config, submodule, mp_common_args, compiler, 0)
+        assert after == before + 1
+
+        # other submodules don't matter
+        mp_common_args.mod_hashes['my_mod@other.smod'] = 1000
+        assert _get_obj_combo_hash(mp_common_args.config, submodule, mp_common_args, compiler, 0) == after
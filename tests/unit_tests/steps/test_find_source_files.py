@@ -8,13 +8,15 @@
 Test the find_source_files step.
 """
 
+import random
 from pathlib import Path
 
 import pytest
 
 from fab.artefacts import ArtefactSet
 from fab.build_config import BuildConfig
-from fab.steps.find_source_files import Exclude, find_source_files, Include
+from fab.steps.find_source_files import (Exclude, find_source_files, Include,
+                                         _PathFilterMatcher)
 from fab.tools.tool_box import ToolBox
 
 
@@ -173,3 +175,35 @@ def test_find_source_files_no_files(tmp_path: Path):
 
     artefacts = config.artefact_store[ArtefactSet.INITIAL_SOURCE_FILES]
     assert set() == artefacts
+
+
+def test_path_filter_matcher_equivalence():
+    """
+    Ensure the compiled matcher wants exactly the same paths as checking
+    each filter in turn, for random filters and paths.
+    """
+    def check_each(path_filters, path):
+        wanted = True
+        max_len = -1
+        for path_filter in path_filters:
+            pattern_len, result = path_filter.check(path)
+            if result is not None and pattern_len >= max_len:
+                wanted = result
+                max_len = pattern_len
+        return wanted
+
+    def random_string(rng, max_len):
+        # A small alphabet gives plenty of overlapping and repeated matches
+        return ''.join(rng.choice('ab/.') for _ in range(rng.randint(0, max_len)))
+
+    rng = random.Random(42)
+    for _ in range(200):
+        path_filters = [
+            rng.choice([Include, Exclude])(*[random_string(rng, 4) for _ in range(rng.randint(1, 3))])
+            for _ in range(rng.randint(0, 5))
+        ]
+        matcher = _PathFilterMatcher(path_filters)
+        for _ in range(20):
+            path = Path(random_string(rng, 12) or '.')
+            assert matcher.check(path) == check_each(path_filters, path), \
+                f"{path} with {', '.join(map(str, path_filters))}"
@@ -7,6 +7,7 @@
 Exercises executable linkage step.
 """
 from pathlib import Path
+from unittest.mock import patch
 
 from pytest import warns, raises
 from pytest_subprocess.fake_process import FakeProcess
@@ -17,6 +18,7 @@ from fab.parse.c import AnalysedC
 from fab.parse.fortran import AnalysedFortran
 from fab.steps.link import link_exe
 from fab.tools.category import Category
+from fab.tools.fake import FakeCCompiler
 from fab.tools.linker import Linker
 from fab.tools.tool_box import ToolBox
 from fab.tools.tool_repository import ToolRepository
@@ -184,3 +186,47 @@ def test_no_targets(fake_process: FakeProcess,
     assert "No target objects defined, linking aborted" in str(err.value)
 
     assert call_list(fake_process) == [version_command]
+
+
+def test_up_to_date(tmp_path: Path) -> None:
+    """
+    Tests an executable is only linked again when one of its link inputs
+    changes.
+    """
+    tool_box = ToolBox()
+    tool_box.add_tool(Linker(FakeCCompiler()))
+    config = BuildConfig('link_test', tool_box, fab_workspace=tmp_path,
+                         mpi=False, openmp=False, multiprocessing=False)
+    config.prebuild_folder.mkdir(parents=True)
+    for name in ['a.o', 'b.o', 'c.o', 'lib/libmine.a']:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text(name)
+    config.artefact_store[ArtefactSet.OBJECT_FILES] = {
+        'foo': {tmp_path / 'a.o', tmp_path / 'c.o'},
+        'bar': {tmp_path / 'b.o', tmp_path / 'c.o'}}
+
+    def linked(flags=None):
+        with warns(UserWarning, match="cannot send metrics"), \
+                patch.object(Linker, 'link', autospec=True,
+                             side_effect=Linker.link) as spy:
+            link_exe(config, flags=flags)
+        assert config.artefact_store[ArtefactSet.EXECUTABLES] == {
+            config.project_workspace / 'foo', config.project_workspace / 'bar'}
+        return sorted(call.args[2].name for call in spy.call_args_list)
+
+    assert linked() == ['bar', 'foo']
+    assert linked() == []
+
+    # a changed object, or flag, or a deleted executable
+    (tmp_path / 'a.o').write_text('changed')
+    assert linked() == ['foo']
+    assert linked(['-O2']) == ['bar', 'foo']
+    (config.project_workspace / 'bar').unlink()
+    assert linked(['-O2']) == ['bar']
+
+    # a library found in a -L folder
+    flags = [f'-L{tmp_path / "lib"}', '-lmine']
+    assert linked(flags) == ['bar', 'foo']
+    (tmp_path / 'lib/libmine.a').write_text('changed')
+    assert linked(flags) == ['bar', 'foo']
+    assert linked(flags) == []
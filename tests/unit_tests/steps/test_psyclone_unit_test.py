@@ -71,7 +71,8 @@ class TestGenPrebuildHash:
         ToDo: Monkeying with "private" members.
         """
         mp_payload, x90_file = data
-        mp_payload.analysed_x90[x90_file]._file_hash += 1
+        analysed_x90 = mp_payload.analysed_x90[x90_file]
+        mp_payload.analysed_x90[x90_file] = analysed_x90.replace(file_hash=analysed_x90.file_hash + 1)
         result = _gen_prebuild_hash(x90_file=x90_file, mp_payload=mp_payload)
         assert result == 5699416686
 
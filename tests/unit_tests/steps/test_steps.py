@@ -4,11 +4,20 @@
 # which you should have received as part of this distribution
 ##############################################################################
 """
-Exercises the multi-process error helper.
+Exercises the multi-process helpers.
 """
-from pytest import raises
+import multiprocessing
+from unittest import mock
 
-from fab.steps import check_for_errors
+from pytest import mark, raises
+
+from fab.steps import check_for_errors, run_mp
+
+
+def _square(i):
+    if i < 0:
+        raise ValueError('negative')
+    return i * i
 
 
 class Test_check_for_errors(object):
@@ -27,3 +36,51 @@ class Test_check_for_errors(object):
         """
         with raises(RuntimeError):
             check_for_errors(['foo', MemoryError('bar')])
+
+
+class Test_run_mp(object):
+    """
+    Tests running items in a process pool.
+    """
+    @mark.parametrize('start_method', ['fork', 'spawn'])
+    def test_throttled(self, tmp_path, start_method):
+        """
+        Tests a throttled run gives the results in order, however the items are sent to the workers.
+        """
+        config = mock.Mock(multiprocessing=True, n_procs=2, metrics_folder=tmp_path)
+        with mock.patch('multiprocessing.get_start_method', return_value=start_method):
+            assert run_mp(config, range(10), _square, throttle=True) == [i * i for i in range(10)]
+
+    def test_throttled_admission(self, tmp_path):
+        """
+        Tests items wait until the throttle admits them, here one at a time.
+        """
+        config = mock.Mock(multiprocessing=True, n_procs=2, metrics_folder=tmp_path)
+        admitted = []
+
+        def admit(estimate, running):
+            if not running:
+                admitted.append(estimate)
+            return not running
+
+        with mock.patch('fab.steps.MemoryThrottle.admit', side_effect=admit):
+            assert run_mp(config, range(3), _square, throttle=True) == [0, 1, 4]
+        assert len(admitted) == 3
+
+    def test_throttled_error(self, tmp_path):
+        """
+        Tests an item's exception is raised, as with an unthrottled run.
+        """
+        config = mock.Mock(multiprocessing=True, n_procs=2, metrics_folder=tmp_path)
+        with raises(ValueError):
+            run_mp(config, [1, -1, 2], _square, throttle=True)
+
+    @mark.parametrize('throttle', [False, True])
+    def test_max_procs(self, tmp_path, throttle):
+        """
+        Tests a run can use fewer processes than the config allows.
+        """
+        config = mock.Mock(multiprocessing=True, n_procs=4, metrics_folder=tmp_path)
+        with mock.patch('multiprocessing.Pool', wraps=multiprocessing.Pool) as pool:
+            assert run_mp(config, range(3), _square, throttle=throttle, max_procs=2) == [0, 1, 4]
+        assert pool.call_args.args[0] == 2
@@ -0,0 +1,118 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Test the compile cache daemon.
+"""
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from fab.cache_daemon import CacheDaemon, request, request_run
+from fab.tools.compiler import CCompiler
+from fab.tools.launcher import CacheDaemonLauncher
+
+# A compiler which logs its arguments, preprocesses by printing its source and "compiles" by copying it.
+COMPILER = f"""#!{sys.executable}
+import pathlib, sys
+args = sys.argv[1:]
+with pathlib.Path(__file__).with_name('calls').open('a') as calls:
+    calls.write(' '.join(args) + '\\n')
+source = pathlib.Path([arg for arg in args if arg.endswith(('.c', '.f90'))][0]).read_text()
+if 'error' in source:
+    sys.exit('bad source')
+if '-E' in args:
+    print(source)
+else:
+    pathlib.Path(args[args.index('-o') + 1]).write_text('object of ' + source)
+    print('warning: compiled', file=sys.stderr)
+"""
+
+
+@pytest.fixture
+def compiler(tmp_path):
+    fpath = tmp_path / 'cc'
+    fpath.write_text(COMPILER)
+    fpath.chmod(0o755)
+    return fpath
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    daemon = CacheDaemon(tmp_path / 'cache', tmp_path / 'socket' / 'd.sock')
+    thread = threading.Thread(target=daemon.serve)
+    thread.start()
+    for _ in range(100):
+        if daemon.socket_path.exists():
+            break
+        time.sleep(0.01)
+    yield daemon
+    request(daemon.socket_path, {'op': 'shutdown'})
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def _calls(compiler):
+    return compiler.with_name('calls').read_text().splitlines()
+
+
+class TestCacheDaemon:
+
+    def test_hit(self, daemon, compiler, tmp_path):
+        (tmp_path / 'a.c').write_text('int a;')
+        command = [str(compiler), '-c', '-O2', 'a.c', '-o', 'a.o']
+
+        result = request_run(daemon.socket_path, command, str(tmp_path), dict(os.environ))
+        assert result == (0, b'', b'warning: compiled\n')
+        assert (tmp_path / 'a.o').read_text() == 'object of int a;'
+
+        # the same compile, to another object file, only preprocesses, and gets the same warnings
+        command[-1] = 'b.o'
+        assert request_run(daemon.socket_path, command, str(tmp_path), dict(os.environ)) == result
+        assert (tmp_path / 'b.o').read_text() == 'object of int a;'
+        assert _calls(compiler) == ['-E -O2 a.c', '-c -O2 a.c -o a.o', '-E -O2 a.c']
+
+        # a change to the source, or the flags, is compiled
+        (tmp_path / 'a.c').write_text('int b;')
+        request_run(daemon.socket_path, command, str(tmp_path), dict(os.environ))
+        command[2] = '-O3'
+        request_run(daemon.socket_path, command, str(tmp_path), dict(os.environ))
+        assert request(daemon.socket_path, {'op': 'stats'}) == {'hits': 1, 'misses': 3, 'uncached': 0}
+
+    def test_uncached(self, daemon, compiler, tmp_path):
+        # Fortran compiles are just run
+        (tmp_path / 'a.f90').write_text('end')
+        command = [str(compiler), '-c', 'a.f90', '-o', 'a.o']
+        for _ in range(2):
+            assert request_run(daemon.socket_path, command, str(tmp_path), dict(os.environ))[0] == 0
+        assert _calls(compiler) == ['-c a.f90 -o a.o'] * 2
+        assert request(daemon.socket_path, {'op': 'stats'}) == {'hits': 0, 'misses': 0, 'uncached': 2}
+
+    def test_error(self, daemon, compiler, tmp_path):
+        # a failed compile isn't cached, and its error is returned
+        (tmp_path / 'a.c').write_text('error')
+        command = [str(compiler), '-c', 'a.c', '-o', 'a.o']
+        assert request_run(daemon.socket_path, command, str(tmp_path), dict(os.environ)) == (1, b'', b'bad source\n')
+        assert request_run(daemon.socket_path, command, str(tmp_path), dict(os.environ))[0] == 1
+        assert request(daemon.socket_path, {'op': 'stats'})['hits'] == 0
+
+    def test_already_running(self, daemon, tmp_path):
+        with pytest.raises(RuntimeError):
+            CacheDaemon(tmp_path / 'cache', daemon.socket_path).serve()
+
+
+def test_launcher(daemon, compiler, tmp_path, stub_configuration):
+    # a compiler sends its compiles to the daemon through the launcher
+    (tmp_path / 'a.c').write_text('int a;')
+    cc = CCompiler('cc', str(compiler), 'test', version_regex=r'([\d.]+)')
+    cc.set_launcher(CacheDaemonLauncher(daemon.socket_path))
+    for obj in ['a.o', 'b.o']:
+        cc.compile_file(tmp_path / 'a.c', Path(obj), config=stub_configuration)
+    assert (tmp_path / 'b.o').read_text() == 'object of int a;'
+    assert daemon.stats == {'hits': 1, 'misses': 1, 'uncached': 0}
@@ -0,0 +1,141 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Test resuming a build from the step checkpoints.
+"""
+from pathlib import Path
+from types import MappingProxyType
+from typing import List
+from unittest import mock
+
+import pytest
+
+from fab.artefacts import ArtefactSet
+from fab.build_config import BuildConfig
+from fab.checkpoints import _stat_tree
+from fab.steps import step
+from fab.tools.tool_box import ToolBox
+
+
+class Build():
+    """
+    A small build which records which steps actually ran.
+    """
+    def __init__(self, tmp_path: Path):
+        self.tmp_path = tmp_path
+        self.ran: List[str] = []
+        self.fail = False
+
+        @step(resumable=False)
+        def fetch(config):
+            self.ran.append('fetch')
+            source = config.source_root / 'foo.f90'
+            if not source.exists():
+                source.write_text('program foo\nend program foo\n')
+
+        @step
+        def find(config, suffix):
+            self.ran.append('find')
+            config.artefact_store.add(ArtefactSet.INITIAL_SOURCE_FILES,
+                                      list(config.source_root.glob(f'*{suffix}')))
+
+        @step
+        def compile(config):
+            self.ran.append('compile')
+            if self.fail:
+                raise RuntimeError('compile failed')
+            for fpath in config.artefact_store[ArtefactSet.INITIAL_SOURCE_FILES]:
+                obj = config.build_output / fpath.with_suffix('.o').name
+                obj.write_text(fpath.read_text())
+                config.artefact_store.update_dict(ArtefactSet.OBJECT_FILES, obj, 'foo')
+            config.artefact_store[ArtefactSet.BUILD_TREES] = MappingProxyType({'foo': {}})
+
+        self.steps = [fetch, find, compile]
+
+    def run(self, suffix='.f90'):
+        self.ran = []
+        with BuildConfig('proj', ToolBox(), multiprocessing=False, resume=True,
+                         fab_workspace=self.tmp_path / 'fab') as config:
+            fetch, find, compile = self.steps
+            fetch(config)
+            find(config, suffix=suffix)
+            compile(config)
+        return config
+
+
+@pytest.fixture
+def build(tmp_path, stub_tool_repository):
+    return Build(tmp_path)
+
+
+class TestStepCheckpoints:
+
+    def test_resume(self, build):
+        first = build.run()
+        assert build.ran == ['fetch', 'find', 'compile']
+
+        # nothing has changed, only the step we can't fingerprint is run
+        second = build.run()
+        assert build.ran == ['fetch']
+        assert second.artefact_store[ArtefactSet.OBJECT_FILES] == first.artefact_store[ArtefactSet.OBJECT_FILES]
+        assert isinstance(second.artefact_store[ArtefactSet.BUILD_TREES], MappingProxyType)
+
+    def test_source_tree_stat_once(self, build):
+        build.run()
+
+        # the source folder is only looked at again after a step which ran
+        with mock.patch('fab.checkpoints._stat_tree', wraps=_stat_tree) as stat_tree:
+            build.run()
+        assert build.ran == ['fetch']
+        assert stat_tree.call_count == 2
+
+    def test_source_changed(self, build):
+        config = build.run()
+        (config.source_root / 'foo.f90').write_text('program foo\n! changed\nend program foo\n')
+        build.run()
+        assert build.ran == ['fetch', 'find', 'compile']
+
+    def test_output_changed(self, build):
+        config = build.run()
+        (config.build_output / 'foo.o').unlink()
+        build.run()
+        assert build.ran == ['fetch', 'compile']
+
+    def test_args_changed(self, build):
+        build.run()
+        build.run(suffix='.F90')
+        assert build.ran == ['fetch', 'find', 'compile']
+
+    def test_failed_step(self, build):
+        build.fail = True
+        with pytest.raises(RuntimeError):
+            build.run()
+
+        # we resume at the failed step
+        build.fail = False
+        build.run()
+        assert build.ran == ['fetch', 'compile']
+
+    def test_not_resuming(self, build, tmp_path):
+        # checkpointing is opt-in
+        build.run()
+        build.ran = []
+        with BuildConfig('proj', ToolBox(), multiprocessing=False,
+                         fab_workspace=tmp_path / 'fab') as config:
+            assert config.checkpoints is None
+            build.steps[1](config, suffix='.f90')
+        assert build.ran == ['find']
+
+    def test_nested(self, build, tmp_path):
+        # steps called by other steps are part of that step
+        @step
+        def outer(config):
+            build.steps[1](config, suffix='.f90')
+
+        with BuildConfig('proj', ToolBox(), multiprocessing=False, resume=True,
+                         fab_workspace=tmp_path / 'fab') as config:
+            outer(config)
+        assert [c['step'] for c in config.checkpoints._checkpoints] == ['outer', 'cleanup_prebuilds']
@@ -1,7 +1,13 @@
+import pickle
 from pathlib import Path
+from string import Template
+from unittest import mock
 
-from fab.build_config import AddFlags, BuildConfig
+import pytest
+
+from fab.build_config import AddFlags, BuildConfig, FlagsConfig
 from fab.constants import SOURCE_ROOT
+from fab.tools.flags import Flags
 from fab.tools.tool_box import ToolBox
 
 
@@ -29,3 +35,78 @@ class TestAddFlags:
             input_flags=my_flags,
             config=config)
         assert my_flags == ['-foo']
+
+
+class TestFlagsConfig:
+
+    @pytest.fixture
+    def config(self, stub_tool_repository):
+        return BuildConfig('proj', ToolBox(), mpi=False, openmp=False,
+                           fab_workspace=Path("/fab_workspace"))
+
+    @pytest.fixture
+    def flags_config(self):
+        return FlagsConfig(
+            common_flags=['-c', '-I$output'],
+            path_flags=[
+                AddFlags(match="$source/foo/*", flags=['-I$relative/include']),
+                AddFlags(match="$relative/b*.c", flags=['-b']),
+                AddFlags(match="", flags=['-all']),
+            ])
+
+    def test_flags_for_path(self, config, flags_config):
+        source = config.source_root
+        output = config.build_output
+        assert flags_config.flags_for_path(source / 'foo/bar.c', config) == [
+            '-c', f'-I{output}', f'-I{source}/foo/include', '-b', '-all']
+        assert flags_config.flags_for_path(source / 'foo/qux.c', config) == [
+            '-c', f'-I{output}', f'-I{source}/foo/include', '-all']
+        assert flags_config.flags_for_path(source / 'baz/bar.c', config) == [
+            '-c', f'-I{output}', '-b', '-all']
+
+    def test_same_as_add_flags(self, config, flags_config):
+        # we must give the same flags as running each AddFlags in turn
+        for fpath in ['foo/bar.c', 'foo/qux.c', 'foo/sub/bar.c', 'bar.c', 'baz/b.c']:
+            path = config.source_root / fpath
+            expect = ['-c', f'-I{config.build_output}']
+            for add_flags in flags_config.path_flags:
+                add_flags.run(path, expect, config)
+            assert flags_config.flags_for_path(path, config) == expect
+
+    def test_cached_per_folder(self, config, flags_config):
+        source = config.source_root
+        with mock.patch('fab.build_config.Template', wraps=Template) as template:
+            flags_config.flags_for_path(source / 'foo/bar.c', config)
+            rendered = template.call_count
+            flags_config.flags_for_path(source / 'foo/qux.c', config)
+            flags_config.flags_for_path(source / 'foo/bar.c', config)
+        assert rendered and template.call_count == rendered
+
+        # a new folder is rendered again
+        flags_config.flags_for_path(source / 'baz/bar.c', config)
+        assert len(flags_config._folders) == 2
+
+    def test_copy(self, config, flags_config):
+        # the caller can modify the flags without affecting the next file
+        flags = flags_config.flags_for_path(config.source_root / 'foo/bar.c', config)
+        flags.append('-x')
+        assert '-x' not in flags_config.flags_for_path(config.source_root / 'foo/bar.c', config)
+
+    def test_checksum(self, config, flags_config):
+        # the same as the checksum of the flags, calculated once for each set of flags in a folder
+        source = config.source_root
+        for fpath in ['foo/bar.c', 'foo/qux.c', 'baz/bar.c']:
+            path = source / fpath
+            assert flags_config.checksum_for_path(path, config) == \
+                Flags(flags_config.flags_for_path(path, config)).checksum()
+        with mock.patch('fab.build_config.string_checksum') as checksum:
+            flags_config.checksum_for_path(source / 'foo/bar.c', config)
+        checksum.assert_not_called()
+
+    def test_pickle(self, config, flags_config):
+        # the cache isn't sent to the worker processes with every item
+        flags = flags_config.flags_for_path(config.source_root / 'foo/bar.c', config)
+        unpickled = pickle.loads(pickle.dumps(flags_config))
+        assert len(flags_config._folders) == 1
+        assert not unpickled._folders
+        assert unpickled.flags_for_path(config.source_root / 'foo/bar.c', config) == flags
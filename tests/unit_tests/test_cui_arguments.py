@@ -188,6 +188,19 @@ class TestParser:
         assert args.debug == debug
         assert args.quiet == quiet
 
+    def test_profile(self):
+        """Check the profile option, unless the target has its own."""
+
+        parser = FabArgumentParser()
+        assert parser.parse_args(["--profile"]).profile_python
+        assert not parser.parse_args([]).profile_python
+
+        parser = FabArgumentParser()
+        parser.add_argument("--profile", type=str)
+        args = parser.parse_args(["--profile", "full-debug"])
+        assert args.profile == "full-debug"
+        assert not hasattr(args, "profile_python")
+
     @pytest.mark.parametrize(
         "argv",
         [
@@ -1,8 +1,9 @@
 from pathlib import Path
+from unittest import mock
 
 import pytest
 
-from fab.dep_tree import extract_sub_tree, AnalysedDependent
+from fab.dep_tree import extract_sub_tree, AnalysedDependent, SubTreeExtractor
 
 
 @pytest.fixture
@@ -29,3 +30,69 @@ class Test_extract_sub_tree(object):
         assert result == expect
 
     # todo: check missing deps raise a message
+
+
+class Test_SubTreeExtractor(object):
+
+    def test_vanilla(self, src_tree):
+        extractor = SubTreeExtractor(src_tree)
+        result = extractor.extract([Path('root.f90')])
+        expect = src_tree.copy()
+        del expect[Path('foo.f90')]
+        assert dict(result) == expect
+        assert extractor.closure(Path('a.f90')) == {Path('a.f90'), Path('c.f90')}
+
+    def test_read_only(self, src_tree):
+        result = SubTreeExtractor(src_tree).extract([Path('root.f90')])
+        with pytest.raises(TypeError):
+            result[Path('foo.f90')] = src_tree[Path('foo.f90')]  # type: ignore
+
+    def test_shared(self, src_tree):
+        # roots which need the same files get the same tree object
+        extractor = SubTreeExtractor(src_tree)
+        root_tree = extractor.extract([Path('root.f90')])
+        assert extractor.extract([Path('root.f90'), Path('a.f90')]) is root_tree
+        assert extractor.extract([Path('a.f90')]) is not root_tree
+        assert extractor.closure(Path('a.f90')) is not extractor.closure(Path('b.f90'))
+
+    def test_walked_once(self, src_tree):
+        # files shared between roots are only visited by the first root which needs them
+        extractor = SubTreeExtractor(src_tree)
+        with mock.patch.object(SubTreeExtractor, '_children', autospec=True,
+                               side_effect=SubTreeExtractor._children) as children:
+            extractor.extract([Path('a.f90')])
+            extractor.extract([Path('b.f90')])
+            extractor.extract([Path('root.f90')])
+            extractor.extract([Path('root.f90'), Path('foo.f90')])
+            extractor.missing(Path('root.f90'))
+        visited = [call.args[1] for call in children.call_args_list]
+        assert sorted(visited) == sorted(src_tree)
+
+    def test_multiple_roots(self, src_tree):
+        result = SubTreeExtractor(src_tree).extract([Path('a.f90'), Path('foo.f90')])
+        assert set(result) == {Path('a.f90'), Path('c.f90'), Path('foo.f90')}
+
+    def test_cycle(self, src_tree):
+        # c depends back on a, so a and c need the same files
+        src_tree[Path('c.f90')] = src_tree[Path('c.f90')].replace(file_deps={Path('a.f90')})
+        extractor = SubTreeExtractor(src_tree)
+        assert extractor.closure(Path('b.f90')) == {Path('a.f90'), Path('b.f90'), Path('c.f90')}
+        assert extractor.closure(Path('a.f90')) == extractor.closure(Path('c.f90'))
+        assert set(extractor.extract([Path('root.f90')])) == {
+            Path('root.f90'), Path('a.f90'), Path('b.f90'), Path('c.f90')}
+
+    def test_missing(self, src_tree):
+        src_tree[Path('c.f90')] = src_tree[Path('c.f90')].replace(file_deps={Path('nope.f90')})
+        extractor = SubTreeExtractor(src_tree)
+        assert Path('nope.f90') not in extractor.extract([Path('root.f90')])
+        assert extractor.missing(Path('root.f90')) == {Path('nope.f90')}
+        assert extractor.missing(Path('foo.f90')) == set()
+
+    def test_deep(self):
+        # deep chains must not hit the recursion limit
+        n = 5000
+        chain = {}
+        for i in range(n):
+            deps = {Path(f'{i + 1}.f90')} if i < n - 1 else set()
+            chain[Path(f'{i}.f90')] = AnalysedDependent(fpath=Path(f'{i}.f90'), file_hash=0, file_deps=deps)
+        assert len(SubTreeExtractor(chain).extract([Path('0.f90')])) == n
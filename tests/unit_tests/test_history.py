@@ -0,0 +1,102 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Test the build performance history.
+"""
+import json
+
+import pytest
+
+from fab.cui.__main__ import main
+from fab.history import BuildHistory, history_path
+from fab.metrics import JSON_FILENAME
+
+
+def _metrics(label='proj', step_time=10.0, file_times=None):
+    file_times = file_times or {'a.f90': 1.0, 'b.f90': 2.0}
+    return {
+        'run': {'label': label, 'datetime': '2026-01-01T00:00:00', 'time taken': step_time + 1,
+                'machine': 'x86_64'},
+        'steps': {'compile fortran': step_time, 'link': 1.0},
+        'compile fortran': {fpath: {'time_taken': taken, 'start': 0} for fpath, taken in file_times.items()},
+        'tool usage': {'compile fortran: a.f90': {'user': 1.0, 'count': 1}},
+    }
+
+
+@pytest.fixture
+def history(tmp_path):
+    return BuildHistory(history_path(tmp_path / 'proj'))
+
+
+class TestBuildHistory:
+
+    def test_append_only(self, history):
+        first = history.record_run(_metrics())
+        second = history.record_run(_metrics(step_time=12.0))
+        assert second > first
+
+        runs = history.last_runs(5)
+        assert [run['id'] for run in runs] == [first, second]
+        assert runs[-1]['time_taken'] == 13.0
+        assert runs[-1]['machine'] == 'x86_64'
+
+        # tool usage isn't a file timing
+        assert history._timings('file_times', 'step, fpath', [first])[first] == {
+            ('compile fortran', 'a.f90'): 1.0, ('compile fortran', 'b.f90'): 2.0}
+
+    def test_compare(self, history):
+        for step_time in [10.0, 11.0, 10.0]:
+            history.record_run(_metrics(step_time=step_time))
+        history.record_run(_metrics(step_time=15.0, file_times={'a.f90': 1.05, 'b.f90': 4.0, 'c.f90': 3.0}))
+
+        comparison = history.compare(num_runs=4, threshold=10, min_seconds=0.5)
+
+        # the latest run is compared with the median of the earlier runs
+        assert [(c.step, c.baseline, c.latest) for c in comparison.step_regressions] == [
+            ('compile fortran', 10.0, 15.0)]
+        # a's slowdown is within the threshold, c is new
+        assert [(c.name, c.percent) for c in comparison.file_regressions] == [('b.f90', 100.0)]
+        assert [c.name for c in comparison.largest_changes] == ['b.f90', 'a.f90']
+        assert [name for _, name, _ in comparison.slowest_files] == ['b.f90', 'c.f90', 'a.f90']
+
+        report = comparison.report()
+        assert 'compile fortran: b.f90' in report
+
+    def test_label(self, history):
+        history.record_run(_metrics(label='debug'))
+        history.record_run(_metrics(label='fast', step_time=20.0))
+        history.record_run(_metrics(label='debug', step_time=10.0))
+
+        comparison = history.compare(label='debug')
+        assert len(comparison.runs) == 2
+        assert not comparison.step_regressions
+
+    def test_single_run(self, history):
+        history.record_run(_metrics())
+        comparison = history.compare()
+        assert not comparison.largest_changes
+        assert 'need at least two runs' in comparison.report()
+
+    def test_record_metrics_file(self, history, tmp_path):
+        # a build shouldn't fail because we couldn't record its history
+        assert history.record_metrics_file(tmp_path) is None
+
+        (tmp_path / JSON_FILENAME).write_text(json.dumps(_metrics()))
+        assert history.record_metrics_file(tmp_path) == 1
+
+
+class TestHistoryCommand:
+
+    def test_report(self, history, tmp_path, capsys):
+        history.record_run(_metrics())
+        history.record_run(_metrics(step_time=20.0))
+
+        main(['history', '--project', 'proj', '--workspace', str(tmp_path), '--runs', '2'])
+        assert 'step regressions over 10%:' in capsys.readouterr().out
+
+    def test_no_history(self, tmp_path):
+        with pytest.raises(SystemExit):
+            main(['history', '--project', 'nosuch', '--workspace', str(tmp_path)])
@@ -0,0 +1,211 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Test sending metrics to the reader process.
+"""
+import json
+import subprocess
+import sys
+from unittest import mock
+
+from fab import metrics
+from fab.metrics import (BATCH_SIZE, init_metrics, JSON_FILENAME, merge_usage, run_process, send_metric,
+                         stop_metrics, trace_event, TRACE_FILENAME, USAGE_BY_STEP_GROUP, USAGE_GROUP)
+from fab.steps import run_mp, step
+from fab.tools.category import Category
+from fab.tools.tool import Tool
+
+
+def _send_worker_metric(i):
+    send_metric('worker', f'item {i}', i)
+
+
+def _send_many_metrics(i):
+    # enough metrics, with long enough values, to send several batches larger than an atomic pipe write
+    for j in range(20):
+        send_metric('many', f'item {i} metric {j}', 'x' * 1000)
+
+
+def _run_tool(i):
+    tool = Tool('echo', 'echo', Category.MISC)
+    for _ in range(i):
+        tool.run(['hello'])
+
+
+class TestSendMetric:
+
+    def test_batches(self, tmp_path):
+        num_metrics = BATCH_SIZE * 2 + 1
+        init_metrics(metrics_folder=tmp_path)
+        try:
+            with mock.patch.object(metrics._metric_send_conn, 'send',
+                                   wraps=metrics._metric_send_conn.send) as send:
+                for i in range(num_metrics):
+                    send_metric('group', f'item {i}', i)
+                # two full batches sent, one metric still buffered
+                assert send.call_count == 2
+        finally:
+            stop_metrics()
+
+        # the last metric is sent when we stop
+        result = json.loads((tmp_path / JSON_FILENAME).read_text())
+        assert result['group'] == {f'item {i}': i for i in range(num_metrics)}
+
+    def test_workers(self, tmp_path):
+        # metrics buffered in pool workers are sent when the workers exit
+        config = mock.Mock(multiprocessing=True, n_procs=2, metrics_folder=tmp_path)
+        init_metrics(metrics_folder=tmp_path)
+        try:
+            run_mp(config, range(10), _send_worker_metric)
+        finally:
+            stop_metrics()
+
+        result = json.loads((tmp_path / JSON_FILENAME).read_text())
+        assert result['worker'] == {f'item {i}': i for i in range(10)}
+
+    def test_many_workers(self, tmp_path):
+        # batches sent from many workers at once don't interleave in the pipe, so none are lost
+        config = mock.Mock(multiprocessing=True, n_procs=8, metrics_folder=tmp_path)
+        init_metrics(metrics_folder=tmp_path)
+        try:
+            run_mp(config, range(200), _send_many_metrics)
+        finally:
+            stop_metrics()
+
+        result = json.loads((tmp_path / JSON_FILENAME).read_text())
+        assert len(result['many']) == 200 * 20
+
+    def test_bad_messages(self, tmp_path):
+        # the reader logs anything it can't read and carries on
+        init_metrics(metrics_folder=tmp_path)
+        try:
+            metrics._metric_send_conn.send_bytes(b'not a pickle')
+            metrics._metric_send_conn.send(['not a metric'])
+            send_metric('group', 'item', 1)
+        finally:
+            stop_metrics()
+
+        result = json.loads((tmp_path / JSON_FILENAME).read_text())
+        assert result['group'] == {'item': 1}
+
+
+class TestTrace:
+
+    def test_build_timeline(self, tmp_path):
+        config = mock.Mock(multiprocessing=True, n_procs=2, metrics_folder=tmp_path)
+
+        @step
+        def my_step(config):
+            run_mp(config, range(4), _send_worker_metric)
+            Tool('echo', 'echo', Category.MISC).run(['hello'])
+
+        init_metrics(metrics_folder=tmp_path)
+        try:
+            my_step(config)
+        finally:
+            stop_metrics()
+
+        events = json.loads((tmp_path / TRACE_FILENAME).read_text())['traceEvents']
+        spans = [e for e in events if e['ph'] == 'X']
+        assert {(e['cat'], e['name']) for e in spans} == {
+            ('step', 'my_step'), ('item', '_send_worker_metric'), ('tool', 'echo'),
+            ('pool', 'start pool'), ('pool', 'map'), ('pool', 'join pool')}
+
+        # the items ran in the workers' lanes, everything else in the main lane
+        main_pid = spans[0]['pid']
+        assert all(e['pid'] == main_pid for e in spans)
+        for e in spans:
+            assert (e['tid'] == main_pid) == (e['cat'] != 'item')
+        assert sorted(e['args']['item'] for e in spans if e['cat'] == 'item') == ['0', '1', '2', '3']
+        assert [e['args']['command'] for e in spans if e['cat'] == 'tool'] == ['echo hello']
+
+        # each lane is named
+        lanes = {e['tid']: e['args']['name'] for e in events if e['name'] == 'thread_name'}
+        assert lanes[main_pid] == 'main'
+        assert {e['tid'] for e in spans} == set(lanes)
+
+    def test_long_command(self, tmp_path):
+        # only the start of a long command line is recorded
+        init_metrics(metrics_folder=tmp_path)
+        try:
+            Tool('echo', 'echo', Category.MISC).run(['x' * 10000])
+        finally:
+            stop_metrics()
+
+        events = json.loads((tmp_path / TRACE_FILENAME).read_text())['traceEvents']
+        command = next(e['args']['command'] for e in events if e.get('cat') == 'tool')
+        assert len(command) == Tool.TRACE_COMMAND_LENGTH
+        assert command.startswith('echo xxx') and command.endswith('...')
+
+    def test_no_metrics(self, recwarn):
+        # tracing is silent when metrics aren't being recorded
+        trace_event('foo', 'tool', 0, 1)
+        assert not recwarn
+
+
+class TestToolUsage:
+
+    def test_attribution(self, tmp_path):
+        config = mock.Mock(multiprocessing=True, n_procs=2, metrics_folder=tmp_path)
+
+        @step
+        def my_step(config):
+            run_mp(config, [1, 2], _run_tool)
+            Tool('echo', 'echo', Category.MISC).run(['hello'])
+
+        init_metrics(metrics_folder=tmp_path)
+        try:
+            my_step(config)
+        finally:
+            stop_metrics()
+
+        result = json.loads((tmp_path / JSON_FILENAME).read_text())
+
+        # each item's tool runs are added up, tools run outside an item are recorded by tool name
+        usage = result[USAGE_GROUP]
+        assert set(usage) == {'my_step: 1', 'my_step: 2', 'my_step: echo'}
+        assert usage['my_step: 2']['count'] == 2
+        assert usage['my_step: 2']['step'] == 'my_step'
+        assert usage['my_step: 2']['max_rss_kb'] > 0
+
+        by_step = result[USAGE_BY_STEP_GROUP]['my_step']
+        assert by_step['count'] == 4
+        assert by_step['max_rss_kb'] == max(u['max_rss_kb'] for u in usage.values())
+
+    def test_run_process(self):
+        res, usage = run_process(['echo', 'hello'], capture_output=True)
+        assert res.returncode == 0 and res.stdout == b'hello\n'
+        assert usage['count'] == 1
+        assert usage['user'] >= 0 and usage['system'] >= 0
+        assert usage['max_rss_kb'] > 0
+
+    def test_child_usage_is_per_child(self):
+        # A small child after a large one reports its own peak memory, not the large child's.
+        # A child's peak includes the memory of the process which started it, so we start both
+        # from a fresh interpreter rather than this test process, which may be large.
+        script = ('import json, sys; from fab.metrics import run_process; '
+                  'large = run_process([sys.executable, "-c", "x = b\'1\' * 200 * 1024 * 1024"], False)[1]; '
+                  'small = run_process(["true"], False)[1]; '
+                  'print(json.dumps([large["max_rss_kb"], small["max_rss_kb"]]))')
+        res = subprocess.run([sys.executable, '-c', script], capture_output=True, check=True)
+        large, small = json.loads(res.stdout)
+        assert large > 200 * 1024
+        assert small < 100 * 1024
+
+    def test_run_process_output(self):
+        # stdout and stderr are both read, however much is written to each
+        res, _ = run_process([sys.executable, '-c', 'import sys; sys.stderr.write("e" * 200000); print("o" * 200000); '
+                                                    'sys.exit(3)'], capture_output=True)
+        assert res.returncode == 3
+        assert res.stdout == b'o' * 200000 + b'\n'
+        assert res.stderr == b'e' * 200000
+
+    def test_merge_usage(self):
+        total = merge_usage({}, {'user': 1, 'system': 2, 'inblock': 3, 'oublock': 4, 'count': 1,
+                                 'max_rss_kb': 100, 'step': 'compile'})
+        merge_usage(total, {'user': 1, 'system': 2, 'inblock': 3, 'oublock': 4, 'count': 1, 'max_rss_kb': 50})
+        assert total == {'user': 2, 'system': 4, 'inblock': 6, 'oublock': 8, 'count': 2,
+                         'max_rss_kb': 100, 'step': 'compile'}
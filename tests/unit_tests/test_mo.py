@@ -31,7 +31,9 @@ def test_mo():
     an_for = src_tree[Path('foo.f90')]
     assert an_for.file_deps == set()
     add_mo_commented_file_deps(src_tree)
-    assert an_for.file_deps == set([Path('/some/path/root.c')])
+    assert src_tree[Path('foo.f90')].file_deps == set([Path('/some/path/root.c')])
+    # analysis results are immutable, so the original is unchanged
+    assert an_for.file_deps == set()
 
 
 def test_mo_missing_ignored():
@@ -0,0 +1,75 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Test the profiling of steps and their pool workers.
+"""
+import pstats
+from unittest import mock
+
+from fab.profiling import (init_profiling, pool_options, PROFILE_FOLDER, profile_step, profiling, stop_profiling,
+                           SUMMARY_FILENAME)
+from fab.steps import run_mp, step
+
+
+def _hot_path(i):
+    return sum(j * j for j in range(i * 200000))
+
+
+@step
+def inner_step(config):
+    _hot_path(1)
+
+
+@step
+def outer_step(config):
+    inner_step(config)
+    run_mp(config, range(4), _hot_path)
+
+
+def test_not_profiling(tmp_path):
+    assert not profiling()
+    assert pool_options() == {}
+    with profile_step('foo'):
+        pass
+    assert stop_profiling() is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_steps(tmp_path):
+    # the old profiles are removed
+    (tmp_path / PROFILE_FOLDER).mkdir()
+    (tmp_path / PROFILE_FOLDER / 'old_step.prof').write_text('')
+    init_profiling(tmp_path)
+
+    config = mock.Mock(multiprocessing=True, n_procs=2, metrics_folder=tmp_path)
+    try:
+        outer_step(config)
+        outer_step(config)
+    finally:
+        summary = stop_profiling()
+
+    # inner steps are in the outer step's profile, and each worker has its own profile
+    profiles = [fpath.name for fpath in (tmp_path / PROFILE_FOLDER).iterdir()]
+    workers = [name for name in profiles if '.worker-' in name]
+    assert sorted(set(profiles) - set(workers)) == ['outer_step-2.prof', 'outer_step.prof']
+    # each run_mp has two workers, which might not both get an item
+    assert 2 <= len(workers) <= 4
+    functions = {func[2] for func in pstats.Stats(str(tmp_path / PROFILE_FOLDER / 'outer_step.prof')).stats}
+    assert {'outer_step', 'inner_step', '_hot_path'} <= functions
+    assert {name.split('.')[0] for name in workers} == {'outer_step', 'outer_step-2'}
+
+    assert summary == tmp_path / SUMMARY_FILENAME
+    text = summary.read_text()
+    assert 'profiled 2 steps' in text
+    assert 'outer_step, with' in text
+    assert '_hot_path' in text
+
+
+def test_no_steps(tmp_path):
+    init_profiling(tmp_path)
+    assert profiling()
+    assert stop_profiling().read_text() == 'no steps were profiled\n'
+    assert not profiling()
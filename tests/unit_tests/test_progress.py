@@ -0,0 +1,122 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Test the progress reporting of run_mp items.
+"""
+import io
+import json
+import logging
+from unittest import mock
+
+import pytest
+
+from fab.metrics import init_metrics, ITEM_TIMES_GROUP, JSON_FILENAME, stop_metrics
+from fab.progress import load_item_times, Progress
+from fab.steps import run_mp, step
+
+
+class _Terminal(io.StringIO):
+
+    def isatty(self):
+        return True
+
+
+@pytest.fixture
+def clock():
+    # the time, as seen by the progress reporting
+    with mock.patch('fab.progress.perf_counter', return_value=0.0) as perf_counter:
+        yield perf_counter
+
+
+@pytest.fixture(autouse=True)
+def info_logging():
+    fab_logger = logging.getLogger('fab')
+    level = fab_logger.level
+    fab_logger.setLevel(logging.INFO)
+    yield
+    fab_logger.setLevel(level)
+
+
+class TestProgress:
+
+    def test_eta_from_history(self, clock):
+        # the big file took 8s last time, the new file is expected to take the average
+        progress = Progress('compile', ['big.f90', 'small.f90', 'new.f90'], {'big.f90': 8.0, 'small.f90': 2.0})
+        assert progress.eta() is None
+
+        # this time everything is taking half as long
+        clock.return_value = 1.0
+        progress.item_done(1)
+        assert progress.eta() == pytest.approx((8.0 + 5.0) / 2)
+        assert progress.status() == 'compile: 1/3 (33%), about 7s left'
+
+    def test_eta_no_history(self, clock):
+        progress = Progress('compile', ['a', 'b', 'c', 'd'])
+        clock.return_value = 30.0
+        progress.item_done(0)
+        progress.item_done(0)
+        assert progress.done == 1
+        assert progress.status() == 'compile: 1/4 (25%), about 1m30s left'
+
+    def test_terminal(self, clock):
+        stream = _Terminal()
+        progress = Progress('compile', ['a', 'b', 'c'], stream=stream)
+
+        # the line is redrawn, but not too often
+        clock.return_value = 1.0
+        progress.item_done(0)
+        clock.return_value = 1.1
+        progress.item_done(1)
+        assert stream.getvalue() == '\rcompile: 1/3 (33%), about 2s left'
+
+        # and cleared at the end
+        clock.return_value = 2.0
+        progress.item_done(2)
+        progress.finish()
+        assert stream.getvalue().endswith('\r' + ' ' * 33 + '\r')
+
+    def test_log(self, clock, caplog):
+        # without a terminal, progress is logged now and then
+        progress = Progress('compile', [str(i) for i in range(10)], stream=io.StringIO())
+        with caplog.at_level(logging.INFO, logger='fab'):
+            for i in range(9):
+                clock.return_value = 3.0 * (i + 1)
+                progress.item_done(i)
+        assert [r.message for r in caplog.records] == [
+            'compile: 4/10 (40%), about 18s left', 'compile: 8/10 (80%), about 6s left']
+
+    def test_quiet(self, clock):
+        logging.getLogger('fab').setLevel(logging.WARNING)
+        stream = _Terminal()
+        progress = Progress('compile', ['a', 'b'], stream=stream)
+        clock.return_value = 1.0
+        progress.item_done(0)
+        assert stream.getvalue() == ''
+
+
+def _square(i):
+    return i * i
+
+
+def test_item_times(tmp_path):
+    # run_mp records how long each item took, which the next build loads
+    config = mock.Mock(multiprocessing=True, n_procs=2, metrics_folder=tmp_path)
+
+    @step
+    def my_step(config):
+        assert run_mp(config, range(10), _square) == [i * i for i in range(10)]
+
+    init_metrics(metrics_folder=tmp_path)
+    try:
+        my_step(config)
+    finally:
+        stop_metrics()
+
+    times = json.loads((tmp_path / JSON_FILENAME).read_text())[ITEM_TIMES_GROUP]
+    assert set(times) == {f'my_step: {i}' for i in range(10)}
+    assert set(load_item_times(tmp_path, 'my_step')) == {str(i) for i in range(10)}
+    assert load_item_times(tmp_path, 'other_step') == {}
+    assert load_item_times(tmp_path / 'nope', 'my_step') == {}
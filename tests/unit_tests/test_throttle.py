@@ -0,0 +1,103 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Test the memory-aware admission of run_mp items.
+"""
+import json
+from unittest import mock
+
+import pytest
+
+from fab.metrics import JSON_FILENAME, USAGE_GROUP
+from fab.throttle import available_memory_kb, load_peak_rss, MemoryThrottle
+
+
+@pytest.fixture
+def throttle():
+    # 4GB available, a quiet 8 core machine
+    with mock.patch('fab.throttle.available_memory_kb', return_value=4 * 1024 * 1024), \
+            mock.patch('os.getloadavg', return_value=(0.0, 0.0, 0.0)), \
+            mock.patch('os.sched_getaffinity', return_value=set(range(8)), create=True):
+        yield MemoryThrottle(max_procs=4, peak_rss={'big.f90': 3 * 1024 * 1024, 'small.f90': 1024})
+
+
+class TestMemoryThrottle:
+
+    def test_estimate(self, throttle):
+        assert throttle.estimate('big.f90') == 3 * 1024 * 1024
+        # unknown work is estimated as the average
+        assert throttle.estimate('new.f90') == (3 * 1024 * 1024 + 1024) // 2
+
+    def test_no_history(self):
+        assert MemoryThrottle(max_procs=4).estimate('new.f90') == 0
+
+    def test_admit(self, throttle):
+        assert throttle.admit(1024, [1024, 1024])
+
+    def test_always_admit_one(self, throttle):
+        with mock.patch('fab.throttle.available_memory_kb', return_value=0):
+            assert throttle.admit(100 * 1024 * 1024, [])
+
+    def test_max_procs(self, throttle):
+        assert not throttle.admit(0, [0, 0, 0, 0])
+
+    def test_budget(self, throttle):
+        # the big file is running, and may not have reached its peak
+        assert not throttle.admit(1024 * 1024, [3 * 1024 * 1024])
+        assert throttle.admit(1024, [3 * 1024 * 1024])
+
+    def test_available(self, throttle):
+        # something else is using the memory
+        with mock.patch('fab.throttle.available_memory_kb', return_value=throttle.MARGIN_KB):
+            assert not throttle.admit(1024, [1024])
+
+    def test_load(self, throttle):
+        # our own work counts towards the load average
+        with mock.patch('os.getloadavg', return_value=(9.0, 0.0, 0.0)):
+            assert throttle.admit(1024, [1024, 1024])
+            with mock.patch('os.getloadavg', return_value=(12.0, 0.0, 0.0)):
+                assert not throttle.admit(1024, [1024, 1024])
+
+
+def test_admit_realistic_history(tmp_path):
+    # a typical build: most files peak at around 100MB, one large file at 2.5GB
+    usage = {f'compile_fortran: /src/mod_{i}.f90': {'max_rss_kb': (60 + i) * 1024, 'step': 'compile_fortran'}
+             for i in range(100)}
+    usage['compile_fortran: /src/big_table.f90'] = {'max_rss_kb': 2560 * 1024, 'step': 'compile_fortran'}
+    (tmp_path / JSON_FILENAME).write_text(json.dumps({USAGE_GROUP: usage}))
+
+    # 6GB available, a quiet 8 core machine
+    with mock.patch('fab.throttle.available_memory_kb', return_value=6 * 1024 * 1024), \
+            mock.patch('os.getloadavg', return_value=(0.0, 0.0, 0.0)), \
+            mock.patch('os.sched_getaffinity', return_value=set(range(8)), create=True):
+        throttle = MemoryThrottle(max_procs=8, peak_rss=load_peak_rss(tmp_path, 'compile_fortran'))
+
+        # the ordinary files fill every worker
+        running = []
+        for i in range(100):
+            estimate = throttle.estimate(f'/src/mod_{i}.f90')
+            if throttle.admit(estimate, running):
+                running.append(estimate)
+        assert len(running) == 8
+
+        # the large file can run alongside the ordinary files, but not alongside another large file
+        big = throttle.estimate('/src/big_table.f90')
+        assert throttle.admit(big, running[:7])
+        assert not throttle.admit(big, [big, big])
+
+
+def test_available_memory_kb():
+    available = available_memory_kb()
+    assert available is None or available > 0
+
+
+def test_load_peak_rss(tmp_path):
+    (tmp_path / JSON_FILENAME).write_text(json.dumps({USAGE_GROUP: {
+        'compile_fortran: /src/a.f90': {'max_rss_kb': 100, 'step': 'compile_fortran'},
+        'compile_c: /src/b.c': {'max_rss_kb': 200, 'step': 'compile_c'},
+    }}))
+    assert load_peak_rss(tmp_path, 'compile_fortran') == {'/src/a.f90': 100}
+    assert load_peak_rss(tmp_path / 'nope', 'compile_fortran') == {}
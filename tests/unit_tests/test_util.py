@@ -1,10 +1,11 @@
+import os
 from pathlib import Path
 from unittest import mock
 
 import pytest
 
 from fab.artefacts import SuffixFilter
-from fab.util import input_to_output_fpath, suffix_filter, file_walk
+from fab.util import compile_batches, input_to_output_fpath, suffix_filter, file_walk
 
 
 @pytest.fixture
@@ -57,6 +58,43 @@ class Test_file_walk():
         result = list(file_walk(tmp_path / 'foo', ignore_folders=[pbf.parent]))
         assert result == [f]
 
+    def test_threads(self, files, tmp_path):
+        # the same files, in the same order, however many threads list the folders
+        assert list(file_walk(tmp_path, max_workers=4)) == list(file_walk(tmp_path))
+
+    def test_snapshot(self, files, tmp_path):
+        f, pbf = files
+        snapshot = tmp_path / 'snapshot.json'
+
+        # folders modified long enough before the last walk aren't listed again
+        for folder in [tmp_path / 'foo', f.parent, pbf.parent]:
+            os.utime(folder, (0, 0))
+        assert set(file_walk(tmp_path / 'foo', snapshot=snapshot)) == {f, pbf}
+        with mock.patch('fab.util._scan_folder') as mock_scan:
+            assert set(file_walk(tmp_path / 'foo', snapshot=snapshot)) == {f, pbf}
+        mock_scan.assert_not_called()
+
+        # adding a file changes its folder's mtime
+        new_file = f.parent / 'new.txt'
+        new_file.touch()
+        assert set(file_walk(tmp_path / 'foo', snapshot=snapshot)) == {f, pbf, new_file}
+
+    def test_snapshot_recent(self, files, tmp_path):
+        # A folder modified just before the last walk may have changed again within its mtime's resolution.
+        f, pbf = files
+        snapshot = tmp_path / 'snapshot.json'
+
+        list(file_walk(tmp_path / 'foo', snapshot=snapshot))
+        with mock.patch('fab.util._scan_folder', return_value=[]) as mock_scan:
+            list(file_walk(tmp_path / 'foo', snapshot=snapshot))
+        mock_scan.assert_called()
+
+    def test_snapshot_unreadable(self, files, tmp_path):
+        f, pbf = files
+        snapshot = tmp_path / 'snapshot.json'
+        snapshot.write_text('not json')
+        assert set(file_walk(tmp_path / 'foo', snapshot=snapshot)) == {f, pbf}
+
 
 class Test_input_to_output_fpath(object):
 
@@ -78,3 +116,29 @@ class Test_input_to_output_fpath(object):
         input_path = Path('/other/folder/file.txt')
         result = input_to_output_fpath(config, input_path)
         assert result == Path(config.build_output / 'other/folder/file.txt')
+
+
+class TestCompileBatches():
+
+    @staticmethod
+    def _item(path):
+        return mock.Mock(fpath=Path(path)), Path(f'prebuild/{Path(path).stem}.o')
+
+    def test_by_flags(self):
+        items = [self._item(f'src/{name}.c') for name in 'abcde']
+        flags = {Path('src/c.c'): ['-O0']}
+        batches = compile_batches(items, lambda fpath: flags.get(fpath, ['-O2']), batch_size=3)
+        assert [[item[0].fpath.stem for item in batch] for batch in batches] == [['a', 'b', 'd'], ['c'], ['e']]
+
+    def test_same_name(self):
+        # files with the same name can't share a batch
+        items = [self._item(path) for path in ['x/foo.c', 'y/foo.c', 'x/bar.c', 'z/foo.c']]
+        batches = compile_batches(items, lambda fpath: [], batch_size=10)
+        assert [[str(item[0].fpath) for item in batch] for batch in batches] == [
+            ['x/bar.c', 'x/foo.c'], ['y/foo.c'], ['z/foo.c']]
+
+    def test_workers(self):
+        # smaller batches keep all the workers busy
+        items = [self._item(f'src/{i}.c') for i in range(10)]
+        batches = compile_batches(items, lambda fpath: [], batch_size=8, workers=4)
+        assert [len(batch) for batch in batches] == [3, 3, 3, 1]
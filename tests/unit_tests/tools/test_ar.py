@@ -7,6 +7,7 @@
 Tests 'ar' archiver tool.
 """
 from pathlib import Path
+from typing import List, Union
 
 from pytest_subprocess.fake_process import FakeProcess
 
@@ -64,3 +65,38 @@ def test_ar_create(subproc_record: ExtendedRecorder) -> None:
                                         'env': None,
                                         'stderr': None,
                                         'stdout': None}]
+
+
+def test_ar_update(subproc_record: ExtendedRecorder) -> None:
+    """
+    Tests replacing and deleting the members of an archive.
+    """
+    ar = Ar()
+    ar.replace(Path("out.a"), [Path("a.o")])
+    ar.delete(Path("out.a"), ["b.o", "c.o"])
+    assert subproc_record.invocations() == [['ar', 'r', 'out.a', 'a.o'],
+                                            ['ar', 'd', 'out.a', 'b.o', 'c.o']]
+
+
+def test_ar_response_file(fake_process: FakeProcess, monkeypatch) -> None:
+    """
+    Tests a long list of members is passed in a response file.
+    """
+    monkeypatch.setattr(Ar, "RESPONSE_FILE_THRESHOLD", 100)
+    members: List[Union[Path, str]] = [f"object {i}.o" for i in range(20)]
+    contents = []
+    fake_process.register(
+        ["ar", fake_process.any()],
+        callback=lambda process: contents.append(
+            Path(process.args[1][1:]).read_text()))
+
+    Ar().create(Path("out.a"), members)
+    [[ar, response_file]] = call_list(fake_process)
+    assert response_file.startswith("@")
+    assert contents == ["cr\nout.a\n" + "".join(
+        f"object\\ {i}.o\n" for i in range(20))]
+    assert not Path(response_file[1:]).exists()
+
+    # a short command is unchanged
+    fake_process.register(["ar", "cr", "out.a", "a.o"])
+    Ar().create(Path("out.a"), ["a.o"])
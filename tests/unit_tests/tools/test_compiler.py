@@ -272,6 +272,69 @@ def test_compiler_with_add_args(stub_configuration: BuildConfig,
     assert call_list(fake_process) == [command_nomp, command_omp]
 
 
+def test_compiler_compile_files(stub_fortran_compiler: FortranCompiler,
+                                stub_configuration: BuildConfig,
+                                fake_process: FakeProcess) -> None:
+    """
+    Tests compiling several files with one invocation, in the output folder.
+    """
+    command = ['sfc', '-I', '/module_out', '-mods', '/module_out',
+               '-c', '-O3', '/src/a.f90', '/src/sub/b.f90']
+    record = fake_process.register(command)
+
+    stub_fortran_compiler.set_module_output_path(Path("/module_out"))
+    stub_configuration._openmp = False
+
+    objects = stub_fortran_compiler.compile_files(
+        [Path("/src/a.f90"), Path("/src/sub/b.f90")], Path("/batch"),
+        config=stub_configuration, add_flags=["-O3"])
+    assert objects == {Path("/src/a.f90"): Path("/batch/a.o"),
+                       Path("/src/sub/b.f90"): Path("/batch/b.o")}
+    assert call_list(fake_process) == [command]
+    assert arg_list(record)[0]['cwd'] == '/batch'
+
+
+def test_compiler_compile_files_same_name(stub_c_compiler: CCompiler,
+                                          stub_configuration: BuildConfig,
+                                          fake_process: FakeProcess) -> None:
+    """
+    Tests files with the same name can't be compiled in one batch, because
+    their object files would clash.
+    """
+    with raises(ValueError) as err:
+        stub_c_compiler.compile_files([Path("/a/foo.c"), Path("/b/foo.c")],
+                                      Path("/batch"),
+                                      config=stub_configuration)
+    assert "Cannot compile files with the same name" in str(err.value)
+    assert call_list(fake_process) == []
+
+
+def test_compiler_precompile_header(stub_c_compiler: CCompiler,
+                                    stub_configuration: BuildConfig,
+                                    fake_process: FakeProcess) -> None:
+    """
+    Tests precompiling a header next to it, with the compile flags.
+    """
+    command = ['gcc', '-c', '-O3', '-x', 'c-header', 'pch.h',
+               '-o', '/inc/pch.h.gch']
+    record = fake_process.register(command)
+    stub_configuration._openmp = False
+
+    gcc = Gcc()
+    assert gcc.pch_suffix == ".gch"
+    assert gcc.precompile_header(Path("/inc/pch.h"), stub_configuration,
+                                 add_flags=["-O3"]) == Path("/inc/pch.h.gch")
+    assert call_list(fake_process) == [command]
+    assert arg_list(record)[0]['cwd'] == '/inc'
+
+    # a compiler which doesn't support them
+    assert stub_c_compiler.pch_suffix is None
+    with raises(RuntimeError) as err:
+        stub_c_compiler.precompile_header(Path("/inc/pch.h"),
+                                          stub_configuration)
+    assert "does not support precompiled headers" in str(err.value)
+
+
 # ============================================================================
 # Test version number handling
 # ============================================================================
@@ -445,6 +508,7 @@ def test_gcc():
     assert isinstance(gcc, CCompiler)
     assert gcc.category == Category.C_COMPILER
     assert not gcc.mpi
+    assert gcc.supports_response_files
 
 
 def test_gcc_get_version():
@@ -482,6 +546,7 @@ def test_gfortran():
     assert isinstance(gfortran, FortranCompiler)
     assert gfortran.category == Category.FORTRAN_COMPILER
     assert not gfortran.mpi
+    assert gfortran.supports_response_files
 
 
 # Possibly overkill to cover so many gfortran versions but I had to go
@@ -15,7 +15,7 @@ from tests.conftest import ExtendedRecorder, call_list, not_found_callback
 
 from fab.build_config import BuildConfig
 from fab.tools.category import Category
-from fab.tools.compiler import CCompiler, FortranCompiler
+from fab.tools.compiler import CCompiler, FortranCompiler, Gcc
 from fab.tools.compiler_wrapper import (CompilerWrapper,
                                         CrayCcWrapper, CrayFtnWrapper,
                                         Mpicc, Mpif90)
@@ -252,6 +252,33 @@ def test_c_with_add_args(stub_c_compiler: CCompiler,
         assert subproc_record.extras()[1]['cwd'] == '.'
 
 
+def test_c_compile_files(stub_c_compiler: CCompiler,
+                         stub_configuration: BuildConfig,
+                         subproc_record: ExtendedRecorder) -> None:
+    """
+    Tests a compiler wrapper compiles a batch of files with one invocation.
+    """
+    mpicc = Mpicc(stub_c_compiler)
+    objects = mpicc.compile_files([Path("/src/a.c"), Path("/src/b.c")],
+                                  Path("/batch"), add_flags=["-O3"],
+                                  config=stub_configuration)
+    assert objects == {Path("/src/a.c"): Path("/batch/a.o"),
+                       Path("/src/b.c"): Path("/batch/b.o")}
+    assert subproc_record.invocations() == [
+        ['mpicc', '-c', '-O3', '/src/a.c', '/src/b.c']
+    ]
+    assert subproc_record.extras()[0]['cwd'] == '/batch'
+
+
+def test_pch_suffix(stub_c_compiler: CCompiler) -> None:
+    """
+    Tests a compiler wrapper supports precompiled headers if the wrapped
+    compiler does.
+    """
+    assert Mpicc(stub_c_compiler).pch_suffix is None
+    assert Mpicc(Gcc()).pch_suffix == ".gch"
+
+
 def test_flags_independent(stub_c_compiler: CCompiler,
                            stub_configuration: BuildConfig,
                            subproc_record: ExtendedRecorder) -> None:
@@ -0,0 +1,234 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Tests the simulated tools.
+"""
+from pathlib import Path
+import time
+
+import pytest
+
+from fab.tools.category import Category
+from fab.tools.fake import (FAKE_SUITE, FakeAr, FakeCCompiler,
+                            FakeFortranCompiler, FakeLatency,
+                            FakePreprocessor)
+from fab.tools.linker import Linker
+from fab.tools.tool import Tool
+from fab.tools.tool_repository import ToolRepository
+
+
+def test_latency() -> None:
+    """
+    Tests each file always gets the same latency, drawn from a distribution.
+    """
+    assert FakeLatency()("a.f90") == 0.0
+    assert FakeLatency(0.5)("a.f90") == 0.5
+
+    latency = FakeLatency(0.5, sigma=1.0)
+    samples = [latency(f"file_{i}.f90") for i in range(1000)]
+    assert samples == [latency(f"file_{i}.f90") for i in range(1000)]
+    assert len(set(samples)) == 1000
+    assert sum(samples) / len(samples) == pytest.approx(0.5, rel=0.2)
+
+
+def test_available() -> None:
+    """
+    Tests the simulated tools are always available, without an executable.
+    """
+    fc = FakeFortranCompiler()
+    assert fc.is_available
+    assert fc.is_simulated
+    assert fc.suite == FAKE_SUITE
+    assert fc.get_version() == (1, 0, 0)
+    assert FakeAr().check_available()
+
+
+def test_fortran_compile(stub_configuration, tmp_path: Path) -> None:
+    """
+    Tests compiling writes deterministic object and module files.
+    """
+    source = tmp_path / "foo.f90"
+    source.write_text("module foo_mod\ncontains\n"
+                      "  module procedure bar\nend module foo_mod\n")
+    fc = FakeFortranCompiler()
+    fc.set_module_output_path(tmp_path / "mods")
+    (tmp_path / "mods").mkdir()
+
+    fc.compile_file(source, tmp_path / "foo.o", stub_configuration,
+                    add_flags=["-O2"])
+    obj = (tmp_path / "foo.o").read_text()
+    assert obj.startswith("FAKE-OBJECT")
+    assert [p.name for p in (tmp_path / "mods").iterdir()] == ["foo_mod.mod"]
+
+    # the same source and flags give the same output
+    fc.compile_file(source, tmp_path / "foo.o", stub_configuration,
+                    add_flags=["-O2"])
+    assert (tmp_path / "foo.o").read_text() == obj
+    fc.compile_file(source, tmp_path / "foo.o", stub_configuration,
+                    add_flags=["-O3"])
+    assert (tmp_path / "foo.o").read_text() != obj
+
+
+def test_syntax_only(stub_configuration, tmp_path: Path) -> None:
+    """
+    Tests a syntax-only compile only writes module files.
+    """
+    source = tmp_path / "foo.f90"
+    source.write_text("module foo_mod\nend module foo_mod\n")
+    fc = FakeFortranCompiler()
+    fc.compile_file(source, tmp_path / "foo.o", stub_configuration,
+                    syntax_only=True)
+    assert (tmp_path / "foo_mod.mod").exists()
+    assert not (tmp_path / "foo.o").exists()
+
+
+def test_compile_batch(stub_configuration, tmp_path: Path) -> None:
+    """
+    Tests compiling several files at once, which takes the time of them all.
+    """
+    sources = [tmp_path / "a.c", tmp_path / "b.c"]
+    for source in sources:
+        source.write_text(f"int {source.stem};\n")
+    (tmp_path / "batch").mkdir()
+    cc = FakeCCompiler(latency=FakeLatency(0.1))
+    start = time.perf_counter()
+    objects = cc.compile_files(sources, tmp_path / "batch",
+                               stub_configuration)
+    assert time.perf_counter() - start >= 0.2
+    for source in sources:
+        cc.compile_file(source, tmp_path / f"{source.stem}.o",
+                        stub_configuration)
+        assert (objects[source].read_text() ==
+                (tmp_path / f"{source.stem}.o").read_text())
+
+    # an output file can't be given for several files
+    with pytest.raises(RuntimeError) as err:
+        cc.run(["-c", str(sources[0]), str(sources[1]), "-o", "ab.o"])
+    assert "cannot specify '-o' with multiple files" in str(err.value)
+
+
+def test_compile_missing_file(stub_configuration, tmp_path: Path) -> None:
+    """
+    Tests a failed simulation is reported like a failed command.
+    """
+    with pytest.raises(RuntimeError) as err:
+        FakeCCompiler().compile_file(tmp_path / "nosuch.c",
+                                     tmp_path / "nosuch.o",
+                                     stub_configuration)
+    assert "Command failed with return code 1" in str(err.value)
+
+
+def test_precompile_header(stub_configuration, tmp_path: Path) -> None:
+    """
+    Tests precompiling a header, which a compile includes.
+    """
+    (tmp_path / "pch.h").write_text("#include <stdio.h>\n")
+    (tmp_path / "foo.c").write_text("int foo;\n")
+    cc = FakeCCompiler()
+    pch = cc.precompile_header(tmp_path / "pch.h", stub_configuration)
+    assert pch == tmp_path / "pch.h.gch"
+    cc.compile_file(tmp_path / "foo.c", tmp_path / "foo.o",
+                    stub_configuration,
+                    add_flags=["-include", str(tmp_path / "pch.h")])
+
+    with pytest.raises(RuntimeError) as err:
+        cc.compile_file(tmp_path / "foo.c", tmp_path / "foo.o",
+                        stub_configuration,
+                        add_flags=["-include", str(tmp_path / "no.h")])
+    assert "no.h: no such file" in str(err.value)
+
+
+def test_latency_used(stub_configuration, tmp_path: Path) -> None:
+    """
+    Tests the tool takes its time.
+    """
+    source = tmp_path / "foo.c"
+    source.write_text("int foo;\n")
+    cc = FakeCCompiler(latency=FakeLatency(0.2))
+    start = time.perf_counter()
+    cc.compile_file(source, tmp_path / "foo.o", stub_configuration)
+    assert time.perf_counter() - start >= 0.2
+
+
+def test_link(stub_configuration, tmp_path: Path) -> None:
+    """
+    Tests a linker using a simulated compiler simulates linking.
+    """
+    for name in ["a.o", "b.o"]:
+        (tmp_path / name).write_text(name)
+    linker = Linker(FakeCCompiler())
+    assert linker.is_simulated
+    linker.link([tmp_path / "b.o", tmp_path / "a.o"], tmp_path / "exe",
+                stub_configuration)
+    assert (tmp_path / "exe").read_text().startswith("FAKE-EXECUTABLE")
+
+
+def test_link_response_file(stub_configuration, tmp_path: Path,
+                            monkeypatch) -> None:
+    """
+    Tests linking many objects through a response file.
+    """
+    monkeypatch.setattr(Tool, "RESPONSE_FILE_THRESHOLD", 100)
+    objects = [tmp_path / f"object {i}.o" for i in range(20)]
+    for obj in objects:
+        obj.write_text(obj.name)
+    linker = Linker(FakeCCompiler())
+    assert linker.supports_response_files
+    linker.link(objects, tmp_path / "exe", stub_configuration)
+    assert (tmp_path / "exe").read_text().startswith("FAKE-EXECUTABLE")
+
+
+def test_preprocess(tmp_path: Path) -> None:
+    """
+    Tests the preprocessor removes preprocessor directives.
+    """
+    (tmp_path / "foo.F90").write_text("#ifdef FOO\nx = 1\n#endif\n")
+    fpp = FakePreprocessor("fake-fpp", Category.FORTRAN_PREPROCESSOR)
+    fpp.preprocess(tmp_path / "foo.F90", tmp_path / "foo.f90",
+                   add_flags=["-DFOO"])
+    assert (tmp_path / "foo.f90").read_text() == "x = 1\n"
+
+
+def test_ar(tmp_path: Path) -> None:
+    """
+    Tests creating and updating an archive.
+    """
+    (tmp_path / "a.o").write_text("a")
+    FakeAr().create(tmp_path / "lib.a", [tmp_path / "a.o"])
+    assert (tmp_path / "lib.a").read_text().startswith("FAKE-ARCHIVE\na.o ")
+
+    # members are replaced by name, added at the end, and deleted
+    created = (tmp_path / "lib.a").read_text()
+    (tmp_path / "b.o").write_text("b")
+    FakeAr().replace(tmp_path / "lib.a", [tmp_path / "b.o", tmp_path / "a.o"])
+    assert (tmp_path / "lib.a").read_text().startswith(created)
+    FakeAr().delete(tmp_path / "lib.a", ["a.o"])
+    assert (tmp_path / "lib.a").read_text().splitlines()[1].startswith("b.o ")
+
+
+def test_repository() -> None:
+    """
+    Tests the simulated tools are registered, but only used as defaults
+    when asked for.
+    """
+    ToolRepository._singleton = None
+    tr = ToolRepository()
+    assert tr.get_tool(Category.FORTRAN_COMPILER, "fake-fortran").is_simulated
+    assert tr.get_tool(Category.LINKER, "linker-fake-cc").is_simulated
+    assert not any(tool.is_simulated
+                   for tool in tr._default_candidates(Category.AR))
+
+    tr.set_default_compiler_suite(FAKE_SUITE)
+    try:
+        for category in [Category.AR, Category.C_PREPROCESSOR,
+                         Category.FORTRAN_PREPROCESSOR]:
+            assert tr.get_default(category).is_simulated
+        assert tr.get_default(Category.FORTRAN_COMPILER, mpi=False,
+                              openmp=True).name == "fake-fortran"
+        assert tr.get_default(Category.LINKER, mpi=False, openmp=False,
+                              enforce_fortran_linker=False).name == "linker-fake-cc"
+    finally:
+        ToolRepository._singleton = None
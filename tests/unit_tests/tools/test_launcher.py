@@ -0,0 +1,76 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Tests running tools through a launcher.
+"""
+from pathlib import Path
+
+from pytest_subprocess.fake_process import FakeProcess
+
+from fab.build_config import BuildConfig
+from fab.tools.compiler import CCompiler
+from fab.tools.fake import FakeCCompiler
+from fab.tools.launcher import CacheDaemonLauncher, Launcher
+
+from tests.conftest import call_list
+
+
+def test_command() -> None:
+    """
+    Tests a launcher's command can be given as a string or a list.
+    """
+    assert Launcher("nice -n 5 'my launcher'").command == [
+        "nice", "-n", "5", "my launcher"]
+    assert Launcher(["ccache"]).command == ["ccache"]
+    assert str(Launcher(["ccache", "-s"])) == "ccache -s"
+
+
+def test_compile(stub_c_compiler: CCompiler,
+                 stub_configuration: BuildConfig,
+                 fake_process: FakeProcess) -> None:
+    """
+    Tests a compile is launched, but the version check and the hash are
+    not changed by the launcher.
+    """
+    fake_process.register(["scc", "--version"], stdout="1.2.3")
+    hash_before = stub_c_compiler.get_hash()
+    stub_c_compiler._version = None
+
+    stub_c_compiler.set_launcher("ccache")
+    command = ["ccache", "scc", "-c", "a.c", "-o", "a.o"]
+    fake_process.register(command)
+    fake_process.register(["scc", "--version"], stdout="1.2.3")
+    stub_c_compiler.compile_file(Path("a.c"), Path("a.o"),
+                                 config=stub_configuration)
+    assert stub_c_compiler.get_hash() == hash_before
+    assert call_list(fake_process) == [["scc", "--version"], command,
+                                       ["scc", "--version"]]
+
+
+def test_simulated(stub_configuration: BuildConfig, tmp_path: Path) -> None:
+    """
+    Tests a simulated tool ignores its launcher.
+    """
+    (tmp_path / "a.c").write_text("int a;\n")
+    cc = FakeCCompiler()
+    cc.set_launcher("no-such-launcher")
+    cc.compile_file(tmp_path / "a.c", tmp_path / "a.o", stub_configuration)
+    assert (tmp_path / "a.o").exists()
+
+
+def test_no_daemon(stub_c_compiler: CCompiler,
+                   stub_configuration: BuildConfig,
+                   fake_process: FakeProcess, tmp_path: Path) -> None:
+    """
+    Tests commands are run directly when the cache daemon isn't running.
+    """
+    command = ["scc", "-c", "a.c", "-o", "a.o"]
+    fake_process.register(command)
+    launcher = CacheDaemonLauncher(tmp_path / "no.sock")
+    stub_c_compiler.set_launcher(launcher)
+    stub_c_compiler.compile_file(Path("a.c"), Path("a.o"),
+                                 config=stub_configuration)
+    assert call_list(fake_process) == [command]
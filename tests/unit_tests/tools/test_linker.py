@@ -32,6 +32,7 @@ def test_c_linker(stub_c_compiler: CCompiler) -> None:
     assert linker.suite == "stub"
     assert linker.get_flags() == []
     assert linker.output_flag == "-o"
+    assert not linker.supports_response_files
 
 
 def test_fortran_linker(stub_fortran_compiler: FortranCompiler) -> None:
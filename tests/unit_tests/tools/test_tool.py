@@ -208,6 +208,19 @@ class TestToolRun:
                                   "['tool']\nBeef.")
         assert call_list(fake_process) == [['tool']]
 
+    def test_no_response_file(self, fake_process: FakeProcess,
+                              monkeypatch) -> None:
+        """
+        Tests a long command is unchanged for a tool which doesn't
+        support response files.
+        """
+        monkeypatch.setattr(Tool, "RESPONSE_FILE_THRESHOLD", 10)
+        fake_process.register(["tool", "a" * 20])
+        tool = Tool("some tool", "tool", Category.MISC)
+        assert not tool.supports_response_files
+        tool.run(["a" * 20])
+        assert call_list(fake_process) == [["tool", "a" * 20]]
+
     def test_error_file_not_found(self, fake_process: FakeProcess) -> None:
         """
         Tests running a missing tool.
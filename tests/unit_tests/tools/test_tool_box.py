@@ -109,3 +109,50 @@ def test_add_unavailable_tool(fake_process: FakeProcess) -> None:
     with raises(RuntimeError) as err:
         tb.add_tool(gfortran)
     assert str(err.value).startswith(f"Tool '{gfortran}' is not available")
+
+
+def test_set_launcher(stub_tool_repository, stub_c_compiler) -> None:
+    """
+    Tests a launcher is given to the compilers in the tool box, and to
+    those taken from the tool repository later.
+    """
+    tb = ToolBox()
+    tb.add_tool(stub_c_compiler)
+    tb.set_launcher("nice -n 5")
+    cc = tb.get_tool(Category.C_COMPILER)
+    assert cc.launcher is not None
+    assert cc.launcher.command == ["nice", "-n", "5"]
+    # the tool box launches its own copy of the tool
+    assert stub_c_compiler.launcher is None
+
+    fc = tb.get_tool(Category.FORTRAN_COMPILER, mpi=False, openmp=False)
+    assert fc.launcher is cc.launcher
+    linker = tb.get_tool(Category.LINKER, mpi=False, openmp=False,
+                         enforce_fortran_linker=False)
+    assert linker.launcher is None
+
+    tb.set_launcher(["ccache"], categories=[Category.LINKER])
+    linker = tb.get_tool(Category.LINKER)
+    assert linker.launcher is not None
+    assert linker.launcher.command == ["ccache"]
+
+    tb.set_launcher(None)
+    assert tb.get_tool(Category.C_COMPILER).launcher is None
+    assert tb.get_tool(Category.FORTRAN_COMPILER).launcher is None
+
+
+def test_set_launcher_other_tool_box(stub_tool_repository) -> None:
+    """
+    Tests a launcher in one tool box does not affect the same tools from
+    the tool repository in another tool box.
+    """
+    tb = ToolBox()
+    tb.set_launcher("ccache")
+    fc = tb.get_tool(Category.FORTRAN_COMPILER, mpi=False, openmp=False)
+    assert fc.launcher is not None
+
+    other = ToolBox()
+    other_fc = other.get_tool(Category.FORTRAN_COMPILER, mpi=False,
+                              openmp=False)
+    assert other_fc.name == fc.name
+    assert other_fc.launcher is None